@@ -0,0 +1,190 @@
+"""
+Cold-start benchmark for the `execute` tool.
+
+Reports:
+    * the `python -X importtime` breakdown of `import execute`, by top-level package and by module;
+    * the time to first response of a fresh worker process: the import of the flow module, the time
+      until the worker is ready, the first turn and a second (warm) turn, against local stand-in
+      backends, without the background pre-warm (`FLOW_PREWARM`), with it, and with the warm-up of
+      the connections (`FLOW_WARMUP_CONNECTIONS`). The stand-ins delay the first request of each
+      new connection by `--connect-latency-ms`, standing in for DNS resolution and the TLS handshake.
+
+Usage:
+    python benchmarks/cold_start_benchmark.py [--runs 5] [--top 15] [--idle-ms 500] [--connect-latency-ms 100]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from stand_in_backends import REPO_ROOT, StandInBackends, create_connections, prepare_flow_dir
+
+CONVERSATION_PARAMETERS = {
+    "session_id": "d911c7a6-3b1d-4e49-9ef9-aa30a3a78f4b",
+    "persona_name": "public",
+    "topic_area": "customerService",
+    "locale": "en-GB",
+    "user": {"id": "anonymous", "role": "public"},
+}
+
+
+def import_time_breakdown() -> List[Tuple[str, int, int]]:
+    """
+    Runs `python -X importtime -c "import execute"` in a fresh process.
+
+    Returns:
+        List[Tuple[str, int, int]]: The module name, self time and cumulative time (microseconds) of each import.
+    """
+    env = dict(os.environ, FLOW_PREWARM="0", PYTHONPATH=REPO_ROOT)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import execute"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    imports: List[Tuple[str, int, int]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def report_import_time(imports: List[Tuple[str, int, int]], top: int) -> None:
+    """
+    Prints the import time breakdown.
+
+    Args:
+        imports (List[Tuple[str, int, int]]): The parsed `-X importtime` records.
+        top (int): Number of entries to print per table.
+    """
+    total_us: int = next((cumulative for name, _, cumulative in imports if name == "execute"), 0)
+    print(f"import execute: {total_us / 1000:.1f} ms ({len(imports)} modules)\n")
+
+    by_package: Dict[str, int] = defaultdict(int)
+    for name, self_us, _ in imports:
+        by_package[name.split(".")[0]] += self_us
+    print(f"{'top-level package':40} {'self ms':>10} {'share':>7}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:40} {self_us / 1000:10.1f} {100 * self_us / max(total_us, 1):6.1f}%")
+
+    print(f"\n{'module (cumulative)':60} {'ms':>10}")
+    for name, _, cumulative_us in sorted(imports, key=lambda item: -item[2])[:top]:
+        print(f"{name:60} {cumulative_us / 1000:10.1f}")
+
+    own: List[Tuple[str, int, int]] = [item for item in imports if item[0].startswith(("helper_classes", "execute"))]
+    print(f"\nflow modules: {sum(self_us for _, self_us, _ in own) / 1000:.1f} ms self time in {len(own)} modules")
+
+
+def child(server_url: str, idle_ms: float) -> None:
+    """
+    Runs in the fresh worker process: imports the flow, waits until the worker is ready, as the
+    host's readiness probe would, and times the first two turns.
+
+    Args:
+        server_url (str): The base URL of the stand-in backends.
+        idle_ms (float): Idle time between the import and the first request, as on a new worker.
+    """
+    start: float = time.perf_counter()
+    import execute  # pylint: disable=import-outside-toplevel
+
+    from helper_classes import startup  # pylint: disable=import-outside-toplevel
+
+    imported: float = time.perf_counter()
+    startup.wait_until_ready(60)
+    ready: float = time.perf_counter()
+    time.sleep(idle_ms / 1000)
+
+    custom_connections, cognitive_search_connection = create_connections(server_url)
+    timings: Dict[str, float] = {"import_ms": (imported - start) * 1000, "ready_ms": (ready - start) * 1000}
+    for turn, query in enumerate(("What is the best jacket for rain?", "And which boots go with it?")):
+        parameters: Dict[str, Any] = dict(CONVERSATION_PARAMETERS, conversation_id=f"cold-start-{os.getpid()}")
+        turn_start: float = time.perf_counter()
+        execute.execute(custom_connections, cognitive_search_connection, json.dumps(parameters), [], query)
+        timings[("first" if turn == 0 else "second") + "_turn_ms"] = (time.perf_counter() - turn_start) * 1000
+
+    timings["time_to_first_response_ms"] = timings["import_ms"] + timings["first_turn_ms"]
+    print(json.dumps(timings))
+
+
+def time_to_first_response(
+    server_url: str, flow_dir: str, prewarm: str, runs: int, idle_ms: float
+) -> Dict[str, float]:
+    """
+    Starts fresh worker processes and collects the median timings.
+
+    Args:
+        server_url (str): The base URL of the stand-in backends.
+        flow_dir (str): The prepared flow working directory.
+        prewarm (str): `off`, `on` for the background pre-warm, or `connections` for the pre-warm with
+            the warm-up of the connections.
+        runs (int): Number of worker processes.
+        idle_ms (float): Idle time between the worker being ready and the first request.
+
+    Returns:
+        Dict[str, float]: The median of each timing.
+    """
+    env = dict(
+        os.environ,
+        FLOW_PREWARM="0" if prewarm == "off" else "1",
+        FLOW_WARMUP_CONNECTIONS="stand_in_backends:connections_from_env" if prewarm == "connections" else "0",
+        STAND_IN_URL=server_url,
+        PYTHONPATH=REPO_ROOT,
+    )
+    samples: Dict[str, List[float]] = defaultdict(list)
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", server_url, "--idle-ms", str(idle_ms)],
+            cwd=flow_dir, env=env, capture_output=True, text=True, check=True,
+        )
+        for key, value in json.loads(result.stdout.strip().splitlines()[-1]).items():
+            samples[key].append(value)
+    return {key: statistics.median(values) for key, values in samples.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="worker processes per configuration")
+    parser.add_argument("--top", type=int, default=15, help="entries per import time table")
+    parser.add_argument("--idle-ms", type=float, default=500.0, help="idle time before the first request")
+    parser.add_argument(
+        "--connect-latency-ms", type=float, default=100.0, help="added latency of each new connection"
+    )
+    parser.add_argument("--child", metavar="SERVER_URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.idle_ms)
+        return
+
+    report_import_time(import_time_breakdown(), args.top)
+
+    backends = StandInBackends(connect_latency_ms=args.connect_latency_ms)
+    server_url: str = backends.start()
+    try:
+        with tempfile.TemporaryDirectory() as flow_dir:
+            prepare_flow_dir(flow_dir, server_url)
+            print(f"\ntime to first response (median of {args.runs} workers, {args.idle_ms:.0f} ms idle before the first request)")
+            print(
+                f"{'prewarm':12} {'import ms':>10} {'ready ms':>10} {'1st turn ms':>12} {'2nd turn ms':>12} "
+                f"{'TTFR ms':>10}"
+            )
+            for prewarm in ("off", "on", "connections"):
+                timings = time_to_first_response(server_url, flow_dir, prewarm, args.runs, args.idle_ms)
+                print(
+                    f"{prewarm:12} {timings['import_ms']:10.1f} {timings['ready_ms']:10.1f} "
+                    f"{timings['first_turn_ms']:12.1f} {timings['second_turn_ms']:12.1f} "
+                    f"{timings['time_to_first_response_ms']:10.1f}"
+                )
+    finally:
+        backends.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark of the conversation state stores: the JSON file per conversation and the journal.
+
+Simulates turns on a set of conversations carrying a rolling summary of the given size. Each turn
+reads the conversation, sets one argument (and changes the topic every few turns) and saves it,
+as `ResponseHandler.Processor` does. Reports the read and save latency and the bytes written per save.
+
+Usage:
+    python benchmarks/conversation_store_benchmark.py [--conversations 200] [--turns 2000] [--summary-chars 4000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper  # noqa: E402
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run(store: str, conversations: int, turns: int, summary_chars: int) -> Dict[str, float]:
+    """
+    Runs the simulated turns against a store in a fresh chats directory.
+
+    Args:
+        store (str): `file` or `journal`.
+        conversations (int): Number of conversations.
+        turns (int): Number of turns.
+        summary_chars (int): Size of the rolling summary kept in each conversation.
+
+    Returns:
+        Dict[str, float]: The median read and save latency and the bytes written per save.
+    """
+    os.environ["CONVERSATION_STATE_STORE"] = store
+    # Compaction is left to the end so the bytes written per save are those of the saves themselves
+    os.environ["CONVERSATION_JOURNAL_COMPACT_BYTES"] = str(1 << 40)
+    rnd = random.Random(7)
+    reads: List[float] = []
+    saves: List[float] = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        os.makedirs("chats")
+        for index in range(conversations):
+            helper = ConversationDataHelper({"conversation_id": f"c{index}", "persona_name": "public"})
+            data = helper.get_conversation_data()
+            data[ConversationDataHelper.SUMMARY_KEY] = {"text": "x" * summary_chars, "turns_covered": 6}
+            data["arguments"] = {"query": "initial query", "email": f"user{index}@example.com"}
+            helper.save_conversation_data(data)
+
+        size_before: int = directory_size("chats")
+        for turn in range(turns):
+            helper = ConversationDataHelper({"conversation_id": f"c{rnd.randrange(conversations)}"})
+            start: float = time.perf_counter()
+            data = helper.get_conversation_data()
+            reads.append(time.perf_counter() - start)
+
+            data["arguments"]["query"] = f"query of turn {turn}"
+            if turn % 5 == 0:
+                data["topic_name"] = "customerQuery" if data["topic_name"] == "default" else "default"
+            start = time.perf_counter()
+            helper.save_conversation_data(data)
+            saves.append(time.perf_counter() - start)
+
+        # Files are rewritten in place: every save writes the whole document
+        written: float = (
+            directory_size("chats") - size_before
+            if store == "journal"
+            else statistics.mean(os.path.getsize(os.path.join("chats", name)) for name in os.listdir("chats") if name.endswith(".json")) * turns
+        )
+        os.chdir("/")
+
+    return {
+        "read_us": statistics.median(reads) * 1e6,
+        "save_us": statistics.median(saves) * 1e6,
+        "bytes_per_save": written / turns,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--summary-chars", type=int, default=4000)
+    args = parser.parse_args()
+
+    print(f"{args.conversations} conversations, {args.turns} turns, {args.summary_chars} summary chars")
+    print(f"{'store':10} {'read us':>10} {'save us':>10} {'bytes/save':>12}")
+    for store in ("file", "journal"):
+        result = run(store, args.conversations, args.turns, args.summary_chars)
+        print(f"{store:10} {result['read_us']:10.1f} {result['save_us']:10.1f} {result['bytes_per_save']:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
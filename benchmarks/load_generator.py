@@ -0,0 +1,339 @@
+"""
+Load generator of concurrent multi-turn conversations for the `execute` tool.
+
+Simulates users arriving at a configurable rate, each running a scripted multi-turn conversation
+(Q&A, topic switches to customerQuery, fallback resets) through the flow's `execute` entry point,
+with its own conversation id and chat history, as Prompt Flow serving does. The run is repeated
+for each concurrency level (maximum number of live conversations) and reports, per level:
+
+    * throughput (turns/s) and turn latency percentiles;
+    * error rate (exceptions and empty responses);
+    * conversation state store contention: the latency of the state reads and saves of the turns
+      and their share of the turn time.
+
+The knee is the last level whose throughput is at least 10% above the previous level's; past it,
+more concurrency only adds latency.
+
+By default the flow runs against the local stand-in backends (`stand_in_backends.py`) with the
+given latencies. `--connections connections.json` runs it against real backends instead, with a
+file of the form {"custom": {"configs": {...}, "secrets": {...}}, "search": {"api_key": ..., "api_base": ...}}.
+
+Usage:
+    python benchmarks/load_generator.py [--concurrency 1,4,16,64] [--arrival-rate 20] [--duration 20]
+        [--llm-latency-ms 300] [--search-latency-ms 50] [--scripts scripts.jsonl] [--store file|journal]
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from stand_in_backends import REPO_ROOT, StandInBackends, create_connections, prepare_flow_dir
+
+sys.path.insert(0, REPO_ROOT)
+
+# Scripted conversations: each user runs one, turn by turn
+SCRIPTS: List[Dict[str, Any]] = [
+    {
+        "name": "shopper",
+        "turns": [
+            "hello",
+            "give me your best hiking boots",
+            "and a waterproof jacket for rain?",
+            "thanks, bye",
+        ],
+    },
+    {
+        "name": "customer",
+        "turns": [
+            "I want to check my order",
+            "my email is {email}",
+            "how much have I spent on my orders",
+            "thank you",
+        ],
+    },
+    {
+        "name": "switcher",
+        "turns": [
+            "which tent sleeps eight people?",
+            "I want to check my order",
+            "never mind, something else",
+            "what stove boils water fastest?",
+            "bye",
+        ],
+    },
+]
+
+EMAILS: List[str] = ["johnsmith@example.com", "janedoe@example.com", "unknown@example.com"]
+
+CONVERSATION_PARAMETERS: Dict[str, Any] = {
+    "persona_name": "public",
+    "topic_area": "customerService",
+    "locale": "en-GB",
+    "user": {"id": "anonymous", "role": "public"},
+}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered: List[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Recorder:
+    """
+    Collects the turn and state store timings of a run, thread safe.
+    """
+
+    def __init__(self):
+        self.lock: threading.Lock = threading.Lock()
+        self.turns: List[float] = []
+        self.errors: int = 0
+        self.conversations: int = 0
+        self.store: Dict[str, List[float]] = {"read": [], "save": []}
+
+    def add_turn(self, seconds: float, error: bool) -> None:
+        with self.lock:
+            self.turns.append(seconds)
+            self.errors += int(error)
+
+    def add_store(self, operation: str, seconds: float) -> None:
+        with self.lock:
+            self.store[operation].append(seconds)
+
+
+# The recorder of the level being run, read by the timed state store methods
+CURRENT: Dict[str, Optional[Recorder]] = {"recorder": None}
+
+
+def time_store_operation(cls: type, method_name: str, operation: str) -> None:
+    """
+    Wraps a method of the conversation state store to record its duration in the current recorder.
+
+    Args:
+        cls (type): The class of the method.
+        method_name (str): The method name.
+        operation (str): The timing bucket (`read` or `save`).
+    """
+    method: Callable[..., Any] = getattr(cls, method_name)
+
+    def timed(*args: Any, **kwargs: Any) -> Any:
+        start: float = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            recorder: Optional[Recorder] = CURRENT["recorder"]
+            if recorder is not None:
+                recorder.add_store(operation, time.perf_counter() - start)
+
+    setattr(cls, method_name, timed)
+
+
+def run_conversation(
+    execute: Callable[..., str], connections: Tuple[Any, Any], script: Dict[str, Any], rnd: random.Random,
+    think_ms: float, recorder: Recorder,
+) -> None:
+    """
+    Runs one scripted conversation, turn by turn.
+
+    Args:
+        execute (Callable[..., str]): The flow's `execute` tool.
+        connections (Tuple[Any, Any]): The custom and cognitive search connections.
+        script (Dict[str, Any]): The script.
+        rnd (random.Random): The random source of the user.
+        think_ms (float): Mean pause between the turns of a user.
+        recorder (Recorder): The recorder of the level.
+    """
+    parameters: Dict[str, Any] = dict(
+        CONVERSATION_PARAMETERS, session_id=str(uuid.uuid4()), conversation_id=str(uuid.uuid4())
+    )
+    email: str = rnd.choice(EMAILS)
+    chat_history: List[Dict[str, Any]] = []
+    for template in script["turns"]:
+        query: str = template.format(email=email)
+        start: float = time.perf_counter()
+        error: bool = False
+        response: str = ""
+        try:
+            response = execute(connections[0], connections[1], json.dumps(parameters), chat_history, query)
+            error = not response
+        except Exception:  # pylint: disable=broad-except
+            error = True
+        recorder.add_turn(time.perf_counter() - start, error)
+        chat_history.append({"inputs": {"query": query}, "outputs": {"answer": response}})
+        if think_ms:
+            time.sleep(rnd.expovariate(1000.0 / think_ms))
+
+    with recorder.lock:
+        recorder.conversations += 1
+
+
+def run_level(
+    execute: Callable[..., str], connections: Tuple[Any, Any], scripts: List[Dict[str, Any]], concurrency: int,
+    arrival_rate: float, duration: float, think_ms: float, seed: int,
+) -> Dict[str, float]:
+    """
+    Runs users arriving at `arrival_rate` per second (Poisson) for `duration` seconds, with at most
+    `concurrency` live conversations; arrivals wait for a free slot. Conversations in progress at
+    the end of the duration are run to completion.
+
+    Returns:
+        Dict[str, float]: The level's report.
+    """
+    recorder: Recorder = Recorder()
+    CURRENT["recorder"] = recorder
+    slots: threading.Semaphore = threading.Semaphore(concurrency)
+    rnd: random.Random = random.Random(seed)
+    threads: List[threading.Thread] = []
+
+    def user(user_seed: int) -> None:
+        try:
+            user_rnd: random.Random = random.Random(user_seed)
+            run_conversation(execute, connections, user_rnd.choice(scripts), user_rnd, think_ms, recorder)
+        finally:
+            slots.release()
+
+    start: float = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        if arrival_rate:
+            time.sleep(rnd.expovariate(arrival_rate))
+        if not slots.acquire(timeout=max(0.0, duration - (time.perf_counter() - start))):
+            break
+        thread = threading.Thread(target=user, args=(rnd.randrange(1 << 30),), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed: float = time.perf_counter() - start
+    CURRENT["recorder"] = None
+
+    store_times: List[float] = recorder.store["read"] + recorder.store["save"]
+    return {
+        "concurrency": concurrency,
+        "conversations": recorder.conversations,
+        "turns": len(recorder.turns),
+        "throughput": len(recorder.turns) / elapsed,
+        "p50_ms": percentile(recorder.turns, 0.50) * 1000,
+        "p90_ms": percentile(recorder.turns, 0.90) * 1000,
+        "p99_ms": percentile(recorder.turns, 0.99) * 1000,
+        "error_rate": recorder.errors / max(len(recorder.turns), 1),
+        "store_read_p99_ms": percentile(recorder.store["read"], 0.99) * 1000,
+        "store_save_p99_ms": percentile(recorder.store["save"], 0.99) * 1000,
+        "store_share": sum(store_times) / max(sum(recorder.turns), 1e-9),
+    }
+
+
+def find_knee(results: List[Dict[str, float]], min_gain: float = 0.10) -> Optional[float]:
+    """
+    Returns the last concurrency level whose throughput is at least `min_gain` above the previous level's.
+    """
+    knee: Optional[float] = results[0]["concurrency"] if results else None
+    for previous, result in zip(results, results[1:]):
+        if result["throughput"] < previous["throughput"] * (1 + min_gain):
+            break
+        knee = result["concurrency"]
+    return knee
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma separated maximum live conversations")
+    parser.add_argument("--arrival-rate", type=float, default=20.0, help="new users per second, 0 for immediate")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of arrivals per level")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between the turns of a user")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--search-latency-ms", type=float, default=50.0)
+    parser.add_argument("--scripts", help="JSON Lines file of scripts: {\"name\": ..., \"turns\": [...]}")
+    parser.add_argument("--store", choices=("file", "journal"), help="conversation state store")
+    parser.add_argument("--connections", help="JSON file of real backend connections, instead of the stand-ins")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    scripts: List[Dict[str, Any]] = SCRIPTS
+    if args.scripts:
+        with open(args.scripts, "r", encoding="utf-8") as file:
+            scripts = [json.loads(line) for line in file if line.strip()]
+    if args.store:
+        os.environ["CONVERSATION_STATE_STORE"] = args.store
+    os.environ.setdefault("FLOW_PREWARM", "0")
+
+    backends: Optional[StandInBackends] = None
+    work_dir: Optional[tempfile.TemporaryDirectory] = None
+    if args.connections:
+        from promptflow.connections import CognitiveSearchConnection, CustomConnection  # type: ignore
+
+        with open(args.connections, "r", encoding="utf-8") as file:
+            config: Dict[str, Any] = json.load(file)
+        connections: Tuple[Any, Any] = (
+            CustomConnection(configs=config["custom"]["configs"], secrets=config["custom"]["secrets"]),
+            CognitiveSearchConnection(**config["search"]),
+        )
+        os.chdir(REPO_ROOT)
+    else:
+        backends = StandInBackends(args.llm_latency_ms, args.search_latency_ms)
+        url: str = backends.start()
+        work_dir = tempfile.TemporaryDirectory()
+        prepare_flow_dir(work_dir.name, url)
+        os.chdir(work_dir.name)
+        connections = create_connections(url)
+
+    logging.disable(logging.CRITICAL)
+    import execute  # pylint: disable=import-outside-toplevel
+    from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+
+    time_store_operation(ConversationDataHelper, "get_conversation_data", "read")
+    time_store_operation(ConversationDataHelper, "save_conversation_data", "save")
+    # execute prints its search connection on every turn
+    devnull = open(os.devnull, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+    # Warm the flow up so the first level does not pay for the imports and config loads
+    with contextlib.redirect_stdout(devnull):
+        run_conversation(execute.execute, connections, scripts[0], random.Random(0), 0.0, Recorder())
+
+    results: List[Dict[str, float]] = []
+    if not args.json:
+        print(
+            f"{'conc':>5} {'convs':>6} {'turns':>6} {'turns/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+            f"{'errors':>7} {'read p99':>9} {'save p99':>9} {'store':>6}"
+        )
+    for concurrency in (int(level) for level in args.concurrency.split(",")):
+        with contextlib.redirect_stdout(devnull):
+            result = run_level(
+                execute.execute, connections, scripts, concurrency, args.arrival_rate, args.duration,
+                args.think_ms, args.seed,
+            )
+        results.append(result)
+        if not args.json:
+            print(
+                f"{concurrency:5d} {result['conversations']:6d} {result['turns']:6d} {result['throughput']:8.1f} "
+                f"{result['p50_ms']:8.1f} {result['p90_ms']:8.1f} {result['p99_ms']:8.1f} "
+                f"{100 * result['error_rate']:6.1f}% {result['store_read_p99_ms']:9.2f} "
+                f"{result['store_save_p99_ms']:9.2f} {100 * result['store_share']:5.1f}%"
+            )
+
+    knee: Optional[float] = find_knee(results)
+    if args.json:
+        print(json.dumps({"levels": results, "knee": knee}, indent=2))
+    else:
+        print(f"\nknee: concurrency {knee}")
+
+    devnull.close()
+    if backends is not None:
+        backends.stop()
+    os.chdir(REPO_ROOT)
+    if work_dir is not None:
+        work_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
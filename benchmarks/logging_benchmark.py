@@ -0,0 +1,202 @@
+"""
+Benchmark of the time the log records of a turn cost the request thread, before and after the
+logging pipeline (`helper_classes/log_pipeline.py`).
+
+A turn logs what the flow logs: two completions, three searches with their payloads (a hybrid query
+with a 1536 dimension vector), a failed completion with its 20 messages and the turn summary. The
+records are written by a file handler formatting them as JSON with their `extra`, as the log
+exporters of the host do. The request thread waits `--interval-ms` between turns, as it waits for
+the backends in the flow. Each mode runs in its own process:
+
+    before: the handler on the request thread, no pipeline;
+    sync: the pipeline without the queue (`FLOW_LOG_ASYNC=0`), sampling and redacting on the
+        request thread;
+    async: the pipeline with the queue;
+    sampled: the queue, with 10% of the search records sampled.
+
+Usage:
+    python benchmarks/logging_benchmark.py [--turns 1000] [--interval-ms 5]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List
+
+from stand_in_backends import REPO_ROOT
+
+sys.path.insert(0, REPO_ROOT)
+
+MODES: Dict[str, Dict[str, str]] = {
+    "before": {},
+    "sync": {"FLOW_LOG_ASYNC": "0"},
+    "async": {},
+    "sampled": {"FLOW_LOG_SAMPLE_RATES": "1,logging_benchmark:Execution completed=0.1"},
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as JSON with its `extra`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        from helper_classes.log_pipeline import _RECORD_ATTRIBUTES
+
+        values: Dict[str, Any] = {
+            name: value for name, value in record.__dict__.items() if name not in _RECORD_ATTRIBUTES
+        }
+        return json.dumps({"level": record.levelname, "message": record.getMessage(), **values}, default=str)
+
+
+def log_turn(search: Any, messages: List[Dict[str, str]], conversation_id: str) -> None:
+    """
+    Logs the records of a turn, as the flow does.
+    """
+    from helper_classes.log_pipeline import LazyValue
+
+    for stage in ("routing", "handler"):
+        logging.info(
+            "Execution completed",
+            extra={
+                "session_id": "benchmark",
+                "conversation_id": conversation_id,
+                "completion_id": "chatcmpl-benchmark",
+                "utterance": messages[-1]["content"],
+                "execution_time_ms": 412.5,
+                "stage": stage,
+                "model": "gpt-4o",
+                "shared": False,
+                "tokens": {"prompt_tokens": 1850, "completion_tokens": 120, "total_tokens": 1970},
+            },
+        )
+    for _ in range(3):
+        logging.info(
+            "Execution completed",
+            extra={
+                "session_id": "benchmark",
+                "conversation_id": conversation_id,
+                "payload": LazyValue(search.get_loggable_payload),
+                "success": True,
+                "error_message": "",
+                "shared": False,
+            },
+        )
+    logging.error(
+        "Failure occurred",
+        extra={
+            "session_id": "benchmark",
+            "conversation_id": conversation_id,
+            "stage": "handler",
+            "model": "gpt-4o",
+            "messages": messages,
+            "error": "Traceback (most recent call last):\n  ...\nopenai.APITimeoutError: Request timed out.",
+        },
+    )
+    logging.info(
+        "Turn completed",
+        extra={"session_id": "benchmark", "conversation_id": conversation_id, "turn_ms": 1650.0},
+    )
+
+
+def run_mode(mode: str, turns: int, interval_ms: float, path: str) -> Dict[str, float]:
+    """
+    Logs the turns in this process with the pipeline of the mode.
+
+    Returns:
+        Dict[str, float]: The mean, median and p99 time of a turn's records on the request thread
+            and the time after the last turn until the records are written, in milliseconds, and the
+            number of dropped records.
+    """
+    from helper_classes.log_pipeline import LogPipeline
+    from helper_classes.search_ai_executor import SearchAiExecutor
+
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+    if mode != "before":
+        LogPipeline.install()
+
+    search = SearchAiExecutor(
+        "https://search.invalid/indexes/products/docs/search",
+        {"api-key": "benchmark"},
+        {
+            "search": "Which tent is best for rain?",
+            "top": 5,
+            "select": "id,title,content,url",
+            "queryType": "semantic",
+            "vectorQueries": [
+                {"kind": "vector", "vector": [0.0123] * 1536, "fields": "contentVector", "k": 5}
+            ],
+        },
+        uuid.uuid4(),
+        uuid.uuid4(),
+    )
+    messages: List[Dict[str, str]] = [
+        {"role": "system", "content": "You are the assistant of an outdoor gear store. " * 40},
+    ] + [
+        {"role": "user" if index % 2 else "assistant", "content": "I need a tent for four people. " * 5}
+        for index in range(18)
+    ] + [{"role": "user", "content": "My email is johnsmith@example.com, where is my order?"}]
+
+    durations: List[float] = []
+    for turn in range(turns):
+        conversation_id: str = str(uuid.UUID(int=turn))
+        start: float = time.perf_counter()
+        log_turn(search, messages, conversation_id)
+        durations.append((time.perf_counter() - start) * 1000)
+        time.sleep(interval_ms / 1000)
+    start_written: float = time.perf_counter()
+    LogPipeline.stop()
+    handler.flush()
+    durations.sort()
+    return {
+        "mean": statistics.mean(durations),
+        "p50": durations[len(durations) // 2],
+        "p99": durations[int(len(durations) * 0.99)],
+        "written": (time.perf_counter() - start_written) * 1000,
+        "dropped": LogPipeline.get_metrics()["dropped"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    parser.add_argument("--mode", choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        with tempfile.TemporaryDirectory() as work_dir:
+            path: str = os.path.join(work_dir, "flow.log")
+            print(json.dumps(run_mode(args.mode, args.turns, args.interval_ms, path)))
+        return
+
+    print(f"{'mode':10} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'written ms':>11} {'dropped':>8}")
+    for mode, environment in MODES.items():
+        output: str = subprocess.run(
+            [
+                sys.executable, __file__, "--mode", mode,
+                "--turns", str(args.turns), "--interval-ms", str(args.interval_ms),
+            ],
+            env={**os.environ, **environment},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result: Dict[str, float] = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{mode:10} {result['mean']:8.3f} {result['p50']:8.3f} {result['p99']:8.3f} "
+            f"{result['written']:11.1f} {result['dropped']:8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
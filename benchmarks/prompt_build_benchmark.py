@@ -0,0 +1,113 @@
+"""
+Benchmark of the prompt build time (`LMHelper.get_prompt_messages`) as the chat history grows.
+
+For each history length, builds the prompt of the next turn:
+
+    rebuild: without the prompt message cache, every past answer is normalized again;
+    cached: the cache holds the previous turns in memory, only the newest turn is normalized;
+    loaded: the cache of the previous turns is loaded from its file, as on a worker that did not
+        serve the previous turn.
+
+Half of the answers are JSON answers with `response_items`, as returned by the function handlers.
+
+Usage:
+    python benchmarks/prompt_build_benchmark.py [--turns 10,100,1000] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from stand_in_backends import REPO_ROOT, create_connections, prepare_flow_dir
+
+sys.path.insert(0, REPO_ROOT)
+
+from helper_classes.lm_helpers.llm_helper import LLMHelper  # noqa: E402
+from helper_classes.lm_helpers.prompt_message_cache import PromptMessageCache  # noqa: E402
+
+
+def make_history(turns: int) -> List[Dict[str, Any]]:
+    history: List[Dict[str, Any]] = []
+    for index in range(turns):
+        answer: str = (
+            json.dumps(
+                {
+                    "response_items": [
+                        {"key": "topic_name", "value": "qna"},
+                        {"key": "response", "value": f"Answer {index}: the Alpine Explorer tent sleeps eight. " * 4},
+                    ]
+                }
+            )
+            if index % 2
+            else f"Answer {index}: our hiking boots are waterproof and come in every size. " * 3
+        )
+        history.append({"inputs": {"query": f"Question {index} about tents and boots?"}, "outputs": {"answer": answer}})
+    return history
+
+
+def build_ms(custom_connections: Any, search_connection: Any, conversation_id: str, history: List[Dict[str, Any]]) -> float:
+    """
+    Builds the prompt of the turn following a history.
+
+    Returns:
+        float: The prompt build time in milliseconds.
+    """
+    parameters: Dict[str, Any] = {
+        "conversation_id": conversation_id,
+        "session_id": conversation_id,
+        "persona_name": "public",
+        "topic_area": "customerService",
+        "locale": "en-GB",
+    }
+    helper = LLMHelper(
+        custom_connections,
+        search_connection,
+        history,
+        "And the next question?",
+        json.dumps(parameters),
+        {"conversation_id": conversation_id, "topic_name": "default"},
+    )
+    helper.load_topic_object()
+    start: float = time.perf_counter()
+    helper.get_prompt_messages()
+    return (time.perf_counter() - start) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", default="10,100,1000", help="comma separated history lengths")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_flow_dir(work_dir, "http://127.0.0.1:9")
+        os.chdir(work_dir)
+        cached_connections = create_connections("http://127.0.0.1:9", {"prompt_cache": "on"})
+        rebuild_connections = create_connections("http://127.0.0.1:9", {"prompt_cache": "off"})
+
+        print(f"{'turns':>6} {'rebuild ms':>11} {'cached ms':>10} {'loaded ms':>10} {'speed-up':>9}")
+        for turns in (int(value) for value in args.turns.split(",")):
+            history: List[Dict[str, Any]] = make_history(turns)
+            results: Dict[str, List[float]] = {"rebuild": [], "cached": [], "loaded": []}
+            for index in range(args.repeat):
+                results["rebuild"].append(build_ms(*rebuild_connections, f"r{turns}-{index}", history))
+
+                build_ms(*cached_connections, f"c{turns}-{index}", history[:-1])
+                results["cached"].append(build_ms(*cached_connections, f"c{turns}-{index}", history))
+
+                build_ms(*cached_connections, f"l{turns}-{index}", history[:-1])
+                PromptMessageCache._entries.clear()  # pylint: disable=protected-access
+                results["loaded"].append(build_ms(*cached_connections, f"l{turns}-{index}", history))
+
+            rebuild, cached, loaded = (statistics.median(results[name]) for name in ("rebuild", "cached", "loaded"))
+            print(f"{turns:6d} {rebuild:11.3f} {cached:10.3f} {loaded:10.3f} {rebuild / cached:8.1f}x")
+        os.chdir(REPO_ROOT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark of client-side query embedding for the Azure AI Search vector queries, against the
+local stand-ins.
+
+Runs the same stream of searches, drawn from a set of queries with a Zipf popularity, in four modes:
+
+    text: `kind: text` vector queries, vectorized by the search service (`--vectorize-ms` per search);
+    vector, no cache: every query is embedded by the embeddings stand-in (`--embedding-ms` per request);
+    vector, cold cache: the embedding cache starts empty;
+    vector, restarted: the memory cache is cleared but the SQLite store of the cold run is kept,
+        as after a worker restart.
+
+Usage:
+    python benchmarks/query_embedding_benchmark.py [--searches 500] [--queries 100]
+        [--vectorize-ms 30] [--embedding-ms 20] [--search-ms 10]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from stand_in_backends import REPO_ROOT, StandInBackends, create_connections
+
+sys.path.insert(0, REPO_ROOT)
+
+from helper_classes.ai_search import AiSearch  # noqa: E402
+from helper_classes.query_embedding_cache import QueryEmbeddingCache  # noqa: E402
+
+
+def make_stream(searches: int, queries: int, seed: int = 7) -> List[str]:
+    """
+    Returns the queries of the searches, query `i` drawn with a probability proportional to 1 / (i + 1).
+    """
+    rng = random.Random(seed)
+    texts: List[str] = [f"Which tent or boot number {index} is best for hiking?" for index in range(queries)]
+    weights: List[float] = [1 / (index + 1) for index in range(queries)]
+    return rng.choices(texts, weights, k=searches)
+
+
+def run(stream: List[str], url: str, connections: Any, vector_query: str) -> List[float]:
+    """
+    Runs the searches one after the other.
+
+    Returns:
+        List[float]: The duration of each search in milliseconds, query embedding included.
+    """
+    custom_connections, search_connection = connections
+    config: Dict[str, Any] = {
+        "index_details": {"index_name": "products", "endpoint": url},
+        "parameters": {"vector_query": vector_query, "embedding_model": "stand-in-embeddings"},
+    }
+    durations: List[float] = []
+    for query in stream:
+        start: float = time.perf_counter()
+        search = AiSearch.create(
+            {"arguments": {"query": query}},
+            {"session_id": "benchmark", "conversation_id": "benchmark"},
+            config,
+            search_connection,
+            custom_connections,
+        )
+        response = search.execute()
+        if response is None or response.status_code != 200:
+            raise RuntimeError("Search failed")
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=100, help="distinct queries")
+    parser.add_argument("--vectorize-ms", type=float, default=30.0, help="server-side vectorization latency")
+    parser.add_argument("--embedding-ms", type=float, default=20.0, help="embeddings request latency")
+    parser.add_argument("--search-ms", type=float, default=10.0, help="search latency")
+    args = parser.parse_args()
+
+    backends = StandInBackends(
+        search_latency_ms=args.search_ms, embedding_latency_ms=args.embedding_ms, vectorize_latency_ms=args.vectorize_ms
+    )
+    url: str = backends.start()
+    connections = create_connections(url)
+    stream: List[str] = make_stream(args.searches, args.queries)
+
+    # Warms the clients up, off the measured runs
+    run(stream[:5], url, connections, "text")
+    os.environ["QUERY_EMBEDDING_CACHE_SIZE"] = "0"
+    run(stream[:5], url, connections, "vector")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results: Dict[str, Dict[str, float]] = {}
+        modes = [
+            ("text", "text", "0", ""),
+            ("vector, no cache", "vector", "0", ""),
+            ("vector, cold cache", "vector", "4096", os.path.join(work_dir, "embeddings.sqlite")),
+            ("vector, restarted", "vector", "4096", os.path.join(work_dir, "embeddings.sqlite")),
+        ]
+        for name, vector_query, cache_size, store_path in modes:
+            os.environ["QUERY_EMBEDDING_CACHE_SIZE"] = cache_size
+            os.environ["QUERY_EMBEDDING_CACHE_PATH"] = store_path
+            QueryEmbeddingCache.clear()
+            before: Dict[str, float] = QueryEmbeddingCache.get_metrics()
+            embeddings_before: int = backends.request_counts["embeddings"]
+            durations: List[float] = run(stream, url, connections, vector_query)
+            after: Dict[str, float] = QueryEmbeddingCache.get_metrics()
+            hits: float = after["hits"] + after["store_hits"] - before["hits"] - before["store_hits"]
+            lookups: float = hits + after["misses"] - before["misses"]
+            results[name] = {
+                "mean": statistics.mean(durations),
+                "p50": statistics.median(durations),
+                "p90": sorted(durations)[int(len(durations) * 0.9)],
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "embeddings": backends.request_counts["embeddings"] - embeddings_before,
+            }
+    backends.stop()
+
+    print(f"{'mode':20} {'mean ms':>8} {'p50 ms':>7} {'p90 ms':>7} {'hit rate':>9} {'embeddings':>11} {'vs text':>8}")
+    for name, result in results.items():
+        print(
+            f"{name:20} {result['mean']:8.2f} {result['p50']:7.2f} {result['p90']:7.2f} {result['hit_rate']:9.1%} "
+            f"{int(result['embeddings']):11d} {result['mean'] - results['text']['mean']:+8.2f}"
+        )
+    print(QueryEmbeddingCache.get_metrics())
+
+
+if __name__ == "__main__":
+    main()
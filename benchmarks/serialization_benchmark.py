@@ -0,0 +1,177 @@
+"""
+Microbenchmark of the JSON work of a turn, before and after the serialization layer
+(`helper_classes/serialization.py`).
+
+A turn of a Q&A conversation with a customer record:
+
+    parse the conversation parameters (twice before the layer: in `execute` and in `LMHelper`);
+    read the conversation data file, embed the data in the system prompt and save the file;
+    serialize the search payloads and decode the search responses (one per query variant);
+    parse the tool call arguments;
+    embed the customer record in the prompt of the customer query.
+
+`before` is the standard library as the flow used it: `json.dumps` with the default separators,
+responses decoded through `requests.Response.text`. `json` and `orjson` are the layer with each
+backend; `orjson` is skipped if it is not installed.
+
+Usage:
+    python benchmarks/serialization_benchmark.py [--documents 5] [--variants 3] [--turns 2000]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import yaml
+from requests.models import Response
+from stand_in_backends import PRODUCT_CHUNKS, REPO_ROOT
+
+sys.path.insert(0, REPO_ROOT)
+
+from helper_classes import serialization  # noqa: E402
+
+
+def make_turn(documents: int, variants: int) -> Dict[str, Any]:
+    """
+    Returns the inputs of a turn: the raw parameters, conversation data, search payloads, search
+    response bodies, tool arguments and customer record.
+    """
+    with open(os.path.join(REPO_ROOT, "data", "customer_info", "sample.yaml"), "r", encoding="utf-8") as file:
+        customer: Dict[str, Any] = yaml.safe_load(file)[0]
+    parameters: Dict[str, Any] = {
+        "conversation_id": "c3f1b0a2-6d1e-4f5b-9a57-2f0c1d9e8b71",
+        "session_id": "8a0e6c3d-1b2f-4e5a-9c7d-3f2e1d0c9b8a",
+        "persona_name": "public",
+        "topic_area": "customerService",
+        "locale": "en-GB",
+    }
+    conversation_data: Dict[str, Any] = {
+        "_version": 7,
+        "arguments": {
+            "query": "Which tent sleeps the most people?",
+            "email": customer["email"],
+            "previous_answer_provided": "The Alpine Explorer Tent sleeps eight. " * 6,
+            "topic_name": "qna",
+        },
+        "_state": {"persona_name": "public", "topic_area": "customerService"},
+    }
+    body: bytes = json.dumps(
+        {
+            "value": [
+                {
+                    "@search.score": 12.5 - index,
+                    "@search.rerankerScore": 3.2 - index / 10,
+                    "id": f"doc-{index}",
+                    "content": " ".join(PRODUCT_CHUNKS[index % len(PRODUCT_CHUNKS)] for _ in range(12)),
+                }
+                for index in range(documents)
+            ]
+        }
+    ).encode("utf-8")
+    payloads: List[Dict[str, Any]] = [
+        {
+            "search": f"variant {index} of which tent sleeps the most people",
+            "queryType": "semantic",
+            "semanticConfiguration": "default",
+            "top": documents,
+            "select": "id,content",
+            "vectorQueries": [{"kind": "text", "text": "which tent sleeps the most people", "k": 50, "fields": "contentVector"}],
+        }
+        for index in range(variants)
+    ]
+    return {
+        "parameters": json.dumps(parameters),
+        "conversation_data": conversation_data,
+        "payloads": payloads,
+        "bodies": [body] * variants,
+        "arguments": json.dumps({"query": "Which tent sleeps the most people?", "topic_name": "qna"}),
+        "customer": customer,
+    }
+
+
+def make_response(body: bytes) -> Response:
+    response = Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json; odata.metadata=none; charset=utf-8"
+    response._content = body  # pylint: disable=protected-access
+    return response
+
+
+def turn_before(turn: Dict[str, Any], path: str) -> None:
+    parameters: Dict[str, Any] = json.loads(turn["parameters"])
+    json.loads(turn["parameters"])
+    with open(path, "r", encoding="utf-8") as file:
+        data: Dict[str, Any] = json.loads(file.read())
+    "Known details " + json.dumps(data)
+    for payload in turn["payloads"]:
+        json.dumps(payload).encode("utf-8")
+    for body in turn["bodies"]:
+        json.loads(make_response(body).text)["value"]
+    json.loads(turn["arguments"])
+    "Customer record " + json.dumps(turn["customer"])
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    assert parameters
+
+
+def turn_after(turn: Dict[str, Any], path: str) -> None:
+    parameters: Dict[str, Any] = serialization.loads(turn["parameters"])
+    with open(path, "rb") as file:
+        data: Dict[str, Any] = serialization.loads(file.read())
+    "Known details " + serialization.dumps(data)
+    for payload in turn["payloads"]:
+        serialization.dumps_bytes(payload)
+    for body in turn["bodies"]:
+        serialization.loads(make_response(body).content)["value"]
+    serialization.loads(turn["arguments"])
+    "Customer record " + serialization.dumps(turn["customer"])
+    with open(path, "wb") as file:
+        file.write(serialization.dumps_bytes(data))
+    assert parameters
+
+
+def measure_us(function: Callable[[Dict[str, Any], str], None], turn: Dict[str, Any], path: str, turns: int) -> float:
+    """
+    Returns the median time of a turn in microseconds, over batches of 100 turns.
+    """
+    for _ in range(100):
+        function(turn, path)
+    batches: List[float] = []
+    for _ in range(max(1, turns // 100)):
+        start: float = time.perf_counter()
+        for _ in range(100):
+            function(turn, path)
+        batches.append((time.perf_counter() - start) * 1e6 / 100)
+    return statistics.median(batches)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=5, help="search results per response")
+    parser.add_argument("--variants", type=int, default=3, help="searches per turn")
+    parser.add_argument("--turns", type=int, default=2000)
+    args = parser.parse_args()
+
+    turn: Dict[str, Any] = make_turn(args.documents, args.variants)
+    with tempfile.TemporaryDirectory() as work_dir:
+        path: str = os.path.join(work_dir, "conversation.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(turn["conversation_data"], file)
+
+        results: Dict[str, float] = {"before": measure_us(turn_before, turn, path, args.turns)}
+        for backend in ("json", "orjson"):
+            if serialization.set_backend(backend) == backend:
+                results[backend] = measure_us(turn_after, turn, path, args.turns)
+
+    print(f"{'':8} {'us/turn':>9} {'saved':>9}")
+    for name, value in results.items():
+        print(f"{name:8} {value:9.1f} {results['before'] - value:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Local stand-in backends for the flow benchmarks.
+
+Serves a minimal Azure OpenAI chat completions and embeddings API and an Azure AI Search
+`docs/search` API over HTTP on localhost, so the flow can be exercised end to end through its real
+clients without network access or quota. The chat completions stand-in picks a tool call with
+simple keyword rules on the last user message, which is enough to drive the topics of
+`persona-public`. A message asking several things joined by "and also" gets a tool call per part. The embeddings stand-in hashes the words of each input into a vector.
+The model list and the index document count answer the warm-up requests of a new worker, and each
+new connection can be delayed to stand in for DNS resolution and the TLS handshake.
+
+Classes:
+    StandInBackends: The local HTTP server.
+
+Functions:
+    prepare_flow_dir: Copies the flow configs into a working directory pointed at the stand-ins.
+    create_connections: Creates the Prompt Flow connections for the stand-ins.
+    connections_from_env: Creates the connections for the stand-ins at `STAND_IN_URL`.
+"""
+
+import array
+import base64
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRODUCT_CHUNKS = [
+    "The TrailMaster X4 Tent is a durable four person polyester tent with a rainfly and mesh panels.",
+    "The Alpine Explorer Tent sleeps eight, has a detachable divider and a built-in gear loft.",
+    "The SkyView 2-Person Tent offers a panoramic mesh roof and a quick setup design.",
+    "The TrekReady Hiking Boots are waterproof leather boots with a cushioned midsole.",
+    "The RainGuard Hiking Jacket is a breathable waterproof shell with taped seams and a hood.",
+    "The Summit Breeze Jacket is a lightweight windproof jacket that packs into its own pocket.",
+    "The CozyNights Sleeping Bag is rated to minus five degrees and weighs 1.2 kg.",
+    "The TrailBlaze Hiking Pants are quick drying, stretchy and have zip-off legs.",
+    "The Adventurer Pro Backpack has a 40 litre capacity and a ventilated back panel.",
+    "The PowerBurner Camping Stove boils a litre of water in three minutes.",
+]
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# Separates the parts of a message asking several things, each gets its own tool call
+_PARTS = re.compile(r"\s+and also\s+", re.IGNORECASE)
+_WORDS = re.compile(r"\w+")
+
+
+class StandInBackends:
+    """
+    A local HTTP server emulating the Azure OpenAI and Azure AI Search endpoints used by the flow.
+
+    Attributes:
+        llm_latency_ms (float): Added latency of each chat completion.
+        search_latency_ms (float): Added latency of each search.
+        embedding_latency_ms (float): Added latency of each embeddings request.
+        embeddings_available (bool): Whether the embeddings deployment exists, otherwise each
+            embeddings request fails with a 404 error.
+        vectorize_latency_ms (float): Added latency of each search with a `kind: text` vector query,
+            the time the search service takes to vectorize the query.
+        connect_latency_ms (float): Added latency of the first request of each new connection, the
+            time DNS resolution and the TLS handshake take against the real services.
+        request_counts (Dict[str, int]): Number of requests served per API.
+    """
+
+    def __init__(
+        self,
+        llm_latency_ms: float = 0.0,
+        search_latency_ms: float = 0.0,
+        port: int = 0,
+        embedding_latency_ms: float = 0.0,
+        vectorize_latency_ms: float = 0.0,
+        connect_latency_ms: float = 0.0,
+        embeddings_available: bool = True,
+    ):
+        self.llm_latency_ms: float = llm_latency_ms
+        self.search_latency_ms: float = search_latency_ms
+        self.embedding_latency_ms: float = embedding_latency_ms
+        self.vectorize_latency_ms: float = vectorize_latency_ms
+        self.connect_latency_ms: float = connect_latency_ms
+        self.embeddings_available: bool = embeddings_available
+        self.request_counts: Dict[str, int] = {
+            "chat": 0, "search": 0, "embeddings": 0, "warmup": 0, "connections": 0
+        }
+        self._counts_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._create_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """
+        Starts serving on a background thread.
+
+        Returns:
+            str: The base URL of the stand-ins.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stand-in-backends", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, api: str) -> None:
+        with self._counts_lock:
+            self.request_counts[api] = self.request_counts.get(api, 0) + 1
+
+    def _create_handler(self) -> type:
+        backends = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self) -> None:
+                super().setup()
+                backends.count("connections")
+                time.sleep(backends.connect_latency_ms / 1000)
+
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                path: str = self.path.split("?", 1)[0]
+                if path.endswith("/models"):
+                    backends.count("warmup")
+                    self._send({"object": "list", "data": []})
+                elif path.endswith("/docs/$count"):
+                    backends.count("warmup")
+                    self._send(len(PRODUCT_CHUNKS))
+                else:
+                    self._send({"error": {"message": "Not found: " + path}}, 404)
+
+            def do_POST(self) -> None:  # pylint: disable=invalid-name
+                body: Dict[str, Any] = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                path: str = self.path.split("?", 1)[0]
+
+                if path.endswith("/chat/completions"):
+                    backends.count("chat")
+                    time.sleep(backends.llm_latency_ms / 1000)
+                    self._send(chat_completion(body))
+                elif path.endswith("/embeddings"):
+                    backends.count("embeddings")
+                    time.sleep(backends.embedding_latency_ms / 1000)
+                    if backends.embeddings_available:
+                        self._send(embeddings(body))
+                    else:
+                        error: Dict[str, str] = {"code": "DeploymentNotFound", "message": "Not found: " + path}
+                        self._send({"error": error}, 404)
+                elif path.endswith("/docs/search"):
+                    backends.count("search")
+                    text_queries: bool = any(query.get("kind") == "text" for query in body.get("vectorQueries", []))
+                    time.sleep((backends.search_latency_ms + backends.vectorize_latency_ms * text_queries) / 1000)
+                    self._send(search_results(body))
+                else:
+                    self._send({"error": {"message": "Not found: " + path}}, 404)
+
+            def _send(self, payload: Any, status: int = 200) -> None:
+                data: bytes = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        return Handler
+
+
+def chat_completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds a chat completion for the request, choosing a tool call if tools are offered.
+
+    Args:
+        body (Dict[str, Any]): The chat completions request body.
+
+    Returns:
+        Dict[str, Any]: The chat completion response body.
+    """
+    messages: List[Dict[str, Any]] = body.get("messages", [])
+    user_message: str = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+    tool_names = {tool["function"]["name"] for tool in body.get("tools", [])}
+
+    message: Dict[str, Any] = {"role": "assistant", "content": None}
+    tool_calls: List[Tuple[str, Dict[str, Any]]] = []
+    if tool_names:
+        for part in _PARTS.split(user_message):
+            tool_call: Optional[Tuple[str, Dict[str, Any]]] = choose_tool_call(part, tool_names)
+            if tool_call is not None:
+                tool_calls.append(tool_call)
+    if tool_calls:
+        message["tool_calls"] = [
+            {
+                "id": f"call_stand_in_{index}",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(arguments)},
+            }
+            for index, (name, arguments) in enumerate(tool_calls)
+        ]
+    else:
+        message["content"] = "Stand-in answer to: " + user_message[:200]
+
+    prompt_tokens: int = sum(len(str(m.get("content", ""))) for m in messages) // 4
+    return {
+        "id": "chatcmpl-stand-in",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stand-in"),
+        "system_fingerprint": "stand-in",
+        "choices": [
+            {"index": 0, "finish_reason": "tool_calls" if tool_calls else "stop", "message": message}
+        ],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+    }
+
+
+def choose_tool_call(user_message: str, tool_names: set) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Picks a tool call for the user message with keyword rules.
+
+    Args:
+        user_message (str): The last user message.
+        tool_names (set): The names of the offered tools.
+
+    Returns:
+        Optional[Tuple[str, Dict[str, Any]]]: The function name and arguments, or None to answer with content.
+    """
+    text: str = user_message.lower()
+    email = _EMAIL.search(user_message)
+    customer_words = ("order", "membership", "account", "spent", "bought", "purchase")
+
+    if any(word in text for word in ("bye", "thank")) and "end_conversation" in tool_names:
+        return "end_conversation", {"resettopics": {"topic_name": "default", "response": "Thanks for chatting!"}}
+    if any(phrase in text for phrase in ("start again", "something else", "never mind")) and "fallback" in tool_names:
+        return "fallback", {"response": "No problem, let's start again."}
+    if "customerQuery" in tool_names and (email or any(word in text for word in customer_words)):
+        arguments: Dict[str, Any] = {"query": user_message}
+        if email:
+            arguments["email"] = email.group(0)
+        return "customerQuery", arguments
+    if "identify_topic" in tool_names and any(word in text for word in customer_words):
+        return "identify_topic", {
+            "customerQuery": {"topic_name": "customerQuery", "response": "Sure, what is your email address?"}
+        }
+    if re.match(r"^\s*(hello|hi|hey)\b", text):
+        return ("greet", {"response": "Hello! How can I help you today?"}) if "greet" in tool_names else None
+    if "qna" in tool_names:
+        # Without `previous_answer_provided`, as models send on the first turn
+        return "qna", {"query": user_message}
+    return None
+
+
+def embeddings(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Embeds each input by hashing its words into a normalized vector, returned as a list of floats
+    or, with `encoding_format: base64` (the default of the openai client), as base64 float32.
+
+    Args:
+        body (Dict[str, Any]): The embeddings request body.
+
+    Returns:
+        Dict[str, Any]: The embeddings response body.
+    """
+    inputs: List[str] = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    dimensions: int = int(body.get("dimensions") or 64)
+    data: List[Dict[str, Any]] = []
+    for index, text in enumerate(inputs):
+        vector: List[float] = [0.0] * dimensions
+        for word in _WORDS.findall(str(text).lower()):
+            vector[zlib.crc32(word.encode("utf-8")) % dimensions] += 1.0
+        norm: float = sum(value * value for value in vector) ** 0.5 or 1.0
+        vector = [value / norm for value in vector]
+        embedding: Any = (
+            base64.b64encode(array.array("f", vector).tobytes()).decode("ascii")
+            if body.get("encoding_format") == "base64"
+            else vector
+        )
+        data.append({"object": "embedding", "index": index, "embedding": embedding})
+    tokens: int = sum(len(str(text)) for text in inputs) // 4
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "stand-in"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+def search_results(body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Ranks the stand-in product chunks by word overlap with the search text.
+
+    Args:
+        body (Dict[str, Any]): The search request body.
+
+    Returns:
+        Dict[str, Any]: The search response body.
+    """
+    query_words = set(_WORDS.findall(str(body.get("search", "")).lower()))
+    top: int = int(body.get("top", 5))
+    scored = sorted(
+        ((len(query_words & set(_WORDS.findall(chunk.lower()))), index, chunk) for index, chunk in enumerate(PRODUCT_CHUNKS)),
+        key=lambda item: (-item[0], item[1]),
+    )[:top]
+    return {
+        "value": [
+            {"@search.score": float(score), "@search.rerankerScore": 1.0 + score, "chunk": chunk, "id": str(index)}
+            for score, index, chunk in scored
+        ]
+    }
+
+
+def prepare_flow_dir(target_dir: str, search_endpoint: str) -> str:
+    """
+    Copies the flow configs and data into a working directory, pointing the AI search topics at the stand-ins.
+
+    Args:
+        target_dir (str): The working directory to prepare.
+        search_endpoint (str): The base URL of the search stand-in.
+
+    Returns:
+        str: The prepared working directory.
+    """
+    for name in os.listdir(REPO_ROOT):
+        source: str = os.path.join(REPO_ROOT, name)
+        if name.startswith("persona-") or name in ("standard_tool_functions", "data"):
+            shutil.copytree(source, os.path.join(target_dir, name), dirs_exist_ok=True)
+        elif name == "content_safety_system_prompt.txt":
+            shutil.copy(source, target_dir)
+
+    for root, _, files in os.walk(target_dir):
+        for file_name in files:
+            if not (file_name.endswith(".yaml") and os.path.basename(root).startswith("topic_area_")):
+                continue
+            path: str = os.path.join(root, file_name)
+            with open(path, "r", encoding="utf-8") as file:
+                topic = yaml.safe_load(file)
+            for rule in topic.get("follow_on_business_logic", []):
+                if "ai_search" in rule:
+                    rule["ai_search"]["index_details"]["endpoint"] = search_endpoint
+            with open(path, "w", encoding="utf-8") as file:
+                yaml.safe_dump(topic, file, sort_keys=False)
+
+    os.makedirs(os.path.join(target_dir, "chats"), exist_ok=True)
+    return target_dir
+
+
+def create_connections(url: str, configs: Optional[Dict[str, str]] = None) -> Tuple[Any, Any]:
+    """
+    Creates the Prompt Flow connections for the stand-ins.
+
+    Args:
+        url (str): The base URL of the stand-ins.
+        configs (Optional[Dict[str, str]]): Additional custom connection configs.
+
+    Returns:
+        Tuple[Any, Any]: The custom connection and the cognitive search connection.
+    """
+    from promptflow.connections import CognitiveSearchConnection, CustomConnection  # type: ignore
+
+    custom_connections = CustomConnection(
+        configs={"llm_api_endpoint": url, "llm_api_version": "2024-06-01", "llm_model_name": "stand-in", **(configs or {})},
+        secrets={"llm_api_key": "stand-in"},
+    )
+    cognitive_search_connection = CognitiveSearchConnection(api_key="stand-in", api_base=url)
+    return custom_connections, cognitive_search_connection
+
+
+def connections_from_env() -> Tuple[Any, Any]:
+    """
+    Creates the connections for the stand-ins at `STAND_IN_URL`, for `FLOW_WARMUP_CONNECTIONS`.
+
+    Returns:
+        Tuple[Any, Any]: The custom connection and the cognitive search connection.
+    """
+    return create_connections(os.environ["STAND_IN_URL"])
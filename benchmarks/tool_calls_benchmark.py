@@ -0,0 +1,143 @@
+"""
+Benchmark of the completions returning several tool calls, against the local stand-ins.
+
+Each turn asks two things at once ("my email is ... and also which tent ..."), so the routing
+completion returns a `customerQuery` and a `qna` tool call, whose handlers each make a completion
+(and `qna` a search). The default topic of the working copy is given the `customerQuery` tool for
+this. The turns are run with each `tool_calls.policy` of the topic:
+
+    first: only the first tool call is processed, the behaviour before multiple tool calls;
+    sequential: the calls are processed one after the other;
+    parallel: the calls are processed concurrently.
+
+`first` answers half of the turn; the other half costs the user another turn, i.e. another
+routing completion and handler.
+
+Usage:
+    python benchmarks/tool_calls_benchmark.py [--turns 20] [--llm-latency-ms 300] [--search-latency-ms 50]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List
+
+import yaml
+from stand_in_backends import REPO_ROOT, StandInBackends, create_connections, prepare_flow_dir
+
+sys.path.insert(0, REPO_ROOT)
+
+
+def prepare_topic(work_dir: str, policy: str) -> None:
+    """
+    Adds the `customerQuery` tool and handler of the customerQuery topic to the default topic, with
+    the tool call policy.
+    """
+    area: str = os.path.join(work_dir, "persona-public", "topic_area_customerService")
+    with open(os.path.join(area, "customerQuery.yaml"), "r", encoding="utf-8") as file:
+        customer_topic: Dict[str, Any] = yaml.safe_load(file)
+    with open(os.path.join(area, "default.yaml"), "r", encoding="utf-8") as file:
+        topic: Dict[str, Any] = yaml.safe_load(file)
+
+    topic["tools"] = [tool for tool in topic["tools"] if tool["function"]["name"] != "customerQuery"]
+    topic["tools"] += [
+        tool for tool in customer_topic["tools"] if tool["function"]["name"] == "customerQuery"
+    ]
+    topic["follow_on_business_logic"] = [
+        rule for rule in topic["follow_on_business_logic"] if rule["name"] != "customerQuery"
+    ] + [rule for rule in customer_topic["follow_on_business_logic"] if rule["name"] == "customerQuery"]
+    topic["functions_to_persist"] = sorted(set(topic["functions_to_persist"]) | {"customerQuery"})
+    topic["tool_calls"] = {"policy": "sequential" if policy == "first" else policy}
+    with open(os.path.join(area, "default.yaml"), "w", encoding="utf-8") as file:
+        yaml.safe_dump(topic, file, sort_keys=False)
+
+
+def run(turns: int, policy: str, connections: Any) -> List[float]:
+    """
+    Runs one two-question turn per conversation.
+
+    Returns:
+        List[float]: The duration of each turn in milliseconds.
+    """
+    import execute
+    from helper_classes.response_handler import ResponseHandler
+
+    custom_connections, search_connection = connections
+    process = ResponseHandler.Processor.process_tool_calls
+    if policy == "first":
+        # The turn as before multiple tool calls: only the first call is processed
+        ResponseHandler.Processor.process_tool_calls = (  # type: ignore
+            lambda self, functions: self.process_function_response(functions[0])
+        )
+
+    durations: List[float] = []
+    try:
+        for _ in range(turns):
+            parameters: Dict[str, Any] = {
+                "session_id": "benchmark",
+                "conversation_id": str(uuid.uuid4()),
+                "persona_name": "public",
+                "topic_area": "customerService",
+                "locale": "en-GB",
+            }
+            query: str = "My email is johnsmith@example.com and also which tent is best for rain?"
+            start: float = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                execute.execute(custom_connections, search_connection, json.dumps(parameters), [], query)
+            durations.append((time.perf_counter() - start) * 1000)
+    finally:
+        ResponseHandler.Processor.process_tool_calls = process  # type: ignore
+    return durations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--search-latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    backends = StandInBackends(
+        llm_latency_ms=args.llm_latency_ms, search_latency_ms=args.search_latency_ms
+    )
+    url: str = backends.start()
+    connections = create_connections(url)
+    os.environ.setdefault("FLOW_PREWARM", "0")
+
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_flow_dir(work_dir, url)
+        os.chdir(work_dir)
+        for policy in ("first", "sequential", "parallel"):
+            prepare_topic(work_dir, policy)
+            from helper_classes.topic_helper.topic_registry import TopicRegistry
+
+            TopicRegistry.clear()
+            run(2, policy, connections)
+            completions_before: int = backends.request_counts["chat"]
+            durations: List[float] = run(args.turns, policy, connections)
+            results[policy] = {
+                "mean": statistics.mean(durations),
+                "p90": sorted(durations)[int(len(durations) * 0.9)],
+                "completions": (backends.request_counts["chat"] - completions_before) / args.turns,
+            }
+        os.chdir(REPO_ROOT)
+    backends.stop()
+
+    from helper_classes.response_handler import ResponseHandler
+
+    print(f"{'policy':12} {'mean ms':>8} {'p90 ms':>8} {'completions':>12}")
+    for policy, result in results.items():
+        print(f"{policy:12} {result['mean']:8.1f} {result['p90']:8.1f} {result['completions']:12.1f}")
+    print(ResponseHandler.get_metrics())
+
+
+if __name__ == "__main__":
+    main()
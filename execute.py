@@ -1,11 +1,22 @@
-import json
+import os
 from typing import Any
 from promptflow.core import tool # type: ignore
 from promptflow.connections import CustomConnection # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
-from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.conversation_helper.conversation_concurrency import ConversationLock
+from helper_classes.conversation_helper.conversation_summary_helper import ConversationSummaryHelper
 from helper_classes.response_handler import ResponseHandler
 from helper_classes.lm_helpers.llm_helper import LLMHelper
+from helper_classes.turn_context import TurnContext
+from helper_classes import serialization, startup
+from helper_classes.metrics import Metrics
+
+# Configure logging, warm the deferred imports and configs off the first request's path (the
+# pre-warm also starts the expiry of idle conversations) and start the metrics endpoint or file
+# if configured
+startup.configure_logging()
+startup.start_prewarm()
+Metrics.start_exporters()
 
 
 @tool
@@ -30,53 +41,92 @@ def execute(
     """
     print(cognitive_search_connection)
     # Parse conversation parameters from JSON string to dictionary
-    conv_parameters: dict[str, Any] = json.loads(conversation_parameters)
-
-    # Initialize ConversationDataHelper with parsed parameters
-    conv_data_helper: ConversationDataHelper = ConversationDataHelper(conv_parameters)
-    # Retrieve conversation data
-    conv_dict: dict[str, Any] = conv_data_helper.get_conversation_data()
-
-    # Initialize LLMHelper with necessary arguments
-    # # # Initialize LLMHelper with necessary arguments
-    llm_helper: LLMHelper = LLMHelper(
-        custom_connections, cognitive_search_connection, chat_history, query, conversation_parameters, conv_dict
-    )
-    # Initialize the client
-    client = llm_helper.create_client()
-
-    # Load topic object
-    topic_object = llm_helper.load_topic_object()
-
-    # Get prompt messages
-    messages = llm_helper.get_prompt_messages()
-
-    # Get tools list
-    tools_list = llm_helper.get_tools_list()
-
-    # Get model parameters
-    params = topic_object["llm_parameters"]
-
-    # Get model name from custom connections
-    model_name = str(custom_connections.configs["llm_model_name"])
-
-    # Execute the language model helper and get the first message
-    completion: object = llm_helper.execute(
-        session_id=conv_parameters["session_id"],
-        conversation_id=conv_parameters["conversation_id"],
-        client=client,
-        model_name=model_name,
-        messages=messages,
-        tools_list=tools_list,
-        params=params
-    )
-
-    first_choice_message: object = completion.choices[0].message  # type: ignore
-
-    handler: ResponseHandler = ResponseHandler(conv_parameters, custom_connections, cognitive_search_connection, topic_object)
-    
-    # Get the list of functions to persist from the topic object
-    functions_to_persist: list[str] = topic_object["functions_to_persist"]
-
-    # Handle the response message and return the result
-    return handler.handle_response_message(first_choice_message, functions_to_persist, conv_dict)
\ No newline at end of file
+    conv_parameters: dict[str, Any] = serialization.loads(conversation_parameters)
+    # The user's message as typed, for the handlers searching with it alongside the rewritten query
+    conv_parameters["user_query"] = query
+
+    # Started by the pre-warm, unless it is disabled
+    startup.start_sweeper()
+
+    # Turns of the same conversation run one after the other when CONVERSATION_LOCK_TIMEOUT_S is set,
+    # otherwise concurrent turns are reconciled by the versioned saves of the conversation data
+    with ConversationLock.hold(os.path.join(os.getcwd(), "chats"), conv_parameters["conversation_id"]):
+        # The context of the turn, shared by the handlers and helpers so the turn is set up once
+        turn: TurnContext = TurnContext(
+            custom_connections, cognitive_search_connection, conv_parameters, chat_history, query
+        )
+        # The turn is recorded in the metrics whether it completes or fails
+        try:
+            # Retrieve conversation data
+            conv_dict: dict[str, Any] = turn.load_conversation_data()
+
+            # The LLMHelper of the conversation's topic, with the topic loaded
+            llm_helper: LLMHelper = turn.get_llm_helper()
+            # The client, shared by the handlers
+            client = turn.client
+
+            # Topic object and the dispatch table of its handlers, built when the topic area loaded. A
+            # topic whose table is invalid gets none, the response handler then answers with its apology
+            topic_object = llm_helper.topic_object
+            try:
+                dispatch_table = llm_helper.compiled_topic.get_dispatch_table()  # type: ignore
+            except ValueError:
+                dispatch_table = None
+
+            # Get prompt messages
+            with turn.timed("prompt"):
+                messages = llm_helper.get_prompt_messages()
+
+            # Get tools list and the validators for their arguments
+            tools_list = llm_helper.get_tools_list()
+            tool_validators = llm_helper.get_tool_validators()
+
+            # Get model parameters
+            params = topic_object["llm_parameters"]
+
+            # Get the default model name from custom connections, the topic's `model_routing` may override it
+            model_name = str(custom_connections.configs["llm_model_name"])
+
+            # Execute the language model helper and get the first message
+            with turn.timed("routing"):
+                completion: object = llm_helper.execute(
+                    session_id=conv_parameters["session_id"],
+                    conversation_id=conv_parameters["conversation_id"],
+                    client=client,
+                    model_name=model_name,
+                    messages=messages,
+                    tools_list=tools_list,
+                    params=params,
+                    stage="routing",
+                )
+
+            first_choice_message: object = completion.choices[0].message  # type: ignore
+
+            handler: ResponseHandler = ResponseHandler(
+                conv_parameters,
+                custom_connections,
+                cognitive_search_connection,
+                topic_object,
+                tool_validators,
+                dispatch_table,
+                turn,
+            )
+
+            # Get the list of functions to persist from the topic object
+            functions_to_persist: list[str] = topic_object["functions_to_persist"]
+
+            # Handle the response message
+            with turn.timed("handlers"):
+                response: str = handler.handle_response_message(
+                    first_choice_message, functions_to_persist, conv_dict
+                )
+
+            # Fold the oldest turns into the rolling summary in the background, off the response path
+            summary_helper: ConversationSummaryHelper = ConversationSummaryHelper(
+                custom_connections, cognitive_search_connection, conv_parameters
+            )
+            summary_helper.schedule_update(chat_history, query, response)
+        finally:
+            turn.finish()
+
+    return response
\ No newline at end of file
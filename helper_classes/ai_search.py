@@ -1,21 +1,73 @@
-from typing import Any, Dict, Union
-import requests
+import logging
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+from helper_classes.query_embedding_cache import QueryEmbeddingCache
 from helper_classes.search_ai_executor import SearchAiExecutor
 from promptflow.connections import CognitiveSearchConnection # type: ignore
 
+if TYPE_CHECKING:
+    import requests
+    from helper_classes.local_search.local_search import LocalSearch
+
 class AiSearch:
     """
     Encapsulates the AI search logic.
     """
 
-    def __init__(self, conversation_data: Dict[str, Any], conversation_parameters: Dict[str, Any], ai_search_config: Dict[str, Any], cognitive_search_connection: CognitiveSearchConnection):
+    API_VERSION = "2024-05-01-Preview"
+
+    def __init__(self, conversation_data: Dict[str, Any], conversation_parameters: Dict[str, Any], ai_search_config: Dict[str, Any], cognitive_search_connection: CognitiveSearchConnection, query: Optional[str] = None, custom_connections: Optional[Any] = None):
         self.conversation_data = conversation_data
+        # The query defaults to the one the model rewrote into the function arguments
+        self.query = query or conversation_data["arguments"]["query"]
         self.conversation_parameters = conversation_parameters
         self.index_details = ai_search_config["index_details"]
         self.search_params = ai_search_config["parameters"]
         self.cognitive_search_connection = cognitive_search_connection
+        # The flow's Azure OpenAI connection, used to embed the query when `vector_query` is `vector`
+        self.custom_connections = custom_connections
 
-    def execute(self) -> Union[requests.Response, None]:
+    @staticmethod
+    def create(
+        conversation_data: Dict[str, Any],
+        conversation_parameters: Dict[str, Any],
+        ai_search_config: Dict[str, Any],
+        cognitive_search_connection: CognitiveSearchConnection,
+        custom_connections: Optional[Any] = None,
+        query: Optional[str] = None,
+    ) -> Union["AiSearch", "LocalSearch"]:
+        """
+        Creates the search backend selected by the `backend` key of the `ai_search` configuration:
+        `azure` (the default) for Azure AI Search, or `local` for the in-process hybrid search of
+        `helper_classes.local_search`, which needs numpy.
+
+        Args:
+            conversation_data (Dict[str, Any]): The conversation data.
+            conversation_parameters (Dict[str, Any]): The conversation parameters.
+            ai_search_config (Dict[str, Any]): The `ai_search` configuration of the topic.
+            cognitive_search_connection (CognitiveSearchConnection): The Azure AI Search connection.
+            custom_connections (Optional[Any]): The custom connection, used to embed queries by the local
+                backend and by Azure AI Search with `vector_query: vector`.
+            query (Optional[str]): The search query, `arguments.query` of the conversation by default.
+
+        Returns:
+            Union[AiSearch, LocalSearch]: The search backend.
+
+        Raises:
+            ValueError: If the backend is unknown.
+        """
+        backend = ai_search_config.get("backend", "azure")
+        if backend == "azure":
+            return AiSearch(
+                conversation_data, conversation_parameters, ai_search_config, cognitive_search_connection, query, custom_connections
+            )
+        if backend == "local":
+            # Imported on first use, numpy is only needed by the local backend
+            from helper_classes.local_search.local_search import LocalSearch
+
+            return LocalSearch(conversation_data, conversation_parameters, ai_search_config, custom_connections, query)
+        raise ValueError(f"Unknown AI search backend '{backend}'")
+
+    def execute(self) -> Union["requests.Response", None]:
         """
         Executes the AI search with the configured parameters.
 
@@ -43,7 +95,7 @@ class AiSearch:
         Returns:
             Dict[str, Any]: The payload for the AI search request.
         """
-        query = self.conversation_data["arguments"]["query"]
+        query = self.query
 
         # Extract parameters from the ai_search_parameters dictionary
         select = self.search_params.get("select", "content")
@@ -58,8 +110,7 @@ class AiSearch:
             "select": select,
             "vectorQueries": [
                 {
-                    "kind": "text",
-                    "text": query,
+                    **self.get_vector_query(),
                     "fields": vector_field,
                     "k": chunk_count,
                 }
@@ -71,6 +122,29 @@ class AiSearch:
         }
         return payload
 
+    def get_vector_query(self) -> Dict[str, Any]:
+        """
+        Constructs the query of the vector search: the query text, vectorized by the search service
+        (`vector_query: text`, the default), or the query embedding computed here through the
+        embedding cache (`vector_query: vector`, with the embeddings deployment `embedding_model`
+        and optionally `embedding_dimensions`). Falls back to the text if the query cannot be embedded.
+
+        Returns:
+            Dict[str, Any]: The `kind` of the vector query and its `text` or `vector`.
+        """
+        if self.search_params.get("vector_query", "text") == "vector":
+            model: Optional[str] = self.search_params.get("embedding_model")
+            if not model or self.custom_connections is None:
+                logging.warning("vector_query is vector but embedding_model or the custom connection is missing")
+            else:
+                dimensions: Optional[int] = self.search_params.get("embedding_dimensions")
+                vector: Optional[List[float]] = QueryEmbeddingCache.embed(
+                    self.custom_connections, model, self.query, int(dimensions) if dimensions else None
+                )
+                if vector is not None:
+                    return {"kind": "vector", "vector": vector}
+        return {"kind": "text", "text": self.query}
+
     def get_endpoint(self) -> str:
         """
         Constructs the endpoint URL for the AI search.
@@ -78,9 +152,24 @@ class AiSearch:
         Returns:
             str: The endpoint URL for the AI search.
         """
-        service_name = self.index_details["service_name"]
-        index_name = self.index_details["index_name"]
-        return f"https://{service_name}.search.windows.net/indexes/{index_name}/docs/search?api-version=2024-05-01-Preview"
+        return f"{AiSearch.get_index_url(self.index_details)}/docs/search?api-version={AiSearch.API_VERSION}"
+
+    @staticmethod
+    def get_index_url(index_details: Dict[str, Any]) -> str:
+        """
+        Constructs the URL of the index.
+
+        Args:
+            index_details (Dict[str, Any]): The `index_details` of the `ai_search` configuration.
+
+        Returns:
+            str: The URL of the index, without the API version.
+        """
+        # An explicit endpoint (e.g. a private endpoint or a local stand-in) takes precedence over the service name
+        base_url = (
+            index_details.get("endpoint") or f"https://{index_details['service_name']}.search.windows.net"
+        )
+        return f"{base_url.rstrip('/')}/indexes/{index_details['index_name']}"
 
     def get_headers(self) -> Dict[str, str]:
         """
@@ -0,0 +1,87 @@
+"""
+This module provides the ConfigFileCache class, a process wide cache of parsed configuration files
+(topic YAML, standard tool functions, the content safety prompt).
+
+Files are parsed once and re-read only when their modification time changes, so a turn does not
+pay for YAML parsing. Parsed YAML is returned as a deep copy because callers may modify it.
+
+Classes:
+    ConfigFileCache: A cache of parsed configuration files keyed by path and modification time.
+"""
+
+import copy
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+
+class ConfigFileCache:
+    """
+    A process wide cache of parsed configuration files keyed by path and modification time.
+    """
+
+    _entries: Dict[str, Tuple[float, Any]] = {}
+    _lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def load_yaml(path: str) -> Any:
+        """
+        Loads a YAML file through the cache.
+
+        Args:
+            path (str): The path of the YAML file.
+
+        Returns:
+            Any: A copy of the parsed content, safe to modify.
+        """
+        return copy.deepcopy(ConfigFileCache._load(path, ConfigFileCache._parse_yaml))
+
+    @staticmethod
+    def load_text(path: str) -> str:
+        """
+        Loads a text file through the cache.
+
+        Args:
+            path (str): The path of the text file.
+
+        Returns:
+            str: The content of the file.
+        """
+        return ConfigFileCache._load(path, ConfigFileCache._read_text)
+
+    @staticmethod
+    def _load(path: str, parse: Any) -> Any:
+        """
+        Returns the cached content of a file, parsing it if it is not cached or has changed.
+
+        Args:
+            path (str): The path of the file.
+            parse (Any): The function parsing the file.
+
+        Returns:
+            Any: The cached content.
+        """
+        path = os.path.abspath(path)
+        mtime: float = os.path.getmtime(path)
+
+        entry = ConfigFileCache._entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        content = parse(path)
+        with ConfigFileCache._lock:
+            ConfigFileCache._entries[path] = (mtime, content)
+        return content
+
+    @staticmethod
+    def _parse_yaml(path: str) -> Any:
+        # Imported on first parse, it is not needed once the configs are cached
+        import yaml
+
+        with open(path, "r", encoding="utf-8") as file:
+            return yaml.safe_load(file)
+
+    @staticmethod
+    def _read_text(path: str) -> str:
+        with open(path, "r", encoding="utf-8") as file:
+            return file.read()
@@ -0,0 +1,176 @@
+"""
+This module provides the concurrency control of the conversation data, for workers serving turns
+of the same conversation at the same time (double submits, client retries, scale-out without
+sticky routing).
+
+Every stored conversation carries a version (`_version`), incremented by each save. A save is a
+compare-and-swap: it only succeeds if the stored version is still the version the turn read. On a
+conflict, the save follows `CONVERSATION_CONFLICT_POLICY`:
+
+    merge (default): the changes the turn made since it read the conversation are replayed on the
+        stored state, so the arguments persisted by the other turn are kept; on a key both turns
+        changed, the turn saving last wins. The save is then retried at once against the state the
+        conflict returned, up to `CONVERSATION_SAVE_RETRIES` times (default 3).
+    overwrite: the turn's state replaces the stored state, the behaviour without versioning.
+    reject: the save raises ConversationConflictError.
+
+A turn may also hold a per-conversation lock (`CONVERSATION_LOCK_TIMEOUT_S` > 0), so concurrent
+turns of a conversation run one after the other. The lock is a file lock, shared by the worker
+processes using the same chats directory; a turn that cannot take it within the timeout runs
+unlocked and relies on the versioned saves.
+
+Classes:
+    ConversationConflictError: Raised when a conversation changed since the turn read it.
+    ConversationLock: The per-conversation lock of a turn.
+
+Functions:
+    merge_conversation_data: Replays the changes of a turn on a newer stored state.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows, conversations are not locked
+    fcntl = None  # type: ignore
+
+VERSION_KEY = "_version"
+
+
+class ConversationConflictError(Exception):
+    """
+    Raised when a conversation changed since the turn read it.
+
+    Attributes:
+        conversation_id (str): The conversation id.
+        expected_version (int): The version the turn read.
+        stored_version (int): The stored version.
+        stored (Optional[Dict[str, Any]]): The stored state.
+    """
+
+    def __init__(
+        self, conversation_id: str, expected_version: int, stored_version: int, stored: Optional[Dict[str, Any]]
+    ):
+        super().__init__(
+            f"Conversation {conversation_id} is at version {stored_version}, expected {expected_version}"
+        )
+        self.conversation_id: str = conversation_id
+        self.expected_version: int = expected_version
+        self.stored_version: int = stored_version
+        self.stored: Optional[Dict[str, Any]] = stored
+
+
+def get_version(conversation_data: Optional[Dict[str, Any]]) -> int:
+    """
+    Returns the version of a conversation state, 0 for a missing conversation or a state saved
+    before versioning.
+    """
+    return int((conversation_data or {}).get(VERSION_KEY, 0))
+
+
+def merge_conversation_data(
+    base: Dict[str, Any], ours: Dict[str, Any], theirs: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Replays the changes of a turn on a newer stored state.
+
+    Args:
+        base (Dict[str, Any]): The state the turn read.
+        ours (Dict[str, Any]): The state of the turn.
+        theirs (Dict[str, Any]): The stored state, saved by another turn since `base` was read.
+
+    Returns:
+        Dict[str, Any]: `theirs` with the changes from `base` to `ours`, argument by argument.
+    """
+    # Imported here, the journal depends on this module for ConversationConflictError
+    from helper_classes.conversation_helper.conversation_journal import apply_record, diff_records
+
+    merged: Dict[str, Any] = dict(theirs)
+    if isinstance(merged.get("arguments"), dict):
+        merged["arguments"] = dict(merged["arguments"])
+    if isinstance(ours.get("arguments"), dict) and not isinstance(base.get("arguments"), dict):
+        # The turn's first arguments are merged one by one, not as a whole new `arguments` key
+        base = dict(base, arguments={})
+    for record in diff_records(base, ours):
+        if record.get("key") != VERSION_KEY:
+            merged = apply_record(merged, record)
+    return merged
+
+
+class ConversationLock:
+    """
+    The per-conversation lock of a turn: an exclusive file lock on `chats/_locks/<conversation_id>.lock`,
+    taken with a timeout. Disabled when `CONVERSATION_LOCK_TIMEOUT_S` is 0 (the default) or where
+    file locks are not available.
+    """
+
+    _metrics: Dict[str, float] = {"acquired": 0, "timeouts": 0, "wait_ms": 0.0}
+    _metrics_lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def timeout_s() -> float:
+        return float(os.environ.get("CONVERSATION_LOCK_TIMEOUT_S", "0"))
+
+    @staticmethod
+    @contextmanager
+    def hold(chat_path: str, conversation_id: str, timeout_s: Optional[float] = None) -> Iterator[bool]:
+        """
+        Holds the lock of a conversation for the duration of the block.
+
+        Args:
+            chat_path (str): The chats directory.
+            conversation_id (str): The conversation id.
+            timeout_s (Optional[float]): The longest wait for the lock, defaults to `CONVERSATION_LOCK_TIMEOUT_S`.
+
+        Yields:
+            bool: True if the lock is held, False if locking is disabled or timed out.
+        """
+        timeout_s = ConversationLock.timeout_s() if timeout_s is None else timeout_s
+        if timeout_s <= 0 or fcntl is None:
+            yield False
+            return
+
+        lock_path: str = os.path.join(chat_path, "_locks", conversation_id + ".lock")
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, "a", encoding="utf-8") as lock_file:
+            start: float = time.perf_counter()
+            delay: float = 0.005
+            acquired: bool = False
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    acquired = True
+                    break
+                except BlockingIOError:
+                    if time.perf_counter() - start >= timeout_s:
+                        break
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.1)
+
+            wait_ms: float = (time.perf_counter() - start) * 1000
+            with ConversationLock._metrics_lock:
+                ConversationLock._metrics["acquired" if acquired else "timeouts"] += 1
+                ConversationLock._metrics["wait_ms"] += wait_ms
+            if not acquired:
+                logging.warning(
+                    "Conversation lock timed out, the turn runs unlocked",
+                    extra={"conversation_id": conversation_id, "wait_ms": round(wait_ms, 2)},
+                )
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def get_metrics() -> Dict[str, float]:
+        """
+        Returns the number of locks acquired and timed out, and the total time waited for them.
+        """
+        with ConversationLock._metrics_lock:
+            return dict(ConversationLock._metrics)
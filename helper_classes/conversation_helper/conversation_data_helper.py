@@ -2,11 +2,36 @@
 This code defines a class ConversationDataHelper that manages conversation data, 
 saving it to and loading it from JSON files. This class provides functionality 
 to get, save, and reset conversation data based on provided conversation parameters.
+
+With `CONVERSATION_STATE_STORE=journal` the conversation data is stored in the
+ConversationJournal instead, which appends the changes of each save as delta records.
+
+The conversation data is versioned and saved with a compare-and-swap, so concurrent turns of a
+conversation do not lose each other's changes, see conversation_concurrency.
 """
 
-import json
+import copy
+import logging
 import os
-from typing import Any, Dict
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from helper_classes.conversation_helper.conversation_concurrency import (
+    VERSION_KEY,
+    ConversationConflictError,
+    get_version,
+    merge_conversation_data,
+)
+from helper_classes.conversation_helper.conversation_journal import ConversationJournal
+from helper_classes import metrics, serialization
+
+try:
+    import fcntl
+except ImportError:  # Windows, a single process per directory
+    fcntl = None  # type: ignore
 
 class ConversationDataHelper:
     """
@@ -17,7 +42,32 @@ class ConversationDataHelper:
         conversation_parameters (dict[str, Any]): Parameters for the conversation.
         _chat_path (str): Path to the chat where conversation data files are stored.
     """
-    
+
+    # Keys holding internal state that is stored with the conversation but not shown to the model
+    SUMMARY_KEY: str = "conversation_summary"
+    # Persona and creation time of the conversation, used by the expiry of idle conversations
+    STATE_KEY: str = "_state"
+    # Incremented by each save, see conversation_concurrency
+    VERSION_KEY: str = VERSION_KEY
+    # The search results of the last Q&A turn, see RetrievalReuse
+    RETRIEVAL_KEY: str = "_retrieval"
+    INTERNAL_KEYS: Tuple[str, ...] = (SUMMARY_KEY, STATE_KEY, VERSION_KEY, RETRIEVAL_KEY)
+
+    # The state each turn read, by conversation id and version, to merge its changes on a conflict
+    _bases: "OrderedDict[Tuple[str, int], Dict[str, Any]]" = OrderedDict()
+    _bases_lock: threading.Lock = threading.Lock()
+    MAX_BASES: int = 4096
+    # Serialize the compare-and-swap of a conversation file between the threads of the process
+    _file_locks: List[threading.Lock] = [threading.Lock() for _ in range(64)]
+
+    _metrics: Dict[str, int] = {
+        "saves": 0, "conflicts": 0, "merged": 0, "overwritten": 0, "rejected": 0, "retries_exhausted": 0,
+        "instances": 0,
+    }
+    _metrics_lock: threading.Lock = threading.Lock()
+    # The saves deferred by the calling thread, see `deferred_saves`
+    _local: threading.local = threading.local()
+
     def __init__(self, conversation_parameters: Dict[str, Any]):
         """
         Initializes the ConversationDataHelper with given conversation parameters.
@@ -27,55 +77,306 @@ class ConversationDataHelper:
         """
         self.conversation_parameters: Dict[str, Any] = conversation_parameters
         self._chat_path: str = os.path.join(os.getcwd(), "chats")
+        self._journal: Optional[ConversationJournal] = (
+            ConversationJournal.get_instance(self._chat_path)
+            if os.environ.get("CONVERSATION_STATE_STORE", "file") == "journal"
+            else None
+        )
+        self._count("instances")
 
     def get_conversation_data(self) -> Dict[str, Any]:
         """
         Retrieves the conversation data. If the data file does not exist, it creates
-        a default conversation data file.
+        a default conversation data file. Reading the file marks the conversation as active.
 
         Returns:
             dict[str, Any]: The conversation data.
         """
-        file_path: str = self._conversation_data_file_path()
-
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as file:
-                conversation_data = json.load(file)
-        else:
-            conversation_data = {
-                "conversation_id": self.conversation_parameters["conversation_id"],
-                "topic_name": "default",
-            }
-            self.save_conversation_data(conversation_data)
+        start_time: float = time.perf_counter()
+        conversation_id: str = self.conversation_parameters["conversation_id"]
+        conversation_data: Optional[Dict[str, Any]] = self._read()
+        if conversation_data is not None and self._journal is None:
+            # The modification time is the last activity of the conversation, see ConversationSweeper
+            try:
+                os.utime(self._conversation_data_file_path())
+            except FileNotFoundError:
+                # Expired and removed by the sweeper since it was read, the conversation starts again
+                conversation_data = None
+        if conversation_data is None:
+            conversation_data = dict(self._default_conversation_data(), **{self.VERSION_KEY: 1})
+            try:
+                self._write(conversation_data, 0)
+            except ConversationConflictError as e:
+                # Created by a concurrent turn meanwhile
+                conversation_data = e.stored or conversation_data
 
+        self._remember_base(conversation_id, conversation_data)
+        self._observe("load", start_time)
         return conversation_data
 
     def save_conversation_data(self, conversation_data: Dict[str, Any]):
         """
-        Saves the conversation data to a JSON file.
+        Saves the conversation data to a JSON file, or appends its changes to the journal.
+
+        The save only succeeds if the conversation is still at the version it was read at. Otherwise
+        `CONVERSATION_CONFLICT_POLICY` applies, see conversation_concurrency. On success the given
+        conversation data is updated in place to the saved state and version. Within `deferred_saves`
+        the save is only recorded.
 
         Args:
             conversation_data (dict[str, Any]): The conversation data to be saved.
+
+        Raises:
+            ConversationConflictError: The conversation changed meanwhile and the policy is `reject`,
+                or it kept changing for `CONVERSATION_SAVE_RETRIES` retries.
+        """
+        deferred: Optional[Dict[str, Any]] = getattr(ConversationDataHelper._local, "deferred", None)
+        if deferred is not None:
+            deferred["requested"] = True
+            return
+
+        start_time: float = time.perf_counter()
+        conversation_id: str = self.conversation_parameters["conversation_id"]
+        policy: str = os.environ.get("CONVERSATION_CONFLICT_POLICY", "merge")
+        retries: int = int(os.environ.get("CONVERSATION_SAVE_RETRIES", "3"))
+        expected_version: int = get_version(conversation_data)
+        base: Optional[Dict[str, Any]] = self._get_base(conversation_id, expected_version)
+        state: Dict[str, Any] = conversation_data
+
+        for attempt in range(retries + 1):
+            new_state: Dict[str, Any] = dict(state, **{self.VERSION_KEY: expected_version + 1})
+            try:
+                self._write(new_state, expected_version)
+                break
+            except ConversationConflictError as e:
+                outcome: str = "rejected" if policy == "reject" else "retries_exhausted"
+                if policy == "reject" or attempt == retries:
+                    self._count("conflicts", outcome)
+                    metrics.RETRIES.inc(operation="state_save", outcome=outcome)
+                    logging.warning("Conversation save conflict", extra={**self._log_data(e), "outcome": outcome})
+                    self._observe("save", start_time, outcome)
+                    raise
+                stored: Dict[str, Any] = e.stored or {}
+                if policy == "merge" and base is not None:
+                    outcome = "merged"
+                    state = merge_conversation_data(base, state, stored)
+                    base = stored
+                else:
+                    outcome = "overwritten"
+                self._count("conflicts", outcome)
+                metrics.RETRIES.inc(operation="state_save", outcome=outcome)
+                logging.info("Conversation save conflict", extra={**self._log_data(e), "outcome": outcome})
+                expected_version = e.stored_version
+
+        self._count("saves")
+        # The turn goes on with the saved state: later saves of the turn compare against it
+        conversation_data.clear()
+        conversation_data.update(new_state)
+        self._remember_base(conversation_id, new_state)
+        self._observe("save", start_time)
+
+    @staticmethod
+    @contextmanager
+    def deferred_saves() -> Iterator[Dict[str, Any]]:
+        """
+        Defers the saves and resets of the calling thread: `save_conversation_data` leaves the
+        conversation data in memory and only records that a save was requested, and
+        `reset_conversation_data` only records the data to reset to. Used by the tool calls processed
+        in parallel, whose changes are merged and saved once, see ResponseHandler.
+
+        Yields:
+            Dict[str, Any]: `requested`, whether a save was requested meanwhile, and `reset`, the
+                conversation data to reset to if a reset was requested, otherwise None.
+        """
+        deferred: Dict[str, Any] = {"requested": False, "reset": None}
+        ConversationDataHelper._local.deferred = deferred
+        try:
+            yield deferred
+        finally:
+            ConversationDataHelper._local.deferred = None
+
+    def reset_conversation_data(
+        self, conversation_data: Optional[Dict[str, Any]] = None, state: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        Resets the conversation data to default values, at the next version, whatever the stored version.
+        Within `deferred_saves` the reset is only recorded.
+
+        Args:
+            conversation_data (Optional[Dict[str, Any]]): The conversation data to reset to instead of
+                the default values, the reset data with the changes of the calls processed after it.
+            state (Optional[Dict[str, Any]]): The `_state` of the conversation, kept through the reset.
+        """
+        reset_conversation_data: Dict[str, Any] = (
+            conversation_data if conversation_data is not None else self._default_conversation_data(state)
+        )
+        deferred: Optional[Dict[str, Any]] = getattr(ConversationDataHelper._local, "deferred", None)
+        if deferred is not None:
+            deferred["reset"] = reset_conversation_data
+            return
+
+        start_time: float = time.perf_counter()
+        self._write(reset_conversation_data, None)
+        self._observe("reset", start_time)
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        """
+        Reads the stored conversation data.
+
+        Returns:
+            Optional[Dict[str, Any]]: The conversation data, or None if the conversation does not exist.
+        """
+        if self._journal is not None:
+            return self._journal.load(self.conversation_parameters["conversation_id"])
+
+        try:
+            with self._locked_file("rb", exclusive=False) as file:
+                data: bytes = file.read()
+        except FileNotFoundError:
+            return None
+        return serialization.loads(data) if data else None
+
+    def _write(self, conversation_data: Dict[str, Any], expected_version: Optional[int]) -> None:
+        """
+        Stores the conversation data if the stored version is the expected version.
+
+        Args:
+            conversation_data (Dict[str, Any]): The conversation data, with its new version.
+            expected_version (Optional[int]): The version the conversation must be at, 0 if it must not
+                exist. None writes unconditionally, at the version following the stored one.
+
+        Raises:
+            ConversationConflictError: The stored version is not the expected version.
+        """
+        conversation_id: str = self.conversation_parameters["conversation_id"]
+        if self._journal is not None:
+            if expected_version is None:
+                self._journal.reset(conversation_id, conversation_data)
+            else:
+                self._journal.save(conversation_id, conversation_data, expected_version)
+            return
+
+        with self._locked_file("a+b", exclusive=True) as file:
+            file.seek(0)
+            data: bytes = file.read()
+            stored: Optional[Dict[str, Any]] = serialization.loads(data) if data else None
+            if expected_version is None:
+                conversation_data = dict(conversation_data, **{self.VERSION_KEY: get_version(stored) + 1})
+            elif get_version(stored) != expected_version:
+                raise ConversationConflictError(conversation_id, expected_version, get_version(stored), stored)
+            file.seek(0)
+            file.truncate()
+            file.write(serialization.dumps_bytes(conversation_data))
+
+    @contextmanager
+    def _locked_file(self, mode: str, exclusive: bool) -> Iterator[Any]:
+        """
+        Opens the conversation data file, in a binary mode, with a file lock where available, shared
+        to read and exclusive to write, so a read never sees a save half written.
         """
         file_path: str = self._conversation_data_file_path()
-        with open(file_path, "w", encoding="utf-8") as file:
-            json.dump(conversation_data, file)
+        thread_lock: Optional[threading.Lock] = (
+            self._file_locks[zlib.crc32(file_path.encode("utf-8")) % len(self._file_locks)] if exclusive else None
+        )
+        if thread_lock is not None:
+            thread_lock.acquire()
+        try:
+            with open(file_path, mode) as file:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                yield file
+        finally:
+            if thread_lock is not None:
+                thread_lock.release()
+
+    @staticmethod
+    def _remember_base(conversation_id: str, conversation_data: Dict[str, Any]) -> None:
+        with ConversationDataHelper._bases_lock:
+            key: Tuple[str, int] = (conversation_id, get_version(conversation_data))
+            ConversationDataHelper._bases[key] = copy.deepcopy(conversation_data)
+            ConversationDataHelper._bases.move_to_end(key)
+            while len(ConversationDataHelper._bases) > ConversationDataHelper.MAX_BASES:
+                ConversationDataHelper._bases.popitem(last=False)
+
+    @staticmethod
+    def _get_base(conversation_id: str, version: int) -> Optional[Dict[str, Any]]:
+        with ConversationDataHelper._bases_lock:
+            return ConversationDataHelper._bases.get((conversation_id, version))
+
+    def _log_data(self, error: ConversationConflictError) -> Dict[str, Any]:
+        return {
+            "session_id": str(self.conversation_parameters.get("session_id")),
+            "conversation_id": error.conversation_id,
+            "expected_version": error.expected_version,
+            "stored_version": error.stored_version,
+        }
+
+    @staticmethod
+    def _count(*names: str) -> None:
+        with ConversationDataHelper._metrics_lock:
+            for name in names:
+                ConversationDataHelper._metrics[name] += 1
+
+    def _observe(self, operation: str, start_time: float, outcome: str = "ok") -> None:
+        """
+        Records the duration of a state store operation in the metrics.
+        """
+        metrics.STATE_STORE_SECONDS.observe(
+            time.perf_counter() - start_time,
+            store="file" if self._journal is None else "journal",
+            operation=operation,
+            outcome=outcome,
+        )
+
+    @staticmethod
+    def get_metrics() -> Dict[str, int]:
+        """
+        Returns the number of saves, of save conflicts, and how the conflicts were resolved:
+        merged, overwritten, rejected or failed after the retries, and the number of helpers created.
+        """
+        with ConversationDataHelper._metrics_lock:
+            return dict(ConversationDataHelper._metrics)
 
-    def reset_conversation_data(self) -> None:
+    @staticmethod
+    def get_prompt_data(conversation_data: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Resets the conversation data to default values.
+        Returns the conversation data without the internal keys, as shown to the model.
 
         Args:
-            conversation_data (dict[str, Any]): The conversation data as a dictionary.
+            conversation_data (dict[str, Any]): The conversation data.
 
         Returns:
-            dict[str, Any]: The reset conversation data as a dictionary.
+            dict[str, Any]: The conversation data to include in the prompt.
+        """
+        return {
+            key: value
+            for key, value in conversation_data.items()
+            if key not in ConversationDataHelper.INTERNAL_KEYS
+        }
+
+    def _default_conversation_data(self, state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
-        reset_conversation_data = {
-                "conversation_id": self.conversation_parameters["conversation_id"],
-                "topic_name": "default",
-            }
-        self.save_conversation_data(reset_conversation_data)
+        Builds the default conversation data, keeping the state of the conversation on a reset.
+
+        Args:
+            state (Optional[Dict[str, Any]]): The `_state` of the conversation being reset, if any.
+
+        Returns:
+            dict[str, Any]: The default conversation data.
+        """
+        conversation_data: Dict[str, Any] = {
+            "conversation_id": self.conversation_parameters["conversation_id"],
+            "topic_name": "default",
+        }
+
+        # A reset is given the state of the conversation, or the current conversation data as parameters
+        state = state or self.conversation_parameters.get(self.STATE_KEY)
+        if state is None and "persona_name" in self.conversation_parameters:
+            state = {"persona_name": self.conversation_parameters["persona_name"], "created_at": time.time()}
+        if state is not None:
+            conversation_data[self.STATE_KEY] = state
+
+        return conversation_data
 
     def _conversation_data_file_path(self) -> str:
         """
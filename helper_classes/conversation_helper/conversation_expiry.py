@@ -0,0 +1,367 @@
+"""
+This module provides the expiry of idle conversations stored in `chats/`.
+
+A conversation is idle since the last time its file was read or written. The time to live of idle
+conversations is configured per persona in `persona-<name>/persona.yaml`:
+
+    conversation_expiry:
+      ttl_hours: 72
+      archive: true
+
+Conversations of personas without a policy use `CONVERSATION_TTL_HOURS` (0, never expire, by default).
+Expiry is opt-in, no persona of the sample sets a policy.
+
+The ConversationSweeper walks the directory incrementally on a background thread, a batch of entries
+at a time with a pause between batches, so a large directory is never scanned in one go. Expired
+conversations are deleted, after being appended to a gzip JSON lines archive in `chats/_archive/`
+if the policy asks for it.
+
+Classes:
+    ExpiryPolicy: The expiry policy of a persona.
+    ConversationSweeper: Expires idle conversations in the background.
+"""
+
+import copy
+import glob
+import gzip
+import logging
+import os
+import threading
+import time
+import traceback
+from typing import Any, Dict, Iterator, Optional
+
+from helper_classes import serialization
+from helper_classes.config_file_cache import ConfigFileCache
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.topic_helper.flow_bundle import FlowBundle
+
+try:
+    import fcntl
+except ImportError:  # Windows, every worker sweeps
+    fcntl = None  # type: ignore
+
+
+class ExpiryPolicy:
+    """
+    The expiry policy of a persona.
+
+    Attributes:
+        ttl_seconds (float): Idle time after which a conversation expires, 0 to never expire.
+        archive (bool): Whether expired conversations are archived before being deleted.
+    """
+
+    def __init__(self, ttl_seconds: float, archive: bool = False):
+        self.ttl_seconds: float = ttl_seconds
+        self.archive: bool = archive
+
+    @staticmethod
+    def default() -> "ExpiryPolicy":
+        """
+        Returns the policy of conversations without a persona policy, from the environment.
+
+        Returns:
+            ExpiryPolicy: The default policy.
+        """
+        return ExpiryPolicy(
+            float(os.environ.get("CONVERSATION_TTL_HOURS", "0")) * 3600,
+            os.environ.get("CONVERSATION_ARCHIVE", "0") == "1",
+        )
+
+    @staticmethod
+    def for_persona(persona_name: str) -> "ExpiryPolicy":
+        """
+        Returns the policy of a persona, from the flow bundle or `persona-<name>/persona.yaml`.
+
+        Args:
+            persona_name (str): The persona name.
+
+        Returns:
+            ExpiryPolicy: The policy, the default policy if the persona has none.
+        """
+        settings: Dict[str, Any] = {}
+        bundle: Optional[FlowBundle] = FlowBundle.get_active()
+        if bundle is not None:
+            settings = bundle.get_persona(persona_name)
+        else:
+            path: str = os.path.join(os.getcwd(), "persona-" + persona_name, "persona.yaml")
+            if os.path.exists(path):
+                settings = ConfigFileCache.load_yaml(path) or {}
+
+        expiry: Optional[Dict[str, Any]] = settings.get("conversation_expiry")
+        if expiry is None:
+            return ExpiryPolicy.default()
+        return ExpiryPolicy(float(expiry.get("ttl_hours", 0)) * 3600, bool(expiry.get("archive", False)))
+
+    @staticmethod
+    def any_expiring() -> bool:
+        """
+        Returns whether the default policy or the policy of a persona expires conversations.
+
+        Returns:
+            bool: True if a policy has a time to live.
+        """
+        policies = list(ExpiryPolicy.load_all().values()) + [ExpiryPolicy.default()]
+        return any(policy.ttl_seconds > 0 for policy in policies)
+
+    @staticmethod
+    def load_all() -> Dict[str, "ExpiryPolicy"]:
+        """
+        Returns the policies of all personas of the flow bundle or the working directory.
+
+        Returns:
+            Dict[str, ExpiryPolicy]: The policies keyed by persona name.
+        """
+        bundle: Optional[FlowBundle] = FlowBundle.get_active()
+        if bundle is not None:
+            persona_names = {topic_id.split("/")[0] for topic_id in bundle.topic_ids()}
+        else:
+            persona_names = {
+                os.path.basename(path)[len("persona-"):] for path in glob.glob(os.path.join(os.getcwd(), "persona-*"))
+            }
+        return {persona_name: ExpiryPolicy.for_persona(persona_name) for persona_name in sorted(persona_names)}
+
+
+class ConversationSweeper:
+    """
+    Expires idle conversations in the background, a batch of directory entries at a time.
+
+    Attributes:
+        chat_path (str): The directory holding the conversation files.
+        batch_size (int): Number of entries examined per batch.
+        batch_pause_s (float): Pause between two batches.
+        pass_pause_s (float): Pause between two passes over the directory.
+    """
+
+    _instance: Optional["ConversationSweeper"] = None
+    _instance_lock: threading.Lock = threading.Lock()
+
+    def __init__(
+        self,
+        chat_path: Optional[str] = None,
+        batch_size: int = 200,
+        batch_pause_s: float = 0.5,
+        pass_pause_s: float = 300.0,
+    ):
+        self.chat_path: str = chat_path or os.path.join(os.getcwd(), "chats")
+        self.batch_size: int = batch_size
+        self.batch_pause_s: float = batch_pause_s
+        self.pass_pause_s: float = pass_pause_s
+        self._entries: Optional[Iterator[os.DirEntry]] = None
+        self._pass: Dict[str, Any] = {}
+        self._policies: Dict[str, ExpiryPolicy] = {}
+        self._default_policy: ExpiryPolicy = ExpiryPolicy.default()
+        self._min_ttl_seconds: float = float("inf")
+        self._metrics: Dict[str, Any] = {
+            "passes": 0,
+            "expired_total": 0,
+            "archived_total": 0,
+            "errors_total": 0,
+            "last_pass": {},
+        }
+        self._metrics_lock: threading.Lock = threading.Lock()
+        self._stop: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def start() -> Optional["ConversationSweeper"]:
+        """
+        Starts the sweeper of the `chats/` directory, once per process. Disabled with `CONVERSATION_SWEEPER=0`.
+        Only one process per directory sweeps when file locks are available.
+
+        Returns:
+            Optional[ConversationSweeper]: The running sweeper, or None if it is disabled.
+        """
+        if os.environ.get("CONVERSATION_SWEEPER", "1") == "0":
+            return None
+
+        with ConversationSweeper._instance_lock:
+            if ConversationSweeper._instance is None:
+                sweeper = ConversationSweeper(
+                    batch_size=int(os.environ.get("CONVERSATION_SWEEP_BATCH", "200")),
+                    batch_pause_s=float(os.environ.get("CONVERSATION_SWEEP_PAUSE_S", "0.5")),
+                    pass_pause_s=float(os.environ.get("CONVERSATION_SWEEP_INTERVAL_S", "300")),
+                )
+                sweeper._thread = threading.Thread(target=sweeper.run, name="conversation-sweeper", daemon=True)
+                sweeper._thread.start()
+                ConversationSweeper._instance = sweeper
+        return ConversationSweeper._instance
+
+    @staticmethod
+    def get_instance() -> Optional["ConversationSweeper"]:
+        return ConversationSweeper._instance
+
+    def stop(self) -> None:
+        """
+        Stops the sweeper after the current batch.
+        """
+        self._stop.set()
+
+    def run(self) -> None:
+        """
+        Sweeps the directory in batches until stopped. Waits for the directory lock if another
+        process is sweeping the same directory. Nothing is created in the directory until a policy
+        expires conversations.
+        """
+        while not self._stop.is_set() and not ExpiryPolicy.any_expiring():
+            self._stop.wait(self.pass_pause_s)
+        if self._stop.is_set():
+            return
+        os.makedirs(self.chat_path, exist_ok=True)
+        with open(os.path.join(self.chat_path, ".sweeper.lock"), "a", encoding="utf-8") as lock_file:
+            while fcntl is not None and not self._stop.is_set():
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    self._stop.wait(self.pass_pause_s)
+
+            while not self._stop.is_set():
+                try:
+                    pass_completed: bool = self.sweep_batch()
+                except Exception as e:  # pylint: disable=broad-except
+                    pass_completed = True
+                    log_data: Dict[str, Any] = {"error": "".join(traceback.format_exception(None, e, e.__traceback__))}
+                    logging.error("Conversation sweep failed", extra=log_data)
+                self._stop.wait(self.pass_pause_s if pass_completed else self.batch_pause_s)
+
+    def sweep_batch(self, now: Optional[float] = None) -> bool:
+        """
+        Examines the next batch of directory entries and expires the idle conversations.
+
+        Args:
+            now (Optional[float]): The current time, defaults to `time.time()`.
+
+        Returns:
+            bool: True if the batch completed a pass over the directory.
+        """
+        now = now or time.time()
+        if self._entries is None:
+            # Policies are reloaded at the start of each pass
+            self._policies = ExpiryPolicy.load_all()
+            self._default_policy = ExpiryPolicy.default()
+            ttls = [p.ttl_seconds for p in list(self._policies.values()) + [self._default_policy] if p.ttl_seconds > 0]
+            self._min_ttl_seconds = min(ttls) if ttls else float("inf")
+            self._pass = {"started_at": now, "scanned": 0, "live": 0, "expired": 0, "by_persona": {}}
+            if not ttls:
+                # No policy expires conversations, there is nothing to scan
+                self._complete_pass(now)
+                return True
+            self._entries = iter(os.scandir(self.chat_path))
+
+        for _ in range(self.batch_size):
+            entry: Optional[os.DirEntry] = next(self._entries, None)
+            if entry is None:
+                self._complete_pass(now)
+                return True
+            if entry.name.endswith(".json") and entry.is_file():
+                self._pass["scanned"] += 1
+                self.sweep_entry(entry.path, now)
+        return False
+
+    def sweep_entry(self, path: str, now: float) -> bool:
+        """
+        Expires a conversation file if it has been idle longer than the time to live of its persona.
+
+        Args:
+            path (str): The path of the conversation file.
+            now (float): The current time.
+
+        Returns:
+            bool: True if the conversation expired.
+        """
+        try:
+            # Files idle for less than the shortest time to live are not read
+            if now - os.path.getmtime(path) < self._min_ttl_seconds:
+                self._count("live", None)
+                return False
+
+            with open(path, "rb") as file:
+                conversation_data: Dict[str, Any] = serialization.loads(file.read())
+            state: Dict[str, Any] = conversation_data.get(ConversationDataHelper.STATE_KEY) or {}
+            persona_name: str = state.get("persona_name") or ""
+            policy: ExpiryPolicy = self._policies.get(persona_name, self._default_policy)
+
+            # The mtime is checked again so a conversation resumed while it was being read is kept
+            if policy.ttl_seconds <= 0 or now - os.path.getmtime(path) < policy.ttl_seconds:
+                self._count("live", persona_name)
+                return False
+
+            if policy.archive:
+                self.archive(conversation_data, now)
+            os.remove(path)
+            # The lock file of the conversation, if its turns were locked (see ConversationLock),
+            # and its prompt message cache (see PromptMessageCache)
+            conversation_id: str = os.path.basename(path)[: -len(".json")]
+            for side_path in (
+                os.path.join(self.chat_path, "_locks", conversation_id + ".lock"),
+                os.path.join(self.chat_path, "_prompt_cache", conversation_id + ".tsv"),
+            ):
+                try:
+                    os.remove(side_path)
+                except FileNotFoundError:
+                    pass
+            self._count("expired", persona_name)
+            return True
+
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            with self._metrics_lock:
+                self._metrics["errors_total"] += 1
+            logging.error("Conversation expiry failed", extra={"path": path, "error": str(e)})
+            return False
+
+    def archive(self, conversation_data: Dict[str, Any], now: float) -> None:
+        """
+        Appends an expired conversation to the gzip JSON lines archive of the day.
+
+        Args:
+            conversation_data (Dict[str, Any]): The conversation data.
+            now (float): The expiry time.
+        """
+        archive_path: str = os.path.join(self.chat_path, "_archive")
+        os.makedirs(archive_path, exist_ok=True)
+        record: str = serialization.dumps({"expired_at": now, "conversation": conversation_data})
+        file_name: str = time.strftime("%Y-%m-%d", time.gmtime(now)) + ".jsonl.gz"
+        # Each append is a gzip member, concatenated members read back as one stream
+        with gzip.open(os.path.join(archive_path, file_name), "at", encoding="utf-8") as file:
+            file.write(record + "\n")
+        with self._metrics_lock:
+            self._metrics["archived_total"] += 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Returns the sweeper metrics.
+
+        Returns:
+            Dict[str, Any]: The number of passes, the expired, archived and error totals, and the live
+                and expired conversations of the last completed pass, in total and per persona for the
+                conversations idle long enough to be examined ("" for conversations without a persona).
+        """
+        with self._metrics_lock:
+            return copy.deepcopy(self._metrics)
+
+    def _count(self, outcome: str, persona_name: Optional[str]) -> None:
+        self._pass[outcome] += 1
+        if persona_name is not None:
+            by_persona: Dict[str, int] = self._pass["by_persona"].setdefault(persona_name, {"live": 0, "expired": 0})
+            by_persona[outcome] += 1
+        if outcome == "expired":
+            with self._metrics_lock:
+                self._metrics["expired_total"] += 1
+
+    def _complete_pass(self, now: float) -> None:
+        self._entries = None
+        self._pass["duration_s"] = time.time() - self._pass["started_at"]
+        with self._metrics_lock:
+            self._metrics["passes"] += 1
+            self._metrics["last_pass"] = self._pass
+
+        log_data: Dict[str, Any] = {
+            "scanned": self._pass["scanned"],
+            "live": self._pass["live"],
+            "expired": self._pass["expired"],
+            "duration_s": self._pass["duration_s"],
+        }
+        logging.info("Conversation sweep completed", extra=log_data)
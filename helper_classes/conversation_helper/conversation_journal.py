@@ -0,0 +1,456 @@
+"""
+This module provides the ConversationJournal, an event sourced store of conversation data.
+
+Instead of rewriting the whole JSON document of a conversation on every save, the journal appends
+the changes as small delta records to the journal of the conversation's shard, so a save writes
+O(delta) bytes. The records are:
+
+    {"op": "topic", "value": ...}            the topic changed
+    {"op": "arg", "key": ..., "value": ...}  an argument was set
+    {"op": "arg_del", "key": ...}            an argument was removed
+    {"op": "set", "key": ..., "value": ...}  another key was set
+    {"op": "del", "key": ...}                another key was removed
+    {"op": "reset", "value": {...}}          the conversation was reset or created
+
+Each shard (`chats/_journal/<shard>.<generation>.log`) is compacted into a snapshot
+(`<shard>.<generation>.snap`) once its journal grows past `CONVERSATION_JOURNAL_COMPACT_BYTES`,
+on a background thread. A read replays the snapshot entry of the conversation and its records in the
+journal tail, located through an in-memory index of record offsets. Until a shard is compacted its
+journal is also an audit trail of how each turn changed the conversation, see `get_history`.
+
+Writes to a shard and its compaction are serialized with a file lock where available, so several
+worker processes can share the directory. A save given the version the turn read is a
+compare-and-swap, see conversation_concurrency.
+
+Classes:
+    ConversationJournal: The journal store of conversation data.
+
+Functions:
+    diff_records: Computes the delta records turning one conversation state into another.
+    apply_record: Applies a delta record to a conversation state.
+"""
+
+import logging
+import os
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from helper_classes import serialization
+from helper_classes.conversation_helper.conversation_concurrency import (
+    VERSION_KEY,
+    ConversationConflictError,
+    get_version,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows, a single process per directory
+    fcntl = None  # type: ignore
+
+ARGUMENTS_KEY = "arguments"
+
+
+def diff_records(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Computes the delta records turning one conversation state into another.
+
+    Args:
+        old (Dict[str, Any]): The stored state.
+        new (Dict[str, Any]): The state to store.
+
+    Returns:
+        List[Dict[str, Any]]: The delta records, empty if nothing changed.
+    """
+    records: List[Dict[str, Any]] = []
+    for key, value in new.items():
+        if key == ARGUMENTS_KEY and isinstance(value, dict) and isinstance(old.get(key), dict):
+            old_arguments: Dict[str, Any] = old[key]
+            records.extend(
+                {"op": "arg", "key": name, "value": item}
+                for name, item in value.items()
+                if name not in old_arguments or old_arguments[name] != item
+            )
+            records.extend({"op": "arg_del", "key": name} for name in old_arguments if name not in value)
+        elif key not in old or old[key] != value:
+            records.append({"op": "topic", "value": value} if key == "topic_name" else {"op": "set", "key": key, "value": value})
+    records.extend({"op": "del", "key": key} for key in old if key not in new)
+    return records
+
+
+def apply_record(state: Dict[str, Any], record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Applies a delta record to a conversation state.
+
+    Args:
+        state (Dict[str, Any]): The conversation state, modified in place.
+        record (Dict[str, Any]): The delta record.
+
+    Returns:
+        Dict[str, Any]: The new state.
+    """
+    op: str = record["op"]
+    if op == "reset":
+        return dict(record["value"])
+    if op == "topic":
+        state["topic_name"] = record["value"]
+    elif op == "arg":
+        state.setdefault(ARGUMENTS_KEY, {})[record["key"]] = record["value"]
+    elif op == "arg_del":
+        state.get(ARGUMENTS_KEY, {}).pop(record["key"], None)
+    elif op == "set":
+        state[record["key"]] = record["value"]
+    elif op == "del":
+        state.pop(record["key"], None)
+    return state
+
+
+class _ShardIndex:
+    """
+    The in-memory index of a shard generation: the offset of each conversation in the snapshot and
+    of its records in the journal, up to the indexed end of the journal.
+    """
+
+    def __init__(self, generation: int):
+        self.generation: int = generation
+        self.snapshot_offsets: Optional[Dict[str, int]] = None
+        self.log_offsets: Dict[str, List[int]] = {}
+        self.log_end: int = 0
+
+
+class ConversationJournal:
+    """
+    The journal store of conversation data, sharded by conversation id.
+
+    Attributes:
+        path (str): The directory of the journals and snapshots.
+        shards (int): The number of shards.
+        compact_bytes (int): The journal size above which a shard is compacted.
+    """
+
+    _instances: Dict[str, "ConversationJournal"] = {}
+    _instances_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, path: str, shards: int = 16, compact_bytes: int = 1024 * 1024):
+        self.path: str = path
+        self.shards: int = shards
+        self.compact_bytes: int = compact_bytes
+        self._indexes: Dict[int, _ShardIndex] = {}
+        self._locks: Dict[int, threading.Lock] = {shard: threading.Lock() for shard in range(shards)}
+        self._compacting: Set[int] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def get_instance(chat_path: str) -> "ConversationJournal":
+        """
+        Returns the journal store of a chats directory, shared by the process.
+
+        Args:
+            chat_path (str): The chats directory.
+
+        Returns:
+            ConversationJournal: The journal store.
+        """
+        path: str = os.path.join(chat_path, "_journal")
+        journal = ConversationJournal._instances.get(path)
+        if journal is None:
+            with ConversationJournal._instances_lock:
+                journal = ConversationJournal._instances.get(path)
+                if journal is None:
+                    journal = ConversationJournal(
+                        path,
+                        int(os.environ.get("CONVERSATION_JOURNAL_SHARDS", "16")),
+                        int(os.environ.get("CONVERSATION_JOURNAL_COMPACT_BYTES", str(1024 * 1024))),
+                    )
+                    ConversationJournal._instances[path] = journal
+        return journal
+
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Reads a conversation by replaying its snapshot entry and journal records.
+
+        Args:
+            conversation_id (str): The conversation id.
+
+        Returns:
+            Optional[Dict[str, Any]]: The conversation state, or None if the conversation does not exist.
+        """
+        shard: int = self.shard_of(conversation_id)
+        for _ in range(3):
+            try:
+                with self._locks[shard]:
+                    index: _ShardIndex = self._refresh_index(shard)
+                    return self._materialize(shard, index, conversation_id)[0]
+            except FileNotFoundError:
+                # The shard was compacted into a new generation meanwhile
+                self._indexes.pop(shard, None)
+        raise RuntimeError(f"Conversation journal shard {shard} keeps changing, cannot read {conversation_id}")
+
+    def save(self, conversation_id: str, state: Dict[str, Any], expected_version: Optional[int] = None) -> int:
+        """
+        Appends the changes from the stored state to the given state.
+
+        Args:
+            conversation_id (str): The conversation id.
+            state (Dict[str, Any]): The conversation state to store.
+            expected_version (Optional[int]): If given, the save only succeeds if the stored version
+                (`_version`, 0 for a missing conversation) is still this version.
+
+        Returns:
+            int: The number of records appended.
+
+        Raises:
+            ConversationConflictError: The stored version is not the expected version.
+        """
+        shard: int = self.shard_of(conversation_id)
+        with self._locks[shard], self._file_lock(shard):
+            index: _ShardIndex = self._refresh_index(shard)
+            stored, _ = self._materialize(shard, index, conversation_id)
+            if expected_version is not None and get_version(stored) != expected_version:
+                raise ConversationConflictError(conversation_id, expected_version, get_version(stored), stored)
+            records: List[Dict[str, Any]] = (
+                [{"op": "reset", "value": state}] if stored is None else diff_records(stored, state)
+            )
+            if records:
+                self._append(shard, index, conversation_id, records)
+        return len(records)
+
+    def reset(self, conversation_id: str, state: Dict[str, Any]) -> None:
+        """
+        Appends a reset record replacing the whole conversation state, at the next version.
+
+        Args:
+            conversation_id (str): The conversation id.
+            state (Dict[str, Any]): The new conversation state.
+        """
+        shard: int = self.shard_of(conversation_id)
+        with self._locks[shard], self._file_lock(shard):
+            index: _ShardIndex = self._refresh_index(shard)
+            stored, _ = self._materialize(shard, index, conversation_id)
+            value: Dict[str, Any] = dict(state, **{VERSION_KEY: get_version(stored) + 1})
+            self._append(shard, index, conversation_id, [{"op": "reset", "value": value}])
+
+    def get_history(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """
+        Returns the records of a conversation since the last compaction of its shard, for auditing.
+
+        Args:
+            conversation_id (str): The conversation id.
+
+        Returns:
+            List[Dict[str, Any]]: The records in order, with their `t` timestamps.
+        """
+        shard: int = self.shard_of(conversation_id)
+        with self._locks[shard]:
+            index: _ShardIndex = self._refresh_index(shard)
+            return self._materialize(shard, index, conversation_id)[1]
+
+    def compact(self, shard: int) -> int:
+        """
+        Compacts a shard: writes a snapshot of every conversation into a new generation and starts an
+        empty journal. Conversations idle for longer than the time to live of their persona are dropped.
+
+        Args:
+            shard (int): The shard.
+
+        Returns:
+            int: The number of conversations in the new snapshot.
+        """
+        # Imported here, the expiry module depends on the conversation data helper using this store
+        from helper_classes.conversation_helper.conversation_expiry import ExpiryPolicy
+        from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+
+        start_time: float = time.perf_counter()
+        now: float = time.time()
+        policies: Dict[str, ExpiryPolicy] = ExpiryPolicy.load_all()
+        default_policy: ExpiryPolicy = ExpiryPolicy.default()
+
+        with self._locks[shard], self._file_lock(shard):
+            index: _ShardIndex = self._refresh_index(shard)
+            generation: int = index.generation + 1
+            snapshot_path: str = self._file(shard, generation, "snap")
+            kept, dropped = 0, 0
+
+            with open(snapshot_path + ".tmp", "w", encoding="utf-8") as snapshot:
+                for conversation_id in sorted(set(self._snapshot_offsets(shard, index)) | set(index.log_offsets)):
+                    state, records = self._materialize(shard, index, conversation_id)
+                    if state is None:
+                        continue
+                    updated_at: float = records[-1]["t"] if records else self._snapshot_time(shard, index, conversation_id)
+                    persona_name: str = (state.get(ConversationDataHelper.STATE_KEY) or {}).get("persona_name") or ""
+                    ttl_seconds: float = policies.get(persona_name, default_policy).ttl_seconds
+                    if ttl_seconds > 0 and now - updated_at > ttl_seconds:
+                        dropped += 1
+                        continue
+                    snapshot.write(conversation_id + "\t" + serialization.dumps({"t": updated_at, "state": state}) + "\n")
+                    kept += 1
+
+            os.replace(snapshot_path + ".tmp", snapshot_path)
+            open(self._file(shard, generation, "log"), "a", encoding="utf-8").close()
+            with open(self._generation_file(shard) + ".tmp", "w", encoding="utf-8") as file:
+                file.write(str(generation))
+            os.replace(self._generation_file(shard) + ".tmp", self._generation_file(shard))
+
+            for kind in ("snap", "log"):
+                try:
+                    os.remove(self._file(shard, index.generation, kind))
+                except FileNotFoundError:
+                    pass
+            self._indexes.pop(shard, None)
+
+        log_data: Dict[str, Any] = {
+            "shard": shard,
+            "generation": generation,
+            "conversations": kept,
+            "expired": dropped,
+            "execution_time_ms": (time.perf_counter() - start_time) * 1000,
+        }
+        logging.info("Conversation journal compacted", extra=log_data)
+        return kept
+
+    def shard_of(self, conversation_id: str) -> int:
+        return zlib.crc32(conversation_id.encode("utf-8")) % self.shards
+
+    def _append(self, shard: int, index: _ShardIndex, conversation_id: str, records: List[Dict[str, Any]]) -> None:
+        """
+        Appends records to the journal of a shard with a single write. Must be called with the locks held.
+        """
+        now: float = time.time()
+        prefix: bytes = conversation_id.encode("utf-8") + b"\t"
+        data: bytes = b"".join(prefix + serialization.dumps_bytes({"t": now, **record}) + b"\n" for record in records)
+
+        descriptor: int = os.open(self._file(shard, index.generation, "log"), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(descriptor, data)
+            size: int = os.fstat(descriptor).st_size
+        finally:
+            os.close(descriptor)
+
+        if size > self.compact_bytes:
+            self._schedule_compaction(shard)
+
+    def _schedule_compaction(self, shard: int) -> None:
+        if shard in self._compacting:
+            return
+        self._compacting.add(shard)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-journal")
+        self._executor.submit(self._run_compaction, shard)
+
+    def _run_compaction(self, shard: int) -> None:
+        try:
+            self.compact(shard)
+        except Exception as e:  # pylint: disable=broad-except
+            log_data: Dict[str, Any] = {"shard": shard, "error": "".join(traceback.format_exception(None, e, e.__traceback__))}
+            logging.error("Conversation journal compaction failed", extra=log_data)
+        finally:
+            self._compacting.discard(shard)
+
+    def _refresh_index(self, shard: int) -> _ShardIndex:
+        """
+        Brings the index of a shard up to date with its current generation and the end of its journal.
+        """
+        generation: int = self._read_generation(shard)
+        index: Optional[_ShardIndex] = self._indexes.get(shard)
+        if index is None or index.generation != generation:
+            index = _ShardIndex(generation)
+            self._indexes[shard] = index
+
+        log_path: str = self._file(shard, generation, "log")
+        if generation > 0 or os.path.exists(log_path):
+            with open(log_path, "rb") as log:
+                log.seek(index.log_end)
+                tail: bytes = log.read()
+            # Only complete lines are indexed, a record being appended is picked up by the next read
+            offset: int = index.log_end
+            for line in tail.splitlines(keepends=True):
+                if not line.endswith(b"\n"):
+                    break
+                conversation_id: str = line[: line.index(b"\t")].decode("utf-8")
+                index.log_offsets.setdefault(conversation_id, []).append(offset)
+                offset += len(line)
+            index.log_end = offset
+        return index
+
+    def _materialize(
+        self, shard: int, index: _ShardIndex, conversation_id: str
+    ) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Replays the snapshot entry and the journal records of a conversation.
+
+        Returns:
+            Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]: The state, None if the conversation does
+                not exist, and the journal records replayed.
+        """
+        state: Optional[Dict[str, Any]] = None
+        snapshot_offset: Optional[int] = self._snapshot_offsets(shard, index).get(conversation_id)
+        if snapshot_offset is not None:
+            state = self._read_line(self._file(shard, index.generation, "snap"), snapshot_offset)["state"]
+
+        records: List[Dict[str, Any]] = []
+        offsets: List[int] = index.log_offsets.get(conversation_id, [])
+        if offsets:
+            with open(self._file(shard, index.generation, "log"), "rb") as log:
+                for offset in offsets:
+                    log.seek(offset)
+                    records.append(serialization.loads(log.readline().split(b"\t", 1)[1]))
+        for record in records:
+            state = apply_record(state if state is not None else {}, record)
+        return state, records
+
+    def _snapshot_offsets(self, shard: int, index: _ShardIndex) -> Dict[str, int]:
+        if index.snapshot_offsets is None:
+            index.snapshot_offsets = {}
+            snapshot_path: str = self._file(shard, index.generation, "snap")
+            if index.generation > 0:
+                offset: int = 0
+                with open(snapshot_path, "rb") as snapshot:
+                    for line in snapshot:
+                        index.snapshot_offsets[line[: line.index(b"\t")].decode("utf-8")] = offset
+                        offset += len(line)
+        return index.snapshot_offsets
+
+    def _snapshot_time(self, shard: int, index: _ShardIndex, conversation_id: str) -> float:
+        offset: Optional[int] = self._snapshot_offsets(shard, index).get(conversation_id)
+        if offset is None:
+            return time.time()
+        return self._read_line(self._file(shard, index.generation, "snap"), offset)["t"]
+
+    @staticmethod
+    def _read_line(path: str, offset: int) -> Dict[str, Any]:
+        with open(path, "rb") as file:
+            file.seek(offset)
+            return serialization.loads(file.readline().split(b"\t", 1)[1])
+
+    def _read_generation(self, shard: int) -> int:
+        try:
+            with open(self._generation_file(shard), "r", encoding="utf-8") as file:
+                return int(file.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _generation_file(self, shard: int) -> str:
+        return os.path.join(self.path, f"{shard:03d}.generation")
+
+    def _file(self, shard: int, generation: int, kind: str) -> str:
+        return os.path.join(self.path, f"{shard:03d}.{generation}.{kind}")
+
+    @contextmanager
+    def _file_lock(self, shard: int) -> Iterator[None]:
+        """
+        Serializes the writes and compactions of a shard across processes.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.path, f"{shard:03d}.lock"), "a", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,180 @@
+"""
+This module provides the summarizers used to fold older conversation turns into a rolling summary.
+
+Classes:
+    ConversationSummarizer: Abstract base class for conversation summarizers.
+    ExtractiveSummarizer: A local summarizer that keeps the leading sentence of each turn.
+    LLMSummarizer: A summarizer that asks a (cheap) model deployment to write the summary.
+"""
+
+from abc import ABC, abstractmethod
+import re
+from typing import Any, Dict, List
+from promptflow.connections import CustomConnection # type: ignore
+from promptflow.connections import CognitiveSearchConnection # type: ignore
+
+
+class ConversationSummarizer(ABC):
+    """
+    Abstract base class for conversation summarizers.
+
+    A summarizer receives the current rolling summary and the turns that should be folded into it,
+    and returns the new rolling summary.
+    """
+
+    @abstractmethod
+    def summarize(self, previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        """
+        Folds the given turns into the previous summary.
+
+        Args:
+            previous_summary (str): The current rolling summary, empty if there is none yet.
+            turns (List[Dict[str, str]]): The turns to fold, each with a `user` and an `assistant` entry.
+
+        Returns:
+            str: The new rolling summary.
+        """
+        pass
+
+
+class ExtractiveSummarizer(ConversationSummarizer):
+    """
+    A local summarizer that keeps the leading sentence of each user query and assistant answer.
+
+    It needs no model call, so it is cheap and deterministic. The summary is capped to `max_chars`
+    by dropping the oldest lines first.
+    """
+
+    _SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+    def __init__(self, max_chars: int = 2000, max_sentence_chars: int = 200):
+        """
+        Initializes the ExtractiveSummarizer.
+
+        Args:
+            max_chars (int, optional): Maximum length of the summary. Defaults to 2000.
+            max_sentence_chars (int, optional): Maximum length kept per utterance. Defaults to 200.
+        """
+        self.max_chars: int = max_chars
+        self.max_sentence_chars: int = max_sentence_chars
+
+    def summarize(self, previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        """
+        Folds the given turns into the previous summary.
+
+        Args:
+            previous_summary (str): The current rolling summary, empty if there is none yet.
+            turns (List[Dict[str, str]]): The turns to fold, each with a `user` and an `assistant` entry.
+
+        Returns:
+            str: The new rolling summary.
+        """
+        lines: List[str] = previous_summary.splitlines() if previous_summary else []
+        for turn in turns:
+            lines.append("User: " + self.leading_sentence(turn["user"]))
+            lines.append("Assistant: " + self.leading_sentence(turn["assistant"]))
+
+        # Drop the oldest lines until the summary fits the budget
+        while lines and sum(len(line) + 1 for line in lines) > self.max_chars:
+            lines.pop(0)
+
+        return "\n".join(lines)
+
+    def leading_sentence(self, text: str) -> str:
+        """
+        Returns the first sentence of the text, truncated to `max_sentence_chars`.
+
+        Args:
+            text (str): The utterance.
+
+        Returns:
+            str: The leading sentence.
+        """
+        sentence: str = self._SENTENCE_END.split(" ".join(text.split()), maxsplit=1)[0]
+        if len(sentence) > self.max_sentence_chars:
+            sentence = sentence[: self.max_sentence_chars].rstrip() + "..."
+        return sentence
+
+
+class LLMSummarizer(ConversationSummarizer):
+    """
+    A summarizer that asks a model deployment to fold the turns into the summary.
+
+    A small, fast deployment should be configured for this, it runs off the response path.
+    Falls back to the ExtractiveSummarizer if the model call fails.
+    """
+
+    def __init__(
+        self,
+        custom_connections: CustomConnection,
+        cognitive_search_connection: CognitiveSearchConnection,
+        conversation_parameters: Dict[str, Any],
+        model_name: str,
+    ):
+        """
+        Initializes the LLMSummarizer.
+
+        Args:
+            custom_connections (CustomConnection): Custom connections object.
+            cognitive_search_connection (CognitiveSearchConnection): Cognitive search connection object.
+            conversation_parameters (Dict[str, Any]): Parameters for the conversation.
+            model_name (str): The model deployment used to write the summary.
+        """
+        self.custom_connections: CustomConnection = custom_connections
+        self.cognitive_search_connection: CognitiveSearchConnection = cognitive_search_connection
+        self.conversation_parameters: Dict[str, Any] = conversation_parameters
+        self.model_name: str = model_name
+
+    def summarize(self, previous_summary: str, turns: List[Dict[str, str]]) -> str:
+        """
+        Folds the given turns into the previous summary.
+
+        Args:
+            previous_summary (str): The current rolling summary, empty if there is none yet.
+            turns (List[Dict[str, str]]): The turns to fold, each with a `user` and an `assistant` entry.
+
+        Returns:
+            str: The new rolling summary.
+        """
+        # Imported here to avoid a circular import, LMHelper reads the summary when building prompts
+        from helper_classes.lm_helpers.llm_helper import LLMHelper
+
+        transcript: str = "\n".join(
+            "User: " + turn["user"] + "\nAssistant: " + turn["assistant"] for turn in turns
+        )
+        messages: List[Dict[str, str]] = [
+            {
+                "role": "system",
+                "content": "You maintain a running summary of a customer service conversation. "
+                + "Update the summary with the new turns. Keep every fact the customer provided "
+                + "(names, emails, products, orders) and drop small talk. Return only the summary.",
+            },
+            {
+                "role": "user",
+                "content": "Current summary:\n" + (previous_summary or "(none)") + "\n\nNew turns:\n" + transcript,
+            },
+        ]
+
+        llm_helper = LLMHelper(
+            self.custom_connections,
+            self.cognitive_search_connection,
+            [],
+            "",
+            self.conversation_parameters,
+            {},
+        )
+        completion = llm_helper.execute(
+            session_id=self.conversation_parameters["session_id"],
+            conversation_id=self.conversation_parameters["conversation_id"],
+            client=llm_helper.create_client(),
+            model_name=self.model_name,
+            messages=messages,
+            tools_list=[],
+            params={"temperature": 0.0, "top_p": 1.0, "frequency_penalty": 0.0, "presence_penalty": 0.0},
+            stage="summary",
+        )
+
+        if completion is None:
+            return ExtractiveSummarizer().summarize(previous_summary, turns)
+
+        return str(completion.choices[0].message.content)  # type: ignore
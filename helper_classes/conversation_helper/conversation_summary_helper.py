@@ -0,0 +1,290 @@
+"""
+This module provides the ConversationSummaryHelper class, which maintains a rolling summary of the
+oldest turns of a conversation so that prompts can be built from the summary plus the most recent
+turns instead of the full chat history.
+
+The summary is updated by a background task after a turn completes and is stored with the
+conversation data. It records how many turns it covers and a hash of those turns, so a prompt
+built before the latest update has landed (or for a different history) can detect this and fall
+back to sending the uncovered turns verbatim.
+
+Classes:
+    ConversationSummaryHelper: Schedules summary updates and resolves the history used for prompts.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import threading
+import traceback
+from typing import Any, Dict, List, Optional, Set, Tuple
+from promptflow.connections import CustomConnection # type: ignore
+from promptflow.connections import CognitiveSearchConnection # type: ignore
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.conversation_helper.conversation_summarizer import (
+    ConversationSummarizer,
+    ExtractiveSummarizer,
+    LLMSummarizer,
+)
+
+
+class ConversationSummaryHelper:
+    """
+    A helper class that maintains the rolling conversation summary.
+
+    The behaviour is configured through the custom connection configs:
+        summary_mode: `off` (default), `extractive` or `llm`.
+        summary_keep_last_turns: Number of most recent turns always sent verbatim. Defaults to 6.
+        summary_fold_batch_turns: Minimum number of turns folded per update. Defaults to 4.
+        summary_model_name: Model deployment used by the `llm` mode. Defaults to `llm_model_name`.
+    """
+
+    SUMMARY_KEY: str = ConversationDataHelper.SUMMARY_KEY
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _in_flight: Set[str] = set()
+    _lock: threading.Lock = threading.Lock()
+
+    def __init__(
+        self,
+        custom_connections: CustomConnection,
+        cognitive_search_connection: CognitiveSearchConnection,
+        conversation_parameters: Dict[str, Any],
+    ):
+        """
+        Initializes the ConversationSummaryHelper.
+
+        Args:
+            custom_connections (CustomConnection): Custom connections object.
+            cognitive_search_connection (CognitiveSearchConnection): Cognitive search connection object.
+            conversation_parameters (Dict[str, Any]): Parameters for the conversation.
+        """
+        configs = custom_connections.configs
+        self.custom_connections: CustomConnection = custom_connections
+        self.cognitive_search_connection: CognitiveSearchConnection = cognitive_search_connection
+        self.conversation_parameters: Dict[str, Any] = conversation_parameters
+        self.mode: str = str(configs.get("summary_mode", "off")).lower()
+        self.keep_last_turns: int = int(configs.get("summary_keep_last_turns", 6))
+        self.fold_batch_turns: int = max(1, int(configs.get("summary_fold_batch_turns", 4)))
+        self.model_name: str = str(configs.get("summary_model_name", configs.get("llm_model_name", "")))
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether rolling summaries are enabled.
+
+        Returns:
+            bool: True if a summarizer is configured, False otherwise.
+        """
+        return self.mode in ("extractive", "llm")
+
+    def create_summarizer(self) -> ConversationSummarizer:
+        """
+        Creates the summarizer for the configured mode.
+
+        Returns:
+            ConversationSummarizer: The summarizer.
+        """
+        if self.mode == "llm":
+            return LLMSummarizer(
+                self.custom_connections,
+                self.cognitive_search_connection,
+                self.conversation_parameters,
+                self.model_name,
+            )
+        return ExtractiveSummarizer()
+
+    def schedule_update(self, chat_history: List[Dict[str, Any]], query: str, answer: str) -> bool:
+        """
+        Schedules a background update of the rolling summary once a turn has completed.
+        Never blocks: if an update is already running for the conversation, the next turn catches up.
+
+        Args:
+            chat_history (List[Dict[str, Any]]): The chat history before this turn.
+            query (str): The user's query of this turn.
+            answer (str): The answer returned for this turn.
+
+        Returns:
+            bool: True if an update was scheduled, False otherwise.
+        """
+        if not self.enabled:
+            return False
+
+        turns: List[Dict[str, Any]] = list(chat_history)
+        turns.append({"inputs": {"query": query}, "outputs": {"answer": answer}})
+
+        # Nothing to fold until enough turns have piled up behind the verbatim window
+        if len(turns) - self.keep_last_turns < self.fold_batch_turns:
+            return False
+
+        conversation_id: str = self.conversation_parameters["conversation_id"]
+        with ConversationSummaryHelper._lock:
+            if conversation_id in ConversationSummaryHelper._in_flight:
+                return False
+            ConversationSummaryHelper._in_flight.add(conversation_id)
+            if ConversationSummaryHelper._executor is None:
+                ConversationSummaryHelper._executor = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix="conversation-summary"
+                )
+            executor: ThreadPoolExecutor = ConversationSummaryHelper._executor
+
+        executor.submit(self._run_update, turns)
+        return True
+
+    def _run_update(self, turns: List[Dict[str, Any]]) -> None:
+        """
+        Runs the summary update in the background, logging instead of raising on failure.
+
+        Args:
+            turns (List[Dict[str, Any]]): The full chat history including the completed turn.
+        """
+        try:
+            self.update_summary(turns)
+        except Exception as e:
+            log_data: Dict[str, Any] = {
+                "session_id": str(self.conversation_parameters["session_id"]),
+                "conversation_id": str(self.conversation_parameters["conversation_id"]),
+                "error": "".join(traceback.format_exception(None, e, e.__traceback__)),
+            }
+            logging.error("Conversation summary update failed", extra=log_data)
+        finally:
+            with ConversationSummaryHelper._lock:
+                ConversationSummaryHelper._in_flight.discard(self.conversation_parameters["conversation_id"])
+
+    def update_summary(self, turns: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Folds the oldest turns that are not yet covered into the rolling summary and saves it.
+
+        Args:
+            turns (List[Dict[str, Any]]): The full chat history including the completed turn.
+
+        Returns:
+            Optional[Dict[str, Any]]: The new summary record, or None if there was nothing to fold.
+        """
+        cd_helper: ConversationDataHelper = ConversationDataHelper(self.conversation_parameters)
+        summary: Optional[Dict[str, Any]] = self.get_valid_summary(cd_helper.get_conversation_data(), turns)
+        turns_covered: int = summary["turns_covered"] if summary else 0
+        target: int = len(turns) - self.keep_last_turns
+
+        if target - turns_covered < self.fold_batch_turns:
+            return None
+
+        text: str = self.create_summarizer().summarize(
+            summary["text"] if summary else "",
+            [self.normalize_turn(turn) for turn in turns[turns_covered:target]],
+        )
+        record: Dict[str, Any] = {
+            "text": text,
+            "turns_covered": target,
+            "history_hash": self.history_hash(turns[:target]),
+        }
+
+        # Re-read so that state saved by a turn which completed meanwhile is not overwritten
+        conversation_data: Dict[str, Any] = cd_helper.get_conversation_data()
+        conversation_data[self.SUMMARY_KEY] = record
+        cd_helper.save_conversation_data(conversation_data)
+
+        logging.info(
+            "Conversation summary updated",
+            extra={
+                "conversation_id": str(self.conversation_parameters["conversation_id"]),
+                "turns_covered": target,
+                "summary_chars": len(text),
+            },
+        )
+        return record
+
+    @staticmethod
+    def get_prompt_history(
+        conversation_data: Dict[str, Any], chat_history: List[Dict[str, Any]]
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Resolves the summary and the turns to send verbatim for the incoming chat history.
+
+        Args:
+            conversation_data (Dict[str, Any]): Data related to the conversation.
+            chat_history (List[Dict[str, Any]]): The incoming chat history.
+
+        Returns:
+            Tuple[str, List[Dict[str, Any]]]: The summary text (empty if none applies) and the
+            turns not covered by it.
+        """
+        summary: Optional[Dict[str, Any]] = ConversationSummaryHelper.get_valid_summary(
+            conversation_data, chat_history
+        )
+        if summary is None:
+            return "", chat_history
+
+        return summary["text"], chat_history[summary["turns_covered"]:]
+
+    @staticmethod
+    def get_valid_summary(
+        conversation_data: Dict[str, Any], chat_history: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Returns the stored summary if it is consistent with the incoming chat history.
+
+        A summary that lags behind is valid, the turns it does not cover are sent verbatim.
+        A summary covering turns that are not in the incoming history, or a different history
+        (e.g. a retried or edited turn), is discarded.
+
+        Args:
+            conversation_data (Dict[str, Any]): Data related to the conversation.
+            chat_history (List[Dict[str, Any]]): The incoming chat history.
+
+        Returns:
+            Optional[Dict[str, Any]]: The summary record, or None if there is no valid summary.
+        """
+        summary: Optional[Dict[str, Any]] = conversation_data.get(ConversationSummaryHelper.SUMMARY_KEY)
+        if not summary:
+            return None
+
+        turns_covered: int = summary.get("turns_covered", 0)
+        if turns_covered > len(chat_history) or summary.get(
+            "history_hash"
+        ) != ConversationSummaryHelper.history_hash(chat_history[:turns_covered]):
+            logging.info(
+                "Discarding conversation summary that does not match the chat history",
+                extra={"conversation_id": str(conversation_data.get("conversation_id"))},
+            )
+            return None
+
+        return summary
+
+    @staticmethod
+    def history_hash(turns: List[Dict[str, Any]]) -> str:
+        """
+        Computes a hash over the queries and raw answers of the given turns.
+
+        Args:
+            turns (List[Dict[str, Any]]): The chat history turns.
+
+        Returns:
+            str: The hex digest.
+        """
+        digest = hashlib.sha256()
+        for turn in turns:
+            digest.update(str(turn["inputs"]["query"]).encode("utf-8"))
+            digest.update(b"\x1f")
+            digest.update(str(turn["outputs"]["answer"]).encode("utf-8"))
+            digest.update(b"\x1e")
+        return digest.hexdigest()
+
+    @staticmethod
+    def normalize_turn(turn: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Converts a chat history turn into the form consumed by the summarizers.
+
+        Args:
+            turn (Dict[str, Any]): The chat history turn.
+
+        Returns:
+            Dict[str, str]: The turn with `user` and `assistant` entries.
+        """
+        # Imported here to avoid a circular import, LMHelper uses this helper to build prompts
+        from helper_classes.lm_helpers.lm_helper import LMHelper
+
+        return {
+            "user": str(turn["inputs"]["query"]),
+            "assistant": LMHelper.get_assistant_message(str(turn["outputs"]["answer"])),
+        }
@@ -5,9 +5,9 @@ Classes:
     ConversationValidator: A class to validate conversation parameters.
 """
 
-import json
 import uuid
 import logging
+from helper_classes import serialization
 
 class ConversationValidator:
     """
@@ -24,7 +24,7 @@ class ConversationValidator:
         Args:
             conversation_parameters (str): A JSON string of conversation parameters.
         """
-        self.params = json.loads(conversation_parameters)
+        self.params = serialization.loads(conversation_parameters)
 
     def validate(self) -> bool:
         """
@@ -6,12 +6,16 @@ Classes:
     HandlerBase: A base class for handling conversation operations and responses.
 """
 
-from typing import Any
+from typing import TYPE_CHECKING, Any, Optional
 import logging
-from openai import AzureOpenAI
 from promptflow.connections import CustomConnection # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
 from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.lm_helpers.llm_helper import LLMHelper
+
+if TYPE_CHECKING:
+    from openai import AzureOpenAI
+    from helper_classes.turn_context import TurnContext
 
 
 class HandlerBase:
@@ -23,6 +27,7 @@ class HandlerBase:
         custom_connections (CustomConnection): The custom connection object.
         conversation_data (dict): The dictionary of conversation data.
         topic (dict): The dictionary of topic data.
+        turn_context (Optional[TurnContext]): The context of the turn, None outside of a turn.
     """
 
     def __init__(
@@ -32,6 +37,7 @@ class HandlerBase:
         cognitive_search_connection: CognitiveSearchConnection,
         conversation_data: dict[str, Any],
         topic: dict[str, Any],
+        turn_context: Optional["TurnContext"] = None,
     ):
         """
         Initializes the HandlerBase with the provided parameters.
@@ -41,38 +47,74 @@ class HandlerBase:
             custom_connections (CustomConnection): The custom connection object.
             conversation_data (dict): The dictionary of conversation data.
             topic (dict): The dictionary of topic data.
+            turn_context (Optional[TurnContext]): The context of the turn, None outside of a turn.
         """
         self.conversation_parameters = conversation_parameters
         self.conversation_data = conversation_data
         self.custom_connections = custom_connections
         self.cognitive_search_connection = cognitive_search_connection
         self.topic = topic
+        self.turn_context = turn_context
 
     def reset_conversation_id(self) -> None:
         """
         Resets the conversation ID by adding a reset response item.
         """        
         logging.info("Resetting conversation ID")
+        if self.turn_context is not None:
+            # The persona and creation time of the conversation are kept through the reset
+            self.turn_context.data_helper.reset_conversation_data(
+                state=self.conversation_data.get(ConversationDataHelper.STATE_KEY)
+            )
+            return
+
         cd_helper = ConversationDataHelper(self.conversation_data)
         cd_helper.reset_conversation_data()
 
-    def create_llm_client(self) -> AzureOpenAI:
+    def create_llm_client(self) -> "AzureOpenAI":
         """
         Creates an AzureOpenAI client using the custom connection configurations.
+        The client is shared with the other turns using the same connection.
 
         Returns:
             AzureOpenAI: The created AzureOpenAI client.
         """
-        cnn = self.custom_connections
-        return AzureOpenAI(
-            azure_endpoint=str(cnn.configs["llm_api_endpoint"]),
-            api_key=str(cnn.secrets["llm_api_key"]),
-            api_version=str(cnn.configs["llm_api_version"]),
+        if self.turn_context is not None:
+            return self.turn_context.client
+        return LLMHelper.create_pooled_client(self.custom_connections)
+
+    def get_llm_helper(self, query: str) -> LLMHelper:
+        """
+        Returns an LLMHelper with the topic of the conversation loaded: the turn's helper of the topic,
+        or a new one outside of a turn.
+
+        Args:
+            query (str): The query of the helper created outside of a turn.
+
+        Returns:
+            LLMHelper: The helper.
+        """
+        if self.turn_context is not None:
+            return self.turn_context.get_llm_helper(self.conversation_data["topic_name"])
+
+        llm_helper = LLMHelper(
+            self.custom_connections,
+            self.cognitive_search_connection,
+            [],
+            query,
+            self.conversation_parameters,
+            self.conversation_data,
         )
+        llm_helper.load_topic_object()
+        return llm_helper
 
     def save_conversation_data(self) -> None:
         """
-        Saves the conversation data using the ConversationDataHelper.
+        Saves the conversation data using the ConversationDataHelper of the turn.
         """
+        if self.turn_context is not None:
+            self.turn_context.save_conversation_data(self.conversation_data)
+            return
+
         cd_helper = ConversationDataHelper(self.conversation_data)
         cd_helper.save_conversation_data(self.conversation_data)
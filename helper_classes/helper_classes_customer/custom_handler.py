@@ -1,7 +1,10 @@
 """
 Module: CustomHandler
 This module contains the CustomHandler class, which handles various customer-related queries
-using specific handlers for QnA, offer queries, offer details, fallback scenarios, and customer queries.
+using the handlers registered in the HandlerRegistry for QnA, offer queries, offer details,
+fallback scenarios, and customer queries.
+
+Handler modules are imported on first use through the registry, not when this module is imported.
 
 Classes:
     CustomHandler: Handles various customer queries by utilizing appropriate handlers.
@@ -10,34 +13,31 @@ Dependencies:
     typing: For type hinting.
     logging: For logging errors and other information.
     promptflow.connections.CustomConnection: For handling custom connections.
-    helper_classes_customer.customer_service.qna_handler.QnaHandler: For handling QnA queries.
-    helper_classes_customer.offerQuery.offerQuery_handler.OfferQueryHandler: For handling offer queries.
-    helper_classes_customer.offerQuery.offerDetail_handler.offerDetailHandler: For handling offer details.
-    helper_classes_customer.customer_service.fallback_handler.FallbackHandler: For handling fallback scenarios.
-    helper_classes_customer.customer_service.customerQuery_handler.CustomerQueryHandler: For handling customer queries.
+    helper_classes_customer.handler_registry.HandlerRegistry: For resolving the registered handlers.
 """
 
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Dict, Optional
 import logging
+import time
 from promptflow.connections import CustomConnection  # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
-from helper_classes.helper_classes_customer.customer_service.qna_handler import QnaHandler
-from helper_classes.helper_classes_customer.customer_service.fallback_handler import FallbackHandler
-from helper_classes.helper_classes_customer.customer_service.customerQuery_handler import CustomerQueryHandler
+from helper_classes import metrics
+from helper_classes.helper_classes_customer.handler_registry import HandlerRegistry
+
+if TYPE_CHECKING:
+    from helper_classes.turn_context import TurnContext
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class CustomHandler:
     """
     CustomHandler class to handle various customer-related queries.
-    
+
     Methods:
+        handle: Handles a query with the handler registered under a method name.
         handle_qna: Handles QnA queries.
-        handle_offerQuery: Handles offer queries.
-        handle_offerDetail: Handles offer detail queries.
         handle_fallback: Handles fallback scenarios.
-        handle_customer_query: Handles customer queries.
+        handle_customerQuery: Handles customer queries.
     """
 
     def __init__(
@@ -47,64 +47,68 @@ class CustomHandler:
         cognitive_search_connection: CognitiveSearchConnection,
         conversation_data: Dict[str, Any],
         topic: Dict[str, Any],
+        turn_context: Optional["TurnContext"] = None,
     ):
         """
         Initializes the CustomHandler with conversation parameters, custom connections,
         conversation data, and the topic.
-        
+
         Args:
             conversation_parameters (Dict[str, Any]): Parameters for the conversation.
             custom_connections (CustomConnection): Custom connections for the handler.
             conversation_data (Dict[str, Any]): Data related to the conversation.
             topic (Dict[str, Any]): Topic of the conversation.
+            turn_context (Optional[TurnContext]): The context of the turn, handed to the handlers taking it.
         """
-        self.conversation_parameters = conversation_parameters        
+        self.conversation_parameters = conversation_parameters
         self.conversation_data = conversation_data
         self.custom_connections = custom_connections
         self.cognitive_search_connection = cognitive_search_connection
         self.topic = topic
+        self.turn_context = turn_context
 
-    def handle_qna(self) -> str:
-        """Handles QnA queries using QnaHandler."""
+    def handle(self, method_name: str) -> str:
+        """Handles a query using the handler registered under the method name."""
+        start_time: float = time.perf_counter()
+        outcome: str = "error"
         try:
-            handler = QnaHandler(
+            factory = HandlerRegistry.get_factory(method_name)
+            options: Dict[str, Any] = (
+                {"turn_context": self.turn_context}
+                if self.turn_context is not None and HandlerRegistry.accepts_turn_context(factory)
+                else {}
+            )
+            handler = factory(
                 self.conversation_parameters,
                 self.custom_connections,
                 self.cognitive_search_connection,
                 self.conversation_data,
                 self.topic,
+                **options,
             )
-            return handler.execute()
+            response: str = handler.execute()
+            outcome = "ok"
+            return response
         except Exception as e:
             logger.error("Exception occurred: %s", e)
             raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(
+                time.perf_counter() - start_time,
+                persona=self.conversation_parameters.get("persona_name"),
+                topic=self.conversation_data.get("topic_name"),
+                handler=method_name,
+                outcome=outcome,
+            )
+
+    def handle_qna(self) -> str:
+        """Handles QnA queries using QnaHandler."""
+        return self.handle("handle_qna")
 
     def handle_fallback(self) -> str:
         """Handles fallback scenarios using FallbackHandler."""
-        try:
-            handler = FallbackHandler(
-                self.conversation_parameters,
-                self.custom_connections,
-                self.cognitive_search_connection,
-                self.conversation_data,
-                self.topic,
-            )
-            return handler.execute()
-        except Exception as e:
-            logger.error("Exception occurred: %s", e)
-            raise
+        return self.handle("handle_fallback")
 
     def handle_customerQuery(self) -> str:
         """Handles customer queries using CustomerQueryHandler."""
-        try:
-            handler = CustomerQueryHandler(
-                self.conversation_parameters,
-                self.custom_connections,
-                self.cognitive_search_connection,
-                self.conversation_data,
-                self.topic,
-            )
-            return handler.execute()
-        except Exception as e:
-            logger.error("Exception occurred: %s", e)
-            raise
+        return self.handle("handle_customerQuery")
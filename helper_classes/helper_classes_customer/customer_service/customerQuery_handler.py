@@ -5,13 +5,19 @@ This module provides the CustomerQueryHandler class for managing and executing c
 Classes:
     CustomerQueryHandler: Handles customer info queries by performing language model operations.
 """
-import json
-from typing import Any, Dict, List
-import yaml
+import logging
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 from promptflow.connections import CustomConnection  # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
 from helper_classes.helper_classes_customer.base_classes.handler_base import HandlerBase
+from helper_classes.helper_classes_customer.customer_service.customer_record_projector import CustomerRecordProjector
+from helper_classes.helper_classes_customer.customer_service.order_store import OrderQuestion, OrderStore
 from helper_classes.lm_helpers.llm_helper import LLMHelper
+from helper_classes.config_file_cache import ConfigFileCache
+from helper_classes import serialization
+
+if TYPE_CHECKING:
+    from helper_classes.turn_context import TurnContext
 
 class CustomerQueryHandler(HandlerBase):
     """
@@ -25,8 +31,12 @@ class CustomerQueryHandler(HandlerBase):
         cognitive_search_connection: CognitiveSearchConnection,
         conversation_data: Dict[str, Any],
         topic: Dict[str, Any],
+        turn_context: Optional["TurnContext"] = None,
     ):
-        super().__init__(conversation_parameters, custom_connections, cognitive_search_connection, conversation_data, topic)
+        super().__init__(
+            conversation_parameters, custom_connections, cognitive_search_connection,
+            conversation_data, topic, turn_context,
+        )
 
     def execute(self) -> str:
         """
@@ -35,6 +45,11 @@ class CustomerQueryHandler(HandlerBase):
         customer_info: Dict[str, Any] = self.conversation_data["arguments"]
         email: str = customer_info["email"]
         query: str = customer_info["query"]
+
+        # Structured questions about orders are answered exactly from the order store
+        structured_response: Optional[str] = self.get_structured_response(email, query)
+        if structured_response is not None:
+            return self.handle_customer_found(structured_response)
  
         # Load customer data from the YAML file and filter based on email
         filtered_object: Dict[str, Any] = self.get_customer_by_email(email)
@@ -69,33 +84,82 @@ class CustomerQueryHandler(HandlerBase):
 
         return customer_response
 
+    def get_structured_response(self, email: str, query: str) -> Optional[str]:
+        """
+        Answers a structured question about the customer's orders ("how much have I spent", "what
+        was my last order", "how many tents did I buy") from the order store, which computes the
+        answer exactly. The answer is phrased with a template, or by the model if the
+        `structured_answers` option of the customerQuery rule is `llm`; `off` disables it.
+
+        Args:
+            email (str): The customer's email.
+            query (str): The customer's query.
+
+        Returns:
+            Optional[str]: The answer, or None if the query is not a structured question, the
+                customer is unknown or the order store is unavailable.
+        """
+        mode: str = "template"
+        for rule in self.topic.get("follow_on_business_logic", []):
+            if rule.get("name") == "customerQuery":
+                mode = str(rule.get("structured_answers", mode))
+        if mode == "off":
+            return None
+
+        store: Optional[OrderStore] = OrderStore.get_instance()
+        question: Optional[OrderQuestion] = OrderQuestion.parse(query, store) if store else None
+        result: Optional[Dict[str, Any]] = store.answer(email, question) if store and question else None
+        if result is None:
+            return None
+
+        logging.info("Structured order question answered", extra={"mode": mode, "result": result})
+        if mode != "llm":
+            return OrderStore.format_answer(result)
+
+        system_prompt: str = (
+            "You are an assistant answering a customer's question about their orders. The answer was computed "
+            + "exactly and is given in the following json object. Phrase it in one or two sentences without "
+            + "changing any number, date or product name.\n\n"
+            + serialization.dumps(result)
+        )
+        messages: List[Dict[str, str]] = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": query},
+        ]
+        completion: object = self.call_llm(messages, query, "order_answer")
+        if completion is None:
+            return OrderStore.format_answer(result)
+        return str(completion.choices[0].message.content)  # type: ignore
+
     def get_customers(self) -> List[Dict[str, Any]]:
         """
         Loads the list of customers from the YAML file.
         """
-        with open('data/customer_info/sample.yaml', 'r', encoding="utf-8") as file:
-            customers = yaml.safe_load(file)
+        customers = ConfigFileCache.load_yaml('data/customer_info/sample.yaml')
         return customers
     
     def get_customer_by_email(self, email: str) -> Dict[str, Any]:
         """
         Loads the list of customers from the YAML file and filters by email.
         """
-        with open('data/customer_info/sample.yaml', 'r', encoding='utf-8') as file:
-            customers = yaml.safe_load(file)
-            for customer in customers:
-                if customer["email"] == email:
-                    return customer
+        customers = ConfigFileCache.load_yaml('data/customer_info/sample.yaml')
+        for customer in customers:
+            if customer["email"] == email:
+                return customer
         return {}
 
     def get_customer_response(self, customer_info:  Dict[str, Any], email: str, query: str) -> str:
         """
         Retrieves the customer information from the list of customers based on the email.
+        Only the sections of the customer record relevant to the query are sent to the model.
         """
+        projected_info: Dict[str, Any] = CustomerRecordProjector.from_topic(self.topic, "customerQuery").project(
+            customer_info, query
+        )
         system_prompt: str = ( # type: ignore
             "you are an assistant that identifies customer information from the given email and answers their queries.. "
             + "You must return either the answer from the following json object, or `not_found` if not found. Do not return anything else! The customer's email is {email}.\n\n"
-            + json.dumps(customer_info)
+            + serialization.dumps(projected_info)
         ) 
 
         user_prompt: str = query
@@ -104,24 +168,16 @@ class CustomerQueryHandler(HandlerBase):
             {"role": "user", "content": user_prompt},
         ]
 
-        completion: object = self.call_llm(messages, query)
+        completion: object = self.call_llm(messages, query, "customer_response")
         return str(completion.choices[0].message.content)  # type: ignore
 
-    def call_llm(self, messages: List[Dict[str, str]], query: str) -> object:
+    def call_llm(self, messages: List[Dict[str, str]], query: str, stage: str) -> object:
         """
-        Calls the language model to process the messages.
+        Calls the language model of the stage to process the messages.
         """
-        llm_helper = LLMHelper(
-            self.custom_connections,
-            self.cognitive_search_connection,
-            [], #self.conversation_data["chat_history"]
-            query,
-            json.dumps(self.conversation_parameters),
-            self.conversation_data
-        )
-
-        client = llm_helper.create_client()
-        topic_object = llm_helper.load_topic_object()
+        llm_helper: LLMHelper = self.get_llm_helper(query)
+        client = self.create_llm_client()
+        topic_object = llm_helper.topic_object
         tools_list = []
         params = topic_object["llm_parameters"]
         model_name = str(self.custom_connections.configs["llm_model_name"])  # type: ignore
@@ -133,7 +189,8 @@ class CustomerQueryHandler(HandlerBase):
             model_name=model_name,
             messages=messages,
             tools_list=tools_list, #type: ignore
-            params=params
+            params=params,
+            stage=stage,
         )
 
         return completion
@@ -0,0 +1,278 @@
+"""
+Module customer_record_projector
+This module provides the CustomerRecordProjector class, which picks the sections of a customer
+record relevant to a query before the record is pasted into a prompt.
+
+Classes:
+    CustomerRecordProjector: Projects a customer record onto the sections a query is about.
+"""
+
+import logging
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from helper_classes import serialization
+
+
+class CustomerRecordProjector:
+    """
+    Projects a customer record onto the sections a query is about, so the prompt answering
+    "what is my membership level" does not carry every order and product description.
+
+    The sections are routed by keywords of the query:
+        profile: The scalar fields of the customer (name, email, phone, address, membership...).
+        orders: A summary of each order, without its long text fields, with the order count and total.
+        order_details: The orders the query names, by order id or by the words of the product
+            name, brand or category, with their long text fields truncated. All orders if the
+            query asks about product features without naming one.
+
+    The name and email of the customer are always included. Text fields longer than
+    `max_text_chars` are truncated, and the projection is shrunk until its estimated size fits
+    `max_tokens`; orders are listed newest first, so the oldest are left out first. If no section is routed, the full record is returned unchanged.
+
+    Options are read from the `customer_record` block of the topic's business logic rule:
+        max_tokens: Token budget of the projection (default 600).
+        max_text_chars: Maximum length of a text field (default 240).
+    """
+
+    IDENTITY_FIELDS: Tuple[str, ...] = ("firstName", "lastName", "email")
+    ORDER_SUMMARY_FIELDS: Tuple[str, ...] = ("id", "date", "name", "quantity", "total", "category", "brand")
+    ORDER_MATCH_FIELDS: Tuple[str, ...] = ("name", "brand", "category")
+
+    SECTION_KEYWORDS: Dict[str, Set[str]] = {
+        "profile": {
+            "name", "age", "old", "email", "phone", "number", "address", "live", "membership", "member",
+            "level", "tier", "status", "account", "profile", "contact", "details",
+        },
+        "orders": {
+            "order", "orders", "ordered", "bought", "buy", "purchase", "purchases", "purchased", "spent",
+            "spend", "total", "history", "recent", "latest", "many", "items", "products",
+        },
+        "order_details": {
+            "description", "describe", "feature", "features", "warranty", "material", "made", "capacity",
+            "size", "weight", "specification", "specs",
+        },
+    }
+
+    # Approximate number of characters per token of JSON and English text
+    CHARS_PER_TOKEN: int = 4
+
+    _metrics: Dict[str, int] = {"projected": 0, "fallback": 0, "tokens_full": 0, "tokens_sent": 0}
+    _metrics_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, max_tokens: int = 600, max_text_chars: int = 240):
+        """
+        Initializes the CustomerRecordProjector.
+
+        Args:
+            max_tokens (int, optional): Token budget of the projection. Defaults to 600.
+            max_text_chars (int, optional): Maximum length of a text field. Defaults to 240.
+        """
+        self.max_tokens: int = max_tokens
+        self.max_text_chars: int = max_text_chars
+
+    @staticmethod
+    def from_topic(topic: Dict[str, Any], rule_name: str) -> "CustomerRecordProjector":
+        """
+        Creates the projector configured by the `customer_record` block of a business logic rule.
+
+        Args:
+            topic (Dict[str, Any]): The topic object.
+            rule_name (str): The name of the business logic rule.
+
+        Returns:
+            CustomerRecordProjector: The projector.
+        """
+        config: Dict[str, Any] = {}
+        for rule in topic.get("follow_on_business_logic", []):
+            if rule.get("name") == rule_name:
+                config = rule.get("customer_record") or {}
+        return CustomerRecordProjector(
+            int(config.get("max_tokens", 600)), int(config.get("max_text_chars", 240))
+        )
+
+    @staticmethod
+    def estimate_tokens(value: Any) -> int:
+        """
+        Estimates the number of prompt tokens of a value serialized as JSON.
+        """
+        return len(serialization.dumps(value)) // CustomerRecordProjector.CHARS_PER_TOKEN + 1
+
+    @staticmethod
+    def get_terms(text: str) -> Set[str]:
+        return set(re.findall(r"\w+", text.lower()))
+
+    def route(self, record: Dict[str, Any], query: str) -> Tuple[Set[str], List[Dict[str, Any]]]:
+        """
+        Routes a query to the sections of the record and the orders it names.
+
+        Args:
+            record (Dict[str, Any]): The customer record.
+            query (str): The query.
+
+        Returns:
+            Tuple[Set[str], List[Dict[str, Any]]]: The routed sections and the named orders.
+        """
+        terms: Set[str] = self.get_terms(query)
+        sections: Set[str] = {name for name, keywords in self.SECTION_KEYWORDS.items() if terms & keywords}
+        orders: List[Dict[str, Any]] = record.get("orders") or []
+
+        # Order ids are only matched in a query about orders ("order 29", "#29"), not in "2 tents"
+        order_ids: Set[str] = set(re.findall(r"#\s*(\d+)", query))
+        if "orders" in sections:
+            order_ids |= {term for term in terms if term.isdigit()}
+        # Orders are scored by the product words they share with the query, an id match beating any
+        # word; only the best scored orders are named, so "Alpine Explorer Tent" does not name every tent
+        generic_terms: Set[str] = set().union(*self.SECTION_KEYWORDS.values())
+        scores: List[int] = []
+        for order in orders:
+            order_terms: Set[str] = set().union(
+                *(self.get_terms(str(order.get(field, ""))) for field in self.ORDER_MATCH_FIELDS)
+            )
+            product_terms: Set[str] = {term for term in order_terms if len(term) > 3} - generic_terms
+            scores.append(len(terms & product_terms) + (100 if str(order.get("id")) in order_ids else 0))
+        best: int = max(scores, default=0)
+        named: List[Dict[str, Any]] = [order for order, score in zip(orders, scores) if best and score == best]
+
+        if named:
+            sections.add("order_details")
+        return sections, named
+
+    def truncate(self, value: Any, max_chars: int) -> Any:
+        """
+        Truncates the strings longer than `max_chars` in a value.
+        """
+        if isinstance(value, str) and len(value) > max_chars:
+            return value[:max_chars].rstrip() + "..."
+        if isinstance(value, dict):
+            return {key: self.truncate(item, max_chars) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.truncate(item, max_chars) for item in value]
+        return value
+
+    @staticmethod
+    def newest_first(orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Sorts orders by date, newest first. The dates are written month/day/year in the customer
+        data; orders without a valid date come last, in their original order.
+
+        Args:
+            orders (List[Dict[str, Any]]): The orders.
+
+        Returns:
+            List[Dict[str, Any]]: The sorted orders (a new list).
+        """
+
+        def order_date(order: Dict[str, Any]) -> datetime:
+            try:
+                return datetime.strptime(str(order.get("date")), "%m/%d/%Y")
+            except ValueError:
+                return datetime.min
+
+        return sorted(orders, key=order_date, reverse=True)
+
+    def build(
+        self,
+        record: Dict[str, Any],
+        sections: Set[str],
+        named: List[Dict[str, Any]],
+        max_text_chars: int,
+        max_orders: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Builds the projection of the routed sections.
+
+        Args:
+            record (Dict[str, Any]): The customer record.
+            sections (Set[str]): The routed sections.
+            named (List[Dict[str, Any]]): The orders the query names.
+            max_text_chars (int): Maximum length of a text field.
+            max_orders (Optional[int]): Maximum number of orders listed in each order section.
+
+        Returns:
+            Dict[str, Any]: The projection.
+        """
+        projection: Dict[str, Any] = {field: record[field] for field in self.IDENTITY_FIELDS if field in record}
+        if "profile" in sections:
+            projection.update(
+                {key: value for key, value in record.items() if not isinstance(value, (list, dict))}
+            )
+
+        # Listed newest first, so the orders cut to fit the budget are the oldest ones
+        orders: List[Dict[str, Any]] = self.newest_first(record.get("orders") or [])
+        if "orders" in sections:
+            projection["order_count"] = len(orders)
+            projection["orders_total"] = round(sum(float(order.get("total") or 0) for order in orders), 2)
+            projection["orders"] = [
+                {field: order[field] for field in self.ORDER_SUMMARY_FIELDS if field in order}
+                for order in orders[:max_orders]
+            ]
+        if "order_details" in sections:
+            projection["order_details"] = (self.newest_first(named) or orders)[:max_orders]
+        return self.truncate(projection, max_text_chars)
+
+    def project(self, record: Dict[str, Any], query: str) -> Dict[str, Any]:
+        """
+        Projects a customer record onto the sections the query is about, within the token budget.
+
+        Args:
+            record (Dict[str, Any]): The customer record.
+            query (str): The query.
+
+        Returns:
+            Dict[str, Any]: The projection, or the full record if no section is routed.
+        """
+        if not record:
+            return record
+
+        full_tokens: int = self.estimate_tokens(record)
+        sections, named = self.route(record, query)
+        if not sections:
+            self._record("fallback", full_tokens, full_tokens)
+            logging.info("Customer record sent in full", extra={"tokens": full_tokens})
+            return record
+
+        # Shrink the text fields, then the number of orders listed, until the projection fits the budget
+        max_text_chars: int = self.max_text_chars
+        max_orders: Optional[int] = None
+        projection: Dict[str, Any] = self.build(record, sections, named, max_text_chars, max_orders)
+        while self.estimate_tokens(projection) > self.max_tokens:
+            if max_text_chars > 60:
+                max_text_chars //= 2
+            else:
+                listed: int = len(projection.get("orders") or projection.get("order_details") or [])
+                if listed <= 1:
+                    break
+                max_orders = listed - 1
+            projection = self.build(record, sections, named, max_text_chars, max_orders)
+
+        tokens: int = self.estimate_tokens(projection)
+        self._record("projected", full_tokens, tokens)
+        logging.info(
+            "Customer record projected",
+            extra={
+                "sections": sorted(sections),
+                "named_orders": [order.get("id") for order in named],
+                "tokens": tokens,
+                "tokens_full": full_tokens,
+            },
+        )
+        return projection
+
+    @staticmethod
+    def _record(outcome: str, full_tokens: int, tokens: int) -> None:
+        with CustomerRecordProjector._metrics_lock:
+            CustomerRecordProjector._metrics[outcome] += 1
+            CustomerRecordProjector._metrics["tokens_full"] += full_tokens
+            CustomerRecordProjector._metrics["tokens_sent"] += tokens
+
+    @staticmethod
+    def get_metrics() -> Dict[str, int]:
+        """
+        Returns the number of projected and fallback records, and the estimated tokens of the full
+        records and of what was sent to the model.
+        """
+        with CustomerRecordProjector._metrics_lock:
+            return dict(CustomerRecordProjector._metrics)
@@ -1,8 +1,11 @@
-from typing import Any
+from typing import TYPE_CHECKING, Any, Optional
 from promptflow.connections import CustomConnection # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
 from helper_classes.helper_classes_customer.base_classes.handler_base import HandlerBase
 
+if TYPE_CHECKING:
+    from helper_classes.turn_context import TurnContext
+
 
 class FallbackHandler(HandlerBase):
 
@@ -13,9 +16,11 @@ class FallbackHandler(HandlerBase):
         cognitive_search_connection: CognitiveSearchConnection,
         conversation_data: dict[str, Any],
         topic: dict[str, Any],
+        turn_context: Optional["TurnContext"] = None,
     ):
         super().__init__(
-            conversation_parameters, custom_connections, cognitive_search_connection, conversation_data, topic
+            conversation_parameters, custom_connections, cognitive_search_connection,
+            conversation_data, topic, turn_context,
         )
 
     def execute(self) -> str:
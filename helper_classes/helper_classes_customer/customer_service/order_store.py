@@ -0,0 +1,310 @@
+"""
+Module order_store
+This module provides a columnar store of the customers' orders and deterministic answers to the
+structured questions about them ("how much have I spent", "what was my last order", "how many
+tents did I buy").
+
+Classes:
+    OrderStore: The orders of every customer, in NumPy columns indexed by per-customer offsets.
+    OrderQuestion: A structured question about orders, parsed from the customer's query.
+"""
+
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from helper_classes.config_file_cache import ConfigFileCache
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class OrderQuestion:
+    """
+    A structured question about orders, parsed from the customer's query.
+
+    Operations:
+        total_spent: The sum of the order totals.
+        order_count: The number of orders.
+        quantity: The number of items bought.
+        last_order: The most recent order.
+        first_order: The earliest order.
+        largest_order: The order with the highest total.
+
+    The question may be filtered by a product name, brand or category named in the query.
+    """
+
+    # Checked in order: "how many orders" is a count, "how many tents" a quantity
+    PATTERNS: List[Tuple[str, "re.Pattern[str]"]] = [
+        ("total_spent", re.compile(r"\bhow much\b.*\b(spen[dt]|paid|pay)\b|\btotal (spend|spent|amount)\b")),
+        ("order_count", re.compile(r"\bhow many (orders|purchases)\b|\bnumber of (orders|purchases)\b")),
+        ("quantity", re.compile(r"\bhow many\b")),
+        ("last_order", re.compile(r"\b(last|latest|most recent|newest)\b.*\b(order|purchase|bought)\b")),
+        ("first_order", re.compile(r"\b(first|earliest|oldest)\b.*\b(order|purchase|bought)\b")),
+        ("largest_order", re.compile(r"\b(largest|biggest|most expensive|highest)\b.*\b(order|purchase)\b")),
+    ]
+
+    # Another intent about the orders, e.g. "is my last order shipped?" or "what's the return policy on
+    # my latest purchase": the aggregate would not answer it, the question is left to the model
+    OTHER_INTENTS: "re.Pattern[str]" = re.compile(
+        r"\b(ship\w*|deliver\w*|arriv\w*|track\w*|dispatch\w*|status|where|return\w*|refund\w*|exchang\w*"
+        r"|cancel\w*|warrant\w*|guarantee\w*|polic\w*|damaged|broken|missing|wrong|fault\w*|change|why)\b"
+    )
+
+    def __init__(self, operation: str, product_filter: Optional[Tuple[str, str]] = None):
+        """
+        Initializes the OrderQuestion.
+
+        Args:
+            operation (str): The operation, see the class docstring.
+            product_filter (Optional[Tuple[str, str]]): The column (`name`, `brand` or `category`)
+                and value the orders are filtered on, if any.
+        """
+        self.operation: str = operation
+        self.product_filter: Optional[Tuple[str, str]] = product_filter
+
+    @staticmethod
+    def parse(query: str, store: "OrderStore") -> Optional["OrderQuestion"]:
+        """
+        Parses a structured question about orders from a query.
+
+        Args:
+            query (str): The customer's query.
+            store (OrderStore): The store, whose product names, brands and categories are matched.
+
+        Returns:
+            Optional[OrderQuestion]: The question, or None if the query is not a pure structured
+                question.
+        """
+        text: str = query.lower()
+        operation: Optional[str] = next(
+            (name for name, pattern in OrderQuestion.PATTERNS if pattern.search(text)), None
+        )
+        if operation is None or OrderQuestion.OTHER_INTENTS.search(text):
+            return None
+
+        # The most specific value named in the query: a whole product name, then the brand or
+        # category sharing the most words with it. An ambiguous match ("hiking" in "Hiking
+        # Clothing" and "Hiking Footwear") is left to the model.
+        terms: set = {OrderQuestion.singular(term) for term in re.findall(r"\w+", text)}
+        for column in ("name", "brand", "category"):
+            scores: Dict[str, float] = {}
+            for value in store.get_values(column):
+                value_terms: set = {OrderQuestion.singular(term) for term in re.findall(r"\w+", value.lower())}
+                if value_terms and (value_terms <= terms if column == "name" else value_terms & terms):
+                    scores[value] = len(value_terms & terms) / len(value_terms)
+            if scores:
+                best: float = max(scores.values())
+                matches: List[str] = [value for value, score in scores.items() if score == best]
+                if len(matches) > 1:
+                    return None
+                return OrderQuestion(operation, (column, matches[0]))
+
+        # "how many" without a product is a count of items only if it asks about items
+        if operation == "quantity" and not re.search(r"\b(items|things|products)\b", text):
+            return None
+        return OrderQuestion(operation, None)
+
+    @staticmethod
+    def singular(term: str) -> str:
+        return term[:-1] if len(term) > 3 and term.endswith("s") and not term.endswith("ss") else term
+
+
+class OrderStore:
+    """
+    The orders of every customer, in NumPy columns. The orders of the customer at position `i`
+    are the rows `offsets[i]:offsets[i + 1]` of every column, sorted by date. Text columns
+    (product name, brand, category) are dictionary-encoded as integer codes.
+
+    The store is built once per process from `data/customer_info/sample.yaml` and rebuilt when the
+    file changes. It needs numpy; `get_instance` returns None without it.
+    """
+
+    PATH: str = "data/customer_info/sample.yaml"
+
+    _instances: Dict[str, Tuple[float, "OrderStore"]] = {}
+    _lock: threading.Lock = threading.Lock()
+
+    def __init__(self, customers: List[Dict[str, Any]]):
+        """
+        Builds the store.
+
+        Args:
+            customers (List[Dict[str, Any]]): The customer records, with their `orders`.
+        """
+        import numpy as np
+
+        self.customers: Dict[str, int] = {}
+        self.values: Dict[str, List[str]] = {"name": [], "brand": [], "category": []}
+        codes: Dict[str, Dict[str, int]] = {column: {} for column in self.values}
+        rows: List[Tuple[Any, ...]] = []
+        offsets: List[int] = [0]
+        for position, customer in enumerate(customers):
+            self.customers[str(customer.get("email", "")).lower()] = position
+            orders: List[Dict[str, Any]] = sorted(
+                customer.get("orders") or [], key=lambda order: self.parse_date(order["date"])
+            )
+            for order in orders:
+                encoded: List[int] = []
+                for column, column_codes in codes.items():
+                    value: str = str(order.get(column, ""))
+                    if value not in column_codes:
+                        column_codes[value] = len(self.values[column])
+                        self.values[column].append(value)
+                    encoded.append(column_codes[value])
+                rows.append(
+                    (order["id"], self.parse_date(order["date"]), order["total"], order["quantity"], *encoded)
+                )
+            offsets.append(len(rows))
+
+        self.offsets: np.ndarray = np.array(offsets, dtype=np.int64)
+        self.order_id: np.ndarray = np.array([row[0] for row in rows], dtype=np.int64)
+        self.date: np.ndarray = np.array([row[1] for row in rows], dtype="datetime64[D]")
+        self.total: np.ndarray = np.array([row[2] for row in rows], dtype=np.float64)
+        self.quantity: np.ndarray = np.array([row[3] for row in rows], dtype=np.int64)
+        self.codes: Dict[str, np.ndarray] = {
+            column: np.array([row[4 + index] for row in rows], dtype=np.int32)
+            for index, column in enumerate(codes)
+        }
+
+    @staticmethod
+    def parse_date(value: str) -> datetime:
+        """
+        Parses an order date, written month/day/year in the customer data.
+        """
+        return datetime.strptime(str(value), "%m/%d/%Y")
+
+    @staticmethod
+    def get_instance(path: str = PATH) -> Optional["OrderStore"]:
+        """
+        Returns the store of a customer data file, built once per process and rebuilt when the file changes.
+
+        Args:
+            path (str): The path of the customer data file.
+
+        Returns:
+            Optional[OrderStore]: The store, or None if numpy is not installed or the file does not exist.
+        """
+        try:
+            mtime: float = os.path.getmtime(path)
+            with OrderStore._lock:
+                entry: Optional[Tuple[float, OrderStore]] = OrderStore._instances.get(path)
+                if entry is None or entry[0] != mtime:
+                    entry = (mtime, OrderStore(ConfigFileCache.load_yaml(path)))
+                    OrderStore._instances[path] = entry
+                    logging.info("Order store built", extra={"path": path, "orders": len(entry[1].order_id)})
+                return entry[1]
+        except (ImportError, OSError) as e:
+            logging.info("Order store unavailable", extra={"path": path, "error_message": str(e)})
+            return None
+
+    def get_values(self, column: str) -> List[str]:
+        """
+        Returns the distinct values of a text column (`name`, `brand` or `category`).
+        """
+        return self.values[column]
+
+    def get_rows(self, email: str, product_filter: Optional[Tuple[str, str]] = None) -> Optional["np.ndarray"]:
+        """
+        Returns the row numbers of a customer's orders, optionally filtered on a text column.
+
+        Args:
+            email (str): The customer's email.
+            product_filter (Optional[Tuple[str, str]]): The column and value to filter on.
+
+        Returns:
+            Optional[np.ndarray]: The row numbers, sorted by date, or None if the customer is unknown.
+        """
+        import numpy as np
+
+        position: Optional[int] = self.customers.get(email.lower())
+        if position is None:
+            return None
+        rows: np.ndarray = np.arange(self.offsets[position], self.offsets[position + 1])
+        if product_filter is not None:
+            column, value = product_filter
+            rows = rows[self.codes[column][rows] == self.values[column].index(value)]
+        return rows
+
+    def get_order(self, row: int) -> Dict[str, Any]:
+        """
+        Returns the columns of an order.
+        """
+        return {
+            "id": int(self.order_id[row]),
+            "date": str(self.date[row]),
+            "total": float(self.total[row]),
+            "quantity": int(self.quantity[row]),
+            **{column: self.values[column][int(self.codes[column][row])] for column in self.codes},
+        }
+
+    def answer(self, email: str, question: OrderQuestion) -> Optional[Dict[str, Any]]:
+        """
+        Computes the exact answer to a structured question.
+
+        Args:
+            email (str): The customer's email.
+            question (OrderQuestion): The question.
+
+        Returns:
+            Optional[Dict[str, Any]]: The operation, the filter, the number of matching orders and
+                the `value` (a number, an order, or None if no order matches), or None if the
+                customer is unknown.
+        """
+        rows = self.get_rows(email, question.product_filter)
+        if rows is None:
+            return None
+
+        value: Any = None
+        if question.operation == "total_spent":
+            value = round(float(self.total[rows].sum()), 2)
+        elif question.operation == "order_count":
+            value = int(len(rows))
+        elif question.operation == "quantity":
+            value = int(self.quantity[rows].sum())
+        elif len(rows) and question.operation == "last_order":
+            value = self.get_order(int(rows[-1]))
+        elif len(rows) and question.operation == "first_order":
+            value = self.get_order(int(rows[0]))
+        elif len(rows) and question.operation == "largest_order":
+            value = self.get_order(int(rows[int(self.total[rows].argmax())]))
+
+        return {
+            "operation": question.operation,
+            "filter": dict([question.product_filter]) if question.product_filter else None,
+            "orders": int(len(rows)),
+            "value": value,
+        }
+
+    @staticmethod
+    def format_answer(result: Dict[str, Any]) -> str:
+        """
+        Phrases the answer to a structured question with a template.
+
+        Args:
+            result (Dict[str, Any]): The answer, see `answer`.
+
+        Returns:
+            str: The phrased answer.
+        """
+        subject: str = f" on {next(iter(result['filter'].values()))}" if result["filter"] else ""
+        value: Any = result["value"]
+        operation: str = result["operation"]
+        if operation == "total_spent":
+            return f"You have spent a total of {value:.2f}{subject} across {result['orders']} order(s)."
+        if operation == "order_count":
+            return f"You have placed {value} order(s){subject}."
+        if operation == "quantity":
+            items: str = f" {next(iter(result['filter'].values()))}" if result["filter"] else ""
+            return f"You have bought {value} item(s){' of' if items else ''}{items}."
+        if value is None:
+            return f"You have no orders{subject}."
+        adjectives: Dict[str, str] = {"last_order": "most recent", "first_order": "first", "largest_order": "largest"}
+        adjective: str = adjectives[operation]
+        return (
+            f"Your {adjective} order{subject} is order {value['id']} of {value['date']}: "
+            f"{value['quantity']} x {value['name']} ({value['brand']}) for a total of {value['total']:.2f}."
+        )
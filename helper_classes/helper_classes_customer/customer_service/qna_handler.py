@@ -6,14 +6,19 @@ Classes:
     QnaHandler: Handles Q&A related tasks by performing AI search and language model operations.
 """
 
-import json
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 from promptflow.connections import CustomConnection  # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
+from helper_classes import serialization
 from helper_classes.ai_search import AiSearch
+from helper_classes.multi_query_search import MultiQuerySearch
 from helper_classes.llm_rag import LlmRag
+from helper_classes.retrieval_reuse import RetrievalReuse
 from helper_classes.helper_classes_customer.base_classes.handler_base import HandlerBase
 
+if TYPE_CHECKING:
+    from helper_classes.turn_context import TurnContext
+
 class QnaHandler(HandlerBase):
     """
     This class represents a Q&A handler for customer service.
@@ -33,8 +38,12 @@ class QnaHandler(HandlerBase):
         cognitive_search_connection: CognitiveSearchConnection,
         conversation_data: Dict[str, Any],
         topic: Dict[str, Any],
+        turn_context: Optional["TurnContext"] = None,
     ):
-        super().__init__(conversation_parameters, custom_connections, cognitive_search_connection, conversation_data, topic)
+        super().__init__(
+            conversation_parameters, custom_connections, cognitive_search_connection,
+            conversation_data, topic, turn_context,
+        )
 
     def execute(self) -> str:
         """
@@ -46,22 +55,36 @@ class QnaHandler(HandlerBase):
         # Extract AI search configuration from topic
         ai_search_config = self.topic["follow_on_business_logic"][0]["ai_search"]
 
-        # Perform AI search
-        ai_search = AiSearch(self.conversation_data, self.conversation_parameters, ai_search_config, self.cognitive_search_connection)
-        response = ai_search.execute()
-        min_reranker_score = ai_search.search_params.get("min_reranker_score")
-        query_key = ai_search.search_params.get("query_key")
-        score_key = ai_search.search_params.get("score_key")
-        content_key = ai_search.search_params.get("content_key")
+        search_params = ai_search_config["parameters"]
+        min_reranker_score = search_params.get("min_reranker_score")
+        query_key = search_params.get("query_key")
+        score_key = search_params.get("score_key")
+        content_key = search_params.get("content_key")
         llm_response = ""
 
+        # A follow-up question may be answered from the results of the previous Q&A turn
+        retrieval_reuse = RetrievalReuse(
+            self.conversation_data, self.conversation_parameters, ai_search_config
+        )
+        decision: str = retrieval_reuse.decide()
+        if decision == RetrievalReuse.REUSE:
+            response_value = retrieval_reuse.get_previous_results()
+        elif decision == RetrievalReuse.SUPPLEMENT:
+            response_value = retrieval_reuse.supplement(self.search(retrieval_reuse.get_supplement_config()))
+        else:
+            response_value = self.search(ai_search_config)
+
+        # The results of a search are kept for the next Q&A turn
+        searched: bool = decision != RetrievalReuse.REUSE and response_value is not None
+        if searched and RetrievalReuse.is_enabled(ai_search_config):
+            retrieval_reuse.remember(response_value)
+            self.save_conversation_data()
+
         # Check for a successful response
-        if not response or response.status_code != 200:
+        if response_value is None:
             # TODO: Handle error
             pass
         else:
-            response_data = json.loads(response.text)
-            response_value = response_data["value"]
             query = self.conversation_data["arguments"]["query"]
             previous_answer_provided = self.conversation_data["arguments"].get("previous_answer_provided", "")
 
@@ -78,8 +101,40 @@ class QnaHandler(HandlerBase):
                 min_reranker_score,
                 query_key,
                 score_key,
-                content_key
+                content_key,
+                self.turn_context,
             )
             llm_response = llm.execute(query, previous_answer_provided)
 
         return llm_response
+
+    def search(self, ai_search_config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Performs the AI search, with one search per query variant if the topic enables it.
+
+        Args:
+            ai_search_config (Dict[str, Any]): The `ai_search` configuration.
+
+        Returns:
+            Optional[List[Dict[str, Any]]]: The search results, or None if the search failed.
+        """
+        if MultiQuerySearch.is_enabled(ai_search_config):
+            return MultiQuerySearch(
+                self.conversation_data,
+                self.conversation_parameters,
+                ai_search_config,
+                self.cognitive_search_connection,
+                self.custom_connections,
+            ).execute()
+
+        ai_search = AiSearch.create(
+            self.conversation_data,
+            self.conversation_parameters,
+            ai_search_config,
+            self.cognitive_search_connection,
+            self.custom_connections,
+        )
+        response = ai_search.execute()
+        if response and response.status_code == 200:
+            return serialization.loads(response.content)["value"]
+        return None
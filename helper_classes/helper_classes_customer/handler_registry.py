@@ -0,0 +1,278 @@
+"""
+This module provides the registry of custom handlers and the per-topic dispatch table.
+
+Handlers are registered under the `method_name` used in the `follow_on_business_logic` of the topic
+YAML files. A handler can be registered as a class (or any factory taking the HandlerBase arguments)
+or lazily as a `"package.module:ClassName"` reference, in which case the module is only imported the
+first time the handler is dispatched. New handlers are added with the `register_handler` decorator,
+with `HandlerRegistry.register`, or directly in the topic YAML through the `handler` key of an action:
+
+    follow_on_business_logic:
+      - name: myFunction
+        action:
+          type: custom_handler
+          handler: my_package.my_module:MyHandler
+
+Classes:
+    HandlerRegistry: Maps method names to handler factories.
+    TopicDispatchTable: Maps the function names of a topic to their handlers, built once per topic.
+"""
+
+import importlib
+import importlib.util
+import inspect
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+# A handler class or factory, called with the HandlerBase arguments and returning an object with `execute()`
+HandlerFactory = Callable[..., Any]
+
+
+class HandlerRegistry:
+    """
+    Registry mapping the `method_name` of custom handler actions to handler factories.
+    """
+
+    _factories: Dict[str, HandlerFactory] = {}
+    _references: Dict[str, str] = {}
+    _accepts_turn_context: Dict[HandlerFactory, bool] = {}
+    _lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def register(cls, method_name: str, handler: Union[HandlerFactory, str]) -> None:
+        """
+        Registers a handler under a method name.
+
+        Args:
+            method_name (str): The method name used in the topic YAML.
+            handler (Union[HandlerFactory, str]): The handler class or factory, or a lazy
+                `"package.module:ClassName"` reference.
+        """
+        with cls._lock:
+            if isinstance(handler, str):
+                cls.parse_reference(handler)
+                cls._references[method_name] = handler
+                cls._factories.pop(method_name, None)
+            else:
+                cls._factories[method_name] = handler
+                cls._references.pop(method_name, None)
+
+    @classmethod
+    def is_registered(cls, method_name: str) -> bool:
+        """
+        Checks whether a handler is registered under the method name.
+
+        Args:
+            method_name (str): The method name used in the topic YAML.
+
+        Returns:
+            bool: True if a handler is registered, False otherwise.
+        """
+        return method_name in cls._factories or method_name in cls._references
+
+    @classmethod
+    def get_reference(cls, method_name: str) -> Optional[str]:
+        """
+        Returns the lazy reference registered under the method name, if the handler is not imported yet.
+
+        Args:
+            method_name (str): The method name used in the topic YAML.
+
+        Returns:
+            Optional[str]: The `"package.module:ClassName"` reference, or None.
+        """
+        return cls._references.get(method_name)
+
+    @classmethod
+    def get_factory(cls, method_name: str) -> HandlerFactory:
+        """
+        Returns the handler factory registered under the method name, importing it on first use.
+
+        Args:
+            method_name (str): The method name used in the topic YAML.
+
+        Returns:
+            HandlerFactory: The handler factory.
+
+        Raises:
+            KeyError: If no handler is registered under the method name.
+        """
+        factory: Optional[HandlerFactory] = cls._factories.get(method_name)
+        if factory is not None:
+            return factory
+
+        with cls._lock:
+            factory = cls._factories.get(method_name)
+            if factory is None:
+                reference: Optional[str] = cls._references.get(method_name)
+                if reference is None:
+                    raise KeyError(f"No handler registered for method_name '{method_name}'")
+                factory = cls.import_reference(reference)
+                cls._factories[method_name] = factory
+                del cls._references[method_name]
+        return factory
+
+    @classmethod
+    def accepts_turn_context(cls, factory: HandlerFactory) -> bool:
+        """
+        Checks whether a handler factory takes the `turn_context` keyword argument of HandlerBase.
+        Handlers written before the TurnContext are created without it.
+
+        Args:
+            factory (HandlerFactory): The handler factory.
+
+        Returns:
+            bool: True if the factory takes `turn_context` or any keyword argument.
+        """
+        accepts: Optional[bool] = cls._accepts_turn_context.get(factory)
+        if accepts is None:
+            try:
+                parameters = inspect.signature(factory).parameters.values()
+            except (TypeError, ValueError):
+                parameters = []  # type: ignore
+            accepts = any(
+                parameter.name == "turn_context" or parameter.kind == inspect.Parameter.VAR_KEYWORD
+                for parameter in parameters
+            )
+            cls._accepts_turn_context[factory] = accepts
+        return accepts
+
+    @classmethod
+    def preload(cls) -> None:
+        """
+        Imports every lazily registered handler, used to warm a worker off the request path.
+        """
+        for method_name in list(cls._references):
+            cls.get_factory(method_name)
+
+    @staticmethod
+    def parse_reference(reference: str) -> Tuple[str, str]:
+        """
+        Splits a `"package.module:ClassName"` reference.
+
+        Args:
+            reference (str): The handler reference.
+
+        Returns:
+            Tuple[str, str]: The module name and the attribute name.
+
+        Raises:
+            ValueError: If the reference is malformed.
+        """
+        module_name, _, attribute = reference.partition(":")
+        if not module_name or not attribute:
+            raise ValueError(f"Invalid handler reference '{reference}', expected 'package.module:ClassName'")
+        return module_name, attribute
+
+    @staticmethod
+    def import_reference(reference: str) -> HandlerFactory:
+        """
+        Imports the handler class or factory a reference points to.
+
+        Args:
+            reference (str): The `"package.module:ClassName"` reference.
+
+        Returns:
+            HandlerFactory: The handler factory.
+        """
+        module_name, attribute = HandlerRegistry.parse_reference(reference)
+        return getattr(importlib.import_module(module_name), attribute)
+
+    @staticmethod
+    def reference_exists(reference: str) -> bool:
+        """
+        Checks that the module of a reference can be found, without importing it.
+
+        Args:
+            reference (str): The `"package.module:ClassName"` reference.
+
+        Returns:
+            bool: True if the module can be found, False otherwise.
+        """
+        module_name, _ = HandlerRegistry.parse_reference(reference)
+        try:
+            return importlib.util.find_spec(module_name) is not None
+        except ModuleNotFoundError:
+            return False
+
+
+def register_handler(method_name: str) -> Callable[[HandlerFactory], HandlerFactory]:
+    """
+    Class decorator registering a handler under a method name.
+
+    Args:
+        method_name (str): The method name used in the topic YAML.
+
+    Returns:
+        Callable[[HandlerFactory], HandlerFactory]: The decorator.
+    """
+
+    def decorator(handler: HandlerFactory) -> HandlerFactory:
+        HandlerRegistry.register(method_name, handler)
+        return handler
+
+    return decorator
+
+
+# Built-in handlers, imported on first use
+_CUSTOMER_HANDLERS = "helper_classes.helper_classes_customer"
+for _method_name, _reference in {
+    "handle_qna": ".customer_service.qna_handler:QnaHandler",
+    "handle_fallback": ".customer_service.fallback_handler:FallbackHandler",
+    "handle_customerQuery": ".customer_service.customerQuery_handler:CustomerQueryHandler",
+    "handle_offerQuery": ".offerQuery.offerQuery_handler:OfferQueryHandler",
+    "handle_offerDetail": ".offerQuery.offerDetail_handler:offerDetailHandler",
+}.items():
+    HandlerRegistry.register(_method_name, _CUSTOMER_HANDLERS + _reference)
+
+
+class TopicDispatchTable:
+    """
+    Maps the function names of a topic to the method names of their custom handlers.
+
+    The table is built and validated once per topic, so unknown handlers are reported when the
+    topic is loaded rather than in the middle of a turn.
+    """
+
+    def __init__(self, topic: Dict[str, Any]):
+        """
+        Builds the dispatch table from the `follow_on_business_logic` of the topic.
+
+        Args:
+            topic (Dict[str, Any]): The topic object.
+
+        Raises:
+            ValueError: If a custom handler action references an unknown handler.
+        """
+        self.method_names: Dict[str, str] = {}
+
+        for rule in topic.get("follow_on_business_logic", []):
+            action: Dict[str, Any] = rule.get("action") or {}
+            if action.get("type", "") != "custom_handler":
+                continue
+
+            method_name: str = action.get("method_name", "")
+            reference: Optional[str] = action.get("handler")
+            if reference:
+                if not HandlerRegistry.reference_exists(reference):
+                    raise ValueError(f"Handler '{reference}' of function '{rule['name']}' cannot be found")
+                method_name = method_name or reference
+                if not HandlerRegistry.is_registered(method_name):
+                    HandlerRegistry.register(method_name, reference)
+            elif not HandlerRegistry.is_registered(method_name):
+                raise ValueError(f"Unknown method_name '{method_name}' for function '{rule['name']}'")
+
+            # First matching rule wins, as with the linear scan this table replaces
+            self.method_names.setdefault(rule["name"], method_name)
+
+    def get_method_name(self, fn_name: str) -> Optional[str]:
+        """
+        Returns the method name of the custom handler of a function.
+
+        Args:
+            fn_name (str): The name of the function.
+
+        Returns:
+            Optional[str]: The method name, or None if the function has no custom handler.
+        """
+        return self.method_names.get(fn_name)
@@ -1,8 +1,11 @@
-from typing import Any
+from typing import TYPE_CHECKING, Any, Optional
 from promptflow.connections import CustomConnection # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
 from helper_classes.helper_classes_customer.base_classes.handler_base import HandlerBase
 
+if TYPE_CHECKING:
+    from helper_classes.turn_context import TurnContext
+
 
 class offerDetailHandler(HandlerBase):
     def __init__(
@@ -12,8 +15,12 @@ class offerDetailHandler(HandlerBase):
         cognitive_search_connection: CognitiveSearchConnection,
         conversation_data: dict[str, Any],
         topic: dict[str, Any],
+        turn_context: Optional["TurnContext"] = None,
     ):
-        super().__init__(conversation_parameters,custom_connections, cognitive_search_connection, conversation_data, topic)
+        super().__init__(
+            conversation_parameters, custom_connections, cognitive_search_connection,
+            conversation_data, topic, turn_context,
+        )
 
 
     def execute(self) -> str:
@@ -3,12 +3,15 @@ Module offer_query_handler
 This module provides the OfferQueryHandler class for managing and executing offer queries.
 """
 
-import json
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 from promptflow.connections import CustomConnection  # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
 from helper_classes.helper_classes_customer.base_classes.handler_base import HandlerBase
 from helper_classes.lm_helpers.llm_helper import LLMHelper
+from helper_classes import serialization
+
+if TYPE_CHECKING:
+    from helper_classes.turn_context import TurnContext
 
 
 class OfferQueryHandler(HandlerBase):
@@ -23,8 +26,12 @@ class OfferQueryHandler(HandlerBase):
         cognitive_search_connection: CognitiveSearchConnection,        
         conversation_data: Dict[str, Any],
         topic: Dict[str, Any],
+        turn_context: Optional["TurnContext"] = None,
     ):
-        super().__init__(conversation_parameters, custom_connections, cognitive_search_connection, conversation_data, topic)
+        super().__init__(
+            conversation_parameters, custom_connections, cognitive_search_connection,
+            conversation_data, topic, turn_context,
+        )
 
     def execute(self) -> str:
         """
@@ -113,7 +120,7 @@ class OfferQueryHandler(HandlerBase):
         system_prompt: str = (
             "you are an assistant that identifies the customer ID number from the address given. "
             + "You must return either the correct `cuid` from the following json object, or `not_found` if not found. Do not return anything else!\n\n"
-            + json.dumps(json_list_of_addresses)
+            + serialization.dumps(json_list_of_addresses)
         )
 
         user_prompt: str = (
@@ -131,17 +138,9 @@ class OfferQueryHandler(HandlerBase):
         """
         Calls the language model to process the messages.
         """
-        llm_helper = LLMHelper(
-            self.custom_connections,
-            self.cognitive_search_connection,
-            self.conversation_data["chat_history"],
-            self.conversation_data["query"],
-            json.dumps(self.conversation_parameters),
-            self.conversation_data
-        )
-
-        client = llm_helper.create_client()
-        topic_object = llm_helper.load_topic_object()
+        llm_helper: LLMHelper = self.get_llm_helper(self.conversation_data.get("query", ""))
+        client = self.create_llm_client()
+        topic_object = llm_helper.topic_object
         tools_list = llm_helper.get_tools_list()
         params = topic_object["llm_parameters"]
         model_name = str(self.custom_connections.configs["llm_model_name"])  # type: ignore
@@ -153,7 +152,8 @@ class OfferQueryHandler(HandlerBase):
             model_name=model_name,
             messages=messages,
             tools_list=tools_list,
-            params=params
+            params=params,
+            stage="address_lookup",
         )
 
         return completion
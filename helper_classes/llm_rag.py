@@ -1,10 +1,13 @@
-import json
-from typing import Any, Dict, List
-from openai import AzureOpenAI
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 from promptflow.connections import CustomConnection  # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
+from helper_classes import serialization
 from helper_classes.lm_helpers.llm_helper import LLMHelper
 
+if TYPE_CHECKING:
+    from openai import AzureOpenAI
+    from helper_classes.turn_context import TurnContext
+
 class LlmRag:
     """
     A class to handle LLM operations for Q&A.
@@ -12,7 +15,7 @@ class LlmRag:
 
     def __init__(
         self,
-        client: AzureOpenAI,
+        client: "AzureOpenAI",
         custom_connections: CustomConnection,
         cognitive_search_connection: CognitiveSearchConnection,
         conversation_parameters: Dict[str, Any],
@@ -22,7 +25,8 @@ class LlmRag:
         min_reranker_score: float = 0.0,
         query_key: str = "query",
         score_key: str = "@search.rerankerScore",
-        content_key: str = "content"
+        content_key: str = "content",
+        turn_context: Optional["TurnContext"] = None,
     ):
         self.response_value = response_value
         self.conversation_data = conversation_data
@@ -35,6 +39,7 @@ class LlmRag:
         self.query_key = query_key
         self.score_key = score_key
         self.content_key = content_key
+        self.turn_context = turn_context
 
     def execute(self, query: str, previous_answer_provided: str) -> str:
         """
@@ -49,17 +54,22 @@ class LlmRag:
         """
         Calls the LLM to process the messages.
         """
-        llm_helper = LLMHelper(
-            self.custom_connections,
-            self.cognitive_search_connection,
-            [],
-            self.conversation_data["arguments"][self.query_key],
-            json.dumps(self.conversation_parameters),
-            self.conversation_data
-        )
-
-        client = llm_helper.create_client()
-        topic_object = llm_helper.load_topic_object()
+        if self.turn_context is not None:
+            # The turn's helper of the topic, already loaded
+            llm_helper = self.turn_context.get_llm_helper(self.conversation_data["topic_name"])
+            client = self.client
+            topic_object = llm_helper.topic_object
+        else:
+            llm_helper = LLMHelper(
+                self.custom_connections,
+                self.cognitive_search_connection,
+                [],
+                self.conversation_data["arguments"][self.query_key],
+                self.conversation_parameters,
+                self.conversation_data
+            )
+            client = llm_helper.create_client()
+            topic_object = llm_helper.load_topic_object()
         tools_list = []
         params = topic_object["llm_parameters"]
         model_name = str(self.custom_connections.configs["llm_model_name"])  # type: ignore
@@ -71,7 +81,8 @@ class LlmRag:
             model_name=model_name,
             messages=messages,
             tools_list=tools_list,
-            params=params
+            params=params,
+            stage="rag_answer",
         )
 
     def get_messages(self, chunks: List[str], query: str, previous_answer_provided: str) -> List[Dict[str, str]]:
@@ -79,7 +90,7 @@ class LlmRag:
         Constructs the messages for the LLM.
         """
         system_prompt = (
-            "Answer the User's query using ONLY the information provided below:\n\n" + json.dumps(chunks)
+            "Answer the User's query using ONLY the information provided below:\n\n" + serialization.dumps(chunks)
         )
 
         messages = [
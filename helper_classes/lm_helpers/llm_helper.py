@@ -3,35 +3,69 @@ Module llm_helper
 This module provides the LLMHelper class for managing and executing large language model operations.
 """
 
-import json
-import os
+import hashlib
 import logging
+import threading
 import time
 import traceback
-from typing import Any, Dict, List, Union
-from openai import AzureOpenAI
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
 from promptflow.connections import CustomConnection # type: ignore
-import yaml
+from helper_classes import metrics
 from helper_classes.lm_helpers.lm_helper import LMHelper
+from helper_classes.single_flight import SingleFlight
+from helper_classes.tool_argument_validator import ToolArgumentValidator
+
+if TYPE_CHECKING:
+    from openai import AzureOpenAI
 
 class LLMHelper(LMHelper):
     """
     A class that extends LMHelper for large language models.
     """
 
-    def create_client(self) -> AzureOpenAI:
+    _clients: Dict[Tuple[str, str, str], "AzureOpenAI"] = {}
+    _clients_lock: threading.Lock = threading.Lock()
+    _metrics: Dict[str, Dict[str, float]] = {}
+    _metrics_lock: threading.Lock = threading.Lock()
+
+    def create_client(self) -> "AzureOpenAI":
         """
         Create an Azure OpenAI client.
 
         Returns:
             AzureOpenAI: The created Azure OpenAI client.
         """
-        cnn: CustomConnection = self.custom_connections
-        return AzureOpenAI(
-            azure_endpoint=str(cnn.configs["llm_api_endpoint"]),
-            api_key=str(cnn.secrets["llm_api_key"]),
-            api_version=str(cnn.configs["llm_api_version"]),
-        )
+        return LLMHelper.create_pooled_client(self.custom_connections)
+
+    @staticmethod
+    def create_pooled_client(custom_connections: CustomConnection) -> "AzureOpenAI":
+        """
+        Return the Azure OpenAI client shared by all turns using the same connection, creating it on first use.
+        The client is thread safe and keeps its HTTP connection pool alive between turns.
+
+        Args:
+            custom_connections (CustomConnection): Custom connections object.
+
+        Returns:
+            AzureOpenAI: The shared Azure OpenAI client.
+        """
+        cnn: CustomConnection = custom_connections
+        endpoint: str = str(cnn.configs["llm_api_endpoint"])
+        api_version: str = str(cnn.configs["llm_api_version"])
+        api_key: str = str(cnn.secrets["llm_api_key"])
+        key: Tuple[str, str, str] = (endpoint, api_version, hashlib.sha256(api_key.encode("utf-8")).hexdigest())
+
+        client = LLMHelper._clients.get(key)
+        if client is None:
+            # Imported on first use to keep it off the worker's import path
+            from openai import AzureOpenAI
+
+            with LLMHelper._clients_lock:
+                client = LLMHelper._clients.get(key)
+                if client is None:
+                    client = AzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version)
+                    LLMHelper._clients[key] = client
+        return client
 
     def get_tools_list(self) -> List[Dict[str, Any]]:
         """
@@ -50,23 +84,25 @@ class LLMHelper(LMHelper):
         else:
             raise ValueError(f"Unknown config type: {config_type}")
     
-    def _get_tools_from_project_config(self) -> List[Dict[str, Any]]:
+    def get_tool_validators(self) -> Dict[str, ToolArgumentValidator]:
         """
-        Retrieve the list of tools from the project configuration.
+        Retrieve the compiled argument validators for the tools of the loaded topic.
+        The validators are compiled once per topic and kept by the TopicRegistry.
 
         Returns:
-            List[Dict[str, Any]]: The list of tools.
+            Dict[str, ToolArgumentValidator]: The validators keyed by function name.
         """
-        tools: List[Dict[str, Any]] = self.topic_object["tools"]
-        standard_tool_functions: List[str] = self.topic_object["standard_tool_functions"]
+        return self.compiled_topic.get_tool_validators()  # type: ignore
 
-        for stf in standard_tool_functions:
-            path = os.path.join(os.getcwd(), "standard_tool_functions", stf + ".yaml")
-            with open(path, "r", encoding="utf-8") as file:
-                tool = yaml.safe_load(file)
-            tools.append(tool)
+    def _get_tools_from_project_config(self) -> List[Dict[str, Any]]:
+        """
+        Retrieve the list of tools from the project configuration, merged with the standard tool
+        functions when the topic is loaded. The list is shared and read-only.
 
-        return tools
+        Returns:
+            List[Dict[str, Any]]: The list of tools.
+        """
+        return self.compiled_topic.tools_list  # type: ignore
 
     def _get_tools_from_database_config(self) -> List[Dict[str, Any]]:
         """
@@ -82,15 +118,18 @@ class LLMHelper(LMHelper):
         self,
         session_id: str,
         conversation_id: str,
-        client: AzureOpenAI,
+        client: "AzureOpenAI",
         model_name: str,
         messages: List[Dict[str, str]],
         tools_list: List[Dict[str, Any]],
         params: Dict[str, float],
         tool_choice: str = "auto",
+        stage: Optional[str] = None,
     ) -> Union[object, None]:
         """
         Executes the language model with provided parameters and logs the success or failure.
+        The topic's `model_routing` of the stage, if any, replaces the model and parameters, see
+        `get_stage_model`.
 
         Args:
             session_id (str): The session ID.
@@ -101,39 +140,29 @@ class LLMHelper(LMHelper):
             tools_list (List[Dict[str, Any]]): The list of tools to use.
             params (Dict[str, float]): The parameters for the model.
             tool_choice (str, optional): The tool choice. Defaults to "auto".
+            stage (Optional[str], optional): The stage of the turn making the call. Defaults to None.
 
         Returns:
             Union[object, None]: The completion object from the language model, or None if an exception occurred.
         """
         start_time: float = time.time()
+        model_name, params = self.get_stage_model(stage, model_name, params)
 
         try:
             completion: object = None
+            shared: bool = False
 
-            if not tools_list:
-                # Create a completion without tools
-                completion = client.chat.completions.create(
-                    messages=messages, # type: ignore
-                    model=model_name,
-                    temperature=params["temperature"],
-                    top_p=params["top_p"],
-                    frequency_penalty=params["frequency_penalty"],
-                    presence_penalty=params["presence_penalty"],
-                    stop=None,
+            if params["temperature"] == 0:
+                # Identical deterministic completions in flight at the same time share one request
+                key: str = LLMHelper.request_key(client, model_name, messages, tools_list, params, tool_choice)
+                completion, shared = SingleFlight.group("completion").do(
+                    key,
+                    lambda: LLMHelper._create_completion(
+                        client, model_name, messages, tools_list, params, tool_choice
+                    ),
                 )
             else:
-                # Create a completion with tools
-                completion = client.chat.completions.create(
-                    messages=messages, # type: ignore
-                    model=model_name,
-                    temperature=params["temperature"],
-                    top_p=params["top_p"],
-                    frequency_penalty=params["frequency_penalty"],
-                    presence_penalty=params["presence_penalty"],
-                    stop=None,
-                    tools=tools_list, # type: ignore
-                    tool_choice=tool_choice, # type: ignore
-                )
+                completion = LLMHelper._create_completion(client, model_name, messages, tools_list, params, tool_choice)
 
             end_time: float = time.time()
             execution_time_ms: float = (end_time - start_time) * 1000
@@ -144,15 +173,33 @@ class LLMHelper(LMHelper):
                 "system_fingerprint": completion.system_fingerprint,  # type: ignore
                 "completion_id": completion.id,  # type: ignore
                 "utterance": messages[-1]["content"],
-                "execution_time_ms": execution_time_ms,	
+                "execution_time_ms": execution_time_ms,
+                "stage": stage,
+                "model": model_name,
+                "shared": shared,
                 "tokens": {
                     "prompt_tokens": completion.usage.prompt_tokens,  # type: ignore
                     "completion_tokens": completion.usage.completion_tokens,  # type: ignore
                     "total_tokens": completion.usage.total_tokens,  # type: ignore
-                },                                
+                },
             }
 
             logging.info("Execution completed", extra=log_data)
+            # The tokens of a shared completion are counted once, by the call that requested it
+            prompt_tokens: int = 0 if shared else completion.usage.prompt_tokens  # type: ignore
+            completion_tokens: int = 0 if shared else completion.usage.completion_tokens  # type: ignore
+            LLMHelper._count(
+                stage,
+                model_name,
+                calls=1,
+                shared=int(shared),
+                latency_ms=execution_time_ms,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+            self.record_metrics(
+                stage, model_name, "ok", execution_time_ms, prompt_tokens, completion_tokens, shared
+            )
 
             return completion
 
@@ -160,9 +207,148 @@ class LLMHelper(LMHelper):
             log_data: Dict[str, Any] = {
                 "session_id": str(session_id),
                 "conversation_id": str(conversation_id),
+                "stage": stage,
+                "model": model_name,
                 "messages": messages,
                 "error": "".join(traceback.format_exception(None, e, e.__traceback__)),
             }
             logging.error("Failure occurred", extra=log_data)
+            LLMHelper._count(stage, model_name, failures=1)
+            self.record_metrics(stage, model_name, "error", (time.time() - start_time) * 1000)
 
             return None
+
+    def record_metrics(
+        self,
+        stage: Optional[str],
+        model_name: str,
+        outcome: str,
+        execution_time_ms: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        shared: bool = False,
+    ) -> None:
+        """
+        Records a completion in the metrics, labelled by the persona and topic of the conversation.
+        The tokens of a completion shared from another call's request are not recorded again.
+        """
+        labels: Dict[str, Any] = {
+            "persona": self.conversation_parameters.get("persona_name"),
+            "topic": self.conversation_data.get("topic_name"),
+            "stage": stage or "default",
+            "model": model_name,
+        }
+        metrics.LLM_SECONDS.observe(execution_time_ms / 1000, outcome=outcome, **labels)
+        if outcome == "ok" and not shared:
+            metrics.LLM_TOKENS.inc(prompt_tokens, kind="prompt", **labels)
+            metrics.LLM_TOKENS.inc(completion_tokens, kind="completion", **labels)
+            metrics.LLM_COMPLETION_TOKENS.observe(completion_tokens, stage=labels["stage"], model=model_name)
+
+    @staticmethod
+    def _count(stage: Optional[str], model_name: str, **counts: float) -> None:
+        with LLMHelper._metrics_lock:
+            counters: Dict[str, float] = LLMHelper._metrics.setdefault(
+                f"{stage or 'default'}/{model_name}",
+                {
+                    "calls": 0, "failures": 0, "shared": 0, "latency_ms": 0.0,
+                    "prompt_tokens": 0, "completion_tokens": 0,
+                },
+            )
+            for name, count in counts.items():
+                counters[name] += count
+
+    @staticmethod
+    def get_metrics() -> Dict[str, Dict[str, float]]:
+        """
+        Returns the counters of the completions by stage and model: the calls, the failures, the calls
+        sharing a request in flight, the mean latency and the prompt and completion tokens.
+
+        Returns:
+            Dict[str, Dict[str, float]]: The counters keyed by `<stage>/<model>`, `default` for the calls
+                without a stage.
+        """
+        with LLMHelper._metrics_lock:
+            counters: Dict[str, Dict[str, float]] = {
+                key: dict(value) for key, value in LLMHelper._metrics.items()
+            }
+        for value in counters.values():
+            latency_ms: float = value.pop("latency_ms")
+            value["mean_latency_ms"] = round(latency_ms / value["calls"], 3) if value["calls"] else 0.0
+        return counters
+
+    @staticmethod
+    def request_key(
+        client: "AzureOpenAI",
+        model_name: str,
+        messages: List[Dict[str, str]],
+        tools_list: List[Dict[str, Any]],
+        params: Dict[str, float],
+        tool_choice: str,
+    ) -> str:
+        """
+        Returns the canonical hash of a completion request, for the single-flight deduplication.
+
+        Args:
+            client (AzureOpenAI): The client. Clients are pooled per endpoint and credentials, and
+                two clients alive at the same time have different ids.
+            model_name (str): The model name.
+            messages (List[Dict[str, str]]): The messages.
+            tools_list (List[Dict[str, Any]]): The tools.
+            params (Dict[str, float]): The model parameters.
+            tool_choice (str): The tool choice.
+
+        Returns:
+            str: The request hash.
+        """
+        sampling: Dict[str, float] = {
+            name: params[name]
+            for name in ("temperature", "top_p", "frequency_penalty", "presence_penalty", "max_tokens")
+            if name in params
+        }
+        return SingleFlight.request_key(
+            id(client), model_name, messages, tools_list or [], sampling, tool_choice if tools_list else None
+        )
+
+    @staticmethod
+    def _create_completion(
+        client: "AzureOpenAI",
+        model_name: str,
+        messages: List[Dict[str, str]],
+        tools_list: List[Dict[str, Any]],
+        params: Dict[str, float],
+        tool_choice: str,
+    ) -> object:
+        """
+        Creates a chat completion, with the tools if there are any, capped at `max_tokens` if the
+        parameters set it.
+        """
+        options: Dict[str, Any] = {}
+        if params.get("max_tokens"):
+            options["max_tokens"] = int(params["max_tokens"])
+
+        if not tools_list:
+            # Create a completion without tools
+            return client.chat.completions.create(
+                messages=messages, # type: ignore
+                model=model_name,
+                temperature=params["temperature"],
+                top_p=params["top_p"],
+                frequency_penalty=params["frequency_penalty"],
+                presence_penalty=params["presence_penalty"],
+                stop=None,
+                **options,
+            )
+
+        # Create a completion with tools
+        return client.chat.completions.create(
+            messages=messages, # type: ignore
+            model=model_name,
+            temperature=params["temperature"],
+            top_p=params["top_p"],
+            frequency_penalty=params["frequency_penalty"],
+            presence_penalty=params["presence_penalty"],
+            stop=None,
+            tools=tools_list, # type: ignore
+            tool_choice=tool_choice, # type: ignore
+            **options,
+        )
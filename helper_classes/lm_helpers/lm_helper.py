@@ -4,26 +4,35 @@ This module provides the abstract base class LMHelper for managing and executing
 """
 
 from abc import ABC, abstractmethod
-import json
-import os
 import logging
-from typing import Any, Dict, List, Union
-import yaml
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
 from promptflow.connections import CustomConnection # type: ignore
 from promptflow.connections import CognitiveSearchConnection # type: ignore
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.conversation_helper.conversation_summary_helper import ConversationSummaryHelper
+from helper_classes.lm_helpers.prompt_message_cache import PromptMessageCache
+from helper_classes.config_file_cache import ConfigFileCache
+from helper_classes import serialization
+from helper_classes.topic_helper.flow_bundle import FlowBundle
+from helper_classes.topic_helper.topic_registry import CompiledTopic, TopicRegistry
 
 class LMHelper(ABC):
     """
     Abstract base class for managing and executing language model operations.
     """
 
+    # The helpers created and the topics they loaded, see TurnContext.get_metrics
+    _counts: Dict[str, int] = {"instances": 0, "topic_loads": 0}
+    _counts_lock: threading.Lock = threading.Lock()
+
     def __init__(
         self,
         custom_connections: CustomConnection,
         cognitive_search_connection: CognitiveSearchConnection,
         chat_history: List[Dict[str, str]],
         query: str,
-        conversation_parameters: str,
+        conversation_parameters: Union[str, Dict[str, Any]],
         conversation_data: Dict[str, str],
     ):
         """
@@ -33,16 +42,25 @@ class LMHelper(ABC):
             custom_connections (CustomConnection): Custom connections object.
             chat_history (List[Dict[str, str]]): List of chat history records.
             query (str): The user's query.
-            conversation_parameters (str): JSON string of conversation parameters.
+            conversation_parameters (Union[str, Dict[str, Any]]): The conversation parameters, parsed or as a
+                JSON string.
             conversation_data (Dict[str, str]): Data related to the conversation.
         """
         self.custom_connections: CustomConnection = custom_connections
         self.cognitive_search_connection: CognitiveSearchConnection = cognitive_search_connection
         self.chat_history: List[Dict[str, str]] = chat_history
         self.query: str = query
-        self.conversation_parameters: Dict[str, str] = json.loads(conversation_parameters)
+        self.conversation_parameters: Dict[str, str] = (
+            serialization.loads(conversation_parameters)
+            if isinstance(conversation_parameters, str)
+            else conversation_parameters
+        )
         self.conversation_data: Dict[str, str] = conversation_data
         self.topic_object: Dict[str, Any] = {}
+        self.topic_path: str = ""
+        self.compiled_topic: Optional[CompiledTopic] = None
+        self.bundle: Optional[FlowBundle] = FlowBundle.get_active()
+        LMHelper._count("instances")
 
     @abstractmethod
     def create_client(self) -> Any:
@@ -65,6 +83,7 @@ class LMHelper(ABC):
         tools_list: List[Dict[str, Any]],
         params: Dict[str, float],
         tool_choice: str = "auto",
+        stage: Optional[str] = None,
     ) -> Union[object, None]:
         """
         Abstract method to execute the language model operation.
@@ -78,35 +97,79 @@ class LMHelper(ABC):
             tools_list (List[Dict[str, Any]]): The list of tools to use.
             params (Dict[str, float]): The parameters for the model.
             tool_choice (str, optional): The tool choice. Defaults to "auto".
+            stage (Optional[str], optional): The stage of the turn making the call, see `get_stage_model`.
+                Defaults to None.
 
         Returns:
             Union[object, None]: The completion object from the language model, or None if an exception occurred.
         """
         pass
 
-    def load_topic_object(self) -> Dict[str, Any]:
+    def get_stage_model(
+        self, stage: Optional[str], model_name: str, params: Dict[str, Any]
+    ) -> Tuple[str, Dict[str, Any]]:
         """
-        Load the topic object from a JSON file based on conversation parameters.
-        
+        Return the model and parameters of a stage of the turn, from the `model_routing` of the loaded topic.
+        A stage the topic does not route keeps the model and parameters it was given.
+
+        `model_routing` maps the stages (`routing`, `address_lookup`, `customer_response`, `order_answer`,
+        `rag_answer`) to a model deployment (`model`) and parameters overriding `llm_parameters`, such as
+        `max_tokens` or `temperature`:
+
+            model_routing:
+              routing: {model: gpt-4o-mini, max_tokens: 200}
+              rag_answer: {model: gpt-4o, max_tokens: 800}
+
+        Args:
+            stage (Optional[str]): The stage, None if the call has none.
+            model_name (str): The default model name.
+            params (Dict[str, Any]): The default parameters.
+
         Returns:
-            Dict[str, Any]: The loaded topic object.
+            Tuple[str, Dict[str, Any]]: The model name and parameters of the stage.
         """
-        persona_name: str = self.conversation_parameters["persona_name"]
-        topic_area: str = self.conversation_parameters["topic_area"]
-        topic_file: str = self.conversation_data["topic_name"] + ".yaml"
+        routes: Dict[str, Any] = self.topic_object.get("model_routing") or {}
+        route: Optional[Dict[str, Any]] = routes.get(stage) if stage else None
+        if not route:
+            return model_name, params
+        overrides: Dict[str, Any] = {name: value for name, value in route.items() if name != "model"}
+        return str(route.get("model") or model_name), {**params, **overrides}
 
-        path: str = os.path.join(
-            os.getcwd(),
-            "persona-" + persona_name,
-            "topic_area_" + topic_area,
-            topic_file,
-        )
+    def load_topic_object(self, topic_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Load the topic object from the TopicRegistry based on conversation parameters.
+        The topic object is shared and read-only, `copy.deepcopy` it to modify it.
 
-        with open(path, "r", encoding="utf-8") as file:
-            self.topic_object = yaml.safe_load(file)
+        Args:
+            topic_name (Optional[str]): The topic name. Defaults to the topic of the conversation data.
+
+        Returns:
+            Dict[str, Any]: The loaded topic object.
+        """
+        self.compiled_topic = TopicRegistry.get_topic(
+            self.conversation_parameters["persona_name"],
+            self.conversation_parameters["topic_area"],
+            topic_name or self.conversation_data["topic_name"],
+        )
+        self.topic_object = self.compiled_topic.topic_object
+        self.topic_path = self.compiled_topic.source
+        LMHelper._count("topic_loads")
 
         return self.topic_object
 
+    @staticmethod
+    def _count(name: str) -> None:
+        with LMHelper._counts_lock:
+            LMHelper._counts[name] += 1
+
+    @staticmethod
+    def get_counts() -> Dict[str, int]:
+        """
+        Returns the number of helpers created and of topics they loaded.
+        """
+        with LMHelper._counts_lock:
+            return dict(LMHelper._counts)
+
     def get_prompt_messages(self) -> List[Dict[str, str]]:
         """
         Construct the prompt messages for the language model based on the topic object and chat history.
@@ -117,7 +180,42 @@ class LMHelper(ABC):
         system_prompt: str = self.get_system_prompt_message()
         messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt}]
 
-        for chat in self.chat_history:
+        # Older turns may have been folded into a rolling summary, only the rest is sent verbatim
+        summary, chat_history = ConversationSummaryHelper.get_prompt_history(
+            self.conversation_data, self.chat_history  # type: ignore
+        )
+        if summary:
+            messages.append({"role": "system", "content": "Summary of the earlier conversation:\n" + summary})
+
+        # The turns folded into the summary are skipped before they are normalized
+        folded: int = len(self.chat_history) - len(chat_history)
+        messages.extend(self.get_history_messages(self.chat_history, folded))
+        messages.append({"role": "user", "content": self.query})
+
+        return messages
+
+    def get_history_messages(
+        self, chat_history: List[Dict[str, Any]], skipped_turns: int = 0
+    ) -> List[Dict[str, str]]:
+        """
+        Build the user and assistant messages of the chat history, from the conversation's prompt
+        message cache when the custom connection configs enable it, see PromptMessageCache.
+
+        Args:
+            chat_history (List[Dict[str, Any]]): The chat history.
+            skipped_turns (int): Number of turns left out at the start of the history, the turns
+                folded into the summary. Only the cache, which matches the whole history, sees them.
+
+        Returns:
+            List[Dict[str, str]]: Two messages per turn not skipped.
+        """
+        if PromptMessageCache.is_enabled(self.custom_connections.configs, len(chat_history)):
+            return PromptMessageCache.get_messages(
+                self.conversation_parameters["conversation_id"], chat_history, self.get_assistant_message
+            )[2 * skipped_turns:]
+
+        messages: List[Dict[str, str]] = []
+        for chat in chat_history[skipped_turns:]:
             messages.append({"role": "user", "content": chat["inputs"]["query"]})  # type: ignore
             messages.append(
                 {
@@ -127,12 +225,10 @@ class LMHelper(ABC):
                     ),
                 }
             )
-
-        messages.append({"role": "user", "content": self.query})
-
         return messages
 
-    def get_assistant_message(self, msg: str) -> str:
+    @staticmethod
+    def get_assistant_message(msg: str) -> str:
         """
         Retrieve the assistant's message from chat history, handling any JSON formatting.
         
@@ -146,7 +242,7 @@ class LMHelper(ABC):
             return msg
 
         try:
-            json_msg: Dict[str, Any] = json.loads(msg)
+            json_msg: Dict[str, Any] = serialization.loads(msg)
             if "response_items" in json_msg:
                 response_items = json_msg.get("response_items", [])
                 response_item = next(
@@ -158,7 +254,7 @@ class LMHelper(ABC):
 
             return msg
 
-        except json.JSONDecodeError as e:
+        except serialization.JSONDecodeError as e:
             logging.error("Error logging invalid PF parameters: %s, msg: %s", e, msg)
             return msg
 
@@ -172,7 +268,7 @@ class LMHelper(ABC):
         system_prompt: str = self.topic_object["systemPrompt"] + " \n"
         system_prompt += "Only use the functions you have been provided with. \n"
         system_prompt += "Known details for each function can be found in the JSON object provided. \n"
-        system_prompt += json.dumps(self.conversation_data) + " \n\n"
+        system_prompt += serialization.dumps(ConversationDataHelper.get_prompt_data(self.conversation_data)) + " \n\n"
         system_prompt += self.get_safety_prompt() + " \n\n"
         system_prompt += (
             "Your response must be in the language defined by the locale `"
@@ -184,12 +280,11 @@ class LMHelper(ABC):
 
     def get_safety_prompt(self) -> str:
         """
-        Retrieve the content safety system prompt from a file.
+        Retrieve the content safety system prompt from the flow bundle or its file.
         
         Returns:
             str: The content safety system prompt.
         """
-        with open("content_safety_system_prompt.txt", "r", encoding="utf-8") as file:
-            data = file.read()
-
-        return data
+        if self.bundle is not None:
+            return self.bundle.content_safety_prompt
+        return ConfigFileCache.load_text("content_safety_system_prompt.txt")
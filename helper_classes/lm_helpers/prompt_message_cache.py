@@ -0,0 +1,266 @@
+"""
+Module prompt_message_cache
+This module provides the PromptMessageCache class, which keeps the normalized prompt messages of
+each conversation's chat history so a turn only normalizes the turns added since the previous one.
+
+Classes:
+    PromptMessageCache: Per-conversation cache of the user and assistant messages of the chat history.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from helper_classes import metrics, serialization
+
+
+class _CachedHistory:
+    """
+    The cached messages of a conversation: two messages per turn, the hash of the chat history up
+    to each turn, the running digest of the history after the last cached turn and the in-process
+    hash of each turn. Turns loaded from the file have no in-process hash and no messages, only
+    their stored answer in `loaded`, until they are matched with the incoming history.
+    """
+
+    def __init__(self):
+        self.hashes: List[str] = []
+        self.keys: List[Optional[int]] = []
+        self.messages: List[Dict[str, str]] = []
+        self.loaded: List[str] = []
+        self.digest: Any = hashlib.sha256()
+        self.lock: threading.Lock = threading.Lock()
+
+
+class PromptMessageCache:
+    """
+    Per-conversation cache of the user and assistant messages built from the chat history.
+
+    Building the messages of a turn normalizes every past answer (`LMHelper.get_assistant_message`
+    parses the JSON answers), so its cost grows with the history. The cache keeps the messages of
+    the turns already seen. A turn finds the longest prefix of the incoming chat history the cache
+    still matches, drops the cached turns past it (a retried or edited turn) and only normalizes the
+    turns after it, usually the last one.
+
+    Turns seen by the process are matched by their in-process hash. Turns loaded from the file are
+    matched by the hash of the history up to them: a running sha256 of the queries and answers, so
+    the history loaded is verified with a single digest, and turn by turn only if it differs.
+
+    The cache is stored with the conversation state, in `chats/_prompt_cache/<conversation_id>.tsv`,
+    one line appended per turn, so a turn served by another worker loads it instead of normalizing
+    the history again. The most recently used conversations are also kept in memory, up to
+    `PROMPT_CACHE_MAX_CONVERSATIONS` (default 1024).
+
+    Configured through the custom connection configs:
+        prompt_cache: `on` (default) or `off`.
+        prompt_cache_min_turns: Shorter histories are rebuilt without the cache. Defaults to 20.
+    """
+
+    DIRECTORY: str = "_prompt_cache"
+
+    _entries: "OrderedDict[str, _CachedHistory]" = OrderedDict()
+    _lock: threading.Lock = threading.Lock()
+    _metrics: Dict[str, int] = {"turns_reused": 0, "turns_normalized": 0, "truncations": 0, "loads": 0}
+
+    @staticmethod
+    def is_enabled(configs: Dict[str, Any], turns: int) -> bool:
+        """
+        Returns whether the custom connection configs enable the cache for a history of `turns` turns.
+        """
+        return str(configs.get("prompt_cache", "on")).lower() != "off" and turns >= int(
+            configs.get("prompt_cache_min_turns", 20)
+        )
+
+    @staticmethod
+    def get_path(conversation_id: str, chat_path: Optional[str] = None) -> str:
+        chat_path = chat_path or os.path.join(os.getcwd(), "chats")
+        return os.path.join(chat_path, PromptMessageCache.DIRECTORY, conversation_id + ".tsv")
+
+    @staticmethod
+    def update_digest(digest: Any, query: str, answer: str) -> None:
+        digest.update(f"{query}\x1f{answer}\x1e".encode("utf-8"))
+
+    @staticmethod
+    def get_messages(
+        conversation_id: str,
+        chat_history: List[Dict[str, Any]],
+        normalize_answer: Callable[[str], str],
+        chat_path: Optional[str] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        Returns the user and assistant messages of a chat history, from the cache for the turns it
+        already holds.
+
+        Args:
+            conversation_id (str): The conversation id.
+            chat_history (List[Dict[str, Any]]): The incoming chat history.
+            normalize_answer (Callable[[str], str]): Converts an answer into the assistant message.
+            chat_path (Optional[str]): The chats directory, defaults to `chats` in the working directory.
+
+        Returns:
+            List[Dict[str, str]]: Two messages per turn. The messages are shared, do not modify them.
+        """
+        path: str = PromptMessageCache.get_path(conversation_id, chat_path)
+        entry: _CachedHistory = PromptMessageCache._get_entry(conversation_id, path)
+        turns: List[Any] = [(turn["inputs"]["query"], str(turn["outputs"]["answer"])) for turn in chat_history]
+
+        with entry.lock:
+            matched: int = PromptMessageCache._match_loaded(entry, turns)
+            while matched < min(len(entry.keys), len(turns)) and entry.keys[matched] == hash(turns[matched]):
+                matched += 1
+
+            truncated: bool = matched < len(entry.hashes)
+            if truncated:
+                del entry.hashes[matched:]
+                del entry.keys[matched:]
+                del entry.messages[2 * matched:]
+                entry.digest = hashlib.sha256()
+                for query, answer in turns[:matched]:
+                    PromptMessageCache.update_digest(entry.digest, query, answer)
+
+            added: List[str] = []
+            for query, answer in turns[matched:]:
+                content: str = normalize_answer(answer)
+                PromptMessageCache.update_digest(entry.digest, query, answer)
+                entry.hashes.append(entry.digest.hexdigest())
+                entry.keys.append(hash((query, answer)))
+                entry.messages.append({"role": "user", "content": query})
+                entry.messages.append({"role": "assistant", "content": content})
+                # The normalized answer is only stored when it differs from the answer
+                added.append(entry.hashes[-1] + "\t" + (serialization.dumps(content) if content != answer else "") + "\n")
+
+            if truncated or added:
+                PromptMessageCache._persist(path, entry, added, truncated)
+            messages: List[Dict[str, str]] = entry.messages[: 2 * len(turns)]  # type: ignore
+
+        PromptMessageCache._count(turns_reused=matched, turns_normalized=len(added), truncations=int(truncated))
+        metrics.CACHE_REQUESTS.inc(matched, cache="prompt_messages", result="turns_reused")
+        metrics.CACHE_REQUESTS.inc(len(added), cache="prompt_messages", result="turns_normalized")
+        return messages
+
+    @staticmethod
+    def _match_loaded(entry: _CachedHistory, turns: List[Any]) -> int:
+        """
+        Matches the turns loaded from the file, at the start of the cache, with the incoming history
+        and completes their messages. Must be called with the entry lock held.
+
+        Returns:
+            int: The number of loaded turns matched.
+        """
+        loaded: int = len(entry.loaded)
+        if not loaded:
+            return 0
+
+        digest: Any = hashlib.sha256()
+        for query, answer in turns[:loaded]:
+            PromptMessageCache.update_digest(digest, query, answer)
+        if len(turns) >= loaded and digest.hexdigest() == entry.hashes[loaded - 1]:
+            matched: int = loaded
+        else:
+            # The history changed: the longest prefix is found turn by turn
+            digest = hashlib.sha256()
+            matched = 0
+            for query, answer in turns[:loaded]:
+                PromptMessageCache.update_digest(digest, query, answer)
+                if digest.hexdigest() != entry.hashes[matched]:
+                    break
+                matched += 1
+
+        for index in range(matched):
+            query, answer = turns[index]
+            stored: str = entry.loaded[index]
+            entry.keys[index] = hash((query, answer))
+            entry.messages.append({"role": "user", "content": query})
+            entry.messages.append({"role": "assistant", "content": serialization.loads(stored) if stored else answer})
+        # The loaded turns not matched are dropped by the caller
+        entry.loaded = []
+        if matched == len(entry.hashes):
+            entry.digest = digest
+        return matched
+
+    @staticmethod
+    def _get_entry(conversation_id: str, path: str) -> _CachedHistory:
+        """
+        Returns the in-memory entry of a conversation, loading it from its file on a miss.
+        """
+        with PromptMessageCache._lock:
+            entry: Optional[_CachedHistory] = PromptMessageCache._entries.get(conversation_id)
+            if entry is not None:
+                PromptMessageCache._entries.move_to_end(conversation_id)
+                return entry
+            # Locked before it is shared, so no turn sees it before it is loaded
+            entry = _CachedHistory()
+            entry.lock.acquire()
+            PromptMessageCache._entries[conversation_id] = entry
+            max_entries: int = int(os.environ.get("PROMPT_CACHE_MAX_CONVERSATIONS", "1024"))
+            while len(PromptMessageCache._entries) > max_entries:
+                PromptMessageCache._entries.popitem(last=False)
+
+        try:
+            PromptMessageCache._load(path, entry)
+        finally:
+            entry.lock.release()
+        return entry
+
+    @staticmethod
+    def _load(path: str, entry: _CachedHistory) -> None:
+        """
+        Loads the cached turns from a conversation's file. A line holds the hash of the history up
+        to the turn and its normalized answer as JSON, empty when it is the answer itself; the
+        messages of the loaded turns are completed from the incoming history once matched.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                lines: List[str] = [line for line in file if line.endswith("\n")]
+            for line in lines:
+                turn_hash, content = line[:-1].split("\t", 1)
+                entry.hashes.append(turn_hash)
+                entry.loaded.append(content)
+            entry.keys = [None] * len(entry.hashes)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error("Prompt message cache unreadable", extra={"path": path, "error": str(e)})
+            entry.hashes.clear()
+            entry.loaded.clear()
+            return
+        PromptMessageCache._count(loads=1)
+
+    @staticmethod
+    def _persist(path: str, entry: _CachedHistory, added: List[str], truncated: bool) -> None:
+        """
+        Appends the added turns to a conversation's file, or rewrites it after a truncation.
+        """
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if truncated:
+                kept: List[str] = [
+                    turn_hash + "\t" + serialization.dumps(entry.messages[2 * index + 1]["content"]) + "\n"
+                    for index, turn_hash in enumerate(entry.hashes[: len(entry.hashes) - len(added)])
+                ]
+                temp_path: str = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as file:
+                    file.writelines(kept + added)
+                os.replace(temp_path, path)
+            else:
+                with open(path, "a", encoding="utf-8") as file:
+                    file.write("".join(added))
+        except OSError as e:
+            logging.error("Prompt message cache not saved", extra={"path": path, "error": str(e)})
+
+    @staticmethod
+    def _count(**counts: int) -> None:
+        with PromptMessageCache._lock:
+            for name, count in counts.items():
+                PromptMessageCache._metrics[name] += count
+
+    @staticmethod
+    def get_metrics() -> Dict[str, int]:
+        """
+        Returns the number of turns whose messages were reused and normalized, of caches truncated
+        by a changed history, and of caches loaded from their file.
+        """
+        with PromptMessageCache._lock:
+            return {**PromptMessageCache._metrics, "conversations": len(PromptMessageCache._entries)}
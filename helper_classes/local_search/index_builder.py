@@ -0,0 +1,230 @@
+"""
+Offline builder of the local search indexes served by the `local` AI search backend.
+
+Reads the documents of a JSON Lines or JSON file (one object per document, with the text to index
+in the content field) and writes the memory-mapped index described in `local_search_index`.
+Document vectors are computed with the local hashing embedder, unless the documents carry their
+own vectors (`--vector-field`), e.g. exported from an Azure AI Search index, in which case queries
+are embedded with the Azure OpenAI deployment given by `--embedding-model`.
+
+Usage:
+    python -m helper_classes.local_search.index_builder documents.jsonl search_indexes/hikingproducts \
+        [--content-field chunk] [--dims 256] [--ivf-lists 0]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from helper_classes.local_search.local_search_index import FORMAT_VERSION
+from helper_classes.local_search.text_analysis import AzureOpenAIEmbedder, Embedder, HashingEmbedder, tokenize
+
+
+def load_documents(path: str) -> List[Dict[str, Any]]:
+    """
+    Loads the documents of a JSON Lines file, or of a JSON file holding a list or a `value` list
+    as returned by Azure AI Search.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        List[Dict[str, Any]]: The documents.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in file if line.strip()]
+        data: Any = json.load(file)
+    return data["value"] if isinstance(data, dict) else data
+
+
+def offsets(sizes: List[int]) -> np.ndarray:
+    """
+    Returns the start offsets of consecutive items of the given sizes, followed by the total size.
+    """
+    return np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64)
+
+
+def kmeans(vectors: np.ndarray, lists: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Clusters normalized vectors by cosine similarity (spherical k-means).
+
+    Args:
+        vectors (np.ndarray): The normalized vectors.
+        lists (int): The number of clusters.
+        iterations (int): The number of iterations.
+        seed (int): The seed of the initial centroids.
+
+    Returns:
+        np.ndarray: The cluster of each vector.
+    """
+    rng = np.random.default_rng(seed)
+    centroids: np.ndarray = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+    assignments: np.ndarray = np.zeros(len(vectors), dtype=np.int32)
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+        for cluster in range(lists):
+            members: np.ndarray = vectors[assignments == cluster]
+            if len(members):
+                centroid: np.ndarray = members.sum(axis=0)
+                centroids[cluster] = centroid / max(float(np.linalg.norm(centroid)), 1e-12)
+    return assignments
+
+
+def build_index(
+    documents: List[Dict[str, Any]],
+    output: str,
+    content_field: str = "chunk",
+    embedder: Optional[Embedder] = None,
+    vector_field: Optional[str] = None,
+    ivf_lists: int = 0,
+    k1: float = 1.2,
+    b: float = 0.75,
+) -> Dict[str, Any]:
+    """
+    Builds an index and replaces the one in the output directory, if any.
+
+    Args:
+        documents (List[Dict[str, Any]]): The documents.
+        output (str): The index directory.
+        content_field (str): The field holding the text to index.
+        embedder (Optional[Embedder]): The embedder of the documents and queries, the hashing
+            embedder by default.
+        vector_field (Optional[str]): The field holding precomputed document vectors, if any.
+        ivf_lists (int): The number of IVF lists, 0 for brute-force vector search only.
+        k1 (float): The BM25 term frequency saturation.
+        b (float): The BM25 document length normalization.
+
+    Returns:
+        Dict[str, Any]: The index metadata.
+
+    Raises:
+        ValueError: If a document has no content.
+    """
+    embedder = embedder or HashingEmbedder()
+    vocabulary: Dict[str, int] = {}
+    postings: List[List[List[float]]] = []
+    lengths: List[int] = []
+    texts: List[str] = []
+    for doc_id, document in enumerate(documents):
+        text: Any = document.get(content_field)
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError(f"Document {doc_id} has no '{content_field}' text")
+        texts.append(text)
+        terms: List[str] = tokenize(text)
+        lengths.append(len(terms))
+        for term, count in Counter(terms).items():
+            term_id: int = vocabulary.setdefault(term, len(vocabulary))
+            if term_id == len(postings):
+                postings.append([])
+            postings[term_id].append([doc_id, count])
+
+    num_docs: int = len(documents)
+    flat: List[List[float]] = [posting for term_postings in postings for posting in term_postings]
+    document_frequencies: np.ndarray = np.array([len(term_postings) for term_postings in postings], dtype=np.float32)
+    arrays: Dict[str, np.ndarray] = {
+        "document_lengths": np.array(lengths, dtype=np.int32),
+        "term_offsets": offsets([len(term_postings) for term_postings in postings]),
+        "postings_docs": np.array([doc for doc, _ in flat], dtype=np.int32),
+        "postings_tfs": np.array([tf for _, tf in flat], dtype=np.float32),
+        # BM25+ style idf, never negative for terms occurring in most documents
+        "idf": np.log1p((num_docs - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32),
+    }
+
+    if vector_field:
+        vectors: np.ndarray = np.array([document[vector_field] for document in documents], dtype=np.float32)
+        arrays["vectors"] = Embedder.normalize(vectors)
+    else:
+        arrays["vectors"] = embedder.embed(texts) if texts else np.zeros((0, embedder.dims), dtype=np.float32)
+
+    ivf_lists = min(ivf_lists, num_docs)
+    if ivf_lists:
+        assignments: np.ndarray = kmeans(arrays["vectors"], ivf_lists)
+        order: np.ndarray = np.argsort(assignments, kind="stable")
+        centroids: np.ndarray = np.zeros((ivf_lists, arrays["vectors"].shape[1]), dtype=np.float32)
+        for cluster in range(ivf_lists):
+            centroids[cluster] = arrays["vectors"][assignments == cluster].sum(axis=0)
+        arrays["ivf_centroids"] = Embedder.normalize(centroids)
+        arrays["ivf_offsets"] = offsets(np.bincount(assignments, minlength=ivf_lists).tolist())
+        arrays["ivf_docs"] = order.astype(np.int32)
+
+    # Vectors are stored once, in their own array
+    stored: List[bytes] = [
+        json.dumps({key: value for key, value in document.items() if key != vector_field}, ensure_ascii=False)
+        .encode("utf-8")
+        for document in documents
+    ]
+    arrays["document_offsets"] = offsets([len(item) for item in stored])
+
+    meta: Dict[str, Any] = {
+        "format_version": FORMAT_VERSION,
+        "num_docs": num_docs,
+        "content_field": content_field,
+        "bm25": {"k1": k1, "b": b, "avg_doc_length": float(np.mean(lengths)) if lengths else 0.0},
+        "embedder": embedder.describe(),
+        "ivf_lists": ivf_lists,
+        "vocabulary": vocabulary,
+    }
+
+    # Written next to the output and swapped in, so serving processes never see a partial index
+    parent: str = os.path.dirname(os.path.abspath(output))
+    os.makedirs(parent, exist_ok=True)
+    staging: str = tempfile.mkdtemp(dir=parent, prefix=".index-")
+    with open(os.path.join(staging, "documents.bin"), "wb") as file:
+        file.write(b"".join(stored))
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+    with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file, ensure_ascii=False)
+
+    previous: Optional[str] = None
+    if os.path.exists(output):
+        previous = tempfile.mkdtemp(dir=parent, prefix=".index-old-")
+        os.rename(output, os.path.join(previous, "index"))
+    os.rename(staging, output)
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+
+    logging.info(
+        "Local search index built",
+        extra={"path": output, "num_docs": num_docs, "num_terms": len(vocabulary), "ivf_lists": ivf_lists},
+    )
+    return meta
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("documents", help="JSON Lines or JSON file of the documents")
+    parser.add_argument("output", help="index directory, e.g. search_indexes/<index_name>")
+    parser.add_argument("--content-field", default="chunk", help="field holding the text to index")
+    parser.add_argument("--dims", type=int, default=256, help="dimensions of the hashing embedder")
+    parser.add_argument("--vector-field", help="field holding precomputed document vectors")
+    parser.add_argument("--embedding-model", help="Azure OpenAI embeddings deployment of the precomputed vectors")
+    parser.add_argument("--ivf-lists", type=int, default=0, help="number of IVF lists, 0 for brute force")
+    args = parser.parse_args(argv)
+
+    documents: List[Dict[str, Any]] = load_documents(args.documents)
+    embedder: Embedder = HashingEmbedder(args.dims)
+    if args.vector_field:
+        if not args.embedding_model:
+            parser.error("--vector-field needs --embedding-model to embed the queries")
+        dims: int = len(documents[0][args.vector_field]) if documents else 0
+        embedder = AzureOpenAIEmbedder(None, args.embedding_model, dims)
+
+    meta: Dict[str, Any] = build_index(
+        documents, args.output, args.content_field, embedder, args.vector_field, args.ivf_lists
+    )
+    print(f"{args.output}: {meta['num_docs']} documents, {len(meta['vocabulary'])} terms, {meta['ivf_lists']} lists")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
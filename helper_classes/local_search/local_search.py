@@ -0,0 +1,171 @@
+"""
+This module provides the local hybrid search backend, an in-process alternative to Azure AI Search.
+
+A topic selects it with `backend: local` in its `ai_search` block. The index is read from
+`index_details.path`, by default `search_indexes/<index_name>` under the flow directory, and is
+built offline with `python -m helper_classes.local_search.index_builder`.
+
+Classes:
+    LocalSearchResponse: The response of a local search, shaped like the Azure AI Search response.
+    LocalSearch: Runs BM25 and vector search on a local index and fuses them with RRF.
+"""
+
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from helper_classes import serialization
+from helper_classes.local_search.local_search_index import LocalSearchIndex
+from helper_classes.local_search.rank_fusion import DEFAULT_RRF_K
+from helper_classes.local_search.text_analysis import Embedder
+
+
+class LocalSearchResponse:
+    """
+    The response of a local search, with the `status_code`, `reason`, `content` and `text` the
+    callers of `AiSearch.execute` read from a `requests.Response`.
+    """
+
+    def __init__(self, status_code: int, body: Dict[str, Any], reason: str = "OK"):
+        self.status_code: int = status_code
+        self.reason: str = reason
+        self.body: Dict[str, Any] = body
+
+    @property
+    def content(self) -> bytes:
+        return serialization.dumps_bytes(self.body)
+
+    @property
+    def text(self) -> str:
+        return serialization.dumps(self.body)
+
+    def json(self) -> Dict[str, Any]:
+        return self.body
+
+
+class LocalSearch:
+    """
+    Runs BM25 and vector search on a local index and fuses them with reciprocal rank fusion. Takes
+    the `ai_search` configuration of the topic, like `AiSearch`, and returns the same result fields:
+    the selected fields of each document, `@search.score` (the fused score, which orders the results)
+    and `@search.rerankerScore`, a relevance on the 0 to 4 range of the semantic reranker, so
+    `min_reranker_score` filters unrelated results. The fused score only reflects ranks, the best
+    result of any query is ranked first; the relevance is the greater of:
+
+        lexical: how much of the query the document covers (`LocalSearchIndex.lexical_relevance`);
+        semantic: the cosine similarity of the document above the similarity floor of the embedder,
+            scaled to 0 to 1.
+
+    4 means the document contains every content term of the query, or has the same vector.
+
+    Parameters read from `ai_search.parameters`:
+        k: Number of results (default 5).
+        select: Comma-separated fields returned for each document (default content).
+        candidates: Number of results of each retriever fed to the fusion (default 50).
+        nprobe: Number of IVF lists scanned by vector search, 0 for all (default 8).
+        rrf_k: The RRF constant (default 60).
+        vector_search: False for BM25 only (default true).
+        similarity_floor: The similarity below which a document is unrelated to the query (default
+            the `similarity_floor` of the embedder of the index).
+    """
+
+    def __init__(
+        self,
+        conversation_data: Dict[str, Any],
+        conversation_parameters: Dict[str, Any],
+        ai_search_config: Dict[str, Any],
+        custom_connections: Optional[Any] = None,
+        query: Optional[str] = None,
+    ):
+        self.conversation_data = conversation_data
+        self.query: str = query or conversation_data["arguments"]["query"]
+        self.conversation_parameters = conversation_parameters
+        self.index_details = ai_search_config["index_details"]
+        self.search_params = ai_search_config["parameters"]
+        self.custom_connections = custom_connections
+
+    def get_index_path(self) -> str:
+        """
+        Returns the directory of the index.
+
+        Returns:
+            str: The index directory.
+        """
+        default_path: str = os.path.join("search_indexes", self.index_details["index_name"])
+        return self.index_details.get("path") or default_path
+
+    def execute(self) -> LocalSearchResponse:
+        """
+        Searches the index with the query.
+
+        Returns:
+            LocalSearchResponse: The results, or a 404 or 500 response if the index is missing or
+                the search fails.
+        """
+        query: str = self.query
+        chunk_count: int = int(self.search_params.get("k", 5))
+        select: List[str] = [field.strip() for field in self.search_params.get("select", "content").split(",")]
+        rrf_k: int = int(self.search_params.get("rrf_k", DEFAULT_RRF_K))
+        use_vectors: bool = bool(self.search_params.get("vector_search", True))
+
+        log_data: Dict[str, Any] = {
+            "session_id": str(self.conversation_parameters.get("session_id")),
+            "conversation_id": str(self.conversation_parameters.get("conversation_id")),
+            "index_path": self.get_index_path(),
+            "query": query,
+        }
+        start: float = time.perf_counter()
+        try:
+            index: LocalSearchIndex = LocalSearchIndex.open(self.get_index_path())
+        except FileNotFoundError:
+            logging.info("Local search index not found", extra={**log_data, "success": False})
+            return LocalSearchResponse(404, {"error": {"message": "Index not found"}}, "Not Found")
+
+        try:
+            query_vector = None
+            similarity_floor: float = 0.0
+            if use_vectors:
+                embedder: Embedder = index.create_embedder(self.custom_connections)
+                query_vector = embedder.embed([query])[0]
+                similarity_floor = float(
+                    self.search_params.get("similarity_floor", embedder.similarity_floor)
+                )
+            results: List[Dict[str, Any]] = index.hybrid_search(
+                query,
+                query_vector,
+                chunk_count,
+                candidates=int(self.search_params.get("candidates", 50)),
+                nprobe=int(self.search_params.get("nprobe", 8)),
+                rrf_k=rrf_k,
+            )
+        except Exception as e:
+            logging.info("Local search failed", extra={**log_data, "success": False, "error_message": str(e)})
+            return LocalSearchResponse(500, {"error": {"message": str(e)}}, "Internal Server Error")
+
+        lexical: List[float] = index.lexical_relevance(query, [result["doc_id"] for result in results])
+        value: List[Dict[str, Any]] = []
+        for result, lexical_relevance in zip(results, lexical):
+            semantic_relevance: float = 0.0
+            if query_vector is not None:
+                similarity: float = result["vector_score"]
+                if similarity is None:
+                    similarity = index.similarity(result["doc_id"], query_vector)
+                semantic_relevance = max(0.0, (similarity - similarity_floor) / (1.0 - similarity_floor))
+            document: Dict[str, Any] = index.get_document(result["doc_id"])
+            item: Dict[str, Any] = {field: document.get(field) for field in select}
+            item["@search.score"] = result["score"]
+            relevance: float = min(1.0, max(lexical_relevance, semantic_relevance))
+            item["@search.rerankerScore"] = round(4.0 * relevance, 4)
+            value.append(item)
+
+        logging.info(
+            "Execution completed",
+            extra={
+                **log_data,
+                "success": True,
+                "results": len(value),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+            },
+        )
+        return LocalSearchResponse(200, {"value": value})
@@ -0,0 +1,318 @@
+"""
+This module provides the memory-mapped index of the local search backend.
+
+An index is a directory written by `index_builder`:
+    meta.json            Format version, document count, BM25 parameters, embedder and vocabulary.
+    documents.bin        The documents, as concatenated UTF-8 JSON objects.
+    document_offsets.npy Offsets of the documents in documents.bin (num_docs + 1).
+    document_lengths.npy Number of terms of each document.
+    term_offsets.npy     Offsets of the postings of each term (num_terms + 1), CSR style.
+    postings_docs.npy    Document ids of the postings, by term.
+    postings_tfs.npy     Term frequencies of the postings, by term.
+    idf.npy              BM25 inverse document frequency of each term.
+    vectors.npy          L2-normalized document vectors (num_docs, dims).
+    ivf_centroids.npy    Optional IVF centroids (lists, dims).
+    ivf_offsets.npy      Optional offsets of the IVF lists (lists + 1).
+    ivf_docs.npy         Optional document ids, by IVF list.
+
+The arrays are opened with `mmap_mode="r"`, so processes serving the same index share its pages
+through the page cache and opening an index costs nothing but the vocabulary.
+
+Classes:
+    LocalSearchIndex: A read-only BM25 and vector index.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from helper_classes.local_search.rank_fusion import DEFAULT_RRF_K, reciprocal_rank_fusion
+from helper_classes.local_search.text_analysis import Embedder, content_terms, create_embedder, tokenize
+
+FORMAT_VERSION = 1
+
+
+class LocalSearchIndex:
+    """
+    A read-only BM25 and vector index, memory-mapped from the files written by `index_builder`.
+    """
+
+    _cache: Dict[str, "LocalSearchIndex"] = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        """
+        Opens an index.
+
+        Args:
+            path (str): The index directory.
+
+        Raises:
+            FileNotFoundError: If the directory holds no index.
+            ValueError: If the index has an unsupported format version.
+        """
+        self.path: str = path
+        meta_path: str = os.path.join(path, "meta.json")
+        with open(meta_path, "r", encoding="utf-8") as file:
+            self.meta: Dict[str, Any] = json.load(file)
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported local search index format {self.meta.get('format_version')}: {path}")
+        self.mtime: float = os.path.getmtime(meta_path)
+
+        self.num_docs: int = self.meta["num_docs"]
+        self.k1: float = self.meta["bm25"]["k1"]
+        self.b: float = self.meta["bm25"]["b"]
+        self.avg_doc_length: float = self.meta["bm25"]["avg_doc_length"]
+        self.vocabulary: Dict[str, int] = self.meta["vocabulary"]
+
+        self.document_offsets: np.ndarray = self._load("document_offsets")
+        self.document_lengths: np.ndarray = self._load("document_lengths")
+        self.term_offsets: np.ndarray = self._load("term_offsets")
+        self.postings_docs: np.ndarray = self._load("postings_docs")
+        self.postings_tfs: np.ndarray = self._load("postings_tfs")
+        self.idf: np.ndarray = self._load("idf")
+        self.vectors: np.ndarray = self._load("vectors")
+        has_ivf: bool = bool(self.meta.get("ivf_lists"))
+        self.ivf_centroids: Optional[np.ndarray] = self._load("ivf_centroids") if has_ivf else None
+        self.ivf_offsets: Optional[np.ndarray] = self._load("ivf_offsets") if has_ivf else None
+        self.ivf_docs: Optional[np.ndarray] = self._load("ivf_docs") if has_ivf else None
+        # np.memmap cannot map an empty file
+        self._documents: Optional[np.memmap] = (
+            np.memmap(os.path.join(path, "documents.bin"), dtype=np.uint8, mode="r") if self.num_docs else None
+        )
+
+        # Document length normalization of BM25, which only depends on the document
+        relative_lengths: np.ndarray = np.asarray(self.document_lengths, dtype=np.float32) / max(self.avg_doc_length, 1e-9)
+        self.length_norms: np.ndarray = self.k1 * (1.0 - self.b + self.b * relative_lengths)
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    @staticmethod
+    def open(path: str) -> "LocalSearchIndex":
+        """
+        Returns the index in a directory, opened once per process and reopened when it is rebuilt.
+        While `index_builder` swaps in a rebuilt index the directory is briefly missing, the index
+        already open keeps being served.
+
+        Args:
+            path (str): The index directory.
+
+        Returns:
+            LocalSearchIndex: The index.
+
+        Raises:
+            FileNotFoundError: If the directory holds no index and none was opened before.
+        """
+        path = os.path.abspath(path)
+        with LocalSearchIndex._cache_lock:
+            index: Optional[LocalSearchIndex] = LocalSearchIndex._cache.get(path)
+            try:
+                mtime: float = os.path.getmtime(os.path.join(path, "meta.json"))
+                if index is None or index.mtime != mtime:
+                    index = LocalSearchIndex(path)
+                    LocalSearchIndex._cache[path] = index
+                    logging.info(
+                        "Local search index opened",
+                        extra={"path": path, "num_docs": index.num_docs, "num_terms": len(index.vocabulary)},
+                    )
+            except FileNotFoundError:
+                if index is None:
+                    raise
+                # The arrays of the open index stay mapped after its files are removed
+                logging.info("Local search index being replaced, serving the open one", extra={"path": path})
+            return index
+
+    def create_embedder(self, custom_connections: Optional[Any] = None) -> Embedder:
+        """
+        Creates the embedder the document vectors were built with, to embed queries.
+
+        Args:
+            custom_connections (Optional[Any]): The custom connection, required by the Azure OpenAI embedder.
+
+        Returns:
+            Embedder: The embedder.
+        """
+        return create_embedder(self.meta["embedder"], custom_connections)
+
+    def get_document(self, doc_id: int) -> Dict[str, Any]:
+        """
+        Returns a document.
+
+        Args:
+            doc_id (int): The document id, its position in the index.
+
+        Returns:
+            Dict[str, Any]: The document fields.
+        """
+        start, end = int(self.document_offsets[doc_id]), int(self.document_offsets[doc_id + 1])
+        return json.loads(bytes(self._documents[start:end]).decode("utf-8"))
+
+    @staticmethod
+    def top_k(scores: np.ndarray, doc_ids: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """
+        Returns the k best scored documents, best first, ignoring those scored 0 or less.
+
+        Args:
+            scores (np.ndarray): The scores.
+            doc_ids (np.ndarray): The document id of each score.
+            k (int): The number of documents.
+
+        Returns:
+            List[Tuple[int, float]]: The document ids and scores.
+        """
+        if k < len(scores):
+            candidates: np.ndarray = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(doc_ids[i]), float(scores[i])) for i in candidates if scores[i] > 0.0]
+
+    def bm25_search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Scores the documents containing query terms with BM25, one vectorized pass per query term.
+
+        Args:
+            query (str): The query.
+            k (int): The number of results.
+
+        Returns:
+            List[Tuple[int, float]]: The document ids and BM25 scores, best first.
+        """
+        terms: List[str] = tokenize(query)
+        term_ids: List[int] = sorted({self.vocabulary[term] for term in terms if term in self.vocabulary})
+        if not term_ids:
+            return []
+
+        scores: np.ndarray = np.zeros(self.num_docs, dtype=np.float32)
+        for term_id in term_ids:
+            start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+            docs: np.ndarray = self.postings_docs[start:end]
+            tfs: np.ndarray = self.postings_tfs[start:end]
+            # A term occurs at most once in the postings of a document, so plain fancy indexing accumulates
+            scores[docs] += self.idf[term_id] * tfs * (self.k1 + 1.0) / (tfs + self.length_norms[docs])
+
+        matched: np.ndarray = np.flatnonzero(scores)
+        return self.top_k(scores[matched], matched, k)
+
+    def vector_search(self, query_vector: np.ndarray, k: int, nprobe: int = 0) -> List[Tuple[int, float]]:
+        """
+        Returns the documents most similar to a query vector, by cosine similarity.
+
+        Args:
+            query_vector (np.ndarray): The normalized query vector.
+            k (int): The number of results.
+            nprobe (int): The number of IVF lists to scan, if the index has any; 0 scans every document.
+
+        Returns:
+            List[Tuple[int, float]]: The document ids and similarities, best first.
+        """
+        if not self.num_docs:
+            return []
+        if nprobe and self.ivf_centroids is not None and nprobe < len(self.ivf_centroids):
+            lists: np.ndarray = np.argpartition(-(self.ivf_centroids @ query_vector), nprobe - 1)[:nprobe]
+            candidates: np.ndarray = np.concatenate(
+                [self.ivf_docs[int(self.ivf_offsets[i]):int(self.ivf_offsets[i + 1])] for i in lists]
+            )
+            return self.top_k(self.vectors[candidates] @ query_vector, candidates, k)
+        return self.top_k(self.vectors @ query_vector, np.arange(self.num_docs), k)
+
+    def lexical_relevance(self, query: str, doc_ids: List[int]) -> List[float]:
+        """
+        Returns how much of a query each document covers, between 0 and 1, independently of the other
+        results: the BM25 score of the document over the content terms of the query, divided by the
+        score of a document of average length containing each of them once (the sum of their idf).
+        Terms missing from the index weigh as much as the rarest term, so a query about something
+        the index does not hold scores close to 0.
+
+        Args:
+            query (str): The query.
+            doc_ids (List[int]): The documents.
+
+        Returns:
+            List[float]: The relevance of each document.
+        """
+        unknown_idf: float = float(np.log1p((self.num_docs + 0.5) / 0.5))
+        terms: List[Tuple[Optional[int], float]] = []
+        for term in content_terms(query):
+            term_id: Optional[int] = self.vocabulary.get(term)
+            terms.append((term_id, float(self.idf[term_id]) if term_id is not None else unknown_idf))
+        weight: float = sum(idf for _, idf in terms)
+        if not weight:
+            return [0.0] * len(doc_ids)
+
+        relevance: List[float] = []
+        for doc_id in doc_ids:
+            score: float = 0.0
+            for term_id, idf in terms:
+                if term_id is None:
+                    continue
+                start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+                # The postings of a term are in document order
+                position: int = start + int(np.searchsorted(self.postings_docs[start:end], doc_id))
+                if position < end and int(self.postings_docs[position]) == doc_id:
+                    tf: float = float(self.postings_tfs[position])
+                    score += idf * tf * (self.k1 + 1.0) / (tf + float(self.length_norms[doc_id]))
+            relevance.append(min(1.0, score / weight))
+        return relevance
+
+    def similarity(self, doc_id: int, query_vector: np.ndarray) -> float:
+        """
+        Returns the cosine similarity of a document to a query vector.
+
+        Args:
+            doc_id (int): The document.
+            query_vector (np.ndarray): The normalized query vector.
+
+        Returns:
+            float: The similarity.
+        """
+        return float(self.vectors[doc_id] @ query_vector)
+
+    def hybrid_search(
+        self,
+        query: str,
+        query_vector: Optional[np.ndarray],
+        k: int,
+        candidates: int = 50,
+        nprobe: int = 0,
+        rrf_k: int = DEFAULT_RRF_K,
+    ) -> List[Dict[str, Any]]:
+        """
+        Runs BM25 and vector search and fuses their rankings with reciprocal rank fusion.
+
+        Args:
+            query (str): The query.
+            query_vector (Optional[np.ndarray]): The normalized query vector, None for BM25 only.
+            k (int): The number of results.
+            candidates (int): The number of results of each retriever fed to the fusion.
+            nprobe (int): The number of IVF lists to scan.
+            rrf_k (int): The RRF constant.
+
+        Returns:
+            List[Dict[str, Any]]: The results, best first, with the document id, the fused score
+                and the BM25 and vector scores of the document, if it was retrieved by them.
+        """
+        bm25: List[Tuple[int, float]] = self.bm25_search(query, max(candidates, k))
+        vector: List[Tuple[int, float]] = (
+            self.vector_search(query_vector, max(candidates, k), nprobe) if query_vector is not None else []
+        )
+        bm25_scores: Dict[int, float] = dict(bm25)
+        vector_scores: Dict[int, float] = dict(vector)
+
+        rankings: List[List[int]] = [[doc for doc, _ in bm25]]
+        if query_vector is not None:
+            rankings.append([doc for doc, _ in vector])
+        return [
+            {
+                "doc_id": doc_id,
+                "score": score,
+                "bm25_score": bm25_scores.get(doc_id),
+                "vector_score": vector_scores.get(doc_id),
+            }
+            for doc_id, score in reciprocal_rank_fusion(rankings, rrf_k, k)
+        ]
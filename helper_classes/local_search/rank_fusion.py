@@ -0,0 +1,39 @@
+"""
+This module provides reciprocal rank fusion (RRF) of ranked result lists.
+
+RRF scores each document by the sum of `1 / (k + rank)` over the lists it appears in, so results
+ranked well by several retrievers (e.g. BM25 and vector search) come first without calibrating
+their scores against each other.
+
+Functions:
+    reciprocal_rank_fusion: Fuses ranked lists of document ids.
+"""
+
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+DEFAULT_RRF_K = 60
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]], k: int = DEFAULT_RRF_K, top: int = 0
+) -> List[Tuple[Hashable, float]]:
+    """
+    Fuses ranked lists of document ids.
+
+    Args:
+        rankings (Sequence[Sequence[Hashable]]): The ranked lists, best first.
+        k (int): The RRF constant, dampening the weight of the top ranks.
+        top (int): The number of results to return, all if 0.
+
+    Returns:
+        List[Tuple[Hashable, float]]: The document ids and fused scores, best first. Ties keep the
+            order in which the documents were first seen.
+    """
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            scores[document] = scores.get(document, 0.0) + 1.0 / (k + rank)
+
+    fused: List[Tuple[Hashable, float]] = sorted(scores.items(), key=lambda item: -item[1])
+    return fused[:top] if top else fused
+
@@ -0,0 +1,173 @@
+"""
+This module provides the text analysis and embedders of the local search backend.
+
+Classes:
+    Embedder: Abstract base class of the query and document embedders.
+    HashingEmbedder: A local embedder hashing words and character trigrams into a dense vector.
+    AzureOpenAIEmbedder: An embedder calling an Azure OpenAI embeddings deployment.
+
+Functions:
+    tokenize: Splits a text into the lowercase terms indexed by BM25.
+    content_terms: Returns the distinct terms of a query that carry its topic.
+    create_embedder: Creates the embedder described by the index metadata.
+"""
+
+import re
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_TERMS = re.compile(r"\w+")
+
+# Words that carry no topic, left out of the relevance of a query (they are still indexed)
+STOP_WORDS = frozenset({
+    "an", "and", "are", "as", "at", "be", "but", "by", "can", "could", "do", "does", "for", "from",
+    "had", "has", "have", "how", "if", "in", "into", "is", "it", "its", "me", "my", "no", "not", "of",
+    "on", "or", "our", "please", "should", "so", "than", "that", "the", "their", "them", "then",
+    "there", "these", "they", "this", "those", "to", "was", "we", "were", "what", "when", "where",
+    "which", "who", "why", "will", "with", "would", "you", "your",
+})
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into the lowercase terms indexed by BM25, ignoring single characters.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The terms, in order.
+    """
+    return [term for term in _TERMS.findall(text.lower()) if len(term) > 1]
+
+
+def content_terms(text: str) -> List[str]:
+    """
+    Returns the distinct terms of a query that carry its topic, i.e. without the stop words.
+
+    Args:
+        text (str): The query.
+
+    Returns:
+        List[str]: The terms, in order of first occurrence.
+    """
+    return list(dict.fromkeys(term for term in tokenize(text) if term not in STOP_WORDS))
+
+
+class Embedder(ABC):
+    """
+    Abstract base class of the query and document embedders. Vectors are L2-normalized, so the dot product
+    of two vectors is their cosine similarity.
+
+    Attributes:
+        dims (int): The number of dimensions of the vectors.
+        similarity_floor (float): The similarity below which a document is unrelated to a query. It
+            depends on the embedding model, e.g. unrelated texts are around 0.7 apart with
+            text-embedding-ada-002 and around 0.1 with text-embedding-3.
+    """
+
+    dims: int = 0
+    similarity_floor: float = 0.5
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeds texts.
+
+        Args:
+            texts (List[str]): The texts.
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(texts), dims).
+        """
+        pass
+
+    @abstractmethod
+    def describe(self) -> Dict[str, Any]:
+        """
+        Returns the description stored in the index metadata, from which `create_embedder`
+        recreates the embedder.
+        """
+        pass
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms: np.ndarray = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class HashingEmbedder(Embedder):
+    """
+    A local embedder hashing the words and the character trigrams of the words of a text into a
+    dense signed vector. It needs no model or network access and captures lexical and spelling
+    similarity, which complements BM25 for short product catalogs.
+    """
+
+    # Queries about other subjects stay below 0.25 on the sample product chunks
+    similarity_floor: float = 0.25
+
+    def __init__(self, dims: int = 256):
+        self.dims = dims
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors: np.ndarray = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term in tokenize(text):
+                padded: str = "#" + term + "#"
+                features: List[str] = [term] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+                for feature in features:
+                    hashed: int = zlib.crc32(feature.encode("utf-8"))
+                    vectors[row, hashed % self.dims] += 1.0 if hashed & 0x80000000 else -1.0
+        return self.normalize(vectors)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": "hashing", "dims": self.dims}
+
+
+class AzureOpenAIEmbedder(Embedder):
+    """
+    An embedder calling an Azure OpenAI embeddings deployment through the pooled client of the connection.
+    """
+
+    def __init__(self, custom_connections: Any, model: str, dims: int):
+        self.custom_connections: Any = custom_connections
+        self.model: str = model
+        self.dims = dims
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        # Imported here, the hashing embedder needs no client
+        from helper_classes.lm_helpers.llm_helper import LLMHelper
+
+        client = LLMHelper.create_pooled_client(self.custom_connections)
+        response = client.embeddings.create(input=texts, model=self.model)
+        return self.normalize(np.array([item.embedding for item in response.data], dtype=np.float32))
+
+    def describe(self) -> Dict[str, Any]:
+        return {"type": "azure_openai", "model": self.model, "dims": self.dims}
+
+
+def create_embedder(description: Dict[str, Any], custom_connections: Optional[Any] = None) -> Embedder:
+    """
+    Creates the embedder described by the index metadata.
+
+    Args:
+        description (Dict[str, Any]): The embedder description, see `Embedder.describe`.
+        custom_connections (Optional[Any]): The custom connection, required by the Azure OpenAI embedder.
+
+    Returns:
+        Embedder: The embedder.
+
+    Raises:
+        ValueError: If the embedder type is unknown or its connection is missing.
+    """
+    embedder_type: str = description.get("type", "hashing")
+    if embedder_type == "hashing":
+        return HashingEmbedder(int(description.get("dims", 256)))
+    if embedder_type == "azure_openai":
+        if custom_connections is None:
+            raise ValueError("The azure_openai embedder needs the custom connection of the flow")
+        return AzureOpenAIEmbedder(custom_connections, description["model"], int(description["dims"]))
+    raise ValueError(f"Unknown embedder type '{embedder_type}'")
@@ -0,0 +1,439 @@
+"""
+This module provides the logging pipeline of the flow worker, which keeps the formatting and the
+I/O of the log records off the request threads.
+
+`LogPipeline.install` moves the handlers of the root logger behind a bounded queue drained by a
+background thread. On the request thread a record is sampled, snapshotted and queued: the
+sampling rate of its event decides whether it is kept, and the `LazyValue`s of a kept record are
+resolved and its containers copied there, so the values are those of the call and the caller can
+go on changing them. The background thread redacts the secrets and the email addresses, caps the
+size of the values and hands the record to the handlers. When the queue is full the record is
+dropped and counted, the request never waits for the log.
+
+The event of a record is its module and its message, e.g. `search_ai_executor:Execution
+completed`. The sampling rates and the size caps are read from the environment, as a default
+value followed by the values of events or modules:
+
+    FLOW_LOG_SAMPLE_RATES="1,search_ai_executor:Execution completed=0.1,llm_helper=0.5"
+    FLOW_LOG_MAX_CHARS="2000,llm_helper:Failure occurred=8000"
+
+The records of a conversation are sampled together (by its `conversation_id`), so a sampled
+conversation has all its records of the events sharing a rate.
+
+Settings:
+    FLOW_LOG_ASYNC: Set to 0 to sample and redact the records on the request thread, without a queue.
+    FLOW_LOG_QUEUE_SIZE: Maximum number of queued records (default 10000).
+    FLOW_LOG_SAMPLE_RATES: Sampling rates, between 0 and 1 (default 1).
+    FLOW_LOG_MAX_CHARS: Maximum length of a string value (default 2000).
+    FLOW_LOG_MAX_ITEMS: Maximum number of items of a list or dict value (default 50).
+    FLOW_LOG_REDACT: Set to 0 to disable the redaction.
+
+Classes:
+    LazyValue: A value of a log record computed only if the record is sampled.
+    LogPipeline: Installs the pipeline, samples and redacts the records.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Set
+
+# Attributes of every log record, the others are the `extra` of the call
+_RECORD_ATTRIBUTES: Set[str] = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+# Keys whose values are secrets
+_SECRET_KEYS = re.compile(
+    r"(?i)^(key|sig|token)$|(api[-_]?key|subscription[-_]?key|authorization|password|passwd|secret"
+    r"|access[-_]?token|refresh[-_]?token|sas[-_]?token|connection[-_]?string)$"
+)
+_EMAIL = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+_BEARER = re.compile(r"(?i)\bbearer\s+[A-Za-z0-9._~+/=-]+")
+# Secrets in URLs and connection strings
+_SECRET_PARAMETERS = re.compile(
+    r"(?i)\b(api[-_]?key|sig|access_token|accountkey|sharedaccesskey|password|pwd)=[^&;\s\"']+"
+)
+
+REDACTED: str = "<redacted>"
+
+# Whether the values of a key are secrets, by key
+_secret_keys: Dict[Any, bool] = {}
+
+_FORMATTER: logging.Formatter = logging.Formatter()
+
+
+class LazyValue:
+    """
+    A value of a log record computed only if the record is sampled. It is computed on the request
+    thread when the record is admitted, so it reads the state of the call; the logging thread only
+    redacts the result.
+
+    Example:
+        logging.info("Execution completed", extra={"payload": LazyValue(self.get_loggable_payload)})
+    """
+
+    __slots__ = ("function",)
+
+    def __init__(self, function: Callable[[], Any]):
+        """
+        Initializes the LazyValue.
+
+        Args:
+            function (Callable[[], Any]): Computes the value.
+        """
+        self.function = function
+
+    def resolve(self) -> Any:
+        """
+        Returns the value, or a placeholder if it cannot be computed.
+        """
+        try:
+            return self.function()
+        except Exception as e:
+            return f"<unavailable: {type(e).__name__}>"
+
+    def __str__(self) -> str:
+        return str(self.resolve())
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Samples the records on the request thread and queues them without blocking.
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if not LogPipeline.admit(record):
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LogPipeline._count(dropped=1)
+        except Exception:
+            self.handleError(record)
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """
+    Redacts the records on the logging thread before handing them to the handlers.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        LogPipeline.redact(record)
+        LogPipeline._count(written=1)
+        return record
+
+    def enqueue_sentinel(self) -> None:
+        # Waits for room in a full queue, the records before the sentinel are written
+        self.queue.put(self._sentinel)
+
+
+class _SyncHandler(logging.Handler):
+    """
+    Samples and redacts the records on the request thread and hands them to the handlers, when the
+    queue is disabled.
+    """
+
+    def __init__(self, *handlers: logging.Handler):
+        super().__init__()
+        self.handlers: List[logging.Handler] = list(handlers)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if not LogPipeline.admit(record):
+            return
+        LogPipeline.redact(record)
+        LogPipeline._count(written=1)
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class LogPipeline:
+    """
+    Installs the logging pipeline of the worker and samples, snapshots and redacts its records.
+    """
+
+    sample_rates: Dict[str, float] = {}
+    max_chars: Dict[str, float] = {}
+    max_items: int = int(os.environ.get("FLOW_LOG_MAX_ITEMS", "50"))
+    redaction: bool = os.environ.get("FLOW_LOG_REDACT", "1") != "0"
+
+    _listener: Optional[_QueueListener] = None
+    _queue: Optional["queue.Queue[logging.LogRecord]"] = None
+    _installed: bool = False
+    _install_lock: threading.Lock = threading.Lock()
+
+    _metrics: Dict[str, int] = {
+        "sampled_out": 0, "written": 0, "dropped": 0, "redacted": 0, "truncated": 0,
+    }
+    _lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def install() -> None:
+        """
+        Installs the pipeline on the root logger, once per process: moves its handlers behind the
+        queue, or behind a handler sampling and redacting on the request thread if `FLOW_LOG_ASYNC=0`.
+        Handlers added to the root logger afterwards are not part of the pipeline.
+        """
+        with LogPipeline._install_lock:
+            if LogPipeline._installed:
+                return
+            LogPipeline.configure()
+            root: logging.Logger = logging.getLogger()
+            handlers: List[logging.Handler] = list(root.handlers)
+
+            for handler in handlers:
+                root.removeHandler(handler)
+            if os.environ.get("FLOW_LOG_ASYNC", "1") == "0":
+                root.addHandler(_SyncHandler(*handlers))
+            else:
+                LogPipeline._queue = queue.Queue(int(os.environ.get("FLOW_LOG_QUEUE_SIZE", "10000")))
+                root.addHandler(_QueueHandler(LogPipeline._queue))
+                LogPipeline._listener = _QueueListener(
+                    LogPipeline._queue, *handlers, respect_handler_level=True
+                )
+                LogPipeline._listener.start()
+                # Writes the queued records when the process exits
+                atexit.register(LogPipeline.stop)
+            LogPipeline._installed = True
+
+    @staticmethod
+    def configure(sample_rates: Optional[str] = None, max_chars: Optional[str] = None) -> None:
+        """
+        Sets the sampling rates and the size caps, from the arguments or from the environment.
+
+        Args:
+            sample_rates (Optional[str]): Defaults to `FLOW_LOG_SAMPLE_RATES`.
+            max_chars (Optional[str]): Defaults to `FLOW_LOG_MAX_CHARS`.
+        """
+        LogPipeline.sample_rates = LogPipeline._parse(
+            sample_rates if sample_rates is not None else os.environ.get("FLOW_LOG_SAMPLE_RATES", ""), 1.0
+        )
+        LogPipeline.max_chars = LogPipeline._parse(
+            max_chars if max_chars is not None else os.environ.get("FLOW_LOG_MAX_CHARS", ""), 2000.0
+        )
+
+    @staticmethod
+    def stop() -> None:
+        """
+        Writes the queued records and stops the logging thread.
+        """
+        listener: Optional[_QueueListener] = LogPipeline._listener
+        if listener is not None and listener._thread is not None:
+            listener.stop()
+
+    @staticmethod
+    def admit(record: logging.LogRecord) -> bool:
+        """
+        Decides whether a record is sampled. If it is, resolves its `LazyValue`s and copies its
+        containers, so the caller can change them while the record waits in the queue.
+
+        Args:
+            record (logging.LogRecord): The record.
+
+        Returns:
+            bool: True if the record is sampled.
+        """
+        rate: float = LogPipeline._lookup(LogPipeline.sample_rates, record)
+        if rate < 1.0:
+            conversation_id: Any = record.__dict__.get("conversation_id")
+            draw: float = (
+                zlib.crc32(str(conversation_id).encode()) / 0x100000000
+                if conversation_id else random.random()
+            )
+            if draw >= rate:
+                LogPipeline._count(sampled_out=1)
+                return False
+
+        values: Dict[str, Any] = record.__dict__
+        for name, value in values.items():
+            if name in _RECORD_ATTRIBUTES:
+                continue
+            if isinstance(value, LazyValue):
+                values[name] = value.resolve()
+            elif isinstance(value, dict):
+                values[name] = dict(value)
+            elif isinstance(value, list):
+                values[name] = list(value)
+        return True
+
+    @staticmethod
+    def redact(record: logging.LogRecord) -> None:
+        """
+        Replaces the secrets and the email addresses of a record and caps the size of its values.
+
+        Args:
+            record (logging.LogRecord): The record.
+        """
+        limit: int = int(LogPipeline._lookup(LogPipeline.max_chars, record))
+        counts: Dict[str, int] = {"redacted": 0, "truncated": 0}
+        try:
+            message: str = record.getMessage()
+        except Exception:
+            message = str(record.msg)
+        record.msg = LogPipeline._scrub(message, limit, counts, 0)
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            # Formatted here, the handlers reuse the text
+            record.exc_text = _FORMATTER.formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = LogPipeline._scrub(record.exc_text, max(limit, 8000), counts, 0)
+
+        values: Dict[str, Any] = record.__dict__
+        for name in [name for name in values if name not in _RECORD_ATTRIBUTES]:
+            if LogPipeline._is_secret(name):
+                values[name] = REDACTED
+                counts["redacted"] += 1
+            else:
+                values[name] = LogPipeline._scrub(values[name], limit, counts, 0)
+        if counts["redacted"] or counts["truncated"]:
+            LogPipeline._count(**counts)
+
+    @staticmethod
+    def _scrub(value: Any, limit: int, counts: Dict[str, int], depth: int) -> Any:
+        """
+        Returns a copy of a value with its secrets and email addresses replaced, its strings cut
+        to `limit` characters and its lists and dicts cut to `max_items` items.
+        """
+        value_type: type = type(value)
+        if value_type is not str:
+            if value is None or value_type in (bool, int, float):
+                return value
+            if value_type is LazyValue:
+                return LogPipeline._scrub(value.resolve(), limit, counts, depth)
+            if isinstance(value, dict):
+                return LogPipeline._scrub_dict(value, limit, counts, depth)
+            if isinstance(value, (list, tuple, set)):
+                return LogPipeline._scrub_list(value, limit, counts, depth)
+            value = str(value)
+
+        text: str = value
+        length: int = len(text)
+        if length > limit:
+            # Cut with a margin first, so an address across the cut is still found
+            text = text[:limit + 256]
+        if LogPipeline.redaction:
+            if "@" in text:
+                text, replaced = _EMAIL.subn("<email>", text)
+                counts["redacted"] += replaced
+            if "=" in text:
+                text, replaced = _SECRET_PARAMETERS.subn(lambda match: f"{match.group(1)}={REDACTED}", text)
+                counts["redacted"] += replaced
+            if "earer" in text:
+                text, replaced = _BEARER.subn(f"Bearer {REDACTED}", text)
+                counts["redacted"] += replaced
+        if length > limit:
+            text = f"{text[:limit]}... <{length - limit} more characters>"
+            counts["truncated"] += 1
+        return text
+
+    @staticmethod
+    def _scrub_dict(value: Dict[Any, Any], limit: int, counts: Dict[str, int], depth: int) -> Any:
+        """
+        Returns a copy of a dict with the values of its secret keys replaced and its values scrubbed.
+        """
+        if depth >= 8:
+            return "<...>"
+        max_items: int = LogPipeline.max_items
+        scrubbed: Dict[Any, Any] = {}
+        for index, (key, item) in enumerate(value.items()):
+            if index == max_items:
+                scrubbed["<truncated>"] = f"{len(value) - max_items} more items"
+                counts["truncated"] += 1
+                break
+            if LogPipeline._is_secret(key):
+                scrubbed[key] = REDACTED
+                counts["redacted"] += 1
+            else:
+                scrubbed[key] = LogPipeline._scrub(item, limit, counts, depth + 1)
+        return scrubbed
+
+    @staticmethod
+    def _scrub_list(value: Any, limit: int, counts: Dict[str, int], depth: int) -> Any:
+        """
+        Returns a list of the scrubbed items of a list, tuple or set.
+        """
+        if depth >= 8:
+            return "<...>"
+        max_items: int = LogPipeline.max_items
+        items: List[Any] = [
+            LogPipeline._scrub(item, limit, counts, depth + 1) for item in list(value)[:max_items]
+        ]
+        if len(value) > max_items:
+            items.append(f"<{len(value) - max_items} more items>")
+            counts["truncated"] += 1
+        return items
+
+    @staticmethod
+    def _is_secret(key: Any) -> bool:
+        """
+        Returns whether the values of a key are secrets. The keys of the records are few, the
+        answers are kept.
+        """
+        secret: Optional[bool] = _secret_keys.get(key)
+        if secret is None:
+            secret = LogPipeline.redaction and isinstance(key, str) and bool(_SECRET_KEYS.search(key))
+            if len(_secret_keys) < 10000:
+                _secret_keys[key] = secret
+        return secret
+
+    @staticmethod
+    def _lookup(values: Dict[str, float], record: logging.LogRecord) -> float:
+        """
+        Returns the value of the event of a record, of its module, or the default value.
+        """
+        if len(values) > 1:
+            value: Optional[float] = values.get(f"{record.module}:{record.msg}")
+            if value is None:
+                value = values.get(record.module)
+            if value is not None:
+                return value
+        return values["*"]
+
+    @staticmethod
+    def _parse(spec: str, default: float) -> Dict[str, float]:
+        """
+        Parses a default value followed by the values of events or modules, e.g.
+        `1,search_ai_executor:Execution completed=0.1`.
+        """
+        values: Dict[str, float] = {"*": default}
+        for part in spec.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            if "=" in part:
+                event, value = part.rsplit("=", 1)
+                values[event.strip()] = float(value)
+            else:
+                values["*"] = float(part)
+        return values
+
+    @staticmethod
+    def _count(**counts: int) -> None:
+        """
+        Adds to the counts of the pipeline.
+        """
+        with LogPipeline._lock:
+            for key, value in counts.items():
+                LogPipeline._metrics[key] += value
+
+    @staticmethod
+    def get_metrics() -> Dict[str, int]:
+        """
+        Returns the counts of the sampled out, written, dropped, redacted and truncated records and
+        values, and the number of queued records.
+
+        Returns:
+            Dict[str, int]: The counts.
+        """
+        with LogPipeline._lock:
+            result: Dict[str, int] = dict(LogPipeline._metrics)
+        result["queued"] = LogPipeline._queue.qsize() if LogPipeline._queue is not None else 0
+        return result
+
+
+LogPipeline.configure()
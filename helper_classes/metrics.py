@@ -0,0 +1,516 @@
+"""
+This module provides the in-process metrics of the flow, exposed in the Prometheus text format.
+
+The hot path records into counters and bucketed histograms labelled by persona, topic, handler,
+stage and so on. Each thread records into its own shard of a metric, so recording takes no lock:
+a shard is only written by its thread, and the shards are summed when the metrics are rendered.
+The shards of finished threads are folded into a retired total, so counters never go backwards.
+
+The counters that the helpers already keep (`LLMHelper.get_metrics()`, `TopicRegistry.get_metrics()`
+and so on) are rendered as gauges next to them, read from the modules already imported.
+
+The metrics are exposed:
+    * over HTTP at `/metrics` on `FLOW_METRICS_PORT`, bound to `FLOW_METRICS_HOST` (default
+      127.0.0.1), for a Prometheus scrape;
+    * in the file `FLOW_METRICS_FILE`, rewritten every `FLOW_METRICS_INTERVAL_S` seconds (default 15),
+      for the textfile collector of the node exporter.
+Set `FLOW_METRICS=0` to disable the recording.
+
+Classes:
+    Counter: A counter by labels.
+    Histogram: A bucketed histogram by labels.
+    Metrics: The registry of the metrics, their rendering and their exporters.
+"""
+
+import bisect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a cached lookup to a slow completion
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+# Token buckets of a completion
+TOKEN_BUCKETS: Tuple[float, ...] = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+_Shard = Dict[Tuple[str, ...], List[float]]
+
+
+class _Metric:
+    """
+    A metric family recorded in per-thread shards.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): The help text.
+        label_names (Tuple[str, ...]): The label names, in the order of the label values of a series.
+    """
+
+    TYPE: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label_names: Tuple[str, ...] = tuple(label_names)
+        self._local: threading.local = threading.local()
+        self._shards: List[Tuple[threading.Thread, _Shard]] = []
+        self._retired: _Shard = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def _shard(self) -> _Shard:
+        """
+        Returns the shard of the calling thread, registering it on the first record of the thread.
+        """
+        shard: Optional[_Shard] = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def collect(self) -> _Shard:
+        """
+        Sums the shards of the threads.
+
+        Returns:
+            Dict[Tuple[str, ...], List[float]]: The values of each series, keyed by label values.
+        """
+        with self._lock:
+            alive: List[Tuple[threading.Thread, _Shard]] = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    _add(self._retired, shard)
+            self._shards = alive
+            total: _Shard = {key: list(values) for key, values in self._retired.items()}
+            for _, shard in alive:
+                _add(total, shard)
+        return total
+
+    def reset(self) -> None:
+        """
+        Drops the recorded values.
+        """
+        with self._lock:
+            self._retired.clear()
+            for _, shard in self._shards:
+                shard.clear()
+
+    def render(self) -> Iterator[str]:
+        """
+        Renders the metric family in the Prometheus text format.
+        """
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.TYPE}"
+        for key, values in sorted(self.collect().items()):
+            yield from self._render_series(dict(zip(self.label_names, key)), values)
+
+    def _render_series(self, labels: Dict[str, str], values: List[float]) -> Iterator[str]:
+        yield f"{self.name}{_labels(labels)} {_number(values[0])}"
+
+
+class Counter(_Metric):
+    """
+    A counter by labels.
+    """
+
+    TYPE = "counter"
+
+    def inc(self, value: float = 1.0, **labels: Any) -> None:
+        """
+        Adds to the counter of the labels.
+
+        Args:
+            value (float): The amount to add. Defaults to 1.
+            **labels (Any): The label values, missing labels are empty.
+        """
+        if not Metrics.enabled:
+            return
+        key: Tuple[str, ...] = self._key(labels)
+        shard: _Shard = self._shard()
+        values: Optional[List[float]] = shard.get(key)
+        if values is None:
+            shard[key] = [value]
+        else:
+            values[0] += value
+
+
+class Histogram(_Metric):
+    """
+    A bucketed histogram by labels. A series holds the count of each bucket, not cumulated until it
+    is rendered, then the count and the sum of the observations.
+
+    Attributes:
+        buckets (Tuple[float, ...]): The upper bounds of the buckets, without `+Inf`.
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float]):
+        super().__init__(name, documentation, label_names)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """
+        Records an observation.
+
+        Args:
+            value (float): The observed value.
+            **labels (Any): The label values, missing labels are empty.
+        """
+        if not Metrics.enabled:
+            return
+        key: Tuple[str, ...] = self._key(labels)
+        shard: _Shard = self._shard()
+        values: Optional[List[float]] = shard.get(key)
+        if values is None:
+            values = [0.0] * (len(self.buckets) + 3)
+            shard[key] = values
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-2] += 1
+        values[-1] += value
+
+    def _render_series(self, labels: Dict[str, str], values: List[float]) -> Iterator[str]:
+        cumulated: float = 0.0
+        for bound, count in zip(self.buckets + (float("inf"),), values):
+            cumulated += count
+            yield f"{self.name}_bucket{_labels(dict(labels, le=_number(bound)))} {_number(cumulated)}"
+        yield f"{self.name}_count{_labels(labels)} {_number(values[-2])}"
+        yield f"{self.name}_sum{_labels(labels)} {_number(values[-1])}"
+
+
+class Metrics:
+    """
+    The registry of the metrics of the process, their rendering and their exporters.
+    """
+
+    enabled: bool = os.environ.get("FLOW_METRICS", "1") != "0"
+
+    _metrics: Dict[str, _Metric] = {}
+    _lock: threading.Lock = threading.Lock()
+    _exporters: List[Any] = []
+
+    # The `get_metrics` of the helpers rendered as gauges: the module, the function, and the label of
+    # the keys of the first level if the function returns a dict of dicts. The module is only read
+    # once imported by the flow.
+    COLLECTORS: Dict[str, Tuple[str, str, Optional[str]]] = {
+        "llm": ("helper_classes.lm_helpers.llm_helper", "LLMHelper.get_metrics", "stage_model"),
+        "lm_helper": ("helper_classes.lm_helpers.lm_helper", "LMHelper.get_counts", None),
+        "prompt_message_cache": (
+            "helper_classes.lm_helpers.prompt_message_cache", "PromptMessageCache.get_metrics", None
+        ),
+        "tool_calls": ("helper_classes.response_handler", "ResponseHandler.get_metrics", None),
+        "turn_context": ("helper_classes.turn_context", "TurnContext.get_metrics", None),
+        "conversation_data": (
+            "helper_classes.conversation_helper.conversation_data_helper",
+            "ConversationDataHelper.get_metrics",
+            None,
+        ),
+        "conversation_lock": (
+            "helper_classes.conversation_helper.conversation_concurrency",
+            "ConversationLock.get_metrics",
+            None,
+        ),
+        "query_embedding_cache": (
+            "helper_classes.query_embedding_cache", "QueryEmbeddingCache.get_metrics", None
+        ),
+        "retrieval_reuse": ("helper_classes.retrieval_reuse", "RetrievalReuse.get_metrics", None),
+        "multi_query_search": ("helper_classes.multi_query_search", "MultiQuerySearch.get_metrics", "source"),
+        "single_flight": ("helper_classes.single_flight", "SingleFlight.get_metrics", "group"),
+        "topic_registry": ("helper_classes.topic_helper.topic_registry", "TopicRegistry.get_metrics", None),
+        "customer_record_projector": (
+            "helper_classes.helper_classes_customer.customer_service.customer_record_projector",
+            "CustomerRecordProjector.get_metrics",
+            None,
+        ),
+        "startup": ("helper_classes.startup", "get_readiness", None),
+        "logging": ("helper_classes.log_pipeline", "LogPipeline.get_metrics", None),
+    }
+
+    @staticmethod
+    def counter(name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        """
+        Returns the counter of a name, creating it on first use.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            label_names (Sequence[str]): The label names.
+
+        Returns:
+            Counter: The counter.
+        """
+        return Metrics._get(name, lambda: Counter(name, documentation, label_names))  # type: ignore
+
+    @staticmethod
+    def histogram(
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """
+        Returns the histogram of a name, creating it on first use.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text.
+            label_names (Sequence[str]): The label names.
+            buckets (Sequence[float]): The upper bounds of the buckets. Defaults to LATENCY_BUCKETS.
+
+        Returns:
+            Histogram: The histogram.
+        """
+        return Metrics._get(  # type: ignore
+            name, lambda: Histogram(name, documentation, label_names, buckets)
+        )
+
+    @staticmethod
+    def _get(name: str, create: Callable[[], _Metric]) -> _Metric:
+        metric: Optional[_Metric] = Metrics._metrics.get(name)
+        if metric is None:
+            with Metrics._lock:
+                metric = Metrics._metrics.get(name)
+                if metric is None:
+                    metric = create()
+                    Metrics._metrics[name] = metric
+        return metric
+
+    @staticmethod
+    def render() -> str:
+        """
+        Renders the metrics and the gauges of the collectors in the Prometheus text format.
+
+        Returns:
+            str: The exposition.
+        """
+        lines: List[str] = []
+        with Metrics._lock:
+            metrics: List[_Metric] = sorted(Metrics._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            lines.extend(metric.render())
+        for component, (module_name, function_name, label) in Metrics.COLLECTORS.items():
+            lines.extend(Metrics._render_collector(component, module_name, function_name, label))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_collector(
+        component: str, module_name: str, function_name: str, label: Optional[str]
+    ) -> List[str]:
+        """
+        Renders the values returned by the `get_metrics` of a helper as gauges named after the
+        component and the keys.
+        """
+        module: Any = sys.modules.get(module_name)
+        if module is None:
+            return []
+        try:
+            target: Any = module
+            for attribute in function_name.split("."):
+                target = getattr(target, attribute)
+            values: Any = target()
+        except Exception as e:  # pylint: disable=broad-except
+            logging.warning("Metrics collector failed", extra={"component": component, "error": repr(e)})
+            return []
+
+        samples: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+        items: List[Tuple[Dict[str, str], Dict[str, Any]]] = (
+            [({label: str(key)}, value) for key, value in values.items() if isinstance(value, dict)]
+            if label
+            else [({}, values)]
+        )
+        for labels, group in items:
+            for key, value in group.items():
+                name: str = _NAME.sub("_", f"flow_{component}_{key}")
+                if isinstance(value, (bool, int, float)):
+                    samples.setdefault(name, []).append((labels, float(value)))
+                elif isinstance(value, dict):
+                    for item_key, item in value.items():
+                        if isinstance(item, (bool, int, float)):
+                            samples.setdefault(name, []).append(
+                                (dict(labels, key=str(item_key)), float(item))
+                            )
+
+        lines: List[str] = []
+        for name, series in samples.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{_labels(labels)} {_number(value)}" for labels, value in series)
+        return lines
+
+    @staticmethod
+    def start_exporters() -> None:
+        """
+        Starts the HTTP endpoint if `FLOW_METRICS_PORT` is set and the file writer if `FLOW_METRICS_FILE`
+        is set, once per process. A port that cannot be bound, e.g. already bound by another worker
+        of the host, is logged and the worker goes on without the endpoint.
+        """
+        with Metrics._lock:
+            if Metrics._exporters or not Metrics.enabled:
+                return
+
+            port: Optional[str] = os.environ.get("FLOW_METRICS_PORT")
+            if port:
+                # Imported here, the server is only needed when the endpoint is enabled
+                from http.server import ThreadingHTTPServer
+
+                try:
+                    server = ThreadingHTTPServer(
+                        (os.environ.get("FLOW_METRICS_HOST", "127.0.0.1"), int(port)), _create_request_handler()
+                    )
+                except OSError as e:
+                    # The workers of a host share the port, the first one to bind it serves the endpoint
+                    log_data: Dict[str, Any] = {"port": port, "error_message": str(e)}
+                    logging.warning("Metrics endpoint not started", extra=log_data)
+                else:
+                    server.daemon_threads = True
+                    threading.Thread(target=server.serve_forever, name="flow-metrics-http", daemon=True).start()
+                    Metrics._exporters.append(server)
+                    logging.info("Metrics endpoint started", extra={"port": server.server_address[1]})
+
+            path: Optional[str] = os.environ.get("FLOW_METRICS_FILE")
+            if path:
+                interval_s: float = float(os.environ.get("FLOW_METRICS_INTERVAL_S", "15"))
+                writer = threading.Thread(
+                    target=Metrics._write_periodically,
+                    args=(path, interval_s),
+                    name="flow-metrics-file",
+                    daemon=True,
+                )
+                writer.start()
+                Metrics._exporters.append(writer)
+
+    @staticmethod
+    def write(path: str) -> None:
+        """
+        Writes the metrics to a file, replacing it atomically.
+
+        Args:
+            path (str): The file path.
+        """
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            file.write(Metrics.render())
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _write_periodically(path: str, interval_s: float) -> None:
+        while True:
+            try:
+                Metrics.write(path)
+            except OSError as e:
+                logging.error("Metrics file not written", extra={"path": path, "error": repr(e)})
+            time.sleep(interval_s)
+
+    @staticmethod
+    def clear() -> None:
+        """
+        Drops the recorded values of every metric.
+        """
+        with Metrics._lock:
+            metrics: List[_Metric] = list(Metrics._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+
+def _create_request_handler() -> type:
+    """
+    Returns the request handler serving the metrics at `/metrics`.
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            data: bytes = Metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    return MetricsRequestHandler
+
+
+def _add(total: _Shard, shard: _Shard) -> None:
+    for key, values in list(shard.items()):
+        current: Optional[List[float]] = total.get(key)
+        if current is None:
+            total[key] = list(values)
+        else:
+            for index, value in enumerate(values):
+                current[index] += value
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# The metrics recorded by the flow
+TURN_SECONDS: Histogram = Metrics.histogram(
+    "flow_turn_duration_seconds", "Duration of the turns.", ("persona", "topic")
+)
+TURN_STEP_SECONDS: Histogram = Metrics.histogram(
+    "flow_turn_step_duration_seconds", "Duration of the steps of the turns.", ("persona", "step")
+)
+HANDLER_SECONDS: Histogram = Metrics.histogram(
+    "flow_handler_duration_seconds",
+    "Duration of the custom handlers.",
+    ("persona", "topic", "handler", "outcome"),
+)
+LLM_SECONDS: Histogram = Metrics.histogram(
+    "flow_llm_request_duration_seconds",
+    "Duration of the completions by stage and model.",
+    ("persona", "topic", "stage", "model", "outcome"),
+)
+LLM_TOKENS: Counter = Metrics.counter(
+    "flow_llm_tokens_total", "Tokens of the completions by stage, model and kind.",
+    ("persona", "topic", "stage", "model", "kind"),
+)
+LLM_COMPLETION_TOKENS: Histogram = Metrics.histogram(
+    "flow_llm_completion_tokens_per_request",
+    "Completion tokens of each completion.",
+    ("stage", "model"),
+    TOKEN_BUCKETS,
+)
+SEARCH_SECONDS: Histogram = Metrics.histogram(
+    "flow_search_request_duration_seconds", "Duration of the Azure AI Search requests.", ("outcome", "shared")
+)
+CACHE_REQUESTS: Counter = Metrics.counter(
+    "flow_cache_requests_total", "Lookups of the caches by result.", ("cache", "result")
+)
+RETRIES: Counter = Metrics.counter(
+    "flow_retries_total", "Operations retried or repaired, by outcome.", ("operation", "outcome")
+)
+STATE_STORE_SECONDS: Histogram = Metrics.histogram(
+    "flow_state_store_operation_duration_seconds",
+    "Duration of the conversation state store operations.",
+    ("store", "operation", "outcome"),
+)
@@ -0,0 +1,281 @@
+"""
+This module provides multi-query retrieval: several variants of the user's question are searched
+concurrently and their ranked results are merged with reciprocal rank fusion.
+
+Classes:
+    MultiQuerySearch: Derives the query variants of a turn, searches them in parallel and fuses the results.
+"""
+
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from promptflow.connections import CognitiveSearchConnection  # type: ignore
+from helper_classes import serialization
+from helper_classes.ai_search import AiSearch
+from helper_classes.local_search.rank_fusion import DEFAULT_RRF_K, reciprocal_rank_fusion
+
+
+class MultiQuerySearch:
+    """
+    Derives the query variants of a turn, searches them in parallel and fuses the results.
+
+    The variants are:
+        rewritten: `arguments.query`, the query the model rewrote from the conversation.
+        raw: The user's message of the turn, as typed.
+        previous_answer: The rewritten query followed by the start of `arguments.previous_answer_provided`,
+            which recalls the documents the follow-up question is about.
+
+    Identical variants are searched once. The searches run concurrently on a shared pool, so the
+    turn waits for the slowest search rather than their sum.
+
+    Parameters read from `ai_search.parameters`:
+        multi_query: Enables multi-query retrieval (default false).
+        multi_query_variants: The variants to search (default all three).
+        previous_answer_chars: Number of characters of the previous answer added to its variant (default 300).
+        rrf_k: The RRF constant (default 60).
+        k: Number of fused results (default 5).
+    """
+
+    VARIANTS: List[str] = ["rewritten", "raw", "previous_answer"]
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _lock: threading.Lock = threading.Lock()
+    _metrics: Dict[str, Dict[str, int]] = {}
+
+    def __init__(
+        self,
+        conversation_data: Dict[str, Any],
+        conversation_parameters: Dict[str, Any],
+        ai_search_config: Dict[str, Any],
+        cognitive_search_connection: CognitiveSearchConnection,
+        custom_connections: Optional[Any] = None,
+    ):
+        """
+        Initializes the MultiQuerySearch.
+
+        Args:
+            conversation_data (Dict[str, Any]): The conversation data.
+            conversation_parameters (Dict[str, Any]): The conversation parameters, with the user's
+                message of the turn in `user_query`.
+            ai_search_config (Dict[str, Any]): The `ai_search` configuration of the topic.
+            cognitive_search_connection (CognitiveSearchConnection): The Azure AI Search connection.
+            custom_connections (Optional[Any]): The custom connection.
+        """
+        self.conversation_data = conversation_data
+        self.conversation_parameters = conversation_parameters
+        self.ai_search_config = ai_search_config
+        self.search_params: Dict[str, Any] = ai_search_config["parameters"]
+        self.cognitive_search_connection = cognitive_search_connection
+        self.custom_connections = custom_connections
+
+    @staticmethod
+    def is_enabled(ai_search_config: Dict[str, Any]) -> bool:
+        """
+        Returns whether the `ai_search` configuration of a topic enables multi-query retrieval.
+        """
+        return bool(ai_search_config["parameters"].get("multi_query", False))
+
+    def get_variants(self) -> Dict[str, str]:
+        """
+        Derives the query variants of the turn.
+
+        Returns:
+            Dict[str, str]: The distinct, non-empty queries by variant name.
+        """
+        arguments: Dict[str, Any] = self.conversation_data["arguments"]
+        rewritten: str = str(arguments.get("query") or "")
+        previous_answer: str = str(arguments.get("previous_answer_provided") or "")
+        previous_answer_chars: int = int(self.search_params.get("previous_answer_chars", 300))
+        candidates: Dict[str, str] = {
+            "rewritten": rewritten,
+            "raw": str(self.conversation_parameters.get("user_query") or ""),
+            "previous_answer": (
+                f"{rewritten} {previous_answer[:previous_answer_chars]}" if previous_answer else ""
+            ),
+        }
+
+        variants: Dict[str, str] = {}
+        seen: set = set()
+        for name in self.search_params.get("multi_query_variants", self.VARIANTS):
+            query: str = candidates.get(name, "").strip()
+            normalized: str = " ".join(re.findall(r"\w+", query.lower()))
+            if query and normalized not in seen:
+                seen.add(normalized)
+                variants[name] = query
+        return variants
+
+    def _search(self, query: str) -> Tuple[Optional[List[Dict[str, Any]]], float]:
+        """
+        Runs one search.
+
+        Args:
+            query (str): The query.
+
+        Returns:
+            Tuple[Optional[List[Dict[str, Any]]], float]: The results, None if the search failed,
+                and its duration in milliseconds.
+        """
+        start: float = time.perf_counter()
+        search = AiSearch.create(
+            self.conversation_data,
+            self.conversation_parameters,
+            self.ai_search_config,
+            self.cognitive_search_connection,
+            self.custom_connections,
+            query,
+        )
+        response = search.execute()
+        duration_ms: float = round((time.perf_counter() - start) * 1000, 2)
+        if not response or response.status_code != 200:
+            return None, duration_ms
+        return serialization.loads(response.content)["value"], duration_ms
+
+    def execute(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Searches the query variants in parallel and fuses their results.
+
+        Each fused result is the result item of the first variant retrieving it, with the highest
+        score of the score key (`@search.rerankerScore`) across variants, so `min_reranker_score`
+        filters fused results like single-query results.
+
+        Returns:
+            Optional[List[Dict[str, Any]]]: The fused results, best first, or None if every search failed.
+        """
+        variants: Dict[str, str] = self.get_variants()
+        content_key: str = self.search_params.get("content_key", "content")
+        score_key: str = self.search_params.get("score_key", "@search.rerankerScore")
+
+        with MultiQuerySearch._lock:
+            if MultiQuerySearch._executor is None:
+                MultiQuerySearch._executor = ThreadPoolExecutor(
+                    max_workers=8, thread_name_prefix="multi-query-search"
+                )
+            executor: ThreadPoolExecutor = MultiQuerySearch._executor
+
+        start: float = time.perf_counter()
+        futures: Dict[str, Future] = {
+            name: executor.submit(self._search, query) for name, query in variants.items()
+        }
+        results: Dict[str, Tuple[Optional[List[Dict[str, Any]]], float]] = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logging.info("Multi-query search failed", extra={"variant": name, "error_message": str(e)})
+                results[name] = (None, 0.0)
+
+        succeeded: Dict[str, List[Dict[str, Any]]] = {
+            name: value for name, (value, _) in results.items() if value is not None
+        }
+        if not succeeded:
+            self._record(variants, results, [])
+            return None
+
+        # Results are identified by their content, the only field every search backend returns
+        items: Dict[str, Dict[str, Any]] = {}
+        rankings: List[List[str]] = []
+        for value in succeeded.values():
+            ranking: List[str] = []
+            for item in value:
+                key: str = str(item.get(content_key))
+                best: Optional[Dict[str, Any]] = items.get(key)
+                if best is None:
+                    items[key] = dict(item)
+                elif item.get(score_key, 0.0) > best.get(score_key, 0.0):
+                    best[score_key] = item[score_key]
+                ranking.append(key)
+            rankings.append(ranking)
+
+        fused: List[Dict[str, Any]] = []
+        for key, score in reciprocal_rank_fusion(
+            rankings, int(self.search_params.get("rrf_k", DEFAULT_RRF_K)), int(self.search_params.get("k", 5))
+        ):
+            item = items[key]
+            item["@search.fusedScore"] = score
+            fused.append(item)
+
+        fused_keys: List[str] = [str(item.get(content_key)) for item in fused]
+        report: Dict[str, Dict[str, Any]] = self._record(variants, results, fused_keys)
+        logging.info(
+            "Multi-query retrieval completed",
+            extra={
+                "session_id": str(self.conversation_parameters.get("session_id")),
+                "conversation_id": str(self.conversation_parameters.get("conversation_id")),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                "results": len(fused),
+                "variants": report,
+            },
+        )
+        return fused
+
+    def _record(
+        self,
+        variants: Dict[str, str],
+        results: Dict[str, Tuple[Optional[List[Dict[str, Any]]], float]],
+        fused_keys: List[str],
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Builds the contribution report of the variants and adds it to the process-wide counters.
+
+        Args:
+            variants (Dict[str, str]): The queries by variant name.
+            results (Dict[str, Tuple[Optional[List[Dict[str, Any]]], float]]): The results and
+                duration by variant name.
+            fused_keys (List[str]): The content of the fused results, best first.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: By variant: its query, duration, number of results, fused
+                results it retrieved (`contributed`) and fused results only it retrieved (`unique`).
+        """
+        content_key: str = self.search_params.get("content_key", "content")
+        retrieved: Dict[str, set] = {
+            name: {str(item.get(content_key)) for item in value or []} for name, (value, _) in results.items()
+        }
+        report: Dict[str, Dict[str, Any]] = {}
+        for name, query in variants.items():
+            value, duration_ms = results[name]
+            others: set = set().union(*(keys for other, keys in retrieved.items() if other != name))
+            report[name] = {
+                "query": query,
+                "duration_ms": duration_ms,
+                "failed": value is None,
+                "results": len(value or []),
+                "contributed": sum(1 for key in fused_keys if key in retrieved[name]),
+                "unique": sum(1 for key in fused_keys if key in retrieved[name] and key not in others),
+            }
+
+        with MultiQuerySearch._lock:
+            for name, entry in report.items():
+                counters: Dict[str, int] = MultiQuerySearch._metrics.setdefault(
+                    name, {"searches": 0, "failures": 0, "fused_results": 0, "contributed": 0, "unique": 0}
+                )
+                counters["searches"] += 1
+                counters["failures"] += int(entry["failed"])
+                counters["fused_results"] += len(fused_keys)
+                counters["contributed"] += entry["contributed"]
+                counters["unique"] += entry["unique"]
+        return report
+
+    @staticmethod
+    def get_metrics() -> Dict[str, Dict[str, float]]:
+        """
+        Returns the contribution of each variant since the process started. A variant whose
+        `unique_rate` stays near 0 only retrieves what the other variants already find, and can
+        be dropped from `multi_query_variants`.
+
+        Returns:
+            Dict[str, Dict[str, float]]: By variant: the searches, failures, fused results
+                contributed and uniquely contributed, and their share of the fused results.
+        """
+        with MultiQuerySearch._lock:
+            metrics: Dict[str, Dict[str, float]] = {}
+            for name, counters in MultiQuerySearch._metrics.items():
+                metrics[name] = dict(counters)
+                total: int = max(counters["fused_results"], 1)
+                metrics[name]["contribution_rate"] = counters["contributed"] / total
+                metrics[name]["unique_rate"] = counters["unique"] / total
+            return metrics
@@ -0,0 +1,236 @@
+"""
+This module provides the client-side embedding of search queries, with a cache of the embeddings.
+
+A topic whose `ai_search.parameters` set `vector_query: vector` sends Azure AI Search the vector of
+the query (`kind: vector`) instead of its text (`kind: text`), so the search service does not
+vectorize the same popular queries again on every request. The vector is computed with the
+embeddings deployment `embedding_model` of the flow's Azure OpenAI endpoint, and cached by the
+normalized query text.
+
+The cache keeps the most recently used embeddings in memory, up to `QUERY_EMBEDDING_CACHE_SIZE`
+(default 4096), for `QUERY_EMBEDDING_CACHE_TTL_S` seconds (default 86400). If
+`QUERY_EMBEDDING_CACHE_PATH` is set, the embeddings are also stored in a SQLite database at that
+path, shared by the workers and kept across restarts.
+
+Classes:
+    QueryEmbeddingCache: Embeds search queries through an LRU and TTL cache.
+"""
+
+import array
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from helper_classes import metrics
+from helper_classes.single_flight import SingleFlight
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryEmbeddingCache:
+    """
+    Embeds search queries through an LRU and TTL cache keyed by the normalized query text, the
+    embeddings deployment and its endpoint. The normalized text (case-folded, whitespace
+    collapsed) is what is embedded, so a cached vector is the vector of its key.
+
+    A query missing from the memory cache is looked up in the SQLite store, if configured, then
+    embedded. Concurrent misses of the same query share one embeddings request.
+    """
+
+    _entries: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+    _lock: threading.Lock = threading.Lock()
+    _store: Optional[sqlite3.Connection] = None
+    _store_path: Optional[str] = None
+    _store_lock: threading.Lock = threading.Lock()
+    _metrics: Dict[str, float] = {
+        "hits": 0, "store_hits": 0, "misses": 0, "expired": 0, "evictions": 0, "failures": 0,
+        "hit_ms": 0.0, "miss_ms": 0.0,
+    }
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return _WHITESPACE.sub(" ", query).strip().casefold()
+
+    @staticmethod
+    def get_key(endpoint: str, model: str, dimensions: Optional[int], text: str) -> str:
+        return hashlib.sha256(f"{endpoint}\x1f{model}\x1f{dimensions or ''}\x1f{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def embed(
+        custom_connections: Any, model: str, query: str, dimensions: Optional[int] = None
+    ) -> Optional[List[float]]:
+        """
+        Returns the embedding of a search query, from the cache if it holds it.
+
+        Args:
+            custom_connections (Any): The custom connection of the flow's Azure OpenAI endpoint.
+            model (str): The embeddings deployment.
+            query (str): The search query.
+            dimensions (Optional[int]): The number of dimensions requested from the model, if any.
+
+        Returns:
+            Optional[List[float]]: The embedding, or None if the embeddings request failed.
+        """
+        start: float = time.perf_counter()
+        text: str = QueryEmbeddingCache.normalize(query)
+        key: str = QueryEmbeddingCache.get_key(
+            str(custom_connections.configs["llm_api_endpoint"]), model, dimensions, text
+        )
+
+        vector: Optional[List[float]] = QueryEmbeddingCache._get(key)
+        source: str = "hits"
+        if vector is None:
+            vector = QueryEmbeddingCache._load(key)
+            source = "store_hits"
+        if vector is None:
+            source = "misses"
+            try:
+                vector, _ = SingleFlight.group("embedding").do(
+                    key, lambda: QueryEmbeddingCache._request(custom_connections, model, text, dimensions)
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error("Query embedding failed", extra={"model": model, "error_message": str(e)})
+                QueryEmbeddingCache._count(failures=1)
+                metrics.CACHE_REQUESTS.inc(cache="query_embedding", result="error")
+                return None
+            QueryEmbeddingCache._save(key, vector)
+        if source != "hits":
+            QueryEmbeddingCache._put(key, vector)
+
+        duration_ms: float = (time.perf_counter() - start) * 1000
+        QueryEmbeddingCache._count(
+            **{source: 1, "miss_ms" if source == "misses" else "hit_ms": duration_ms}  # type: ignore
+        )
+        metrics.CACHE_REQUESTS.inc(cache="query_embedding", result=source)
+        return vector
+
+    @staticmethod
+    def _request(custom_connections: Any, model: str, text: str, dimensions: Optional[int]) -> List[float]:
+        # Imported here, the client is only needed on a miss
+        from helper_classes.lm_helpers.llm_helper import LLMHelper
+
+        client = LLMHelper.create_pooled_client(custom_connections)
+        options: Dict[str, Any] = {"dimensions": dimensions} if dimensions else {}
+        response = client.embeddings.create(input=[text], model=model, **options)
+        return list(response.data[0].embedding)
+
+    @staticmethod
+    def ttl_seconds() -> float:
+        return float(os.environ.get("QUERY_EMBEDDING_CACHE_TTL_S", "86400"))
+
+    @staticmethod
+    def _get(key: str) -> Optional[List[float]]:
+        with QueryEmbeddingCache._lock:
+            entry: Optional[Tuple[float, List[float]]] = QueryEmbeddingCache._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del QueryEmbeddingCache._entries[key]
+                QueryEmbeddingCache._metrics["expired"] += 1
+                return None
+            QueryEmbeddingCache._entries.move_to_end(key)
+            return entry[1]
+
+    @staticmethod
+    def _put(key: str, vector: List[float]) -> None:
+        max_entries: int = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+        with QueryEmbeddingCache._lock:
+            QueryEmbeddingCache._entries[key] = (time.time() + QueryEmbeddingCache.ttl_seconds(), vector)
+            QueryEmbeddingCache._entries.move_to_end(key)
+            while len(QueryEmbeddingCache._entries) > max_entries:
+                QueryEmbeddingCache._entries.popitem(last=False)
+                QueryEmbeddingCache._metrics["evictions"] += 1
+
+    @staticmethod
+    def _get_store() -> Optional[sqlite3.Connection]:
+        """
+        Returns the connection to the SQLite store of `QUERY_EMBEDDING_CACHE_PATH`, opened on first
+        use, or None if no store is configured. Must be called with the store lock held.
+        """
+        path: str = os.environ.get("QUERY_EMBEDDING_CACHE_PATH", "")
+        if not path:
+            return None
+        if QueryEmbeddingCache._store is None or QueryEmbeddingCache._store_path != path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            store: sqlite3.Connection = sqlite3.connect(path, timeout=1.0, check_same_thread=False)
+            store.execute("PRAGMA journal_mode=WAL")
+            store.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, expires_at REAL, vector BLOB)"
+            )
+            QueryEmbeddingCache._store, QueryEmbeddingCache._store_path = store, path
+        return QueryEmbeddingCache._store
+
+    @staticmethod
+    def _load(key: str) -> Optional[List[float]]:
+        """
+        Reads an embedding from the SQLite store. The vectors are stored as float32.
+        """
+        try:
+            with QueryEmbeddingCache._store_lock:
+                store: Optional[sqlite3.Connection] = QueryEmbeddingCache._get_store()
+                if store is None:
+                    return None
+                row: Optional[Tuple[float, bytes]] = store.execute(
+                    "SELECT expires_at, vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.error("Query embedding store unreadable", extra={"error_message": str(e)})
+            return None
+        if row is None or row[0] <= time.time():
+            return None
+        return array.array("f", row[1]).tolist()
+
+    @staticmethod
+    def _save(key: str, vector: List[float]) -> None:
+        try:
+            with QueryEmbeddingCache._store_lock:
+                store: Optional[sqlite3.Connection] = QueryEmbeddingCache._get_store()
+                if store is None:
+                    return
+                with store:
+                    store.execute(
+                        "INSERT OR REPLACE INTO embeddings (key, expires_at, vector) VALUES (?, ?, ?)",
+                        (key, time.time() + QueryEmbeddingCache.ttl_seconds(), array.array("f", vector).tobytes()),
+                    )
+                    # Expired embeddings are dropped with the writes, so the store does not grow unbounded
+                    store.execute("DELETE FROM embeddings WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logging.error("Query embedding not stored", extra={"error_message": str(e)})
+
+    @staticmethod
+    def clear() -> None:
+        """
+        Empties the memory cache, as after a restart. The SQLite store is kept.
+        """
+        with QueryEmbeddingCache._lock:
+            QueryEmbeddingCache._entries.clear()
+
+    @staticmethod
+    def _count(**counts: float) -> None:
+        with QueryEmbeddingCache._lock:
+            for name, count in counts.items():
+                QueryEmbeddingCache._metrics[name] += count
+
+    @staticmethod
+    def get_metrics() -> Dict[str, float]:
+        """
+        Returns the number of embeddings served from memory, from the store and requested, the hit
+        rate, and the mean time of a hit and of a miss, whose difference is the time a hit saves.
+        """
+        with QueryEmbeddingCache._lock:
+            counters: Dict[str, float] = dict(QueryEmbeddingCache._metrics)
+            counters["entries"] = len(QueryEmbeddingCache._entries)
+        hits: float = counters["hits"] + counters["store_hits"]
+        lookups: float = hits + counters["misses"]
+        hit_ms: float = counters.pop("hit_ms")
+        miss_ms: float = counters.pop("miss_ms")
+        counters["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        counters["mean_hit_ms"] = round(hit_ms / hits, 3) if hits else 0.0
+        counters["mean_miss_ms"] = round(miss_ms / counters["misses"], 3) if counters["misses"] else 0.0
+        return counters
@@ -2,17 +2,37 @@
 This module provides the ResponseHandler class for handling response messages from a language model
 and managing the persistence of function calls to conversation data.
 
+When a completion returns several tool calls, each distinct call is processed and their responses are
+joined in call order. The topic's `tool_calls.policy` chooses how:
+
+    sequential (default): the calls are processed one after the other on the conversation data.
+    parallel: the calls are processed concurrently on a shared pool of `TOOL_CALL_WORKERS` threads
+        (default 4), each on its own copy of the conversation data with its saves deferred. The
+        changes of the calls are then merged in call order, a later call winning on a key two calls
+        changed, and saved once.
+
 Classes:
     ResponseHandler: A class to handle response messages and manage conversation data.
 """
 
-import json
+import copy
 import logging
-from typing import Any, Dict, List, Union
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
 from promptflow.connections import CustomConnection # type: ignore	
 from promptflow.connections import CognitiveSearchConnection # type: ignore
+from helper_classes.conversation_helper.conversation_concurrency import merge_conversation_data
 from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
 from helper_classes.helper_classes_customer.custom_handler import CustomHandler
+from helper_classes.helper_classes_customer.handler_registry import TopicDispatchTable
+from helper_classes.tool_argument_validator import ToolArgumentValidator
+from helper_classes import metrics, serialization
+
+if TYPE_CHECKING:
+    from helper_classes.turn_context import TurnContext
 
 
 class ResponseHandler:
@@ -23,6 +43,13 @@ class ResponseHandler:
     Methods:
         handle_response_message: Handles the response message and processes it.
     """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _lock: threading.Lock = threading.Lock()
+    _metrics: Dict[str, float] = {
+        "single": 0, "sequential": 0, "parallel": 0, "calls": 0, "duplicates": 0,
+        "handler_ms": 0.0, "parallel_ms": 0.0,
+    }
     
     def __init__(
         self,
@@ -30,6 +57,9 @@ class ResponseHandler:
         custom_connections: CustomConnection,
         cognitive_search_connection: CognitiveSearchConnection,
         topic: Dict[str, Any],
+        tool_validators: Optional[Dict[str, ToolArgumentValidator]] = None,
+        dispatch_table: Optional[TopicDispatchTable] = None,
+        turn_context: Optional["TurnContext"] = None,
     ):
         """
         Initializes the ResponseHandler with necessary parameters.
@@ -38,11 +68,19 @@ class ResponseHandler:
             conversation_parameters (Dict[str, Any]): Parameters for the conversation.
             custom_connections (CustomConnection): Custom connections object.
             topic (Dict[str, Any]): The topic object.
+            tool_validators (Optional[Dict[str, ToolArgumentValidator]]): Compiled argument validators
+                keyed by function name. Arguments are not validated if omitted.
+            dispatch_table (Optional[TopicDispatchTable]): The handler dispatch table of the topic,
+                built from the topic if omitted.
+            turn_context (Optional[TurnContext]): The context of the turn, handed to the handlers.
         """
         self.topic: Dict[str, Any] = topic
+        self.tool_validators: Dict[str, ToolArgumentValidator] = tool_validators or {}
+        self.dispatch_table: Optional[TopicDispatchTable] = dispatch_table
         self.custom_connections: CustomConnection = custom_connections
         self.cognitive_search_connection: CognitiveSearchConnection = cognitive_search_connection
         self.conversation_parameters: Dict[str, Any] = conversation_parameters
+        self.turn_context: Optional["TurnContext"] = turn_context
 
     def handle_response_message(
         self,
@@ -70,6 +108,9 @@ class ResponseHandler:
                 first_message,
                 functions_to_persist,
                 conversation_data,
+                self.tool_validators,
+                self.dispatch_table,
+                self.turn_context,
             )
             return processor.process()
 
@@ -77,13 +118,68 @@ class ResponseHandler:
             logging.error("Exception occurred: %s", e)
             return "I'm sorry, I'm having trouble processing your request. Please try again later."
 
+    @staticmethod
+    def get_tool_call_policy(topic: Dict[str, Any]) -> str:
+        """
+        Returns the policy of the topic for the completions returning several tool calls.
+        """
+        return str((topic.get("tool_calls") or {}).get("policy", "sequential"))
+
+    @staticmethod
+    def get_executor() -> ThreadPoolExecutor:
+        """
+        Returns the pool of the tool calls processed in parallel, shared by all turns.
+        """
+        with ResponseHandler._lock:
+            if ResponseHandler._executor is None:
+                ResponseHandler._executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get("TOOL_CALL_WORKERS", "4")), thread_name_prefix="tool-call"
+                )
+            return ResponseHandler._executor
+
+    @staticmethod
+    def merge_responses(responses: List[str]) -> str:
+        """
+        Joins the responses of the tool calls of a completion in call order, skipping the empty and
+        repeated ones.
+        """
+        merged: List[str] = []
+        for response in responses:
+            if response and response not in merged:
+                merged.append(response)
+        return "\n\n".join(merged)
+
+    @staticmethod
+    def _count(**counts: float) -> None:
+        with ResponseHandler._lock:
+            for name, count in counts.items():
+                ResponseHandler._metrics[name] += count
+
+    @staticmethod
+    def get_metrics() -> Dict[str, float]:
+        """
+        Returns the number of completions with a single tool call and with several tool calls processed
+        sequentially or in parallel, the tool calls processed and the repeated calls skipped. For the
+        parallel calls, `saved_ms` is the time spent in the handlers minus the time the turns waited.
+        """
+        with ResponseHandler._lock:
+            counters: Dict[str, float] = dict(ResponseHandler._metrics)
+        handler_ms: float = counters.pop("handler_ms")
+        parallel_ms: float = counters.pop("parallel_ms")
+        counters["saved_ms"] = round(handler_ms - parallel_ms, 3)
+        return counters
+
     class Processor:
         """
         A nested class to process response messages and manage function persistence.
 
         Methods:
             process: Processes the first message and handles function responses.
+            process_tool_calls: Processes the tool calls of a completion returning several.
+            process_in_parallel: Processes tool calls concurrently and merges their changes in call order.
             process_function_response: Processes a function response from the language model.
+            validate_function_arguments: Validates the function arguments and attempts a targeted repair.
+            handle_invalid_arguments: Re-asks the user for the details that are missing or invalid.
             process_function_arguments: Processes the function arguments from the language model response.
             persist_function_to_conversation_data: Persists function arguments to the conversation data if required.
             update_topic_name: Updates the topic name in the conversation data if it has changed.
@@ -103,6 +199,9 @@ class ResponseHandler:
             first_message: object,
             functions_to_persist: List[str],
             conversation_data: Dict[str, Any],
+            tool_validators: Optional[Dict[str, ToolArgumentValidator]] = None,
+            dispatch_table: Optional[TopicDispatchTable] = None,
+            turn_context: Optional["TurnContext"] = None,
         ):
             """
             Initializes the Processor with necessary parameters.
@@ -114,6 +213,10 @@ class ResponseHandler:
                 first_message (object): The first message from the language model.
                 functions_to_persist (List[str]): List of functions to persist.
                 conversation_data (Dict[str, Any]): Data related to the conversation.
+                tool_validators (Optional[Dict[str, ToolArgumentValidator]]): Compiled argument validators.
+                dispatch_table (Optional[TopicDispatchTable]): The handler dispatch table of the topic,
+                    built from the topic when a function completes if not given.
+                turn_context (Optional[TurnContext]): The context of the turn.
             """
             self.conversation_parameters: Dict[str, Any] = conversation_parameters
             self.custom_connections: CustomConnection = custom_connections
@@ -122,6 +225,9 @@ class ResponseHandler:
             self.first_message = first_message
             self.functions_to_persist: List[str] = functions_to_persist
             self.conversation_data = conversation_data
+            self.tool_validators: Dict[str, ToolArgumentValidator] = tool_validators or {}
+            self.dispatch_table: Optional[TopicDispatchTable] = dispatch_table
+            self.turn_context: Optional["TurnContext"] = turn_context
 
         def process(self) -> str:
             """
@@ -130,8 +236,13 @@ class ResponseHandler:
             Returns:
                 str: The processed response.
             """
-            if self.first_message.tool_calls and self.first_message.tool_calls[0].function:  # type: ignore
-                return self.process_function_response(self.first_message.tool_calls[0].function)  # type: ignore
+            tool_calls: List[object] = self.first_message.tool_calls or []  # type: ignore
+            functions: List[object] = [call.function for call in tool_calls if call.function]  # type: ignore
+            if len(functions) > 1:
+                return self.process_tool_calls(functions)
+            if functions:
+                ResponseHandler._count(single=1, calls=1)
+                return self.process_function_response(functions[0])
 
             if self.first_message.content is not None:  # type: ignore
                 return str(self.first_message.content)  # type: ignore
@@ -140,6 +251,134 @@ class ResponseHandler:
                 pass
             return ""
 
+        def process_tool_calls(self, functions: List[object]) -> str:
+            """
+            Processes the tool calls of a completion returning several, with the policy of the topic.
+
+            Args:
+                functions (List[object]): The function objects of the tool calls, in call order.
+
+            Returns:
+                str: The responses of the calls, joined in call order.
+            """
+            # A call the model repeated with the same arguments is processed once
+            distinct: Dict[Tuple[str, str], object] = {}
+            for fn in functions:
+                distinct.setdefault((fn.name, str(fn.arguments)), fn)  # type: ignore
+            calls: List[object] = list(distinct.values())
+
+            policy: str = ResponseHandler.get_tool_call_policy(self.topic)
+            start: float = time.perf_counter()
+            if policy == "parallel":
+                responses, handler_ms = self.process_in_parallel(calls)
+                duration_ms: float = (time.perf_counter() - start) * 1000
+                ResponseHandler._count(parallel_ms=duration_ms, handler_ms=handler_ms)
+            else:
+                policy = "sequential"
+                responses = [self.process_function_response(fn) for fn in calls]
+                duration_ms = (time.perf_counter() - start) * 1000
+
+            duplicates: int = len(functions) - len(calls)
+            ResponseHandler._count(**{policy: 1, "calls": len(calls), "duplicates": duplicates})
+            logging.info(
+                "Tool calls processed",
+                extra={
+                    "session_id": str(self.conversation_parameters.get("session_id")),
+                    "conversation_id": str(self.conversation_parameters.get("conversation_id")),
+                    "policy": policy,
+                    "functions": [fn.name for fn in calls],  # type: ignore
+                    "duplicates": duplicates,
+                    "execution_time_ms": duration_ms,
+                },
+            )
+            return ResponseHandler.merge_responses(responses)
+
+        def process_in_parallel(self, calls: List[object]) -> Tuple[List[str], float]:
+            """
+            Processes tool calls concurrently, each on its own copy of the conversation data and its
+            own context of the turn, with its saves and resets deferred. The changes of the calls are
+            merged into the conversation data in call order, so a later call wins on a key two calls
+            changed, and saved once if a call saved. As when the calls are processed one after the
+            other, a reset drops the changes of the calls before it and the conversation is reset to
+            the reset data with the changes of the calls after it.
+
+            Args:
+                calls (List[object]): The function objects of the tool calls, in call order.
+
+            Returns:
+                Tuple[List[str], float]: The responses in call order, and the time spent in the calls
+                    in milliseconds.
+
+            Raises:
+                Exception: The exception of the first failed call, once the changes of the others are saved.
+            """
+            base: Dict[str, Any] = copy.deepcopy(self.conversation_data)
+            executor: ThreadPoolExecutor = ResponseHandler.get_executor()
+            futures: List[Future] = [
+                executor.submit(self._process_isolated, fn, copy.deepcopy(base)) for fn in calls
+            ]
+
+            responses: List[str] = []
+            merged: Dict[str, Any] = self.conversation_data
+            save_requested: bool = False
+            reset_requested: bool = False
+            handler_ms: float = 0.0
+            error: Optional[Exception] = None
+            for fn, future in zip(calls, futures):
+                try:
+                    response, conversation_data, deferred, duration_ms, call_context = future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("Tool call failed: %s: %s", fn.name, e)  # type: ignore
+                    error = error or e
+                    continue
+                responses.append(response)
+                if deferred["reset"] is not None:
+                    merged = dict(deferred["reset"])
+                    reset_requested = True
+                else:
+                    merged = merge_conversation_data(base, conversation_data, merged)
+                save_requested = save_requested or deferred["requested"]
+                handler_ms += duration_ms
+                if self.turn_context is not None and call_context is not None:
+                    self.turn_context.merge_call_context(call_context)
+
+            self.conversation_data.clear()
+            self.conversation_data.update(merged)
+            if reset_requested:
+                self.reset_conversation_data()
+            elif save_requested:
+                self.save_conversation_data()
+            if error is not None:
+                raise error
+            return responses, handler_ms
+
+        def _process_isolated(
+            self, fn: object, conversation_data: Dict[str, Any]
+        ) -> Tuple[str, Dict[str, Any], Dict[str, Any], float, Optional["TurnContext"]]:
+            """
+            Processes a tool call on its own copy of the conversation data and its own context of the
+            turn, with its saves and resets deferred. Runs on the tool call pool.
+            """
+            call_context: Optional["TurnContext"] = None
+            if self.turn_context is not None:
+                call_context = self.turn_context.create_call_context(conversation_data)
+            processor = ResponseHandler.Processor(
+                self.conversation_parameters,
+                self.custom_connections,
+                self.cognitive_search_connection,
+                self.topic,
+                self.first_message,
+                self.functions_to_persist,
+                conversation_data,
+                self.tool_validators,
+                self.dispatch_table,
+                call_context,
+            )
+            start: float = time.perf_counter()
+            with ConversationDataHelper.deferred_saves() as deferred:
+                response: str = processor.process_function_response(fn)
+            return response, conversation_data, deferred, (time.perf_counter() - start) * 1000, call_context
+
         def process_function_response(self, fn: object) -> str:
             """
             Processes a function response from the language model.
@@ -150,11 +389,86 @@ class ResponseHandler:
             Returns:
                 str: The processed response.
             """
-            self.persist_function_to_conversation_data(fn)
+            fn_name: str = fn.name  # type: ignore
+
+            # Parse the arguments once, they are shared by persistence and dispatch
+            arguments: Optional[Dict[str, Any]] = ToolArgumentValidator.parse_arguments(
+                str(fn.arguments)  # type: ignore
+            )
+            validator: Optional[ToolArgumentValidator] = self.tool_validators.get(fn_name)
+            if arguments is None:
+                logging.warning("Invalid JSON arguments for function %s", fn_name)
+                return self.handle_invalid_arguments(fn, validator, {})
+
+            if validator is not None:
+                arguments, errors = self.validate_function_arguments(validator, arguments)
+                if errors:
+                    logging.warning("Invalid arguments for function %s: %s", fn_name, errors)
+                    return self.handle_invalid_arguments(fn, validator, arguments)
+
+            self.persist_function_to_conversation_data(fn, arguments)
+            return self.process_function_arguments(fn_name, arguments)
+
+        def validate_function_arguments(
+            self, validator: ToolArgumentValidator, arguments: Dict[str, Any]
+        ) -> Tuple[Dict[str, Any], List[str]]:
+            """
+            Validates the function arguments against the tool schema. Invalid arguments get a
+            targeted repair: missing required fields are filled from the arguments already known
+            for the conversation and scalar values are coerced to the declared type.
+
+            Args:
+                validator (ToolArgumentValidator): The compiled validator of the function.
+                arguments (Dict[str, Any]): The parsed arguments of the function.
+
+            Returns:
+                Tuple[Dict[str, Any], List[str]]: The (possibly repaired) arguments and the remaining errors.
+            """
+            errors: List[str] = validator.validate(arguments)
+            if not errors:
+                return arguments, []
+
+            repaired: Dict[str, Any] = validator.repair(arguments, self.conversation_data.get("arguments", {}))
+            remaining_errors: List[str] = validator.validate(repaired)
+            metrics.RETRIES.inc(
+                operation="tool_arguments", outcome="failed" if remaining_errors else "repaired"
+            )
+            if not remaining_errors:
+                logging.info("Repaired arguments for function %s: %s", validator.name, errors)
+            return repaired, remaining_errors
+
+        def handle_invalid_arguments(
+            self, fn: object, validator: Optional[ToolArgumentValidator], arguments: Dict[str, Any]
+        ) -> str:
+            """
+            Re-asks the user for the details that are missing or invalid instead of dispatching the
+            function. The valid arguments are persisted, so the next turn only has to supply the rest.
 
-            fn_args: str = str(fn.arguments)  # type: ignore
-            arguments: Dict[str, Any] = json.loads(fn_args)
-            return self.process_function_arguments(fn.name, arguments)  # type: ignore
+            Args:
+                fn (object): The function object from the language model response.
+                validator (Optional[ToolArgumentValidator]): The compiled validator of the function.
+                arguments (Dict[str, Any]): The parsed arguments of the function.
+
+            Returns:
+                str: The message asking the user for the missing details.
+            """
+            if validator is None:
+                return "I'm sorry, I didn't quite catch that. Could you please rephrase your request?"
+
+            valid_arguments: Dict[str, Any] = {
+                key: value
+                for key, value in arguments.items()
+                if value is not None and not validator.validate_property(key, value)
+            }
+            self.persist_function_to_conversation_data(fn, valid_arguments)
+
+            missing: List[str] = validator.missing_required(valid_arguments)
+            if not missing:
+                return "I'm sorry, I didn't quite catch that. Could you please rephrase your request?"
+
+            return "To help you with that, I need a few more details: " + ", ".join(
+                validator.describe(key) for key in missing
+            ) + "."
         
         def process_response_dictionary(self, fn_name: str, response: Dict[str, Any]) -> str:
             """
@@ -202,18 +516,23 @@ class ResponseHandler:
 
             return self.process_function_property(fn_name, arguments)
 
-        def persist_function_to_conversation_data(self, fn: object) -> None:
+        def persist_function_to_conversation_data(
+            self, fn: object, arguments: Optional[Dict[str, Any]] = None
+        ) -> None:
             """
             Persists function arguments to the conversation data if required.
 
             Args:
                 fn (object): The function object from the language model response.
+                arguments (Optional[Dict[str, Any]]): The parsed arguments, parsed from `fn` if omitted.
             """
             if fn.name in self.functions_to_persist:  # type: ignore
                 if "arguments" not in self.conversation_data:
                     self.conversation_data["arguments"] = {}
 
-                fn_args = json.loads(fn.arguments)  # type: ignore
+                fn_args: Dict[str, Any] = arguments if arguments is not None else serialization.loads(
+                    fn.arguments  # type: ignore
+                )
                 cd_args: Dict[str, str] = self.conversation_data["arguments"]
                 for key, value in fn_args.items():
                     key: str
@@ -291,13 +610,29 @@ class ResponseHandler:
 
         def save_conversation_data(self):
             """
-            Saves the conversation data using the ConversationDataHelper.
+            Saves the conversation data using the ConversationDataHelper of the turn.
             """
+            if self.turn_context is not None:
+                self.turn_context.save_conversation_data(self.conversation_data)
+                return
+
             cd_helper: ConversationDataHelper = ConversationDataHelper(
                 self.conversation_data
             )
             cd_helper.save_conversation_data(self.conversation_data)
 
+        def reset_conversation_data(self):
+            """
+            Resets the conversation to the conversation data, for a reset requested by a tool call
+            processed in parallel.
+            """
+            cd_helper: ConversationDataHelper = (
+                self.turn_context.data_helper
+                if self.turn_context is not None
+                else ConversationDataHelper(self.conversation_parameters)
+            )
+            cd_helper.reset_conversation_data(self.conversation_data)
+
         def process_completed_function(self, fn_name: str) -> Union[str, None]:
             """
             Processes the completed function based on the business logic defined in the topic.
@@ -308,30 +643,19 @@ class ResponseHandler:
             Returns:
                 Union[str, None]: The processed response or None.
             """
-            topic_business_logic: List[Dict[str, Any]] = self.topic.get(
-                "follow_on_business_logic", []
-            )
-            # This searches the list of business logic rules to find a rule that matches the given function name (fn_name). 
-            # If found, it assigns the rule to business_logic_for_function, otherwise, it assigns None.
-            business_logic_for_function: Union[Dict[str, Any], None] = next(
-                (obj for obj in topic_business_logic if obj["name"] == fn_name), None)
-            
-            # Check for Valid Action
-            # If no matching business logic is found or if the "action" key is missing 
-            # in the found rule, the method returns None.
-            if (not business_logic_for_function or "action" not in business_logic_for_function):
+            # The dispatch table maps function names to the handlers of the topic, built once per topic.
+            # Without one (the topic's is invalid) it is built here, raising the error of the topic
+            dispatch_table: TopicDispatchTable = self.dispatch_table or TopicDispatchTable(self.topic)
+            method_name: Union[str, None] = dispatch_table.get_method_name(fn_name)
+            if method_name is None:
                 return None
 
-            action: Dict[str, Any] = business_logic_for_function["action"]
-            action_type: str = action.get("type", "")
-            if action_type == "custom_handler":
-                method_name: str = action.get("method_name", "")
-                ch: CustomHandler = CustomHandler(
-                    self.conversation_parameters,
-                    self.custom_connections,
-                    self.cognitive_search_connection, # type: ignore
-                    self.conversation_data,
-                    self.topic,
-                )
-                method = getattr(ch, method_name)
-                return method()
+            ch: CustomHandler = CustomHandler(
+                self.conversation_parameters,
+                self.custom_connections,
+                self.cognitive_search_connection, # type: ignore
+                self.conversation_data,
+                self.topic,
+                self.turn_context,
+            )
+            return ch.handle(method_name)
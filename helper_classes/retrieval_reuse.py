@@ -0,0 +1,237 @@
+"""
+This module provides the reuse of the search results of the previous Q&A turn of a conversation
+by its follow-up questions ("and in blue?"), which usually need the same chunks.
+
+Classes:
+    RetrievalReuse: Decides whether a Q&A turn reuses, supplements or replaces the previous retrieval.
+"""
+
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from helper_classes import metrics
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+
+_TERMS = re.compile(r"\w+")
+
+# Words that carry no topic, ignored by the similarity test
+STOP_WORDS: Set[str] = {
+    "the", "and", "for", "you", "your", "are", "was", "were", "have", "has", "had", "what", "which",
+    "who", "how", "when", "where", "why", "does", "did", "can", "could", "would", "should", "will",
+    "with", "about", "this", "that", "these", "those", "there", "any", "some", "also", "too", "please",
+    "tell", "more", "like", "from", "into", "its", "they", "them", "then", "than", "not", "but", "all",
+    "available", "come", "comes", "get", "got", "one", "ones", "show", "want", "need", "know",
+}
+
+
+class RetrievalReuse:
+    """
+    Decides whether a Q&A turn reuses, supplements or replaces the search results of the previous
+    Q&A turn of the conversation.
+
+    The results of the last Q&A turn are stored in the conversation data under `_retrieval`, with
+    their query. The similarity of a new query is the share of its terms (stop words removed)
+    found in the previous query or in the previous results, i.e. how much of the new question the
+    previous retrieval already covers:
+
+        reuse: the similarity reaches `reuse_threshold`, the previous results are used as they are;
+        supplement: it reaches `supplement_threshold`, a smaller search (`supplement_k` results)
+            adds the chunks about the new terms to the previous results;
+        search: the turn runs a full search.
+
+    Parameters read from `ai_search.parameters`:
+        retrieval_reuse: Enables the reuse (default false).
+        reuse_threshold: Default 0.8.
+        supplement_threshold: Default 0.5.
+        supplement_k: Number of results of the supplementary search (default 2).
+        reuse_max_age_s: Previous results older than this are not reused (default 600).
+    """
+
+    KEY: str = ConversationDataHelper.RETRIEVAL_KEY
+    REUSE: str = "reuse"
+    SUPPLEMENT: str = "supplement"
+    SEARCH: str = "search"
+
+    _metrics: Dict[str, int] = {REUSE: 0, SUPPLEMENT: 0, SEARCH: 0}
+    _lock: threading.Lock = threading.Lock()
+
+    def __init__(
+        self,
+        conversation_data: Dict[str, Any],
+        conversation_parameters: Dict[str, Any],
+        ai_search_config: Dict[str, Any],
+    ):
+        """
+        Initializes the RetrievalReuse.
+
+        Args:
+            conversation_data (Dict[str, Any]): The conversation data, with the query of the turn in
+                `arguments.query`.
+            conversation_parameters (Dict[str, Any]): The conversation parameters.
+            ai_search_config (Dict[str, Any]): The `ai_search` configuration of the topic.
+        """
+        self.conversation_data = conversation_data
+        self.conversation_parameters = conversation_parameters
+        self.ai_search_config = ai_search_config
+        self.search_params: Dict[str, Any] = ai_search_config["parameters"]
+        self.query: str = str(conversation_data["arguments"]["query"])
+        self.content_key: str = self.search_params.get("content_key", "content")
+        self.score_key: str = self.search_params.get("score_key", "@search.rerankerScore")
+
+    @staticmethod
+    def is_enabled(ai_search_config: Dict[str, Any]) -> bool:
+        """
+        Returns whether the `ai_search` configuration of a topic enables the reuse.
+        """
+        return bool(ai_search_config["parameters"].get("retrieval_reuse", False))
+
+    @staticmethod
+    def get_terms(text: str) -> Set[str]:
+        return {term for term in _TERMS.findall(text.lower()) if len(term) > 2 and term not in STOP_WORDS}
+
+    def get_source(self) -> str:
+        """
+        Returns the index the results come from, so results are not reused across indexes or selections.
+        """
+        index_details: Dict[str, Any] = self.ai_search_config["index_details"]
+        return "/".join(
+            str(part)
+            for part in (
+                self.ai_search_config.get("backend", "azure"),
+                index_details.get("endpoint") or index_details.get("service_name"),
+                index_details.get("index_name"),
+                self.search_params.get("select", "content"),
+            )
+        )
+
+    def get_previous(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns the stored retrieval of the previous Q&A turn, if it can still be reused.
+        """
+        previous: Optional[Dict[str, Any]] = self.conversation_data.get(self.KEY)
+        if not previous or previous.get("source") != self.get_source():
+            return None
+        max_age_s: float = float(self.search_params.get("reuse_max_age_s", 600))
+        if time.time() - float(previous.get("retrieved_at", 0)) > max_age_s:
+            return None
+        return previous
+
+    def similarity(self, previous: Dict[str, Any]) -> float:
+        """
+        Returns the share of the terms of the query found in the previous query or results.
+
+        Args:
+            previous (Dict[str, Any]): The stored retrieval of the previous turn.
+
+        Returns:
+            float: The similarity, from 0 to 1.
+        """
+        terms: Set[str] = self.get_terms(self.query)
+        if not terms:
+            return 0.0
+        known: Set[str] = self.get_terms(str(previous.get("query", "")))
+        for item in previous.get("results", []):
+            known |= self.get_terms(str(item.get(self.content_key, "")))
+        return len(terms & known) / len(terms)
+
+    def decide(self) -> str:
+        """
+        Decides whether the turn reuses, supplements or replaces the previous retrieval, and logs the
+        decision with the similarity, so the thresholds can be tuned.
+
+        Returns:
+            str: `reuse`, `supplement` or `search`.
+        """
+        if not self.is_enabled(self.ai_search_config):
+            return self.SEARCH
+
+        previous: Optional[Dict[str, Any]] = self.get_previous()
+        similarity: float = self.similarity(previous) if previous else 0.0
+        decision: str = self.SEARCH
+        if previous and similarity >= float(self.search_params.get("reuse_threshold", 0.8)):
+            decision = self.REUSE
+        elif previous and similarity >= float(self.search_params.get("supplement_threshold", 0.5)):
+            decision = self.SUPPLEMENT
+
+        with RetrievalReuse._lock:
+            RetrievalReuse._metrics[decision] += 1
+        metrics.CACHE_REQUESTS.inc(cache="retrieval", result=decision)
+        logging.info(
+            "Retrieval reuse decision",
+            extra={
+                "session_id": str(self.conversation_parameters.get("session_id")),
+                "conversation_id": str(self.conversation_parameters.get("conversation_id")),
+                "decision": decision,
+                "similarity": round(similarity, 3),
+                "query": self.query,
+                "previous_query": previous.get("query") if previous else None,
+                "previous_age_s": (
+                    round(time.time() - float(previous["retrieved_at"]), 1) if previous else None
+                ),
+            },
+        )
+        return decision
+
+    def get_previous_results(self) -> List[Dict[str, Any]]:
+        previous: Optional[Dict[str, Any]] = self.get_previous()
+        return list(previous["results"]) if previous else []
+
+    def get_supplement_config(self) -> Dict[str, Any]:
+        """
+        Returns the `ai_search` configuration of the supplementary search: the topic's, with
+        `supplement_k` results and without multi-query retrieval.
+        """
+        k: int = int(self.search_params.get("supplement_k", 2))
+        return {**self.ai_search_config, "parameters": {**self.search_params, "k": k, "multi_query": False}}
+
+    def supplement(self, results: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Merges the results of the supplementary search into the previous results.
+
+        Args:
+            results (Optional[List[Dict[str, Any]]]): The results of the supplementary search, None if
+                it failed.
+
+        Returns:
+            List[Dict[str, Any]]: The previous and new results, without duplicates, best score
+                first, up to the `k` of the topic.
+        """
+        merged: Dict[str, Dict[str, Any]] = {}
+        for item in self.get_previous_results() + list(results or []):
+            key: str = str(item.get(self.content_key))
+            if key not in merged or item.get(self.score_key, 0.0) > merged[key].get(self.score_key, 0.0):
+                merged[key] = item
+        ranked: List[Dict[str, Any]] = sorted(
+            merged.values(), key=lambda item: -item.get(self.score_key, 0.0)
+        )
+        return ranked[: int(self.search_params.get("k", 5))]
+
+    def remember(self, results: List[Dict[str, Any]]) -> None:
+        """
+        Stores the results of a turn that searched in the conversation data, for the next Q&A turn.
+        Only the content and score of each result are kept. A turn reusing the previous results
+        does not store them again, so they are not reused past `reuse_max_age_s` after their search.
+
+        Args:
+            results (List[Dict[str, Any]]): The results the turn answered from.
+        """
+        self.conversation_data[self.KEY] = {
+            "query": self.query,
+            "source": self.get_source(),
+            "retrieved_at": time.time(),
+            "results": [
+                {self.content_key: item.get(self.content_key), self.score_key: item.get(self.score_key, 0.0)}
+                for item in results
+            ],
+        }
+
+    @staticmethod
+    def get_metrics() -> Dict[str, int]:
+        """
+        Returns the number of Q&A turns that reused, supplemented and replaced the previous retrieval.
+        """
+        with RetrievalReuse._lock:
+            return dict(RetrievalReuse._metrics)
@@ -5,12 +5,19 @@ Classes:
     SearchAiExecutor: A class to execute search AI requests and log the results.
 """
 
-import json
 import logging
-from typing import Any, Union
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Optional, Union
 import uuid
 import traceback
-import requests
+from helper_classes import metrics, serialization
+from helper_classes.log_pipeline import LazyValue
+from helper_classes.single_flight import SingleFlight
+
+if TYPE_CHECKING:
+    import requests
 
 class SearchAiExecutor:
     """
@@ -24,6 +31,11 @@ class SearchAiExecutor:
         conversation_id (uuid.UUID): The conversation ID for the request.
     """
 
+    _session: Optional["requests.Session"] = None
+    _session_lock: threading.Lock = threading.Lock()
+
+    pool_maxsize: int = int(os.environ.get("SEARCH_POOL_MAXSIZE", "32"))
+
     def __init__(self, endpoint: str, headers: dict[str, str], payload: dict[str, Any], session_id: uuid.UUID, conversation_id: uuid.UUID):
         """
         Initializes the SearchAiExecutor with the provided parameters.
@@ -41,20 +53,71 @@ class SearchAiExecutor:
         self.session_id: uuid.UUID = session_id
         self.conversation_id: uuid.UUID = conversation_id
 
-    def execute(self) -> Union[requests.Response, None]:
+    @staticmethod
+    def get_session() -> "requests.Session":
+        """
+        Returns the HTTP session shared by all searches, creating it on first use. The session keeps
+        up to `SEARCH_POOL_MAXSIZE` connections per search service alive between turns, so a search
+        does not pay for DNS resolution and the TLS handshake again.
+
+        Returns:
+            requests.Session: The shared session.
+        """
+        session = SearchAiExecutor._session
+        if session is None:
+            # Imported on first use to keep it off the worker's import path
+            import requests
+
+            with SearchAiExecutor._session_lock:
+                session = SearchAiExecutor._session
+                if session is None:
+                    session = requests.Session()
+                    pool_maxsize: int = SearchAiExecutor.pool_maxsize
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=pool_maxsize, pool_maxsize=pool_maxsize
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    SearchAiExecutor._session = session
+        return session
+
+    def get_loggable_payload(self) -> dict[str, Any]:
+        """
+        Returns the payload to log, with the query vectors replaced by their dimensions. Called by the
+        logging pipeline only if the record is sampled.
+        """
+        vector_queries: list[dict[str, Any]] = self.payload.get("vectorQueries") or []
+        if not any("vector" in vector_query for vector_query in vector_queries):
+            return self.payload
+        return {
+            **self.payload,
+            "vectorQueries": [
+                {**vector_query, "vector": f"<{len(vector_query['vector'])} dimensions>"}
+                if "vector" in vector_query else vector_query
+                for vector_query in vector_queries
+            ],
+        }
+
+    def execute(self) -> Union["requests.Response", None]:
         """
         Executes the search AI request and logs the results.
 
         Returns:
             Union[requests.Response, None]: The response from the search AI request, or None if an exception occurred.
         """
-
+        start_time: float = time.perf_counter()
         try:
-            response: requests.Response = requests.post(
-                self.endpoint,
-                headers=self.headers,
-                data=json.dumps(self.payload),
-                timeout=30
+            # Concurrent identical searches (same endpoint, credentials and payload) share one request
+            key: str = SingleFlight.request_key(self.endpoint, self.headers, self.payload)
+            response: "requests.Response"
+            response, shared = SingleFlight.group("search").do(
+                key,
+                lambda: SearchAiExecutor.get_session().post(
+                    self.endpoint,
+                    headers=self.headers,
+                    data=serialization.dumps_bytes(self.payload),
+                    timeout=30
+                ),
             )
 
             success: bool = response.status_code == 200
@@ -63,12 +126,18 @@ class SearchAiExecutor:
             log_data = {
                 "session_id": str(self.session_id),
                 "conversation_id": str(self.conversation_id),
-                "payload": self.payload,
+                "payload": LazyValue(self.get_loggable_payload),
                 "success": success,
-                "error_message": error_message
+                "error_message": error_message,
+                "shared": shared
             }
 
             logging.info("Execution completed", extra=log_data)
+            metrics.SEARCH_SECONDS.observe(
+                time.perf_counter() - start_time,
+                outcome="ok" if success else "error",
+                shared=str(shared).lower(),
+            )
 
             return response
 
@@ -76,9 +145,10 @@ class SearchAiExecutor:
             log_data = {
                 "session_id": str(self.session_id),
                 "conversation_id": str(self.conversation_id),
-                "payload": self.payload,
+                "payload": LazyValue(self.get_loggable_payload),
                 "error": "".join(traceback.format_exception(None, e, e.__traceback__))
             }
             logging.error("Failure occurred", extra=log_data)
+            metrics.SEARCH_SECONDS.observe(time.perf_counter() - start_time, outcome="error", shared="false")
 
             return None
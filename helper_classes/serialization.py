@@ -0,0 +1,171 @@
+"""
+Module serialization
+This module provides the JSON serialization used on the path of a turn: the conversation
+parameters, the conversation data stored and embedded in the prompt, the search payloads and
+responses, and the tool call arguments.
+
+The backend is orjson when it is installed and the standard library otherwise. `JSON_BACKEND`
+(`auto`, `orjson` or `json`) forces one. Both backends write compact UTF-8 JSON, so the prompts
+and the request hashes do not depend on the backend. A value orjson cannot encode (non-string
+keys, integers over 64 bits) or decode (NaN, lone surrogates) goes through the standard library,
+so both accept the same values.
+
+Classes:
+    StdlibJsonBackend: The standard library backend.
+    OrjsonBackend: The orjson backend.
+
+Functions:
+    dumps: Serializes a value to a string.
+    dumps_bytes: Serializes a value to UTF-8 bytes.
+    loads: Deserializes a string or bytes.
+    get_backend: Returns the name of the backend in use.
+    set_backend: Selects the backend.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Callable, Optional, Union
+
+JSONDecodeError = json.JSONDecodeError
+
+
+class StdlibJsonBackend:
+    """
+    The standard library backend.
+    """
+
+    NAME: str = "json"
+
+    @staticmethod
+    def dumps_bytes(value: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        return StdlibJsonBackend.dumps(value, sort_keys, default).encode("utf-8")
+
+    @staticmethod
+    def dumps(value: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+        return json.dumps(value, sort_keys=sort_keys, default=default, separators=(",", ":"), ensure_ascii=False)
+
+    @staticmethod
+    def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+
+class OrjsonBackend:
+    """
+    The orjson backend, with the standard library for the values orjson rejects.
+    """
+
+    NAME: str = "orjson"
+
+    @staticmethod
+    def dumps_bytes(value: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        import orjson
+
+        try:
+            return orjson.dumps(value, default=default, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+        except TypeError:
+            return StdlibJsonBackend.dumps_bytes(value, sort_keys, default)
+
+    @staticmethod
+    def dumps(value: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+        return OrjsonBackend.dumps_bytes(value, sort_keys, default).decode("utf-8")
+
+    @staticmethod
+    def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        import orjson
+
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Raises the standard library's error if the document is invalid for both
+            return StdlibJsonBackend.loads(data)
+
+
+def _select_backend(name: str) -> Any:
+    """
+    Returns the backend named `auto`, `orjson` or `json`; `auto` is orjson when it is installed.
+    """
+    name = name.lower()
+    if name not in ("auto", OrjsonBackend.NAME, StdlibJsonBackend.NAME):
+        raise ValueError(f"Unknown JSON backend: {name}")
+    if name == StdlibJsonBackend.NAME:
+        return StdlibJsonBackend
+    try:
+        import orjson  # noqa: F401  # pylint: disable=unused-import
+    except ImportError:
+        if name == OrjsonBackend.NAME:
+            logging.warning("JSON_BACKEND is orjson but orjson is not installed, using json")
+        return StdlibJsonBackend
+    return OrjsonBackend
+
+
+_backend: Any = _select_backend(os.environ.get("JSON_BACKEND", "auto"))
+
+
+def set_backend(name: str) -> str:
+    """
+    Selects the backend.
+
+    Args:
+        name (str): `auto`, `orjson` or `json`.
+
+    Returns:
+        str: The name of the backend selected, `json` if orjson is requested but not installed.
+    """
+    global _backend  # pylint: disable=global-statement
+    _backend = _select_backend(name)
+    return _backend.NAME
+
+
+def get_backend() -> str:
+    """
+    Returns the name of the backend in use, `orjson` or `json`.
+    """
+    return _backend.NAME
+
+
+def dumps(value: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """
+    Serializes a value to compact JSON.
+
+    Args:
+        value (Any): The value.
+        sort_keys (bool): Whether the keys of the objects are sorted.
+        default (Optional[Callable[[Any], Any]]): Converts the values JSON cannot represent.
+
+    Returns:
+        str: The JSON document, with the non-ASCII characters unescaped.
+    """
+    return _backend.dumps(value, sort_keys, default)
+
+
+def dumps_bytes(value: Any, sort_keys: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """
+    Serializes a value to compact JSON encoded in UTF-8, for request bodies and files.
+
+    Args:
+        value (Any): The value.
+        sort_keys (bool): Whether the keys of the objects are sorted.
+        default (Optional[Callable[[Any], Any]]): Converts the values JSON cannot represent.
+
+    Returns:
+        bytes: The JSON document.
+    """
+    return _backend.dumps_bytes(value, sort_keys, default)
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """
+    Deserializes a JSON document. Bytes are decoded by the backend, so a response body or a file
+    does not need to be decoded to a string first.
+
+    Args:
+        data (Union[str, bytes, bytearray, memoryview]): The JSON document.
+
+    Returns:
+        Any: The value.
+
+    Raises:
+        JSONDecodeError: The document is not valid JSON.
+    """
+    return _backend.loads(data)
@@ -0,0 +1,157 @@
+"""
+This module provides single-flight deduplication of concurrent identical requests.
+
+When several turns issue the same request at the same time (e.g. the same product question
+during a promotion), the first caller performs it and the concurrent duplicates wait for it and
+share its result or exception. Nothing is kept once the request completes: this is not a cache,
+a request issued after the first one completed is performed again.
+
+Classes:
+    SingleFlight: A group of in-flight requests keyed by a canonical request hash.
+"""
+
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from helper_classes import serialization
+
+T = TypeVar("T")
+
+
+class _Call:
+    """
+    A request in flight, with the result or exception shared with its duplicates.
+    """
+
+    def __init__(self):
+        self.done: threading.Event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.duplicates: int = 0
+
+
+class SingleFlight:
+    """
+    A group of in-flight requests keyed by a canonical request hash. Groups are named after the
+    requests they collapse (`search`, `completion`) and shared process-wide through `group`.
+
+    Set `SINGLE_FLIGHT=0` to disable the deduplication; every caller then performs its request.
+    """
+
+    _groups: Dict[str, "SingleFlight"] = {}
+    _groups_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self._calls: Dict[str, _Call] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self._metrics: Dict[str, int] = {
+            "calls": 0, "executed": 0, "collapsed": 0, "errors": 0, "max_duplicates": 0
+        }
+
+    @staticmethod
+    def group(name: str) -> "SingleFlight":
+        """
+        Returns the process-wide group of a name, creating it on first use.
+
+        Args:
+            name (str): The group name.
+
+        Returns:
+            SingleFlight: The group.
+        """
+        group: Optional[SingleFlight] = SingleFlight._groups.get(name)
+        if group is None:
+            with SingleFlight._groups_lock:
+                group = SingleFlight._groups.setdefault(name, SingleFlight(name))
+        return group
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return os.environ.get("SINGLE_FLIGHT", "1") != "0"
+
+    @staticmethod
+    def request_key(*parts: Any) -> str:
+        """
+        Returns the canonical hash of a request: its parts serialized as JSON with sorted keys,
+        so payloads built in a different key order collapse together.
+
+        Args:
+            *parts (Any): The parts identifying the request (endpoint, payload, model, messages...).
+
+        Returns:
+            str: The request hash.
+        """
+        canonical: bytes = serialization.dumps_bytes(parts, sort_keys=True, default=str)
+        return hashlib.sha256(canonical).hexdigest()
+
+    def do(self, key: str, function: Callable[[], T]) -> Tuple[T, bool]:
+        """
+        Performs a request, or waits for the identical request already in flight and shares its outcome.
+
+        Args:
+            key (str): The request hash, see `request_key`.
+            function (Callable[[], T]): Performs the request.
+
+        Returns:
+            Tuple[T, bool]: The result, and whether it was shared from another caller's request.
+
+        Raises:
+            BaseException: The exception raised by the request, re-raised in every caller sharing it.
+        """
+        if not SingleFlight.is_enabled():
+            with self._lock:
+                self._metrics["calls"] += 1
+                self._metrics["executed"] += 1
+            return function(), False
+
+        with self._lock:
+            self._metrics["calls"] += 1
+            call: Optional[_Call] = self._calls.get(key)
+            leader: bool = call is None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._metrics["executed"] += 1
+            else:
+                call.duplicates += 1
+                self._metrics["collapsed"] += 1
+                self._metrics["max_duplicates"] = max(self._metrics["max_duplicates"], call.duplicates)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._metrics["errors"] += 1
+            raise
+        finally:
+            # Removed before waking the duplicates, so later requests are performed afresh
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    @staticmethod
+    def get_metrics() -> Dict[str, Dict[str, int]]:
+        """
+        Returns the counters of each group: the calls, the requests executed, the calls collapsed
+        into a request in flight, the failed requests, the most duplicates of one request and the
+        requests in flight.
+
+        Returns:
+            Dict[str, Dict[str, int]]: The counters by group name.
+        """
+        metrics: Dict[str, Dict[str, int]] = {}
+        for name, group in list(SingleFlight._groups.items()):
+            with group._lock:
+                metrics[name] = {**group._metrics, "in_flight": len(group._calls)}
+        return metrics
@@ -0,0 +1,366 @@
+"""
+This module provides the startup path of the flow worker.
+
+Heavy modules (the OpenAI client, requests, YAML and the handler modules) are imported on first use
+by the helpers. To keep the first request of a fresh worker from paying for them, `start_prewarm`
+imports them, builds a throwaway client (which pulls in the HTTP transport modules the OpenAI client
+imports lazily), loads the flow bundle or the content safety prompt, and loads and compiles the topic
+areas of every persona in the TopicRegistry (within its memory cap) on a background thread when the
+flow module is imported. The pre-warm can be disabled by setting `FLOW_PREWARM=0`.
+
+The connections of the flow are only handed to the tool with each request. When
+`FLOW_WARMUP_CONNECTIONS` tells the pre-warm where to get them (`promptflow` for the local
+Prompt Flow connection store, or `module:function` returning the custom connection and the search
+connection), the pre-warm also builds the pooled clients and opens a connection to the Azure OpenAI
+endpoint and to each Azure AI Search service of the topics with a cheap request, so the first turns
+do not pay for DNS resolution and the TLS handshakes.
+
+The pre-warm also starts the expiry of idle conversations (`ConversationSweeper`), which the first
+turn starts instead when the pre-warm is disabled.
+
+The worker is ready once the pre-warm has completed, failed steps included. `FLOW_READY_FILE` names
+a file written at that point, for the readiness probe of the host.
+
+Functions:
+    configure_logging: Configures the root logger of the worker and installs the logging pipeline.
+    start_prewarm: Starts the background pre-warm, once per process.
+    start_sweeper: Starts the expiry of idle conversations, once per process.
+    prewarm: Imports the deferred modules, loads the configs and warms the connections.
+    resolve_connections: Returns the connections to warm, from `FLOW_WARMUP_CONNECTIONS`.
+    warm_up_connections: Builds the pooled clients and connects them to their endpoints.
+    is_ready: Returns whether the pre-warm has completed.
+    wait_until_ready: Waits for the pre-warm to complete.
+    get_readiness: Returns the readiness, failed steps and timings of the pre-warm.
+    get_prewarm_timings: Returns the duration of each pre-warm step.
+"""
+
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+from helper_classes.config_file_cache import ConfigFileCache
+from helper_classes.log_pipeline import LogPipeline
+from helper_classes.topic_helper.flow_bundle import FlowBundle
+from helper_classes.topic_helper.topic_registry import TopicRegistry
+
+# Modules imported on first use by the helpers, pre-imported by the pre-warm
+DEFERRED_MODULES = ("openai", "requests", "yaml")
+
+_prewarm_thread: Optional[threading.Thread] = None
+_prewarm_lock: threading.Lock = threading.Lock()
+_prewarm_timings: Dict[str, float] = {}
+_prewarm_failures: List[str] = []
+_ready: threading.Event = threading.Event()
+_sweeper_started: bool = False
+
+# Time allowed to each connection warm-up request
+WARMUP_TIMEOUT_S: float = float(os.environ.get("FLOW_WARMUP_TIMEOUT_S", "5"))
+
+
+def configure_logging() -> None:
+    """
+    Configures the root logger of the worker, unless logging is already configured, and moves its
+    handlers behind the logging pipeline (see `LogPipeline`), once per process.
+    """
+    logging.basicConfig(level=logging.INFO)
+    LogPipeline.install()
+
+
+def start_sweeper() -> None:
+    """
+    Starts the expiry of idle conversations (see `ConversationSweeper`), once per process. Called by
+    the pre-warm and by each turn, so it also runs when the pre-warm is disabled.
+    """
+    global _sweeper_started
+
+    if not _sweeper_started:
+        # Imported here, the conversation helpers are not needed before the first turn
+        from helper_classes.conversation_helper.conversation_expiry import ConversationSweeper
+
+        ConversationSweeper.start()
+        _sweeper_started = True
+
+
+def start_prewarm(root: Optional[str] = None) -> Optional[threading.Thread]:
+    """
+    Starts the background pre-warm, once per process.
+
+    Args:
+        root (Optional[str]): The flow directory holding the configs. Defaults to the working directory.
+
+    Returns:
+        Optional[threading.Thread]: The pre-warm thread, or None if the pre-warm is disabled.
+    """
+    global _prewarm_thread
+
+    if os.environ.get("FLOW_PREWARM", "1") == "0":
+        _set_ready()
+        return None
+
+    with _prewarm_lock:
+        if _prewarm_thread is None:
+            # A ready file left by a previous worker must not report this one ready
+            ready_file: Optional[str] = os.environ.get("FLOW_READY_FILE")
+            if ready_file and os.path.exists(ready_file):
+                os.remove(ready_file)
+            _prewarm_thread = threading.Thread(target=prewarm, args=(root,), name="flow-prewarm", daemon=True)
+            _prewarm_thread.start()
+    return _prewarm_thread
+
+
+def prewarm(root: Optional[str] = None) -> Dict[str, float]:
+    """
+    Imports the deferred modules and handler modules, loads the flow bundle if one is configured,
+    otherwise the content safety prompt into the ConfigFileCache, loads the topic areas into the
+    TopicRegistry while they fit within its memory cap (which builds their dispatch tables) and
+    compiles their tool validators, then warms the connections returned by `resolve_connections`. The worker is
+    ready when it returns.
+
+    Args:
+        root (Optional[str]): The flow directory holding the configs. Defaults to the working directory.
+
+    Returns:
+        Dict[str, float]: The duration of each step in milliseconds.
+    """
+    root = root or os.getcwd()
+
+    try:
+        for module_name in DEFERRED_MODULES:
+            with _timed("import_" + module_name):
+                importlib.import_module(module_name)
+
+        with _timed("prewarm_client"):
+            # The client imports its HTTP transport on construction; the pooled clients are built per connection
+            from openai import AzureOpenAI
+
+            AzureOpenAI(azure_endpoint="https://prewarm.invalid", api_key="prewarm", api_version="2024-06-01").close()
+
+        with _timed("import_handlers"):
+            from helper_classes.helper_classes_customer.handler_registry import HandlerRegistry
+
+            HandlerRegistry.preload()
+
+        if os.environ.get(FlowBundle.ENV_VAR):
+            with _timed("load_bundle"):
+                FlowBundle.get_active()
+        else:
+            with _timed("load_configs"):
+                safety_prompt_path: str = os.path.join(root, "content_safety_system_prompt.txt")
+                if os.path.exists(safety_prompt_path):
+                    ConfigFileCache.load_text(safety_prompt_path)
+
+        with _timed("load_topics"):
+            TopicRegistry.preload()
+
+        with _timed("compile_topics"):
+            for topic in TopicRegistry.get_resident_topics():
+                topic.get_tool_validators()
+
+        with _timed("start_sweeper"):
+            start_sweeper()
+
+        connections: Optional[Tuple[Any, Any]] = None
+        try:
+            with _timed("resolve_connections"):
+                connections = resolve_connections(root)
+        except Exception as e:
+            # The worker still serves, its first turns connect on demand
+            _prewarm_failures.append("resolve_connections")
+            logging.warning("Warm-up connections not resolved", extra={"error": repr(e)})
+        if connections is not None:
+            warm_up_connections(*connections)
+
+        logging.info("Prewarm completed", extra={"timings_ms": dict(_prewarm_timings)})
+
+    except Exception as e:
+        _prewarm_failures.append("prewarm")
+        log_data = {"error": "".join(traceback.format_exception(None, e, e.__traceback__))}
+        logging.error("Prewarm failed", extra=log_data)
+
+    finally:
+        _set_ready()
+
+    return dict(_prewarm_timings)
+
+
+def resolve_connections(root: Optional[str] = None) -> Optional[Tuple[Any, Any]]:
+    """
+    Returns the connections of the flow to warm, as set by `FLOW_WARMUP_CONNECTIONS`:
+
+        promptflow: the connections named by the `execute` node of `flow.dag.yaml`, from the local
+            Prompt Flow connection store (the promptflow devkit);
+        module:function: the custom connection and the search connection returned by the function;
+        unset or 0: none.
+
+    Args:
+        root (Optional[str]): The flow directory holding `flow.dag.yaml`. Defaults to the working directory.
+
+    Returns:
+        Optional[Tuple[Any, Any]]: The custom connection and the search connection, or None.
+    """
+    provider: str = os.environ.get("FLOW_WARMUP_CONNECTIONS", "")
+    if provider in ("", "0"):
+        return None
+
+    if provider == "promptflow":
+        import yaml
+        from promptflow.client import PFClient  # type: ignore
+
+        with open(os.path.join(root or os.getcwd(), "flow.dag.yaml"), "r", encoding="utf-8") as file:
+            flow: Dict[str, Any] = yaml.safe_load(file)
+        node: Dict[str, Any] = next(
+            node for node in flow["nodes"] if node["source"].get("path") == "execute.py"
+        )
+        client = PFClient()
+        return (
+            client.connections.get(node["inputs"]["custom_connections"], with_secrets=True),
+            client.connections.get(node["inputs"]["cognitive_search_connection"], with_secrets=True),
+        )
+
+    module_name, _, function_name = provider.partition(":")
+    provide: Any = getattr(importlib.import_module(module_name), function_name)
+    custom_connections, cognitive_search_connection = provide()
+    return custom_connections, cognitive_search_connection
+
+
+def warm_up_connections(custom_connections: Any, cognitive_search_connection: Any) -> Dict[str, bool]:
+    """
+    Builds the pooled Azure OpenAI client of the connection and the shared search session, and opens
+    a connection to each endpoint with a cheap request: the model list of the Azure OpenAI endpoint
+    and the document count of each Azure AI Search index of the resident topics. Any HTTP response
+    leaves the connection open in the pool; an endpoint that cannot be reached is logged and recorded
+    as a failed step, it does not keep the worker from being ready.
+
+    Args:
+        custom_connections (Any): The custom connection of the flow.
+        cognitive_search_connection (Any): The Azure AI Search connection.
+
+    Returns:
+        Dict[str, bool]: Whether each endpoint was reached.
+    """
+    from helper_classes.ai_search import AiSearch
+    from helper_classes.lm_helpers.llm_helper import LLMHelper
+    from helper_classes.search_ai_executor import SearchAiExecutor
+
+    reached: Dict[str, bool] = {}
+
+    with _timed("connect_llm"):
+        client = LLMHelper.create_pooled_client(custom_connections)
+        reached[str(client.base_url)] = _probe(
+            "connect_llm", lambda: client.with_options(timeout=WARMUP_TIMEOUT_S, max_retries=0).models.list()
+        )
+
+    index_urls: List[str] = sorted({
+        AiSearch.get_index_url(rule["ai_search"]["index_details"])
+        for topic in TopicRegistry.get_resident_topics()
+        for rule in topic.topic_object.get("follow_on_business_logic", [])
+        if "ai_search" in rule and rule["ai_search"].get("backend", "azure") == "azure"
+    })
+    if index_urls:
+        with _timed("connect_search"):
+            session = SearchAiExecutor.get_session()
+            headers: Dict[str, str] = {"api-key": str(cognitive_search_connection.api_key)}
+            for index_url in index_urls:
+                count_url: str = f"{index_url}/docs/$count?api-version={AiSearch.API_VERSION}"
+                reached[index_url] = _probe(
+                    "connect_search",
+                    lambda url=count_url: session.get(url, headers=headers, timeout=WARMUP_TIMEOUT_S),
+                )
+
+    logging.info("Connections warmed up", extra={"endpoints": reached})
+    return reached
+
+
+def is_ready() -> bool:
+    """
+    Returns whether the pre-warm has completed, or is disabled.
+    """
+    return _ready.is_set()
+
+
+def wait_until_ready(timeout: Optional[float] = None) -> bool:
+    """
+    Waits for the pre-warm to complete.
+
+    Args:
+        timeout (Optional[float]): The longest wait in seconds. Defaults to no limit.
+
+    Returns:
+        bool: Whether the worker is ready.
+    """
+    return _ready.wait(timeout)
+
+
+def get_readiness() -> Dict[str, Any]:
+    """
+    Returns the readiness of the worker.
+
+    Returns:
+        Dict[str, Any]: Whether the pre-warm has completed, the steps that failed, and the duration of
+            each completed step in milliseconds.
+    """
+    return {"ready": is_ready(), "failed": list(_prewarm_failures), "timings_ms": dict(_prewarm_timings)}
+
+
+def get_prewarm_timings() -> Dict[str, float]:
+    """
+    Returns the duration of each completed pre-warm step.
+
+    Returns:
+        Dict[str, float]: The duration of each step in milliseconds.
+    """
+    return dict(_prewarm_timings)
+
+
+def _probe(step: str, request: Any) -> bool:
+    """
+    Sends a warm-up request, recording the step as failed if the endpoint cannot be reached.
+    """
+    from openai import APIStatusError
+
+    try:
+        request()
+        return True
+    except APIStatusError:
+        # The endpoint answered, e.g. a key without access to the model list
+        return True
+    except Exception as e:
+        _prewarm_failures.append(step)
+        logging.warning("Warm-up request failed", extra={"step": step, "error": repr(e)})
+        return False
+
+
+def _set_ready() -> None:
+    """
+    Reports the worker ready, writing `FLOW_READY_FILE` if set.
+    """
+    _ready.set()
+    ready_file: Optional[str] = os.environ.get("FLOW_READY_FILE")
+    if ready_file:
+        try:
+            with open(ready_file + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(get_readiness(), file)
+            os.replace(ready_file + ".tmp", ready_file)
+        except OSError as e:
+            logging.error("Ready file not written", extra={"path": ready_file, "error": repr(e)})
+    logging.info("Worker ready", extra=get_readiness())
+
+
+class _timed:
+    """
+    Context manager recording the duration of a pre-warm step.
+    """
+
+    def __init__(self, step: str):
+        self.step: str = step
+        self.start_time: float = 0.0
+
+    def __enter__(self) -> None:
+        self.start_time = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        _prewarm_timings[self.step] = (time.perf_counter() - self.start_time) * 1000
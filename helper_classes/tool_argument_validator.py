@@ -0,0 +1,351 @@
+"""
+This module provides the ToolArgumentValidator class, which validates the arguments of a tool call
+against the `parameters` JSON schema of the tool before the call is dispatched.
+
+Schemas are compiled once into nested validation functions, so validating the arguments of a turn
+does not walk the schema dictionaries again. The subset of JSON schema used by the tool definitions
+is supported: `type`, `properties`, `required`, `enum`, `items`, `additionalProperties`,
+`minLength`/`maxLength` and `minimum`/`maximum`.
+
+Two blocks of a tool definition, beside its `function`, are read by the repair and the re-ask message
+rather than the validation: `argument_defaults`, the values of missing required properties, and
+`argument_prompts`, the labels of the properties asked from the user. They are kept out of the
+`parameters` schema and removed from the tools sent to the language model (`model_tools`).
+
+Classes:
+    ToolArgumentValidator: A compiled validator for the arguments of a single tool.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from helper_classes import serialization
+
+# A compiled schema node: validates a value at a path and appends errors to the list
+Validator = Callable[[Any, str, List[str]], None]
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "string": lambda value: isinstance(value, str),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "null": lambda value: value is None,
+}
+
+# The keys of a tool definition read by the validator, never sent to the language model
+ARGUMENT_KEYS: Tuple[str, ...] = ("argument_prompts", "argument_defaults")
+
+
+def _join(path: str, key: str) -> str:
+    return key if not path else path + "." + key
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """
+    Compiles a JSON schema node into a validation function.
+
+    Args:
+        schema (Dict[str, Any]): The JSON schema node.
+
+    Returns:
+        Validator: A function validating a value at a path and appending errors to a list.
+    """
+    checks: List[Validator] = []
+
+    schema_type = schema.get("type")
+    if schema_type is not None:
+        type_names: Tuple[str, ...] = tuple(schema_type) if isinstance(schema_type, list) else (schema_type,)
+        type_checks = [_TYPE_CHECKS[name] for name in type_names if name in _TYPE_CHECKS]
+
+        def check_type(value: Any, path: str, errors: List[str]) -> None:
+            if not any(type_check(value) for type_check in type_checks):
+                errors.append(f"{path or 'arguments'}: expected {' or '.join(type_names)}")
+
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed: List[Any] = list(schema["enum"])
+
+        def check_enum(value: Any, path: str, errors: List[str]) -> None:
+            if value not in allowed:
+                errors.append(f"{path}: must be one of {allowed}")
+
+        checks.append(check_enum)
+
+    min_length: Optional[int] = schema.get("minLength")
+    max_length: Optional[int] = schema.get("maxLength")
+    if min_length is not None or max_length is not None:
+
+        def check_length(value: Any, path: str, errors: List[str]) -> None:
+            if isinstance(value, str):
+                if min_length is not None and len(value) < min_length:
+                    errors.append(f"{path}: shorter than {min_length} characters")
+                if max_length is not None and len(value) > max_length:
+                    errors.append(f"{path}: longer than {max_length} characters")
+
+        checks.append(check_length)
+
+    minimum: Optional[float] = schema.get("minimum")
+    maximum: Optional[float] = schema.get("maximum")
+    if minimum is not None or maximum is not None:
+
+        def check_range(value: Any, path: str, errors: List[str]) -> None:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if minimum is not None and value < minimum:
+                    errors.append(f"{path}: less than {minimum}")
+                if maximum is not None and value > maximum:
+                    errors.append(f"{path}: greater than {maximum}")
+
+        checks.append(check_range)
+
+    properties: Dict[str, Validator] = {
+        key: compile_schema(value) for key, value in schema.get("properties", {}).items()
+    }
+    required: List[str] = list(schema.get("required", []))
+    additional = schema.get("additionalProperties", True)
+    additional_check: Optional[Validator] = compile_schema(additional) if isinstance(additional, dict) else None
+    if properties or required or additional is not True:
+
+        def check_object(value: Any, path: str, errors: List[str]) -> None:
+            if not isinstance(value, dict):
+                return
+            for key in required:
+                if value.get(key) is None:
+                    errors.append(f"{_join(path, key)}: is required")
+            for key, item in value.items():
+                property_check = properties.get(key)
+                if property_check is not None:
+                    if item is not None:
+                        property_check(item, _join(path, key), errors)
+                elif additional is False:
+                    errors.append(f"{_join(path, key)}: is not allowed")
+                elif additional_check is not None:
+                    additional_check(item, _join(path, key), errors)
+
+        checks.append(check_object)
+
+    if isinstance(schema.get("items"), dict):
+        item_check: Validator = compile_schema(schema["items"])
+
+        def check_items(value: Any, path: str, errors: List[str]) -> None:
+            if isinstance(value, list):
+                for index, item in enumerate(value):
+                    item_check(item, f"{path}[{index}]", errors)
+
+        checks.append(check_items)
+
+    def validate(value: Any, path: str, errors: List[str]) -> None:
+        for check in checks:
+            check(value, path, errors)
+
+    return validate
+
+
+class ToolArgumentValidator:
+    """
+    A compiled validator for the arguments of a single tool.
+
+    Attributes:
+        name (str): The name of the tool function.
+        schema (Dict[str, Any]): The `parameters` schema of the tool.
+        prompts (Dict[str, str]): The labels of the properties asked from the user.
+        defaults (Dict[str, Any]): The values of missing required properties.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        schema: Dict[str, Any],
+        prompts: Optional[Dict[str, str]] = None,
+        defaults: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Compiles the validator for the given tool schema.
+
+        Args:
+            name (str): The name of the tool function.
+            schema (Dict[str, Any]): The `parameters` schema of the tool.
+            prompts (Optional[Dict[str, str]]): The `argument_prompts` of the tool.
+            defaults (Optional[Dict[str, Any]]): The `argument_defaults` of the tool.
+        """
+        self.name: str = name
+        self.schema: Dict[str, Any] = schema
+        self.prompts: Dict[str, str] = dict(prompts or {})
+        self.defaults: Dict[str, Any] = dict(defaults or {})
+        self._validate: Validator = compile_schema(schema)
+        self._property_validators: Dict[str, Validator] = {
+            key: compile_schema(value) for key, value in schema.get("properties", {}).items()
+        }
+
+    @staticmethod
+    def compile_tools(tools: List[Dict[str, Any]]) -> Dict[str, "ToolArgumentValidator"]:
+        """
+        Compiles a validator for each function tool in the list.
+
+        Args:
+            tools (List[Dict[str, Any]]): The tools list passed to the language model.
+
+        Returns:
+            Dict[str, ToolArgumentValidator]: The validators keyed by function name.
+        """
+        validators: Dict[str, ToolArgumentValidator] = {}
+        for tool in tools:
+            function: Dict[str, Any] = tool.get("function", {})
+            if tool.get("type") == "function" and "name" in function:
+                validators[function["name"]] = ToolArgumentValidator(
+                    function["name"],
+                    function.get("parameters", {}),
+                    tool.get("argument_prompts"),
+                    tool.get("argument_defaults"),
+                )
+        return validators
+
+    @staticmethod
+    def model_tools(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Removes the keys read by the validator from the tools, which are then sent to the language model.
+
+        Args:
+            tools (List[Dict[str, Any]]): The tool definitions.
+
+        Returns:
+            List[Dict[str, Any]]: The tools without their `argument_prompts` and `argument_defaults`.
+        """
+        return [
+            {key: value for key, value in tool.items() if key not in ARGUMENT_KEYS}
+            if isinstance(tool, dict)
+            else tool
+            for tool in tools
+        ]
+
+    @staticmethod
+    def parse_arguments(fn_args: str) -> Optional[Dict[str, Any]]:
+        """
+        Parses the JSON arguments of a tool call.
+
+        Args:
+            fn_args (str): The raw arguments string of the tool call.
+
+        Returns:
+            Optional[Dict[str, Any]]: The parsed arguments, or None if they are not a JSON object.
+        """
+        try:
+            arguments = serialization.loads(fn_args)
+        except (TypeError, ValueError):
+            return None
+        return arguments if isinstance(arguments, dict) else None
+
+    def validate(self, arguments: Dict[str, Any]) -> List[str]:
+        """
+        Validates the arguments against the compiled schema.
+
+        Args:
+            arguments (Dict[str, Any]): The parsed arguments of the tool call.
+
+        Returns:
+            List[str]: The validation errors, empty if the arguments are valid.
+        """
+        errors: List[str] = []
+        self._validate(arguments, "", errors)
+        return errors
+
+    def missing_required(self, arguments: Dict[str, Any]) -> List[str]:
+        """
+        Returns the top level required fields that are missing from the arguments.
+
+        Args:
+            arguments (Dict[str, Any]): The parsed arguments of the tool call.
+
+        Returns:
+            List[str]: The names of the missing fields.
+        """
+        return [key for key in self.schema.get("required", []) if arguments.get(key) is None]
+
+    def repair(self, arguments: Dict[str, Any], known_arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Attempts a targeted repair of the arguments: missing required fields are filled from the
+        arguments already known for the conversation, or else from the `argument_defaults` of the tool, and
+        scalar values are coerced to the declared type.
+
+        Args:
+            arguments (Dict[str, Any]): The parsed arguments of the tool call.
+            known_arguments (Dict[str, Any]): The arguments persisted in the conversation data.
+
+        Returns:
+            Dict[str, Any]: The repaired arguments (a new dictionary).
+        """
+        repaired: Dict[str, Any] = dict(arguments)
+        properties: Dict[str, Any] = self.schema.get("properties", {})
+
+        for key in self.missing_required(repaired):
+            known = known_arguments.get(key)
+            if known is not None and not self.validate_property(key, known):
+                repaired[key] = known
+            elif key in self.defaults:
+                # Context the handler can do without, e.g. the previous answer on a first turn
+                repaired[key] = self.defaults[key]
+
+        for key, value in list(repaired.items()):
+            expected = properties.get(key, {}).get("type")
+            repaired[key] = self.coerce(value, expected)
+
+        return repaired
+
+    def validate_property(self, key: str, value: Any) -> List[str]:
+        """
+        Validates a single top level property.
+
+        Args:
+            key (str): The property name.
+            value (Any): The property value.
+
+        Returns:
+            List[str]: The validation errors, empty if the value is valid.
+        """
+        property_validator: Optional[Validator] = self._property_validators.get(key)
+        if property_validator is None:
+            return []
+        errors: List[str] = []
+        property_validator(value, key, errors)
+        return errors
+
+    def describe(self, key: str) -> str:
+        """
+        Describes a top level property for a re-ask message, which is shown to the user. The
+        `description` of the schema is written for the model and is not used.
+
+        Args:
+            key (str): The property name.
+
+        Returns:
+            str: The `argument_prompts` entry of the property if the tool has one, otherwise its name.
+        """
+        prompt: str = str(self.prompts.get(key, "")).strip()
+        return prompt or key.replace("_", " ")
+
+    @staticmethod
+    def coerce(value: Any, expected: Any) -> Any:
+        """
+        Coerces a scalar value to the expected JSON schema type where this is lossless.
+
+        Args:
+            value (Any): The value.
+            expected (Any): The expected JSON schema type.
+
+        Returns:
+            Any: The coerced value, or the value unchanged.
+        """
+        if expected == "string" and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        if expected in ("number", "integer") and isinstance(value, str):
+            try:
+                number = float(value)
+            except ValueError:
+                return value
+            if expected == "integer":
+                return int(number) if number.is_integer() else value
+            return number
+        if expected == "boolean" and isinstance(value, str) and value.lower() in ("true", "false"):
+            return value.lower() == "true"
+        return value
@@ -0,0 +1,173 @@
+"""
+This module provides the FlowBundle class, the runtime view of a compiled flow bundle.
+
+A bundle is produced offline by `flow_bundle_compiler` from the persona topics, the standard tool
+functions and the content safety prompt. When the `FLOW_BUNDLE` environment variable points at a
+bundle file, the flow reads it in one go at startup and serves every topic, tools list, persona
+setting and the safety prompt from it instead of the YAML files. Bundles are immutable: callers
+get copies.
+
+Classes:
+    FlowBundle: A loaded flow bundle.
+"""
+
+import copy
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class FlowBundle:
+    """
+    A loaded flow bundle.
+
+    Attributes:
+        path (str): The path of the bundle file.
+        version (str): The content hash of the bundle.
+        label (str): The release label given when the bundle was compiled.
+        content_safety_prompt (str): The content safety system prompt.
+    """
+
+    FORMAT = "promptflow-accelerator-flow-bundle"
+    FORMAT_VERSION = 1
+    ENV_VAR = "FLOW_BUNDLE"
+
+    _bundles: Dict[str, "FlowBundle"] = {}
+    _lock: threading.Lock = threading.Lock()
+
+    def __init__(self, path: str, data: Dict[str, Any]):
+        """
+        Initializes the bundle from its parsed content.
+
+        Args:
+            path (str): The path of the bundle file.
+            data (Dict[str, Any]): The parsed bundle.
+
+        Raises:
+            ValueError: If the file is not a bundle of a supported format version.
+        """
+        if data.get("format") != FlowBundle.FORMAT or data.get("format_version") != FlowBundle.FORMAT_VERSION:
+            raise ValueError(
+                f"{path} is not a flow bundle of format version {FlowBundle.FORMAT_VERSION}, recompile it"
+            )
+        self.path: str = path
+        self.version: str = data["version"]
+        self.label: str = data.get("label", "")
+        self.content_safety_prompt: str = data["content_safety_prompt"]
+        self._topics: Dict[str, Dict[str, Any]] = data["topics"]
+        self._personas: Dict[str, Dict[str, Any]] = data.get("personas", {})
+
+    @staticmethod
+    def load(path: str) -> "FlowBundle":
+        """
+        Reads a bundle file.
+
+        Args:
+            path (str): The path of the bundle file.
+
+        Returns:
+            FlowBundle: The loaded bundle.
+        """
+        with open(path, "rb") as file:
+            data: Dict[str, Any] = json.loads(file.read())
+        return FlowBundle(path, data)
+
+    @staticmethod
+    def get_active() -> Optional["FlowBundle"]:
+        """
+        Returns the bundle configured by the `FLOW_BUNDLE` environment variable, loading it once per process.
+
+        Returns:
+            Optional[FlowBundle]: The bundle, or None if no bundle is configured.
+        """
+        path: str = os.environ.get(FlowBundle.ENV_VAR, "")
+        if not path:
+            return None
+
+        path = os.path.abspath(path)
+        bundle = FlowBundle._bundles.get(path)
+        if bundle is None:
+            with FlowBundle._lock:
+                bundle = FlowBundle._bundles.get(path)
+                if bundle is None:
+                    bundle = FlowBundle.load(path)
+                    FlowBundle._bundles[path] = bundle
+                    log_data: Dict[str, Any] = {
+                        "bundle_path": path,
+                        "bundle_version": bundle.version,
+                        "bundle_label": bundle.label,
+                        "topics": len(bundle._topics),
+                    }
+                    logging.info("Flow bundle loaded", extra=log_data)
+        return bundle
+
+    @staticmethod
+    def topic_id(persona_name: str, topic_area: str, topic_name: str) -> str:
+        """
+        Returns the id of a topic in the bundle.
+
+        Args:
+            persona_name (str): The persona name.
+            topic_area (str): The topic area.
+            topic_name (str): The topic name.
+
+        Returns:
+            str: The topic id, `persona/topic_area/topic`.
+        """
+        return f"{persona_name}/{topic_area}/{topic_name}"
+
+    def topic_ids(self) -> List[str]:
+        return list(self._topics)
+
+    def has_topic(self, topic_id: str) -> bool:
+        return topic_id in self._topics
+
+    def get_topic(self, topic_id: str) -> Dict[str, Any]:
+        """
+        Returns a topic object as defined in its YAML file.
+
+        Args:
+            topic_id (str): The topic id.
+
+        Returns:
+            Dict[str, Any]: A copy of the topic object, safe to modify.
+
+        Raises:
+            KeyError: If the topic is not in the bundle.
+        """
+        return copy.deepcopy(self._get_entry(topic_id)["topic"])
+
+    def get_persona(self, persona_name: str) -> Dict[str, Any]:
+        """
+        Returns the settings of a persona, from its `persona.yaml`.
+
+        Args:
+            persona_name (str): The persona name.
+
+        Returns:
+            Dict[str, Any]: A copy of the persona settings, empty if the persona has none.
+        """
+        return copy.deepcopy(self._personas.get(persona_name, {}))
+
+    def get_tools_list(self, topic_id: str) -> List[Dict[str, Any]]:
+        """
+        Returns the tools list of a topic, merged with its standard tool functions.
+
+        Args:
+            topic_id (str): The topic id.
+
+        Returns:
+            List[Dict[str, Any]]: A fresh copy of the tools list, decoded from its pre-serialized JSON.
+
+        Raises:
+            KeyError: If the topic is not in the bundle.
+        """
+        return json.loads(self._get_entry(topic_id)["tools_json"])
+
+    def _get_entry(self, topic_id: str) -> Dict[str, Any]:
+        entry = self._topics.get(topic_id)
+        if entry is None:
+            raise KeyError(f"Topic '{topic_id}' is not in flow bundle {self.version} ({self.path})")
+        return entry
@@ -0,0 +1,580 @@
+"""
+This module provides the offline compiler of the flow bundle.
+
+The compiler reads the persona topics (`persona-*/topic_area_*/*.yaml`), the persona settings
+(`persona-*/persona.yaml`), the standard tool functions (`standard_tool_functions/*.yaml`) and the
+content safety prompt (`content_safety_system_prompt.txt`), validates and cross-references them,
+and writes a single versioned JSON bundle in which the tools list of each topic is already merged
+with its standard tool functions and serialized. The flow loads the bundle with FlowBundle when the
+`FLOW_BUNDLE` environment variable points at it.
+
+The cross-reference checks cover the names in `standard_tool_functions`, `functions_to_persist` and
+`follow_on_business_logic`, the custom handlers of the business logic, duplicate function names,
+`required` arguments missing from the tool schemas, the arguments named by `argument_prompts` and
+`argument_defaults` and the topics referenced through `topic_name` arguments and `current_topic_name`.
+
+Usage:
+    python -m helper_classes.topic_helper.flow_bundle_compiler compile [--root .] [--output flow_bundle.json]
+    python -m helper_classes.topic_helper.flow_bundle_compiler check [--root .]
+    python -m helper_classes.topic_helper.flow_bundle_compiler diff OLD_BUNDLE NEW_BUNDLE
+
+Classes:
+    FlowBundleCompiler: Compiles and validates the flow configs into a bundle.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import yaml
+
+from helper_classes.helper_classes_customer.handler_registry import HandlerRegistry
+from helper_classes.tool_argument_validator import ARGUMENT_KEYS, ToolArgumentValidator
+from helper_classes.topic_helper.flow_bundle import FlowBundle
+
+# Keys every topic file must define, with their expected types
+TOPIC_KEYS: Dict[str, type] = {
+    "systemPrompt": str,
+    "llm_parameters": dict,
+    "tools": list,
+    "standard_tool_functions": list,
+    "functions_to_persist": list,
+    "follow_on_business_logic": list,
+}
+LLM_PARAMETERS: Tuple[str, ...] = ("temperature", "top_p", "frequency_penalty", "presence_penalty")
+# Policies of the optional `tool_calls` of a topic, for the completions returning several tool calls
+TOOL_CALL_POLICIES: Tuple[str, ...] = ("sequential", "parallel")
+# Stages of a turn the optional `model_routing` of a topic can route to their own model
+MODEL_STAGES: Tuple[str, ...] = (
+    "routing", "address_lookup", "customer_response", "order_answer", "rag_answer"
+)
+
+SAFETY_PROMPT_FILE = "content_safety_system_prompt.txt"
+
+# Topic switches name their target topic as "Default to 'topic'." in the description of `topic_name`
+_DEFAULT_TOPIC = re.compile(r"default to '([^']+)'", re.IGNORECASE)
+
+
+class FlowBundleCompiler:
+    """
+    Compiles the persona topics, standard tool functions and content safety prompt of a flow
+    directory into a bundle.
+
+    Attributes:
+        root (str): The flow directory.
+        errors (List[str]): The validation errors of the last compilation.
+    """
+
+    def __init__(self, root: str = "."):
+        """
+        Initializes the compiler for a flow directory.
+
+        Args:
+            root (str): The flow directory.
+        """
+        self.root: str = os.path.abspath(root)
+        self.errors: List[str] = []
+
+    def compile(self, label: str = "") -> Dict[str, Any]:
+        """
+        Compiles the flow configs into a bundle.
+
+        Args:
+            label (str): An optional release label stored in the bundle.
+
+        Returns:
+            Dict[str, Any]: The bundle.
+
+        Raises:
+            ValueError: If the configs are invalid, with one line per error.
+        """
+        self.errors = []
+        sources: Dict[str, str] = {}
+
+        standard_tools: Dict[str, Dict[str, Any]] = {}
+        for path in sorted(glob.glob(os.path.join(self.root, "standard_tool_functions", "*.yaml"))):
+            tool = self.load_yaml(path, sources)
+            name: str = os.path.splitext(os.path.basename(path))[0]
+            if tool is not None and self.check_tool(tool, self.relpath(path)):
+                standard_tools[name] = tool
+
+        content_safety_prompt: str = ""
+        safety_prompt_path: str = os.path.join(self.root, SAFETY_PROMPT_FILE)
+        if os.path.exists(safety_prompt_path):
+            with open(safety_prompt_path, "r", encoding="utf-8") as file:
+                content_safety_prompt = file.read()
+            sources[SAFETY_PROMPT_FILE] = self.hash_text(content_safety_prompt)
+        if not content_safety_prompt.strip():
+            self.errors.append(f"{SAFETY_PROMPT_FILE}: missing or empty")
+
+        personas: Dict[str, Dict[str, Any]] = {}
+        for path in sorted(glob.glob(os.path.join(self.root, "persona-*", "persona.yaml"))):
+            persona = self.load_yaml(path, sources)
+            if self.check_persona(persona, self.relpath(path)):
+                personas[os.path.basename(os.path.dirname(path))[len("persona-"):]] = persona
+
+        topic_paths: List[str] = sorted(glob.glob(os.path.join(self.root, "persona-*", "topic_area_*", "*.yaml")))
+        topic_ids: Set[str] = {self.topic_id_of(path) for path in topic_paths}
+
+        topics: Dict[str, Dict[str, Any]] = {}
+        for path in topic_paths:
+            topic = self.load_yaml(path, sources)
+            if topic is None:
+                continue
+            topic_id: str = self.topic_id_of(path)
+            tools_list = self.compile_topic(topic, self.relpath(path), topic_id, standard_tools, topic_ids)
+            if tools_list is not None:
+                topics[topic_id] = {
+                    "topic": topic,
+                    "tools_json": json.dumps(tools_list, ensure_ascii=False, separators=(",", ":")),
+                }
+
+        if not topics and not self.errors:
+            self.errors.append(f"{self.root}: no persona topics found")
+        if self.errors:
+            raise ValueError("\n".join(self.errors))
+
+        bundle: Dict[str, Any] = {
+            "format": FlowBundle.FORMAT,
+            "format_version": FlowBundle.FORMAT_VERSION,
+            "content_safety_prompt": content_safety_prompt,
+            "topics": topics,
+            "personas": personas,
+            "sources": sources,
+        }
+        bundle["version"] = self.hash_text(json.dumps(bundle, sort_keys=True, ensure_ascii=False))[:16]
+        bundle["label"] = label
+        return bundle
+
+    def compile_topic(
+        self,
+        topic: Any,
+        source: str,
+        topic_id: str,
+        standard_tools: Dict[str, Dict[str, Any]],
+        topic_ids: Set[str],
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Validates a topic and merges its tools with its standard tool functions.
+
+        Args:
+            topic (Any): The parsed topic file.
+            source (str): The path of the topic file, for the error messages.
+            topic_id (str): The id of the topic in the bundle.
+            standard_tools (Dict[str, Dict[str, Any]]): The standard tool functions keyed by name.
+            topic_ids (Set[str]): The ids of all topics, to resolve topic switches.
+
+        Returns:
+            Optional[List[Dict[str, Any]]]: The merged tools list, or None if the topic is invalid.
+        """
+        error_count: int = len(self.errors)
+        if not isinstance(topic, dict):
+            self.errors.append(f"{source}: a topic must be a mapping")
+            return None
+
+        for key, expected in TOPIC_KEYS.items():
+            if not isinstance(topic.get(key), expected):
+                self.errors.append(f"{source}: '{key}' must be a {expected.__name__}")
+        if len(self.errors) > error_count:
+            return None
+
+        for parameter in LLM_PARAMETERS:
+            value = topic["llm_parameters"].get(parameter)
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                self.errors.append(f"{source}: llm_parameters.{parameter} must be a number")
+        self.check_model_routing(topic.get("model_routing"), source)
+        tool_calls: Any = topic.get("tool_calls", {})
+        policy: Any = tool_calls.get("policy", "sequential") if isinstance(tool_calls, dict) else None
+        if policy not in TOOL_CALL_POLICIES:
+            self.errors.append(f"{source}: tool_calls.policy must be one of {', '.join(TOOL_CALL_POLICIES)}")
+
+        tools_list: List[Dict[str, Any]] = []
+        for index, tool in enumerate(topic["tools"]):
+            if self.check_tool(tool, f"{source}: tools[{index}]"):
+                tools_list.append(tool)
+        for name in topic["standard_tool_functions"]:
+            if name in standard_tools:
+                tools_list.append(standard_tools[name])
+            else:
+                self.errors.append(f"{source}: unknown standard tool function '{name}'")
+
+        function_names: Set[str] = set()
+        for tool in tools_list:
+            name = tool["function"]["name"]
+            if name in function_names:
+                self.errors.append(f"{source}: function '{name}' is defined more than once")
+            function_names.add(name)
+            self.check_topic_switches(tool, source, topic_id, topic_ids)
+
+        for name in topic["functions_to_persist"]:
+            if name not in function_names:
+                self.errors.append(f"{source}: functions_to_persist references unknown function '{name}'")
+
+        for index, rule in enumerate(topic["follow_on_business_logic"]):
+            self.check_business_logic(rule, f"{source}: follow_on_business_logic[{index}]", topic_id, function_names, topic_ids)
+
+        return tools_list if len(self.errors) == error_count else None
+
+    def check_model_routing(self, model_routing: Any, source: str) -> None:
+        """
+        Checks the optional `model_routing` of a topic: a mapping of stages to a model deployment and
+        parameters overriding `llm_parameters`.
+
+        Args:
+            model_routing (Any): The `model_routing` of the topic, None if it has none.
+            source (str): The path of the topic file, for the error messages.
+        """
+        if model_routing is None:
+            return
+        if not isinstance(model_routing, dict):
+            self.errors.append(f"{source}: 'model_routing' must be a dict")
+            return
+
+        for stage, route in model_routing.items():
+            prefix: str = f"{source}: model_routing.{stage}"
+            if stage not in MODEL_STAGES:
+                self.errors.append(f"{prefix} is not a stage, expected one of {', '.join(MODEL_STAGES)}")
+                continue
+            if not isinstance(route, dict):
+                self.errors.append(f"{prefix} must be a dict")
+                continue
+            for name, value in route.items():
+                if name == "model":
+                    if not isinstance(value, str) or not value:
+                        self.errors.append(f"{prefix}.model must be a model deployment name")
+                elif name == "max_tokens":
+                    if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                        self.errors.append(f"{prefix}.max_tokens must be a positive integer")
+                elif name in LLM_PARAMETERS:
+                    if not isinstance(value, (int, float)) or isinstance(value, bool):
+                        self.errors.append(f"{prefix}.{name} must be a number")
+                else:
+                    self.errors.append(f"{prefix}: unknown parameter '{name}'")
+
+    def check_persona(self, persona: Any, source: str) -> bool:
+        """
+        Checks the settings of a persona.
+
+        Args:
+            persona (Any): The parsed persona settings.
+            source (str): The path of the settings file, for the error messages.
+
+        Returns:
+            bool: True if the settings are valid, False otherwise.
+        """
+        error_count: int = len(self.errors)
+        if not isinstance(persona, dict):
+            self.errors.append(f"{source}: persona settings must be a mapping")
+            return False
+
+        expiry: Any = persona.get("conversation_expiry")
+        if expiry is not None:
+            ttl_hours: Any = expiry.get("ttl_hours", 0) if isinstance(expiry, dict) else None
+            if not isinstance(ttl_hours, (int, float)) or isinstance(ttl_hours, bool) or ttl_hours < 0:
+                self.errors.append(f"{source}: conversation_expiry.ttl_hours must be a number >= 0")
+            elif not isinstance(expiry.get("archive", False), bool):
+                self.errors.append(f"{source}: conversation_expiry.archive must be true or false")
+        return len(self.errors) == error_count
+
+    def check_tool(self, tool: Any, source: str) -> bool:
+        """
+        Checks the shape of a tool definition and that its schema compiles.
+
+        Args:
+            tool (Any): The tool definition.
+            source (str): The location of the tool, for the error messages.
+
+        Returns:
+            bool: True if the tool is valid, False otherwise.
+        """
+        function: Any = tool.get("function") if isinstance(tool, dict) else None
+        if not isinstance(tool, dict) or tool.get("type") != "function" or not isinstance(function, dict):
+            self.errors.append(f"{source}: a tool must have type 'function' and a 'function' mapping")
+            return False
+        if not isinstance(function.get("name"), str) or not function["name"]:
+            self.errors.append(f"{source}: the function has no name")
+            return False
+
+        parameters: Any = function.get("parameters", {})
+        if not isinstance(parameters, dict):
+            self.errors.append(f"{source}: parameters of '{function['name']}' must be a mapping")
+            return False
+
+        error_count: int = len(self.errors)
+        self.check_required(parameters, f"{source}: {function['name']}")
+        properties: Any = parameters.get("properties", {})
+        for key in ARGUMENT_KEYS:
+            block: Any = tool.get(key, {})
+            location: str = f"{source}: {key} of '{function['name']}'"
+            if not isinstance(block, dict):
+                self.errors.append(f"{location} must be a mapping")
+                continue
+            for name in block:
+                if not isinstance(properties, dict) or name not in properties:
+                    self.errors.append(f"{location} has unknown argument '{name}'")
+        try:
+            ToolArgumentValidator(
+                function["name"], parameters, tool.get("argument_prompts"), tool.get("argument_defaults")
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            self.errors.append(f"{source}: the schema of '{function['name']}' does not compile: {e}")
+        return len(self.errors) == error_count
+
+    def check_required(self, schema: Dict[str, Any], source: str) -> None:
+        """
+        Checks that the `required` arguments of an object schema and its nested objects are defined.
+
+        Args:
+            schema (Dict[str, Any]): The schema node.
+            source (str): The location of the schema node, for the error messages.
+        """
+        properties: Any = schema.get("properties", {})
+        if not isinstance(properties, dict):
+            self.errors.append(f"{source}: 'properties' must be a mapping")
+            return
+        for name in schema.get("required", []):
+            if name not in properties:
+                self.errors.append(f"{source}: required argument '{name}' is not defined in properties")
+        for name, value in properties.items():
+            if isinstance(value, dict):
+                self.check_required(value, f"{source}.{name}")
+
+    def check_topic_switches(self, tool: Dict[str, Any], source: str, topic_id: str, topic_ids: Set[str]) -> None:
+        """
+        Checks that the topics a tool can switch to, through a `topic_name` argument, exist.
+
+        Args:
+            tool (Dict[str, Any]): The tool definition.
+            source (str): The path of the topic file, for the error messages.
+            topic_id (str): The id of the topic using the tool.
+            topic_ids (Set[str]): The ids of all topics.
+        """
+        name: str = tool["function"]["name"]
+        stack: List[Any] = [tool["function"].get("parameters", {})]
+        while stack:
+            schema = stack.pop()
+            if not isinstance(schema, dict):
+                continue
+            properties: Any = schema.get("properties", {})
+            if not isinstance(properties, dict):
+                continue
+            topic_name: Any = properties.get("topic_name")
+            if isinstance(topic_name, dict):
+                for target in self.get_topic_targets(topic_name):
+                    if self.sibling_topic_id(topic_id, target) not in topic_ids:
+                        self.errors.append(f"{source}: function '{name}' switches to unknown topic '{target}'")
+            stack.extend(properties.values())
+
+    def check_business_logic(
+        self,
+        rule: Any,
+        source: str,
+        topic_id: str,
+        function_names: Set[str],
+        topic_ids: Set[str],
+    ) -> None:
+        """
+        Checks a business logic rule against the functions of the topic and the handler registry.
+
+        Args:
+            rule (Any): The business logic rule.
+            source (str): The location of the rule, for the error messages.
+            topic_id (str): The id of the topic.
+            function_names (Set[str]): The names of the functions of the topic.
+            topic_ids (Set[str]): The ids of all topics.
+        """
+        if not isinstance(rule, dict) or not isinstance(rule.get("name"), str):
+            self.errors.append(f"{source}: a rule must be a mapping with a 'name'")
+            return
+        if rule["name"] not in function_names:
+            self.errors.append(f"{source}: rule references unknown function '{rule['name']}'")
+
+        action: Any = rule.get("action") or {}
+        if isinstance(action, dict) and action.get("type") == "custom_handler":
+            reference: Optional[str] = action.get("handler")
+            method_name: str = action.get("method_name", "")
+            if reference:
+                try:
+                    if not HandlerRegistry.reference_exists(reference):
+                        self.errors.append(f"{source}: handler '{reference}' cannot be found")
+                except ValueError as e:
+                    self.errors.append(f"{source}: {e}")
+            elif not HandlerRegistry.is_registered(method_name):
+                self.errors.append(f"{source}: unknown method_name '{method_name}'")
+
+        target: Any = rule.get("current_topic_name")
+        if target is not None and self.sibling_topic_id(topic_id, str(target)) not in topic_ids:
+            self.errors.append(f"{source}: current_topic_name references unknown topic '{target}'")
+
+    @staticmethod
+    def get_topic_targets(schema: Dict[str, Any]) -> List[str]:
+        """
+        Returns the topics a `topic_name` argument can take, from its enum, const, default or description.
+
+        Args:
+            schema (Dict[str, Any]): The schema of the `topic_name` argument.
+
+        Returns:
+            List[str]: The topic names.
+        """
+        if isinstance(schema.get("enum"), list):
+            return [str(value) for value in schema["enum"]]
+        for key in ("const", "default"):
+            if key in schema:
+                return [str(schema[key])]
+        return _DEFAULT_TOPIC.findall(str(schema.get("description", "")))
+
+    def load_yaml(self, path: str, sources: Dict[str, str]) -> Any:
+        """
+        Parses a YAML file and records its hash in the sources of the bundle.
+
+        Args:
+            path (str): The path of the YAML file.
+            sources (Dict[str, str]): The source hashes keyed by relative path.
+
+        Returns:
+            Any: The parsed content, or None if the file cannot be parsed.
+        """
+        with open(path, "r", encoding="utf-8") as file:
+            text: str = file.read()
+        sources[self.relpath(path)] = self.hash_text(text)
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            self.errors.append(f"{self.relpath(path)}: invalid YAML: {e}")
+            return None
+
+    def relpath(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    @staticmethod
+    def topic_id_of(path: str) -> str:
+        """
+        Returns the bundle id of a topic file, `persona/topic_area/topic`.
+
+        Args:
+            path (str): The path of the topic file.
+
+        Returns:
+            str: The topic id.
+        """
+        topic_area_dir, file_name = os.path.split(path)
+        persona_dir, topic_area = os.path.split(topic_area_dir)
+        return FlowBundle.topic_id(
+            os.path.basename(persona_dir)[len("persona-"):],
+            topic_area[len("topic_area_"):],
+            os.path.splitext(file_name)[0],
+        )
+
+    @staticmethod
+    def sibling_topic_id(topic_id: str, topic_name: str) -> str:
+        return topic_id.rsplit("/", 1)[0] + "/" + topic_name
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def write(bundle: Dict[str, Any], output: str) -> None:
+        """
+        Writes a bundle atomically, with sorted keys so bundles of two releases can be diffed.
+
+        Args:
+            bundle (Dict[str, Any]): The bundle.
+            output (str): The path of the bundle file.
+        """
+        temp_path: str = output + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(bundle, file, indent=2, sort_keys=True, ensure_ascii=False)
+            file.write("\n")
+        os.replace(temp_path, output)
+
+    @staticmethod
+    def diff(old: FlowBundle, new: FlowBundle) -> List[str]:
+        """
+        Compares two bundles topic by topic.
+
+        Args:
+            old (FlowBundle): The previous bundle.
+            new (FlowBundle): The new bundle.
+
+        Returns:
+            List[str]: One line per difference, empty if the bundles have the same content.
+        """
+        changes: List[str] = []
+        if old.content_safety_prompt != new.content_safety_prompt:
+            changes.append("~ content safety prompt")
+
+        for topic_id in sorted(set(old.topic_ids()) | set(new.topic_ids())):
+            if not new.has_topic(topic_id):
+                changes.append(f"- {topic_id}")
+                continue
+            if not old.has_topic(topic_id):
+                changes.append(f"+ {topic_id}")
+                continue
+
+            old_topic, new_topic = old.get_topic(topic_id), new.get_topic(topic_id)
+            keys: List[str] = [
+                key for key in sorted(set(old_topic) | set(new_topic)) if key != "tools" and old_topic.get(key) != new_topic.get(key)
+            ]
+            old_tools = {tool["function"]["name"]: tool for tool in old.get_tools_list(topic_id)}
+            new_tools = {tool["function"]["name"]: tool for tool in new.get_tools_list(topic_id)}
+            tools: List[str] = [
+                ("+" if name not in old_tools else "-" if name not in new_tools else "~") + name
+                for name in sorted(set(old_tools) | set(new_tools))
+                if old_tools.get(name) != new_tools.get(name)
+            ]
+            if keys or tools:
+                changes.append(f"~ {topic_id}: " + ", ".join(keys + (["tools " + " ".join(tools)] if tools else [])))
+        return changes
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_parser = commands.add_parser("compile", help="compile the flow configs into a bundle")
+    compile_parser.add_argument("--root", default=".", help="flow directory (default: current directory)")
+    compile_parser.add_argument("--output", default="flow_bundle.json", help="bundle file to write")
+    compile_parser.add_argument("--label", default="", help="release label stored in the bundle")
+
+    check_parser = commands.add_parser("check", help="validate the flow configs without writing a bundle")
+    check_parser.add_argument("--root", default=".", help="flow directory (default: current directory)")
+
+    diff_parser = commands.add_parser("diff", help="compare two bundles")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "diff":
+        old, new = FlowBundle.load(args.old), FlowBundle.load(args.new)
+        print(f"{old.version} -> {new.version}")
+        for change in FlowBundleCompiler.diff(old, new):
+            print(change)
+        return 0
+
+    compiler = FlowBundleCompiler(args.root)
+    try:
+        bundle: Dict[str, Any] = compiler.compile(getattr(args, "label", ""))
+    except ValueError:
+        for error in compiler.errors:
+            print(error, file=sys.stderr)
+        print(f"{len(compiler.errors)} error(s)", file=sys.stderr)
+        return 1
+
+    if args.command == "compile":
+        FlowBundleCompiler.write(bundle, args.output)
+        print(f"Wrote {args.output}: version {bundle['version']}, {len(bundle['topics'])} topic(s)")
+    else:
+        print(f"OK: {len(bundle['topics'])} topic(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
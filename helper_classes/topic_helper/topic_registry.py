@@ -0,0 +1,505 @@
+"""
+This module provides the TopicRegistry, the process wide store of the persona topics.
+
+Topics are loaded on demand, a whole topic area (`persona-<name>/topic_area_<area>/`) at a time,
+from the flow bundle if one is configured or from the YAML files. Each topic is compiled once into a
+CompiledTopic holding the frozen topic object, its tools list merged with the standard tool functions,
+and, on first use, its argument validators and handler dispatch table. Frozen objects cannot be
+modified, so they are shared by all turns and threads without copying; `copy.deepcopy` returns a
+mutable copy.
+
+The resident topic areas are bounded by an approximate memory cap (`TOPIC_REGISTRY_MAX_BYTES`,
+64 MiB by default) and the least recently used areas are evicted first. Topic files are checked for
+changes at most every `TOPIC_REGISTRY_RELOAD_CHECK_S` seconds (1 by default, 0 disables the check)
+and a changed area is reloaded.
+
+Classes:
+    FrozenDict: A read-only dict.
+    FrozenList: A read-only list.
+    CompiledTopic: A loaded topic and the objects compiled from it.
+    TopicArea: The compiled topics of a topic area.
+    TopicRegistry: Loads, caches and evicts topic areas.
+
+Functions:
+    freeze: Returns a frozen copy of a parsed YAML or JSON value.
+"""
+
+import glob
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from helper_classes.helper_classes_customer.handler_registry import TopicDispatchTable
+from helper_classes.tool_argument_validator import ToolArgumentValidator
+from helper_classes.topic_helper.flow_bundle import FlowBundle
+
+
+def _immutable(self: Any, *args: Any, **kwargs: Any) -> None:
+    raise TypeError(f"{type(self).__name__} is shared and cannot be modified, copy.deepcopy() it first")
+
+
+class FrozenDict(dict):
+    """
+    A read-only dict. Serializes, compares and reads like a dict; `copy.deepcopy` returns a mutable dict.
+    """
+
+    __setitem__ = __delitem__ = __ior__ = _immutable  # type: ignore
+    clear = pop = popitem = setdefault = update = _immutable  # type: ignore
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Dict[str, Any]:
+        return thaw(self)
+
+    def __reduce__(self) -> Any:
+        return dict, (thaw(self),)
+
+
+class FrozenList(list):
+    """
+    A read-only list. Serializes, compares and reads like a list; `copy.deepcopy` returns a mutable list.
+    """
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable  # type: ignore
+    append = extend = insert = pop = remove = clear = sort = reverse = _immutable  # type: ignore
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> List[Any]:
+        return thaw(self)
+
+    def __reduce__(self) -> Any:
+        return list, (thaw(self),)
+
+
+def freeze(value: Any) -> Any:
+    """
+    Returns a frozen copy of a parsed YAML or JSON value.
+
+    Args:
+        value (Any): The value.
+
+    Returns:
+        Any: The value with its dicts and lists replaced by FrozenDict and FrozenList.
+    """
+    if isinstance(value, dict):
+        frozen_dict = FrozenDict()
+        for key, item in value.items():
+            dict.__setitem__(frozen_dict, key, freeze(item))
+        return frozen_dict
+    if isinstance(value, (list, tuple)):
+        frozen_list = FrozenList()
+        list.extend(frozen_list, (freeze(item) for item in value))
+        return frozen_list
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """
+    Returns a mutable copy of a frozen value.
+
+    Args:
+        value (Any): The frozen value.
+
+    Returns:
+        Any: The value with plain dicts and lists.
+    """
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [thaw(item) for item in value]
+    return value
+
+
+def _sizeof(value: Any) -> int:
+    """
+    Returns the approximate memory footprint of a parsed value and everything it references.
+    """
+    size: int = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_sizeof(key) + _sizeof(item) for key, item in value.items())
+    elif isinstance(value, list):
+        size += sum(_sizeof(item) for item in value)
+    return size
+
+
+class CompiledTopic:
+    """
+    A loaded topic and the objects compiled from it, shared by all turns.
+
+    Attributes:
+        topic_id (str): The topic id, `persona/topic_area/topic`.
+        source (str): The topic file, or the bundle path and topic id.
+        key (Tuple[str, Any]): The source and version of the topic.
+        topic_object (FrozenDict): The topic as defined in its YAML file.
+        tools_list (FrozenList): The tools of the topic merged with its standard tool functions, as sent
+            to the language model.
+    """
+
+    def __init__(self, topic_id: str, source: str, version: Any, topic_object: Any, tools_list: Any):
+        self.topic_id: str = topic_id
+        self.source: str = source
+        self.key: Tuple[str, Any] = (source, version)
+        self.topic_object: FrozenDict = freeze(topic_object)
+        # The argument prompts and defaults of the tools are read by the validators only
+        self._tools: FrozenList = freeze(tools_list)
+        self.tools_list: FrozenList = freeze(ToolArgumentValidator.model_tools(tools_list))
+        self._tool_validators: Optional[Dict[str, ToolArgumentValidator]] = None
+        self._dispatch_table: Optional[TopicDispatchTable] = None
+        self._dispatch_error: Optional[ValueError] = None
+        # Guards the lazy builds, the topic is shared by the threads of the process
+        self._lock: threading.Lock = threading.Lock()
+
+    def get_tool_validators(self) -> Dict[str, ToolArgumentValidator]:
+        """
+        Returns the argument validators of the tools, compiling them on first use.
+
+        Returns:
+            Dict[str, ToolArgumentValidator]: The validators keyed by function name.
+        """
+        if self._tool_validators is None:
+            with self._lock:
+                if self._tool_validators is None:
+                    self._tool_validators = ToolArgumentValidator.compile_tools(self._tools)
+        return self._tool_validators
+
+    def build_dispatch_table(self) -> bool:
+        """
+        Builds and validates the handler dispatch table of the topic. Called by the TopicRegistry
+        when the topic area loads. A failure is logged and kept, see `get_dispatch_table`.
+
+        Returns:
+            bool: True if the dispatch table is valid.
+        """
+        try:
+            self._dispatch_table = TopicDispatchTable(self.topic_object)
+        except ValueError as e:
+            self._dispatch_error = e
+            log_data: Dict[str, Any] = {"topic_id": self.topic_id, "error_message": str(e)}
+            logging.error("Topic dispatch table invalid", extra=log_data)
+        return self._dispatch_error is None
+
+    def get_dispatch_table(self) -> TopicDispatchTable:
+        """
+        Returns the handler dispatch table of the topic, built when the topic area loaded.
+
+        Returns:
+            TopicDispatchTable: The dispatch table.
+
+        Raises:
+            ValueError: If a custom handler action references an unknown handler, the error of the build.
+        """
+        if self._dispatch_table is None and self._dispatch_error is None:
+            with self._lock:
+                if self._dispatch_table is None and self._dispatch_error is None:
+                    self.build_dispatch_table()
+        if self._dispatch_error is not None:
+            raise self._dispatch_error
+        return self._dispatch_table  # type: ignore
+
+
+class TopicArea:
+    """
+    The compiled topics of a topic area.
+
+    Attributes:
+        topics (Dict[str, CompiledTopic]): The topics keyed by topic name.
+        sources (Dict[str, float]): The modification time of each file the topics were loaded from.
+        size_bytes (int): The approximate memory footprint of the topics.
+    """
+
+    def __init__(self, topics: Dict[str, CompiledTopic], sources: Dict[str, float]):
+        self.topics: Dict[str, CompiledTopic] = topics
+        self.sources: Dict[str, float] = sources
+        self.size_bytes: int = sum(
+            _sizeof(topic.topic_object) + _sizeof(topic.tools_list) for topic in topics.values()
+        )
+        self.checked_at: float = time.monotonic()
+
+    def is_stale(self) -> bool:
+        """
+        Checks whether a file the topics were loaded from has changed or been removed.
+
+        Returns:
+            bool: True if the area must be reloaded.
+        """
+        for path, mtime in self.sources.items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+
+class TopicRegistry:
+    """
+    Loads topic areas on demand and keeps the most recently used ones within a memory cap.
+    """
+
+    _areas: "OrderedDict[Tuple[str, str], TopicArea]" = OrderedDict()
+    _lock: threading.Lock = threading.Lock()
+    _area_locks: Dict[Tuple[str, str], threading.Lock] = {}
+    _metrics: Dict[str, float] = {"hits": 0, "loads": 0, "reloads": 0, "evictions": 0, "load_ms_total": 0.0}
+    _load_counts: Dict[str, int] = {}
+
+    max_bytes: int = int(os.environ.get("TOPIC_REGISTRY_MAX_BYTES", str(64 * 1024 * 1024)))
+    reload_check_s: float = float(os.environ.get("TOPIC_REGISTRY_RELOAD_CHECK_S", "1"))
+
+    @staticmethod
+    def get_topic(persona_name: str, topic_area: str, topic_name: str) -> CompiledTopic:
+        """
+        Returns a compiled topic, loading its topic area if it is not resident.
+
+        Args:
+            persona_name (str): The persona name.
+            topic_area (str): The topic area.
+            topic_name (str): The topic name.
+
+        Returns:
+            CompiledTopic: The compiled topic.
+
+        Raises:
+            FileNotFoundError: If the topic does not exist.
+        """
+        area_key: Tuple[str, str] = (persona_name, topic_area)
+        area: TopicArea = TopicRegistry.get_area(area_key)
+
+        topic: Optional[CompiledTopic] = area.topics.get(topic_name)
+        if topic is None and FlowBundle.get_active() is None:
+            # The topic file may have been added since the area was loaded
+            area = TopicRegistry.get_area(area_key, reload=True)
+            topic = area.topics.get(topic_name)
+        if topic is None:
+            raise FileNotFoundError(f"Topic '{FlowBundle.topic_id(persona_name, topic_area, topic_name)}' not found")
+        return topic
+
+    @staticmethod
+    def get_area(area_key: Tuple[str, str], reload: bool = False) -> TopicArea:
+        """
+        Returns a resident topic area, loading it if it is not resident or has changed.
+
+        Args:
+            area_key (Tuple[str, str]): The persona name and topic area.
+            reload (bool): Whether to reload the area even if it has not changed.
+
+        Returns:
+            TopicArea: The topic area.
+        """
+        area: Optional[TopicArea] = TopicRegistry._get_resident(area_key)
+        if area is not None and not reload and not TopicRegistry._needs_reload(area):
+            with TopicRegistry._lock:
+                TopicRegistry._metrics["hits"] += 1
+            return area
+
+        with TopicRegistry._lock:
+            area_lock = TopicRegistry._area_locks.setdefault(area_key, threading.Lock())
+
+        with area_lock:
+            # Another thread may have loaded the area while this one was waiting
+            current: Optional[TopicArea] = TopicRegistry._get_resident(area_key)
+            if current is not None and current is not area and not reload:
+                return current
+
+            start_time: float = time.perf_counter()
+            loaded: TopicArea = TopicRegistry.load_area(*area_key)
+            load_ms: float = (time.perf_counter() - start_time) * 1000
+
+            area_id: str = "/".join(area_key)
+            with TopicRegistry._lock:
+                TopicRegistry._areas[area_key] = loaded
+                TopicRegistry._areas.move_to_end(area_key)
+                TopicRegistry._metrics["reloads" if current is not None else "loads"] += 1
+                TopicRegistry._metrics["load_ms_total"] += load_ms
+                TopicRegistry._load_counts[area_id] = TopicRegistry._load_counts.get(area_id, 0) + 1
+                evicted: List[str] = TopicRegistry._evict(keep=area_key)
+
+            log_data: Dict[str, Any] = {
+                "topic_area": area_id,
+                "topics": len(loaded.topics),
+                "size_bytes": loaded.size_bytes,
+                "load_ms": load_ms,
+                "evicted": evicted,
+            }
+            logging.info("Topic area loaded", extra=log_data)
+            return loaded
+
+    @staticmethod
+    def load_area(persona_name: str, topic_area: str) -> TopicArea:
+        """
+        Loads and compiles the topics of a topic area from the flow bundle or the YAML files.
+
+        Args:
+            persona_name (str): The persona name.
+            topic_area (str): The topic area.
+
+        Returns:
+            TopicArea: The topic area.
+
+        Raises:
+            FileNotFoundError: If the topic area does not exist.
+        """
+        topics: Dict[str, CompiledTopic] = {}
+        sources: Dict[str, float] = {}
+        prefix: str = FlowBundle.topic_id(persona_name, topic_area, "")
+
+        bundle: Optional[FlowBundle] = FlowBundle.get_active()
+        if bundle is not None:
+            for topic_id in bundle.topic_ids():
+                if topic_id.startswith(prefix):
+                    topics[topic_id[len(prefix):]] = CompiledTopic(
+                        topic_id,
+                        bundle.path + "#" + topic_id,
+                        bundle.version,
+                        bundle.get_topic(topic_id),
+                        bundle.get_tools_list(topic_id),
+                    )
+        else:
+            area_dir: str = os.path.join(os.getcwd(), "persona-" + persona_name, "topic_area_" + topic_area)
+            standard_tools: Dict[str, Any] = {}
+            for path in sorted(glob.glob(os.path.join(area_dir, "*.yaml"))):
+                topic_name: str = os.path.splitext(os.path.basename(path))[0]
+                sources[path] = os.path.getmtime(path)
+                topic_object: Dict[str, Any] = TopicRegistry._parse_yaml(path)
+                tools_list: List[Any] = list(topic_object.get("tools") or [])
+                for stf in topic_object.get("standard_tool_functions") or []:
+                    if stf not in standard_tools:
+                        stf_path: str = os.path.join(os.getcwd(), "standard_tool_functions", stf + ".yaml")
+                        sources[stf_path] = os.path.getmtime(stf_path)
+                        standard_tools[stf] = TopicRegistry._parse_yaml(stf_path)
+                    tools_list.append(standard_tools[stf])
+                topics[topic_name] = CompiledTopic(
+                    FlowBundle.topic_id(persona_name, topic_area, topic_name), path, sources[path], topic_object, tools_list
+                )
+
+        if not topics:
+            raise FileNotFoundError(f"Topic area '{prefix.rstrip('/')}' not found")
+        # Unknown handlers are reported once, when the area loads, rather than by every turn
+        for topic in topics.values():
+            topic.build_dispatch_table()
+        return TopicArea(topics, sources)
+
+    @staticmethod
+    def preload(area_keys: Optional[Iterable[Tuple[str, str]]] = None) -> List[str]:
+        """
+        Loads topic areas ahead of the first turn, while they fit within the memory cap.
+
+        Args:
+            area_keys (Optional[Iterable[Tuple[str, str]]]): The persona names and topic areas to load.
+                Defaults to every topic area of the bundle or the working directory.
+
+        Returns:
+            List[str]: The loaded topic areas.
+        """
+        if area_keys is None:
+            area_keys = TopicRegistry.list_areas()
+
+        loaded: List[str] = []
+        for area_key in area_keys:
+            if TopicRegistry.get_metrics()["resident_bytes"] >= TopicRegistry.max_bytes:
+                break
+            TopicRegistry.get_area(area_key)
+            loaded.append("/".join(area_key))
+        return loaded
+
+    @staticmethod
+    def list_areas() -> List[Tuple[str, str]]:
+        """
+        Lists the topic areas of the bundle or the working directory.
+
+        Returns:
+            List[Tuple[str, str]]: The persona names and topic areas.
+        """
+        bundle: Optional[FlowBundle] = FlowBundle.get_active()
+        if bundle is not None:
+            return sorted({tuple(topic_id.split("/")[:2]) for topic_id in bundle.topic_ids()})  # type: ignore
+
+        area_keys: List[Tuple[str, str]] = []
+        for area_dir in sorted(glob.glob(os.path.join(os.getcwd(), "persona-*", "topic_area_*"))):
+            persona_dir, topic_area = os.path.split(area_dir)
+            area_keys.append((os.path.basename(persona_dir)[len("persona-"):], topic_area[len("topic_area_"):]))
+        return area_keys
+
+    @staticmethod
+    def get_resident_topics() -> List[CompiledTopic]:
+        """
+        Returns the topics of the resident topic areas, without loading any area.
+
+        Returns:
+            List[CompiledTopic]: The resident topics.
+        """
+        with TopicRegistry._lock:
+            return [topic for area in TopicRegistry._areas.values() for topic in area.topics.values()]
+
+    @staticmethod
+    def get_metrics() -> Dict[str, Any]:
+        """
+        Returns the registry metrics.
+
+        Returns:
+            Dict[str, Any]: The resident size and counts, the load, reload, hit and eviction counters,
+                and the number of loads of each topic area.
+        """
+        with TopicRegistry._lock:
+            return {
+                "resident_bytes": sum(area.size_bytes for area in TopicRegistry._areas.values()),
+                "resident_areas": len(TopicRegistry._areas),
+                "resident_topics": sum(len(area.topics) for area in TopicRegistry._areas.values()),
+                "max_bytes": TopicRegistry.max_bytes,
+                **TopicRegistry._metrics,
+                "load_counts": dict(TopicRegistry._load_counts),
+            }
+
+    @staticmethod
+    def clear() -> None:
+        """
+        Evicts every topic area.
+        """
+        with TopicRegistry._lock:
+            TopicRegistry._areas.clear()
+
+    @staticmethod
+    def _get_resident(area_key: Tuple[str, str]) -> Optional[TopicArea]:
+        with TopicRegistry._lock:
+            area = TopicRegistry._areas.get(area_key)
+            if area is not None:
+                TopicRegistry._areas.move_to_end(area_key)
+            return area
+
+    @staticmethod
+    def _needs_reload(area: TopicArea) -> bool:
+        """
+        Checks the files of a file-backed area for changes, at most once per check interval.
+        """
+        if not area.sources or TopicRegistry.reload_check_s <= 0:
+            return False
+        now: float = time.monotonic()
+        if now - area.checked_at < TopicRegistry.reload_check_s:
+            return False
+        area.checked_at = now
+        return area.is_stale()
+
+    @staticmethod
+    def _evict(keep: Tuple[str, str]) -> List[str]:
+        """
+        Evicts the least recently used areas until the resident areas fit within the memory cap.
+        Must be called with the registry lock held.
+        """
+        evicted: List[str] = []
+        resident_bytes: int = sum(area.size_bytes for area in TopicRegistry._areas.values())
+        while resident_bytes > TopicRegistry.max_bytes and len(TopicRegistry._areas) > 1:
+            area_key = next(iter(TopicRegistry._areas))
+            if area_key == keep:
+                break
+            resident_bytes -= TopicRegistry._areas.pop(area_key).size_bytes
+            TopicRegistry._metrics["evictions"] += 1
+            evicted.append("/".join(area_key))
+        return evicted
+
+    @staticmethod
+    def _parse_yaml(path: str) -> Any:
+        # Imported on first load, it is not needed once the areas are resident
+        import yaml
+
+        with open(path, "r", encoding="utf-8") as file:
+            return yaml.safe_load(file)
@@ -0,0 +1,237 @@
+"""
+This module provides the context of a turn, created once by `execute` and handed to the response
+handler, the custom handlers and the helpers they call.
+
+Before the context, each helper set the turn up again: `LlmRag`, `CustomerQueryHandler` and
+`OfferQueryHandler` each built an `LLMHelper` and loaded its topic, and each save built a
+`ConversationDataHelper`. The context does this work once per turn and keeps the timing of its
+steps.
+
+Classes:
+    TurnContext: The parameters, conversation state, helpers and timings of a turn.
+"""
+
+import copy
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+
+from promptflow.connections import CognitiveSearchConnection  # type: ignore
+from promptflow.connections import CustomConnection  # type: ignore
+from helper_classes import metrics
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.lm_helpers.llm_helper import LLMHelper
+from helper_classes.lm_helpers.lm_helper import LMHelper
+
+if TYPE_CHECKING:
+    from openai import AzureOpenAI
+
+
+class TurnContext:
+    """
+    The parameters, conversation state, helpers and timings of a turn.
+
+    The context is shared by the tool calls of the turn processed one after the other. A tool call
+    processed in parallel gets a context of its own, see `create_call_context`.
+
+    Attributes:
+        conversation_parameters (Dict[str, Any]): The parsed conversation parameters.
+        custom_connections (CustomConnection): The custom connection.
+        cognitive_search_connection (CognitiveSearchConnection): The search connection.
+        chat_history (List[Dict[str, Any]]): The chat history.
+        query (str): The user's message.
+        data_helper (ConversationDataHelper): The conversation state store, used by every load and save.
+        conversation_data (Dict[str, Any]): The conversation data read by `load_conversation_data`.
+        timings (Dict[str, float]): The time spent in each step of the turn, in milliseconds.
+    """
+
+    _metrics: Dict[str, float] = {"turns": 0, "llm_helpers_created": 0, "llm_helpers_reused": 0, "turn_ms": 0.0}
+    _metrics_lock: threading.Lock = threading.Lock()
+
+    def __init__(
+        self,
+        custom_connections: CustomConnection,
+        cognitive_search_connection: CognitiveSearchConnection,
+        conversation_parameters: Dict[str, Any],
+        chat_history: List[Dict[str, Any]],
+        query: str,
+    ):
+        """
+        Initializes the TurnContext.
+
+        Args:
+            custom_connections (CustomConnection): The custom connection.
+            cognitive_search_connection (CognitiveSearchConnection): The search connection.
+            conversation_parameters (Dict[str, Any]): The parsed conversation parameters.
+            chat_history (List[Dict[str, Any]]): The chat history.
+            query (str): The user's message.
+        """
+        self.started_at: float = time.perf_counter()
+        self.custom_connections: CustomConnection = custom_connections
+        self.cognitive_search_connection: CognitiveSearchConnection = cognitive_search_connection
+        self.conversation_parameters: Dict[str, Any] = conversation_parameters
+        self.chat_history: List[Dict[str, Any]] = chat_history
+        self.query: str = query
+        self.data_helper: ConversationDataHelper = ConversationDataHelper(conversation_parameters)
+        self.conversation_data: Dict[str, Any] = {}
+        self.timings: Dict[str, float] = {}
+        self._client: Optional["AzureOpenAI"] = None
+        self._llm_helpers: Dict[str, LLMHelper] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    @contextmanager
+    def timed(self, step: str) -> Iterator[None]:
+        """
+        Adds the time spent in the block to the timing of a step of the turn.
+
+        Args:
+            step (str): The step name.
+        """
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration_ms: float = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.timings[step] = self.timings.get(step, 0.0) + duration_ms
+
+    @property
+    def client(self) -> "AzureOpenAI":
+        """
+        The Azure OpenAI client of the turn, from the pool of LLMHelper.
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = LLMHelper.create_pooled_client(self.custom_connections)
+            return self._client
+
+    def load_conversation_data(self) -> Dict[str, Any]:
+        """
+        Reads the conversation data of the turn.
+
+        Returns:
+            Dict[str, Any]: The conversation data, kept as `conversation_data`.
+        """
+        with self.timed("load_state"):
+            self.conversation_data = self.data_helper.get_conversation_data()
+        return self.conversation_data
+
+    def save_conversation_data(self, conversation_data: Dict[str, Any]) -> None:
+        """
+        Saves conversation data of the turn, see ConversationDataHelper.save_conversation_data.
+
+        Args:
+            conversation_data (Dict[str, Any]): The conversation data, the turn's or the copy of a
+                tool call processed in parallel.
+        """
+        with self.timed("save_state"):
+            self.data_helper.save_conversation_data(conversation_data)
+
+    def get_llm_helper(self, topic_name: Optional[str] = None) -> LLMHelper:
+        """
+        Returns the LLMHelper of a topic for the turn, created with its topic loaded on first use.
+
+        Args:
+            topic_name (Optional[str]): The topic name. Defaults to the topic of the conversation data.
+
+        Returns:
+            LLMHelper: The helper, shared by the calls of the turn for the same topic.
+        """
+        topic_name = topic_name or self.conversation_data["topic_name"]
+        with self._lock:
+            llm_helper: Optional[LLMHelper] = self._llm_helpers.get(topic_name)
+            reused: bool = llm_helper is not None
+            if llm_helper is None:
+                llm_helper = LLMHelper(
+                    self.custom_connections,
+                    self.cognitive_search_connection,
+                    self.chat_history,
+                    self.query,
+                    self.conversation_parameters,
+                    self.conversation_data,
+                )
+                llm_helper.load_topic_object(topic_name)
+                self._llm_helpers[topic_name] = llm_helper
+        TurnContext._count(**{"llm_helpers_reused" if reused else "llm_helpers_created": 1})
+        return llm_helper
+
+    def create_call_context(self, conversation_data: Dict[str, Any]) -> "TurnContext":
+        """
+        Returns the context of a tool call processed in parallel. It shares the parameters,
+        connections and state store of the turn, but has the call's copy of the conversation data
+        and its own timings and LLMHelpers, which are bound to that copy.
+
+        Args:
+            conversation_data (Dict[str, Any]): The conversation data of the call.
+
+        Returns:
+            TurnContext: The context of the call, see `merge_call_context`.
+        """
+        call_context: TurnContext = copy.copy(self)
+        call_context.conversation_data = conversation_data
+        call_context.timings = {}
+        call_context._llm_helpers = {}
+        call_context._lock = threading.Lock()
+        return call_context
+
+    def merge_call_context(self, call_context: "TurnContext") -> None:
+        """
+        Adds the timings of the context of a tool call processed in parallel to the timings of the
+        turn, as for the calls processed one after the other.
+
+        Args:
+            call_context (TurnContext): The context of the call, once the call completed.
+        """
+        with self._lock:
+            for step, step_ms in call_context.timings.items():
+                self.timings[step] = self.timings.get(step, 0.0) + step_ms
+
+    def finish(self) -> None:
+        """
+        Logs the timings of the turn, counts it and records it in the metrics.
+        """
+        turn_ms: float = (time.perf_counter() - self.started_at) * 1000
+        TurnContext._count(turns=1, turn_ms=turn_ms)
+        persona: str = str(self.conversation_parameters.get("persona_name"))
+        metrics.TURN_SECONDS.observe(
+            turn_ms / 1000, persona=persona, topic=self.conversation_data.get("topic_name")
+        )
+        for step, step_ms in self.timings.items():
+            metrics.TURN_STEP_SECONDS.observe(step_ms / 1000, persona=persona, step=step)
+        logging.info(
+            "Turn completed",
+            extra={
+                "session_id": str(self.conversation_parameters.get("session_id")),
+                "conversation_id": str(self.conversation_parameters.get("conversation_id")),
+                "execution_time_ms": turn_ms,
+                "timings": {step: round(value, 3) for step, value in self.timings.items()},
+                "llm_helpers": len(self._llm_helpers),
+            },
+        )
+
+    @staticmethod
+    def _count(**counts: float) -> None:
+        with TurnContext._metrics_lock:
+            for name, count in counts.items():
+                TurnContext._metrics[name] += count
+
+    @staticmethod
+    def get_metrics() -> Dict[str, float]:
+        """
+        Returns the number of turns, their mean duration, the helpers the contexts created and reused,
+        and the LMHelper instances, topic loads and ConversationDataHelper instances per turn across
+        the process (the rolling summaries included), which show the setup work done per turn.
+        """
+        with TurnContext._metrics_lock:
+            counters: Dict[str, float] = dict(TurnContext._metrics)
+        turns: float = counters["turns"]
+        lm_counts: Dict[str, int] = LMHelper.get_counts()
+        data_helpers: int = ConversationDataHelper.get_metrics()["instances"]
+        turn_ms: float = counters.pop("turn_ms")
+        counters["mean_turn_ms"] = round(turn_ms / turns, 3) if turns else 0.0
+        counters["llm_helpers_per_turn"] = round(lm_counts["instances"] / turns, 3) if turns else 0.0
+        counters["topic_loads_per_turn"] = round(lm_counts["topic_loads"] / turns, 3) if turns else 0.0
+        counters["data_helpers_per_turn"] = round(data_helpers / turns, 3) if turns else 0.0
+        return counters
@@ -0,0 +1,79 @@
+"""
+Shared fixtures of the tests: the local stand-in backends of `benchmarks/stand_in_backends.py` and
+a working copy of the flow configs pointed at them.
+"""
+
+import json
+import os
+import sys
+from typing import Any, Dict, Iterator, Tuple
+
+import pytest
+
+REPO_ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "benchmarks"))
+
+from stand_in_backends import StandInBackends, create_connections, prepare_flow_dir  # noqa: E402
+
+os.environ.setdefault("FLOW_PREWARM", "0")
+
+
+@pytest.fixture(scope="session")
+def stand_ins() -> Iterator[StandInBackends]:
+    """
+    The stand-in backends, started once for the session.
+    """
+    backends = StandInBackends(llm_latency_ms=0, search_latency_ms=0)
+    backends.start()
+    yield backends
+    backends.stop()
+
+
+@pytest.fixture(scope="session")
+def flow_dir(stand_ins: StandInBackends, tmp_path_factory: pytest.TempPathFactory) -> Iterator[str]:
+    """
+    A working copy of the flow configs pointed at the stand-ins, made the working directory for the
+    session.
+    """
+    work_dir: str = str(tmp_path_factory.mktemp("flow"))
+    prepare_flow_dir(work_dir, stand_ins.url)
+    cwd: str = os.getcwd()
+    os.chdir(work_dir)
+    yield work_dir
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def connections(stand_ins: StandInBackends) -> Tuple[Any, Any]:
+    """
+    The custom connection and the search connection of the stand-ins.
+    """
+    return create_connections(stand_ins.url)
+
+
+@pytest.fixture
+def run_turn(flow_dir: str, connections: Tuple[Any, Any]) -> Any:
+    """
+    Runs a turn of a conversation through `execute.execute`.
+
+    Returns:
+        Callable[[str, str], str]: Takes the conversation id and the query, returns the answer.
+    """
+    import execute
+
+    custom_connections, search_connection = connections
+
+    def run(conversation_id: str, query: str, chat_history: Any = None) -> str:
+        parameters: Dict[str, Any] = {
+            "session_id": "tests",
+            "conversation_id": conversation_id,
+            "persona_name": "public",
+            "topic_area": "customerService",
+            "locale": "en-GB",
+        }
+        return execute.execute(
+            custom_connections, search_connection, json.dumps(parameters), chat_history or [], query
+        )
+
+    return run
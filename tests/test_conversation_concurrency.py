@@ -0,0 +1,95 @@
+"""
+Tests of the versioned saves and the per-conversation lock of concurrent turns
+(`conversation_concurrency`, `ConversationDataHelper.save_conversation_data`).
+"""
+
+import os
+import uuid
+from typing import Any, Dict, Tuple
+
+import pytest
+
+from helper_classes.conversation_helper import conversation_concurrency
+from helper_classes.conversation_helper.conversation_concurrency import (
+    ConversationConflictError,
+    ConversationLock,
+    merge_conversation_data,
+)
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+
+
+def read_twice(flow_dir: str) -> Tuple[ConversationDataHelper, Dict[str, Any], Dict[str, Any]]:
+    """
+    Two turns of a new conversation reading the same version.
+    """
+    helper: ConversationDataHelper = ConversationDataHelper(
+        {"conversation_id": str(uuid.uuid4()), "persona_name": "public"}
+    )
+    first: Dict[str, Any] = helper.get_conversation_data()
+    second: Dict[str, Any] = helper.get_conversation_data()
+    first["arguments"] = {"email": "jane@example.com"}
+    second["arguments"] = {"query": "Where is my order?"}
+    return helper, first, second
+
+
+def test_concurrent_saves_are_merged(flow_dir: str, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("CONVERSATION_CONFLICT_POLICY", "merge")
+    helper, first, second = read_twice(flow_dir)
+
+    helper.save_conversation_data(first)
+    helper.save_conversation_data(second)
+
+    stored: Dict[str, Any] = helper.get_conversation_data()
+    assert stored["arguments"] == {"email": "jane@example.com", "query": "Where is my order?"}
+    assert stored[ConversationDataHelper.VERSION_KEY] == 3
+    # The turn goes on with the saved state
+    assert second == stored
+
+
+def test_conflicting_save_is_rejected(flow_dir: str, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("CONVERSATION_CONFLICT_POLICY", "reject")
+    helper, first, second = read_twice(flow_dir)
+    helper.save_conversation_data(first)
+
+    with pytest.raises(ConversationConflictError) as conflict:
+        helper.save_conversation_data(second)
+    assert (conflict.value.expected_version, conflict.value.stored_version) == (1, 2)
+    assert helper.get_conversation_data()["arguments"] == {"email": "jane@example.com"}
+
+
+def test_conflicting_save_overwrites(flow_dir: str, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("CONVERSATION_CONFLICT_POLICY", "overwrite")
+    helper, first, second = read_twice(flow_dir)
+
+    helper.save_conversation_data(first)
+    helper.save_conversation_data(second)
+
+    assert helper.get_conversation_data()["arguments"] == {"query": "Where is my order?"}
+
+
+def test_merge_keeps_the_last_change_of_a_key():
+    base: Dict[str, Any] = {"topic_name": "default", "arguments": {"query": "tents"}, "_version": 1}
+    theirs: Dict[str, Any] = {
+        "topic_name": "qna", "arguments": {"query": "boots", "email": "a@b.c"}, "_version": 2,
+    }
+    ours: Dict[str, Any] = {"topic_name": "default", "arguments": {"query": "jackets"}, "_version": 1}
+
+    merged: Dict[str, Any] = merge_conversation_data(base, ours, theirs)
+
+    assert merged == {"topic_name": "qna", "arguments": {"query": "jackets", "email": "a@b.c"}, "_version": 2}
+
+
+@pytest.mark.skipif(conversation_concurrency.fcntl is None, reason="file locks are not available")
+def test_conversation_lock_times_out_while_held(tmp_path: Any):
+    chat_path: str = str(tmp_path)
+
+    with ConversationLock.hold(chat_path, "locked", timeout_s=1.0) as held:
+        assert held
+        with ConversationLock.hold(chat_path, "locked", timeout_s=0.05) as waiting:
+            assert not waiting
+        # Other conversations are not blocked
+        with ConversationLock.hold(chat_path, "other", timeout_s=0.05) as other:
+            assert other
+    with ConversationLock.hold(chat_path, "locked", timeout_s=0.05) as released:
+        assert released
+    assert os.path.exists(os.path.join(chat_path, "_locks", "locked.lock"))
@@ -0,0 +1,39 @@
+"""
+Tests of the expiry of idle conversations racing the turns that read them (`ConversationSweeper`).
+"""
+
+import os
+import uuid
+from typing import Any, Dict, Optional
+
+import pytest
+
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.conversation_helper.conversation_expiry import ConversationSweeper
+
+
+def test_conversation_removed_after_the_read_starts_again(flow_dir: str, monkeypatch: pytest.MonkeyPatch):
+    parameters: Dict[str, Any] = {"conversation_id": str(uuid.uuid4()), "persona_name": "public"}
+    helper: ConversationDataHelper = ConversationDataHelper(parameters)
+    stored: Dict[str, Any] = helper.get_conversation_data()
+    helper.save_conversation_data(dict(stored, topic_name="customerQuery"))
+    read = ConversationDataHelper._read
+
+    def read_then_expire(self: ConversationDataHelper) -> Optional[Dict[str, Any]]:
+        conversation_data: Optional[Dict[str, Any]] = read(self)
+        # The sweeper removes the idle conversation between the read and the touch
+        os.remove(self._conversation_data_file_path())
+        return conversation_data
+
+    monkeypatch.setattr(ConversationDataHelper, "_read", read_then_expire)
+    conversation_data: Dict[str, Any] = ConversationDataHelper(parameters).get_conversation_data()
+
+    assert conversation_data["topic_name"] == "default"
+    assert conversation_data[ConversationDataHelper.VERSION_KEY] == 1
+
+
+def test_metrics_are_a_copy(tmp_path: Any):
+    sweeper: ConversationSweeper = ConversationSweeper(str(tmp_path))
+
+    sweeper.get_metrics()["last_pass"]["live"] = 10
+    assert sweeper.get_metrics()["last_pass"] == {}
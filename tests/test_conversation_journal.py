@@ -0,0 +1,82 @@
+"""
+Tests of the journal store of conversation data (`ConversationJournal`).
+"""
+
+import copy
+import os
+import uuid
+from typing import Any, Dict, List
+
+import pytest
+
+from helper_classes.conversation_helper.conversation_concurrency import ConversationConflictError
+from helper_classes.conversation_helper.conversation_journal import (
+    ConversationJournal,
+    apply_record,
+    diff_records,
+)
+
+STATE: Dict[str, Any] = {
+    "topic_name": "customerQuery",
+    "arguments": {"email": "jane@example.com", "query": "Where is my order?"},
+    "_version": 1,
+}
+
+
+def test_changes_are_journaled_as_deltas():
+    new: Dict[str, Any] = copy.deepcopy(STATE)
+    new["topic_name"] = "default"
+    new["arguments"]["query"] = "Which tent?"
+    del new["arguments"]["email"]
+    new["_version"] = 2
+
+    records: List[Dict[str, Any]] = diff_records(STATE, new)
+    assert {record["op"] for record in records} == {"topic", "arg", "arg_del", "set"}
+    assert len(records) == 4
+
+    state: Dict[str, Any] = copy.deepcopy(STATE)
+    for record in records:
+        state = apply_record(state, record)
+    assert state == new
+    assert diff_records(new, new) == []
+
+
+def test_saves_are_replayed_and_survive_a_compaction(tmp_path: Any):
+    journal: ConversationJournal = ConversationJournal(str(tmp_path), shards=2)
+    conversation_id: str = str(uuid.uuid4())
+
+    assert journal.save(conversation_id, STATE, expected_version=0) == 1
+    updated: Dict[str, Any] = dict(STATE, topic_name="default", _version=2)
+    assert journal.save(conversation_id, updated, expected_version=1) == 2
+    assert journal.load(conversation_id) == updated
+    assert [record["op"] for record in journal.get_history(conversation_id)] == ["reset", "topic", "set"]
+
+    shard: int = journal.shard_of(conversation_id)
+    assert journal.compact(shard) == 1
+    assert os.path.exists(os.path.join(str(tmp_path), f"{shard:03d}.1.snap"))
+    # Read back from the snapshot, also by another process sharing the directory
+    assert journal.load(conversation_id) == updated
+    assert ConversationJournal(str(tmp_path), shards=2).load(conversation_id) == updated
+    assert journal.get_history(conversation_id) == []
+
+
+def test_save_at_a_stale_version_is_rejected(tmp_path: Any):
+    journal: ConversationJournal = ConversationJournal(str(tmp_path))
+    conversation_id: str = str(uuid.uuid4())
+    journal.save(conversation_id, STATE, expected_version=0)
+
+    with pytest.raises(ConversationConflictError):
+        journal.save(conversation_id, dict(STATE, topic_name="default"), expected_version=0)
+    assert journal.load(conversation_id) == STATE
+
+
+def test_turns_keep_their_state_in_the_journal(flow_dir: str, run_turn: Any, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("CONVERSATION_STATE_STORE", "journal")
+    conversation_id: str = str(uuid.uuid4())
+
+    run_turn(conversation_id, "Where is my order?")
+
+    journal: ConversationJournal = ConversationJournal.get_instance(os.path.join(flow_dir, "chats"))
+    state: Dict[str, Any] = journal.load(conversation_id)  # type: ignore
+    assert state["topic_name"] == "customerQuery"
+    assert not os.path.exists(os.path.join(flow_dir, "chats", conversation_id + ".json"))
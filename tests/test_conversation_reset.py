@@ -0,0 +1,26 @@
+"""
+Tests of the reset of a conversation by the fallback tool.
+"""
+
+import json
+import os
+from typing import Any, Dict
+
+
+def read_conversation(flow_dir: str, conversation_id: str) -> Dict[str, Any]:
+    with open(os.path.join(flow_dir, "chats", conversation_id + ".json"), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def test_reset_keeps_the_state_of_the_conversation(flow_dir: str, run_turn: Any):
+    run_turn("reset-state", "Where is my order?")
+    before: Dict[str, Any] = read_conversation(flow_dir, "reset-state")
+    assert before["topic_name"] == "customerQuery"
+
+    answer: str = run_turn("reset-state", "Never mind, let's start again")
+    after: Dict[str, Any] = read_conversation(flow_dir, "reset-state")
+
+    assert "start again" in answer
+    assert after["topic_name"] == "default" and "arguments" not in after
+    # The expiry of idle conversations relies on the persona and creation time
+    assert after["_state"] == before["_state"]
@@ -0,0 +1,121 @@
+"""
+Tests of the rolling conversation summary (`ConversationSummaryHelper` and the summarizers).
+"""
+
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.conversation_helper.conversation_summarizer import ExtractiveSummarizer, LLMSummarizer
+from helper_classes.conversation_helper.conversation_summary_helper import ConversationSummaryHelper
+from helper_classes.lm_helpers.llm_helper import LLMHelper
+from stand_in_backends import StandInBackends, create_connections
+
+
+def create_history(count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "inputs": {"query": f"Question {index}. More detail."},
+            "outputs": {"answer": f"Answer {index}. More detail."},
+        }
+        for index in range(count)
+    ]
+
+
+@pytest.fixture
+def summary_connections(stand_ins: StandInBackends) -> Tuple[Any, Any]:
+    return create_connections(
+        stand_ins.url,
+        {"summary_mode": "extractive", "summary_keep_last_turns": "2", "summary_fold_batch_turns": "2"},
+    )
+
+
+@pytest.fixture
+def summary_helper(flow_dir: str, summary_connections: Tuple[Any, Any]) -> ConversationSummaryHelper:
+    parameters: Dict[str, Any] = {
+        "session_id": "tests",
+        "conversation_id": str(uuid.uuid4()),
+        "persona_name": "public",
+        "topic_area": "customerService",
+        "locale": "en-GB",
+    }
+    return ConversationSummaryHelper(summary_connections[0], summary_connections[1], parameters)
+
+
+def stored_summary(helper: ConversationSummaryHelper) -> Optional[Dict[str, Any]]:
+    data: Dict[str, Any] = ConversationDataHelper(helper.conversation_parameters).get_conversation_data()
+    return data.get(ConversationSummaryHelper.SUMMARY_KEY)
+
+
+def test_oldest_turns_are_folded_in_batches(summary_helper: ConversationSummaryHelper):
+    history: List[Dict[str, Any]] = create_history(6)
+
+    record: Optional[Dict[str, Any]] = summary_helper.update_summary(history)
+    # All but the last 2 turns, each as the leading sentence of the query and the answer
+    assert record is not None and record["turns_covered"] == 4
+    assert record["text"].splitlines()[:2] == ["User: Question 0.", "Assistant: Answer 0."]
+    assert stored_summary(summary_helper) == record
+
+    # A single new turn is less than a batch
+    assert summary_helper.update_summary(history + create_history(7)[6:]) is None
+    record = summary_helper.update_summary(create_history(8))
+    assert record is not None and record["turns_covered"] == 6
+    assert record["text"].splitlines()[-2:] == ["User: Question 5.", "Assistant: Answer 5."]
+
+
+def test_summary_of_another_history_is_discarded(summary_helper: ConversationSummaryHelper):
+    history: List[Dict[str, Any]] = create_history(6)
+    summary_helper.update_summary(history)
+    summary: Optional[Dict[str, Any]] = stored_summary(summary_helper)
+    conversation_data: Dict[str, Any] = {ConversationSummaryHelper.SUMMARY_KEY: summary}
+
+    # A summary lagging behind the history is valid
+    assert ConversationSummaryHelper.get_valid_summary(conversation_data, create_history(9)) is not None
+    # An edited turn, or a history shorter than the summary, is not
+    edited: List[Dict[str, Any]] = create_history(6)
+    edited[1]["outputs"]["answer"] = "Another answer."
+    assert ConversationSummaryHelper.get_valid_summary(conversation_data, edited) is None
+    assert ConversationSummaryHelper.get_valid_summary(conversation_data, create_history(3)) is None
+
+
+def test_failed_model_summary_falls_back_to_extractive(
+    summary_connections: Tuple[Any, Any], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(LLMHelper, "execute", lambda self, *args, **kwargs: None)
+    summarizer: LLMSummarizer = LLMSummarizer(
+        summary_connections[0], summary_connections[1], {"session_id": "tests", "conversation_id": "summary"},
+        "stand-in",
+    )
+    turns: List[Dict[str, str]] = [
+        {"user": "Which tent? For rain.", "assistant": "The Alpine Explorer. It is dry."}
+    ]
+
+    expected: str = ExtractiveSummarizer().summarize("User: Hello", turns)
+    assert summarizer.summarize("User: Hello", turns) == expected
+
+
+def test_prompt_is_the_summary_and_the_turns_it_does_not_cover(
+    summary_helper: ConversationSummaryHelper, summary_connections: Tuple[Any, Any]
+):
+    history: List[Dict[str, Any]] = create_history(6)
+    summary_helper.update_summary(history)
+    conversation_data: Dict[str, Any] = ConversationDataHelper(
+        summary_helper.conversation_parameters
+    ).get_conversation_data()
+    helper: LLMHelper = LLMHelper(
+        summary_connections[0], summary_connections[1], history, "Question 6.",
+        summary_helper.conversation_parameters, conversation_data,
+    )
+    helper.load_topic_object("default")
+
+    messages: List[Dict[str, str]] = helper.get_prompt_messages()
+    assert messages[1]["role"] == "system" and "User: Question 0." in messages[1]["content"]
+    assert [message["content"] for message in messages[2:]] == [
+        "Question 4. More detail.",
+        "Answer 4. More detail.",
+        "Question 5. More detail.",
+        "Answer 5. More detail.",
+        "Question 6.",
+    ]
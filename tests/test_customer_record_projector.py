@@ -0,0 +1,37 @@
+"""
+Tests of the projection of a customer record onto the sections of a query (`CustomerRecordProjector`).
+"""
+
+from typing import Any, Dict, List
+
+from helper_classes.helper_classes_customer.customer_service.customer_record_projector import (
+    CustomerRecordProjector,
+)
+
+
+def create_record(dates: List[str]) -> Dict[str, Any]:
+    orders: List[Dict[str, Any]] = [
+        {"id": index, "date": date, "name": "Trail Tent", "quantity": 1, "total": 100.0, "description": "x" * 400}
+        for index, date in enumerate(dates)
+    ]
+    return {"firstName": "Jane", "lastName": "Doe", "email": "jane@example.com", "orders": orders}
+
+
+def test_orders_cut_to_the_budget_are_the_oldest():
+    # In file order: the newest order is in the middle
+    record: Dict[str, Any] = create_record(["1/5/2022", "3/1/2024", "12/24/2023", "6/30/2021"])
+    projector: CustomerRecordProjector = CustomerRecordProjector(max_tokens=90)
+
+    projection: Dict[str, Any] = projector.project(record, "What are my recent orders?")
+
+    listed: List[int] = [order["id"] for order in projection["orders"]]
+    assert 0 < len(listed) < 4
+    assert listed == [1, 2, 0, 3][: len(listed)]
+    # The count and total still cover every order
+    assert projection["order_count"] == 4 and projection["orders_total"] == 400.0
+
+
+def test_orders_without_a_valid_date_come_last():
+    record: Dict[str, Any] = create_record(["unknown", "2/10/2023", "4/2/2023"])
+
+    assert [order["id"] for order in CustomerRecordProjector.newest_first(record["orders"])] == [2, 1, 0]
@@ -0,0 +1,70 @@
+"""
+Tests of the dispatch of tool calls to the custom handlers of a topic (`TopicDispatchTable`).
+"""
+
+import json
+import os
+import shutil
+from typing import Any, Dict, Tuple
+
+import pytest
+
+from helper_classes.topic_helper.topic_registry import TopicRegistry
+
+APOLOGY: str = "I'm sorry, I'm having trouble processing your request. Please try again later."
+
+
+@pytest.fixture(scope="module")
+def broken_persona(flow_dir: str) -> str:
+    """
+    A copy of the public persona whose customerQuery topic references an unknown handler.
+    """
+    target: str = os.path.join(flow_dir, "persona-broken")
+    shutil.copytree(os.path.join(flow_dir, "persona-public"), target, dirs_exist_ok=True)
+    path: str = os.path.join(target, "topic_area_customerService", "customerQuery.yaml")
+    with open(path, encoding="utf-8") as file:
+        content: str = file.read()
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(content.replace("method_name: handle_customerQuery", "method_name: handle_missing"))
+    return "broken"
+
+
+def test_dispatch_table_maps_functions_to_handlers(flow_dir: str):
+    topic = TopicRegistry.get_topic("public", "customerService", "customerQuery")
+
+    table = topic.get_dispatch_table()
+    assert table.get_method_name("customerQuery") == "handle_customerQuery"
+    assert table.get_method_name("fallback") == "handle_fallback"
+    assert table.get_method_name("greet") is None
+
+
+def test_unknown_handler_is_reported_when_the_area_loads(broken_persona: str, caplog: pytest.LogCaptureFixture):
+    area = TopicRegistry.load_area(broken_persona, "customerService")
+    assert "Topic dispatch table invalid" in caplog.text
+
+    topic = area.topics["customerQuery"]
+    with pytest.raises(ValueError, match="handle_missing") as first:
+        topic.get_dispatch_table()
+    # The failure is kept, not rebuilt on every turn
+    with pytest.raises(ValueError) as second:
+        topic.get_dispatch_table()
+    assert second.value is first.value
+    # The other topics of the area are served
+    assert area.topics["default"].get_dispatch_table() is not None
+
+
+def test_turn_of_invalid_topic_answers_with_the_apology(broken_persona: str, connections: Tuple[Any, Any]):
+    import execute
+
+    def run(query: str) -> str:
+        parameters: Dict[str, Any] = {
+            "session_id": "tests",
+            "conversation_id": "broken-dispatch",
+            "persona_name": broken_persona,
+            "topic_area": "customerService",
+            "locale": "en-GB",
+        }
+        return execute.execute(connections[0], connections[1], json.dumps(parameters), [], query)
+
+    run("Where is my order?")
+    assert run("My email is johnsmith@example.com, where is my order?") == APOLOGY
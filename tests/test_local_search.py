@@ -0,0 +1,71 @@
+"""
+Tests of the relevance scores of the local hybrid search backend (`LocalSearch`).
+"""
+
+import os
+from typing import Any, Dict, List
+
+import pytest
+
+from stand_in_backends import PRODUCT_CHUNKS
+
+pytest.importorskip("numpy")
+
+from helper_classes.local_search.index_builder import build_index  # noqa: E402
+from helper_classes.local_search.local_search import LocalSearch  # noqa: E402
+from helper_classes.local_search.local_search_index import LocalSearchIndex  # noqa: E402
+from helper_classes.local_search.text_analysis import Embedder  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def index_path(tmp_path_factory: pytest.TempPathFactory) -> str:
+    path: str = os.path.join(str(tmp_path_factory.mktemp("indexes")), "products")
+    build_index([{"chunk": chunk} for chunk in PRODUCT_CHUNKS], path)
+    return path
+
+
+def search(index_path: str, query: str) -> List[Dict[str, Any]]:
+    config: Dict[str, Any] = {
+        "index_details": {"index_name": "products", "path": index_path},
+        "parameters": {"select": "chunk", "k": 3},
+    }
+    response = LocalSearch({"arguments": {"query": query}}, {}, config).execute()
+    assert response.status_code == 200
+    return response.json()["value"]
+
+
+@pytest.mark.parametrize("query", ["zzzz qqq", "the weather on mars tomorrow", "how do I file my taxes"])
+def test_unrelated_queries_score_close_to_zero(index_path: str, query: str):
+    results: List[Dict[str, Any]] = search(index_path, query)
+
+    # Vector search always returns neighbours, their relevance must not depend on their rank
+    assert results
+    assert max(result["@search.rerankerScore"] for result in results) < 0.5
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [("Which tent sleeps eight?", "Alpine Explorer"), ("waterproof hiking jacket", "RainGuard")],
+)
+def test_relevant_queries_score_high(index_path: str, query: str, expected: str):
+    results: List[Dict[str, Any]] = search(index_path, query)
+
+    assert expected in results[0]["chunk"]
+    assert results[0]["@search.rerankerScore"] >= 2.0
+
+
+def test_open_index_is_served_while_the_rebuild_is_swapped_in(tmp_path: Any):
+    path: str = os.path.join(str(tmp_path), "products")
+    build_index([{"chunk": chunk} for chunk in PRODUCT_CHUNKS], path)
+    index = LocalSearchIndex.open(path)
+    # index_builder renames the old index away before renaming the new one in
+    os.rename(path, path + "-old")
+
+    assert LocalSearchIndex.open(path) is index
+    with pytest.raises(FileNotFoundError):
+        LocalSearchIndex.open(os.path.join(str(tmp_path), "missing"))
+
+
+def test_embedder_is_abstract():
+    with pytest.raises(TypeError):
+        Embedder()  # type: ignore[abstract]
@@ -0,0 +1,146 @@
+"""
+Tests of the sampling, snapshots and redaction of the log records (`LogPipeline`).
+"""
+
+import logging
+import queue
+from typing import Any, Dict, Iterator, List
+
+import pytest
+
+from helper_classes.log_pipeline import REDACTED, LazyValue, LogPipeline, _QueueHandler, _QueueListener
+
+
+@pytest.fixture(autouse=True)
+def pipeline(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setattr(LogPipeline, "redaction", True)
+    yield
+    LogPipeline.configure()
+
+
+def create_record(msg: str = "Execution completed", **extra: Any) -> logging.LogRecord:
+    return logging.makeLogRecord({
+        "name": "tests", "module": "search_ai_executor", "levelno": logging.INFO, "levelname": "INFO",
+        "msg": msg, **extra,
+    })
+
+
+class ListHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+def test_records_of_a_conversation_are_sampled_together():
+    LogPipeline.configure(sample_rates="1,search_ai_executor:Execution completed=0.5")
+
+    admitted: Dict[str, List[bool]] = {
+        f"conversation-{index}": [
+            LogPipeline.admit(create_record(conversation_id=f"conversation-{index}")) for _ in range(5)
+        ]
+        for index in range(200)
+    }
+
+    assert all(len(set(draws)) == 1 for draws in admitted.values())
+    assert 60 < sum(draws[0] for draws in admitted.values()) < 140
+    # The other events keep the default rate
+    assert all(
+        LogPipeline.admit(create_record("Failure occurred", conversation_id=name)) for name in admitted
+    )
+
+
+def test_lazy_value_is_computed_only_for_sampled_records():
+    calls: List[int] = []
+
+    def payload() -> Dict[str, Any]:
+        calls.append(1)
+        return {"results": 3}
+
+    LogPipeline.configure(sample_rates="0")
+    sampled_out: int = LogPipeline.get_metrics()["sampled_out"]
+    assert not LogPipeline.admit(create_record(conversation_id="lazy", payload=LazyValue(payload)))
+    assert calls == [] and LogPipeline.get_metrics()["sampled_out"] == sampled_out + 1
+
+    LogPipeline.configure(sample_rates="1")
+    record: logging.LogRecord = create_record(conversation_id="lazy", payload=LazyValue(payload))
+    assert LogPipeline.admit(record)
+    # Resolved on the calling thread, when the record is admitted
+    assert calls == [1] and record.payload == {"results": 3}
+
+
+def test_admitted_record_keeps_the_values_of_the_call():
+    arguments: Dict[str, Any] = {"query": "tents"}
+    record: logging.LogRecord = create_record(arguments=arguments)
+
+    assert LogPipeline.admit(record)
+    arguments["query"] = "boots"
+
+    assert record.arguments == {"query": "tents"}
+
+
+def test_secrets_and_email_addresses_are_redacted():
+    record: logging.LogRecord = create_record(
+        "Reply sent to johnsmith@example.com",
+        api_key="abc123",
+        request={
+            "headers": {"Authorization": "Bearer eyJhbGciOi.secret", "Accept": "application/json"},
+            "url": "https://search.example.net/indexes?api-key=abc123&top=3",
+            "note": "Token Bearer eyJhbGciOi.secret expired",
+        },
+    )
+    redacted: int = LogPipeline.get_metrics()["redacted"]
+
+    LogPipeline.redact(record)
+
+    assert record.getMessage() == "Reply sent to <email>"
+    assert record.api_key == REDACTED
+    assert record.request["headers"] == {"Authorization": REDACTED, "Accept": "application/json"}
+    assert record.request["url"] == f"https://search.example.net/indexes?api-key={REDACTED}&top=3"
+    assert record.request["note"] == f"Token Bearer {REDACTED} expired"
+    assert LogPipeline.get_metrics()["redacted"] == redacted + 5
+
+
+def test_long_values_are_truncated(monkeypatch: pytest.MonkeyPatch):
+    LogPipeline.configure(max_chars="20,search_ai_executor:Failure occurred=40")
+    monkeypatch.setattr(LogPipeline, "max_items", 3)
+    record: logging.LogRecord = create_record(
+        answer="x" * 30, results=list(range(5)), scores={f"doc{index}": index for index in range(4)}
+    )
+
+    LogPipeline.redact(record)
+
+    assert record.answer == "x" * 20 + "... <10 more characters>"
+    assert record.results == [0, 1, 2, "<2 more items>"]
+    assert record.scores == {"doc0": 0, "doc1": 1, "doc2": 2, "<truncated>": "1 more items"}
+    # The cap of the event
+    failure: logging.LogRecord = create_record("Failure occurred", answer="x" * 30)
+    LogPipeline.redact(failure)
+    assert failure.answer == "x" * 30
+
+
+def test_full_queue_drops_the_record():
+    handler: _QueueHandler = _QueueHandler(queue.Queue(1))
+    dropped: int = LogPipeline.get_metrics()["dropped"]
+
+    handler.emit(create_record())
+    handler.emit(create_record())
+
+    assert handler.queue.qsize() == 1
+    assert LogPipeline.get_metrics()["dropped"] == dropped + 1
+
+
+def test_queued_records_are_redacted_before_the_handlers():
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(10)
+    target: ListHandler = ListHandler()
+    listener: _QueueListener = _QueueListener(records, target, respect_handler_level=True)
+    written: int = LogPipeline.get_metrics()["written"]
+
+    listener.start()
+    _QueueHandler(records).emit(create_record("Reply sent", email="johnsmith@example.com"))
+    listener.stop()
+
+    assert [record.email for record in target.records] == ["<email>"]
+    assert LogPipeline.get_metrics()["written"] == written + 1
@@ -0,0 +1,82 @@
+"""
+Tests of the metrics of the flow (`helper_classes/metrics.py`) and of their exporters.
+"""
+
+import socket
+import threading
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from helper_classes import metrics
+from helper_classes.lm_helpers.llm_helper import LLMHelper
+from helper_classes.metrics import Histogram, Metrics
+from stand_in_backends import StandInBackends
+
+PARAMS: Dict[str, float] = {"temperature": 0.0, "top_p": 0.95, "frequency_penalty": 0.0, "presence_penalty": 0.0}
+
+
+def observations(histogram: Histogram) -> float:
+    return sum(values[-2] for values in histogram.collect().values())
+
+
+def test_busy_port_does_not_stop_the_worker(monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture):
+    with socket.socket() as other_worker:
+        other_worker.bind(("127.0.0.1", 0))
+        other_worker.listen()
+        monkeypatch.setenv("FLOW_METRICS_PORT", str(other_worker.getsockname()[1]))
+        monkeypatch.delenv("FLOW_METRICS_FILE", raising=False)
+        monkeypatch.setattr(Metrics, "_exporters", [])
+
+        Metrics.start_exporters()
+
+    assert Metrics._exporters == []
+    assert "Metrics endpoint not started" in caplog.text
+
+
+def test_failed_turn_is_recorded(run_turn: Any, monkeypatch: pytest.MonkeyPatch):
+    def fail(self: LLMHelper) -> Any:
+        raise RuntimeError("prompt template missing")
+
+    monkeypatch.setattr(LLMHelper, "get_prompt_messages", fail)
+    turns: float = observations(metrics.TURN_SECONDS)
+
+    with pytest.raises(RuntimeError):
+        run_turn("failed-turn", "Which tent is best for rain?")
+
+    assert observations(metrics.TURN_SECONDS) == turns + 1
+
+
+def test_shared_completions_count_their_tokens_once(
+    stand_ins: StandInBackends, connections: Tuple[Any, Any], monkeypatch: pytest.MonkeyPatch
+):
+    custom_connections, search_connection = connections
+    helper: LLMHelper = LLMHelper(
+        custom_connections, search_connection, [], "Which tent?",
+        {"session_id": "tests", "conversation_id": "tokens", "persona_name": "public"}, {"topic_name": "default"},
+    )
+
+    def complete(stage: str, content: str) -> Any:
+        return helper.execute(
+            "tests", "tokens", LLMHelper.create_pooled_client(custom_connections), "stand-in",
+            [{"role": "user", "content": content}], [], PARAMS, stage=stage,
+        )
+
+    usage: Any = complete("tokens_alone", "How warm is the down sleeping bag?").usage
+    monkeypatch.setattr(stand_ins, "llm_latency_ms", 200.0)
+    barrier: threading.Barrier = threading.Barrier(4)
+
+    def run() -> None:
+        barrier.wait()
+        complete("tokens_shared", "How warm is the down sleeping bag?")
+
+    threads: List[threading.Thread] = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    counters: Dict[str, float] = LLMHelper.get_metrics()["tokens_shared/stand-in"]
+    assert counters["calls"] == 4 and counters["shared"] == 3
+    assert counters["prompt_tokens"] == usage.prompt_tokens
+    assert counters["completion_tokens"] == usage.completion_tokens
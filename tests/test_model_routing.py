@@ -0,0 +1,101 @@
+"""
+Tests of the routing of the stages of a turn to their own model (`model_routing` of a topic).
+"""
+
+import os
+from typing import Any, Dict, Tuple
+
+import pytest
+import yaml
+
+from helper_classes.lm_helpers.llm_helper import LLMHelper
+from helper_classes.topic_helper.flow_bundle_compiler import FlowBundleCompiler
+from stand_in_backends import StandInBackends, prepare_flow_dir
+
+PARAMS: Dict[str, float] = {
+    "temperature": 0.0, "top_p": 0.95, "frequency_penalty": 0.0, "presence_penalty": 0.0
+}
+
+ROUTES: Dict[str, Any] = {
+    "routing": {"model": "routing-model", "max_tokens": 50},
+    "rag_answer": {"temperature": 0.7},
+}
+
+
+def create_helper(connections: Tuple[Any, Any]) -> LLMHelper:
+    helper: LLMHelper = LLMHelper(
+        connections[0], connections[1], [], "Which tent?",
+        {"session_id": "tests", "conversation_id": "model-routing", "persona_name": "public"},
+        {"topic_name": "default"},
+    )
+    helper.topic_object = {"model_routing": ROUTES}
+    return helper
+
+
+def test_routed_stage_overrides_the_model_and_parameters(connections: Tuple[Any, Any]):
+    helper: LLMHelper = create_helper(connections)
+
+    routed: Tuple[str, Dict[str, Any]] = helper.get_stage_model("routing", "stand-in", PARAMS)
+    assert routed == ("routing-model", {**PARAMS, "max_tokens": 50})
+    # Parameters without a model keep the default model
+    routed = helper.get_stage_model("rag_answer", "stand-in", PARAMS)
+    assert routed == ("stand-in", {**PARAMS, "temperature": 0.7})
+    assert helper.get_stage_model("order_answer", "stand-in", PARAMS) == ("stand-in", PARAMS)
+    assert helper.get_stage_model(None, "stand-in", PARAMS) == ("stand-in", PARAMS)
+    # The defaults are not changed
+    assert "max_tokens" not in PARAMS
+
+
+def test_execute_calls_the_model_of_the_stage(stand_ins: StandInBackends, connections: Tuple[Any, Any]):
+    helper: LLMHelper = create_helper(connections)
+
+    completion: Any = helper.execute(
+        "tests", "model-routing", LLMHelper.create_pooled_client(connections[0]), "stand-in",
+        [{"role": "user", "content": "Where is my order?"}], [], PARAMS, stage="routing",
+    )
+
+    assert completion.model == "routing-model"
+    assert LLMHelper.get_metrics()["routing/routing-model"]["calls"] >= 1
+
+
+@pytest.fixture
+def flow_copy(stand_ins: StandInBackends, tmp_path: Any) -> str:
+    """
+    A copy of the flow configs for the compiler, whose topics can be edited.
+    """
+    return prepare_flow_dir(str(tmp_path), stand_ins.url)
+
+
+def write_routing(root: str, model_routing: Any) -> None:
+    path: str = os.path.join(root, "persona-public", "topic_area_customerService", "default.yaml")
+    with open(path, encoding="utf-8") as file:
+        topic: Dict[str, Any] = yaml.safe_load(file)
+    topic["model_routing"] = model_routing
+    with open(path, "w", encoding="utf-8") as file:
+        yaml.safe_dump(topic, file, sort_keys=False)
+
+
+def test_compiler_accepts_valid_routing(flow_copy: str):
+    write_routing(flow_copy, ROUTES)
+
+    assert FlowBundleCompiler(flow_copy).compile()
+
+
+def test_compiler_reports_invalid_routing(flow_copy: str):
+    write_routing(flow_copy, {
+        "summary": {"model": "small"},
+        "routing": {"model": "", "max_tokens": 0, "temperature": "hot", "seed": 1},
+        "rag_answer": "gpt-4o",
+    })
+    compiler: FlowBundleCompiler = FlowBundleCompiler(flow_copy)
+
+    with pytest.raises(ValueError):
+        compiler.compile()
+
+    errors: str = "\n".join(compiler.errors)
+    assert "model_routing.summary is not a stage" in errors
+    assert "model_routing.routing.model must be a model deployment name" in errors
+    assert "model_routing.routing.max_tokens must be a positive integer" in errors
+    assert "model_routing.routing.temperature must be a number" in errors
+    assert "model_routing.routing: unknown parameter 'seed'" in errors
+    assert "model_routing.rag_answer must be a dict" in errors
@@ -0,0 +1,89 @@
+"""
+Tests of the multi-query retrieval of the Q&A handler (`MultiQuerySearch`).
+"""
+
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from helper_classes.multi_query_search import MultiQuerySearch
+
+RESULTS: Dict[str, List[Dict[str, Any]]] = {
+    "tent for rain": [
+        {"content": "RainGuard tent", "@search.rerankerScore": 2.5},
+        {"content": "Alpine Explorer tent", "@search.rerankerScore": 2.0},
+    ],
+    "Which tent keeps me dry?": [
+        {"content": "Alpine Explorer tent", "@search.rerankerScore": 3.0},
+        {"content": "TrailMaster tarp", "@search.rerankerScore": 1.5},
+    ],
+}
+
+
+def create_search(
+    arguments: Dict[str, Any], user_query: str = "Which tent keeps me dry?", **parameters: Any
+) -> MultiQuerySearch:
+    return MultiQuerySearch(
+        {"arguments": arguments},
+        {"session_id": "tests", "conversation_id": "multi-query", "user_query": user_query},
+        {"parameters": dict({"multi_query": True, "k": 5}, **parameters)},
+        None,
+    )
+
+
+def test_variants_are_distinct():
+    search: MultiQuerySearch = create_search(
+        {"query": "Which tent keeps me dry", "previous_answer_provided": "The RainGuard is waterproof."}
+    )
+
+    variants: Dict[str, str] = search.get_variants()
+    # The raw message only differs from the rewritten query by its punctuation
+    assert list(variants) == ["rewritten", "previous_answer"]
+    assert variants["previous_answer"] == "Which tent keeps me dry The RainGuard is waterproof."
+    assert list(create_search({"query": "tent for rain"}).get_variants()) == ["rewritten", "raw"]
+
+
+def test_results_are_fused_with_their_best_score(monkeypatch: pytest.MonkeyPatch):
+    def search_variant(self: MultiQuerySearch, query: str) -> Tuple[Optional[List[Dict[str, Any]]], float]:
+        return [dict(item) for item in RESULTS[query]], 1.0
+
+    monkeypatch.setattr(MultiQuerySearch, "_search", search_variant)
+
+    fused: List[Dict[str, Any]] = create_search({"query": "tent for rain"}).execute()  # type: ignore
+    # Retrieved by both variants, so ranked first
+    assert [item["content"] for item in fused] == [
+        "Alpine Explorer tent", "RainGuard tent", "TrailMaster tarp",
+    ]
+    assert fused[0]["@search.rerankerScore"] == 3.0
+    assert all("@search.fusedScore" in item for item in fused)
+
+
+def test_failed_variants_are_left_out(monkeypatch: pytest.MonkeyPatch):
+    def search_variant(self: MultiQuerySearch, query: str) -> Tuple[Optional[List[Dict[str, Any]]], float]:
+        if query != "tent for rain":
+            raise ConnectionError("search unavailable")
+        return [dict(item) for item in RESULTS[query]], 1.0
+
+    monkeypatch.setattr(MultiQuerySearch, "_search", search_variant)
+    fused: Optional[List[Dict[str, Any]]] = create_search({"query": "tent for rain"}).execute()
+    assert [item["content"] for item in fused or []] == ["RainGuard tent", "Alpine Explorer tent"]
+
+    monkeypatch.setattr(MultiQuerySearch, "_search", lambda self, query: (None, 1.0))
+    assert create_search({"query": "tent for rain"}).execute() is None
+
+
+def test_variants_are_searched_in_parallel(monkeypatch: pytest.MonkeyPatch):
+    def slow_search(self: MultiQuerySearch, query: str) -> Tuple[Optional[List[Dict[str, Any]]], float]:
+        time.sleep(0.2)
+        return [dict(item) for item in RESULTS.get(query, [])], 200.0
+
+    monkeypatch.setattr(MultiQuerySearch, "_search", slow_search)
+    search: MultiQuerySearch = create_search(
+        {"query": "tent for rain", "previous_answer_provided": "The RainGuard is waterproof."}
+    )
+
+    start: float = time.perf_counter()
+    search.execute()
+    assert len(search.get_variants()) == 3
+    assert time.perf_counter() - start < 0.5
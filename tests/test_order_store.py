@@ -0,0 +1,52 @@
+"""
+Tests of the structured order questions answered from the order store (`OrderQuestion`, `OrderStore`).
+"""
+
+from typing import Optional
+
+import pytest
+
+from helper_classes.helper_classes_customer.customer_service.order_store import OrderQuestion, OrderStore
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def store(flow_dir: str) -> OrderStore:
+    order_store: Optional[OrderStore] = OrderStore.get_instance()
+    assert order_store is not None
+    return order_store
+
+
+@pytest.mark.parametrize(
+    "query, operation",
+    [
+        ("What was my last order?", "last_order"),
+        ("How much have I spent on tents?", "total_spent"),
+        ("How many orders have I placed?", "order_count"),
+        ("What is my most expensive order?", "largest_order"),
+    ],
+)
+def test_pure_questions_are_structured(store: OrderStore, query: str, operation: str):
+    question: Optional[OrderQuestion] = OrderQuestion.parse(query, store)
+    assert question is not None and question.operation == operation
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "Is my last order shipped?",
+        "What's the return policy on my latest purchase?",
+        "Where is my most recent order?",
+        "Can I get a refund on the last thing I bought?",
+    ],
+)
+def test_questions_with_another_intent_go_to_the_model(store: OrderStore, query: str):
+    assert OrderQuestion.parse(query, store) is None
+
+
+def test_mixed_question_is_not_answered_by_the_template(run_turn):
+    run_turn("order-mixed", "Where is my order?")
+    answer: str = run_turn("order-mixed", "My email is johnsmith@example.com, is my last order shipped?")
+
+    assert "Your most recent order" not in answer
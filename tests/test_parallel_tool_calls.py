@@ -0,0 +1,59 @@
+"""
+Tests of the isolation of the tool calls processed in parallel: deferred resets of the conversation
+data and the context of each call.
+"""
+
+import uuid
+from typing import Any, Dict, Tuple
+
+from helper_classes.conversation_helper.conversation_data_helper import ConversationDataHelper
+from helper_classes.turn_context import TurnContext
+
+
+def create_turn(connections: Tuple[Any, Any]) -> TurnContext:
+    parameters: Dict[str, Any] = {
+        "session_id": "tests",
+        "conversation_id": str(uuid.uuid4()),
+        "persona_name": "public",
+        "topic_area": "customerService",
+        "locale": "en-GB",
+    }
+    turn: TurnContext = TurnContext(connections[0], connections[1], parameters, [], "Which tent?")
+    turn.load_conversation_data()
+    return turn
+
+
+def test_reset_is_deferred_with_the_saves(flow_dir: str, connections: Tuple[Any, Any]):
+    turn: TurnContext = create_turn(connections)
+    conversation_data: Dict[str, Any] = dict(turn.conversation_data, topic_name="customerQuery")
+    turn.save_conversation_data(conversation_data)
+
+    with ConversationDataHelper.deferred_saves() as deferred:
+        turn.data_helper.reset_conversation_data()
+    # Only recorded, the stored conversation is unchanged
+    assert deferred["reset"]["topic_name"] == "default"
+    assert turn.data_helper.get_conversation_data()["topic_name"] == "customerQuery"
+
+    # The reset data with the changes of the calls after the reset
+    turn.data_helper.reset_conversation_data(dict(deferred["reset"], arguments={"query": "boots"}))
+    stored: Dict[str, Any] = turn.data_helper.get_conversation_data()
+    assert stored["topic_name"] == "default" and stored["arguments"] == {"query": "boots"}
+
+
+def test_call_context_has_its_own_state(flow_dir: str, connections: Tuple[Any, Any]):
+    turn: TurnContext = create_turn(connections)
+    with turn.timed("handlers"):
+        pass
+    call_data: Dict[str, Any] = dict(turn.conversation_data)
+    call_context: TurnContext = turn.create_call_context(call_data)
+
+    with call_context.timed("search"):
+        pass
+    assert "search" not in turn.timings
+    assert call_context.get_llm_helper().conversation_data is call_data
+    assert turn.get_llm_helper().conversation_data is turn.conversation_data
+    # Shared with the turn
+    assert call_context.data_helper is turn.data_helper
+
+    turn.merge_call_context(call_context)
+    assert set(turn.timings) >= {"handlers", "search"}
@@ -0,0 +1,156 @@
+"""
+Tests of the cache of query embeddings (`QueryEmbeddingCache`) against the embeddings stand-in.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pytest
+
+from stand_in_backends import StandInBackends, create_connections
+
+from helper_classes.ai_search import AiSearch
+from helper_classes.query_embedding_cache import QueryEmbeddingCache
+
+MODEL: str = "text-embedding-3-small"
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    """
+    Starts each test with an empty memory cache and no SQLite store.
+    """
+    for name in ("QUERY_EMBEDDING_CACHE_SIZE", "QUERY_EMBEDDING_CACHE_TTL_S", "QUERY_EMBEDDING_CACHE_PATH"):
+        monkeypatch.delenv(name, raising=False)
+    QueryEmbeddingCache.clear()
+    yield
+    QueryEmbeddingCache.clear()
+
+
+def embed(connections: Tuple[Any, Any], query: str) -> Optional[List[float]]:
+    return QueryEmbeddingCache.embed(connections[0], MODEL, query)
+
+
+def counted(stand_ins: StandInBackends, function: Any) -> Tuple[Any, int, Dict[str, float]]:
+    """
+    Calls the function and returns its result, the number of embeddings requests it made and the
+    change of the cache metrics.
+    """
+    requests: int = stand_ins.request_counts["embeddings"]
+    before: Dict[str, float] = QueryEmbeddingCache.get_metrics()
+    result: Any = function()
+    after: Dict[str, float] = QueryEmbeddingCache.get_metrics()
+    changes: Dict[str, float] = {
+        name: after[name] - before[name]
+        for name in ("hits", "store_hits", "misses", "expired", "evictions", "failures")
+    }
+    return result, stand_ins.request_counts["embeddings"] - requests, changes
+
+
+def test_same_query_is_embedded_once(stand_ins: StandInBackends, connections: Tuple[Any, Any]):
+    vector, requests, changes = counted(stand_ins, lambda: embed(connections, "Which tent for rain?"))
+    assert vector and requests == 1 and changes["misses"] == 1
+
+    # Normalized to the same key
+    cached, requests, changes = counted(stand_ins, lambda: embed(connections, "  which TENT  for rain? "))
+    assert cached == vector
+    assert requests == 0 and changes["hits"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(
+    stand_ins: StandInBackends, connections: Tuple[Any, Any], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("QUERY_EMBEDDING_CACHE_SIZE", "2")
+    embed(connections, "tents")
+    embed(connections, "boots")
+    # Used again, so boots is now the least recently used
+    embed(connections, "tents")
+
+    _, requests, changes = counted(stand_ins, lambda: embed(connections, "jackets"))
+    assert requests == 1 and changes["evictions"] == 1
+    assert QueryEmbeddingCache.get_metrics()["entries"] == 2
+
+    _, requests, _ = counted(stand_ins, lambda: embed(connections, "tents"))
+    assert requests == 0
+    _, requests, _ = counted(stand_ins, lambda: embed(connections, "boots"))
+    assert requests == 1
+
+
+def test_expired_entry_is_embedded_again(
+    stand_ins: StandInBackends, connections: Tuple[Any, Any], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("QUERY_EMBEDDING_CACHE_TTL_S", "0.05")
+    embed(connections, "sleeping bags")
+    time.sleep(0.1)
+
+    _, requests, changes = counted(stand_ins, lambda: embed(connections, "sleeping bags"))
+    assert requests == 1
+    assert changes["expired"] == 1 and changes["misses"] == 1
+
+
+def test_embeddings_are_reloaded_from_the_store(
+    stand_ins: StandInBackends, connections: Tuple[Any, Any], monkeypatch: pytest.MonkeyPatch, tmp_path: Any
+):
+    monkeypatch.setenv("QUERY_EMBEDDING_CACHE_PATH", os.path.join(str(tmp_path), "embeddings.sqlite"))
+    vector: Optional[List[float]] = embed(connections, "hiking poles")
+    # As after a restart of the worker
+    QueryEmbeddingCache.clear()
+
+    reloaded, requests, changes = counted(stand_ins, lambda: embed(connections, "hiking poles"))
+    assert requests == 0 and changes["store_hits"] == 1
+    # Stored as float32
+    assert reloaded == pytest.approx(vector, abs=1e-6)
+
+    # Back in memory
+    _, requests, changes = counted(stand_ins, lambda: embed(connections, "hiking poles"))
+    assert requests == 0 and changes["hits"] == 1
+
+
+def test_concurrent_misses_share_one_request(
+    stand_ins: StandInBackends, connections: Tuple[Any, Any], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(stand_ins, "embedding_latency_ms", 200.0)
+    vectors: List[Optional[List[float]]] = []
+    barrier: threading.Barrier = threading.Barrier(4)
+
+    def run() -> None:
+        barrier.wait()
+        vectors.append(embed(connections, "waterproof trousers"))
+
+    def run_all() -> None:
+        threads: List[threading.Thread] = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    _, requests, changes = counted(stand_ins, run_all)
+    assert requests == 1
+    assert changes["misses"] == 4
+    assert len(vectors) == 4 and all(vector == vectors[0] for vector in vectors) and vectors[0]
+
+
+def test_search_falls_back_to_text_query_when_embedding_fails():
+    failing: StandInBackends = StandInBackends(embeddings_available=False)
+    failing.start()
+    try:
+        custom_connections, search_connection = create_connections(failing.url)
+        config: Dict[str, Any] = {
+            "index_details": {"index_name": "products", "endpoint": failing.url},
+            "parameters": {"vector_query": "vector", "embedding_model": MODEL},
+        }
+        search: AiSearch = AiSearch(
+            {"arguments": {"query": "tents for four"}}, {}, config, search_connection,
+            custom_connections=custom_connections,
+        )
+
+        before: Dict[str, float] = QueryEmbeddingCache.get_metrics()
+        assert search.get_vector_query() == {"kind": "text", "text": "tents for four"}
+        assert failing.request_counts["embeddings"] == 1
+        assert QueryEmbeddingCache.get_metrics()["failures"] == before["failures"] + 1
+        # Failures are not cached
+        assert QueryEmbeddingCache.get_metrics()["entries"] == 0
+    finally:
+        failing.stop()
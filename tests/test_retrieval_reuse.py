@@ -0,0 +1,78 @@
+"""
+Tests of the reuse of the previous Q&A retrieval by follow-up questions (`RetrievalReuse`).
+"""
+
+from typing import Any, Dict, List
+
+from helper_classes.retrieval_reuse import RetrievalReuse
+
+CONFIG: Dict[str, Any] = {
+    "index_details": {"endpoint": "https://search.example.com", "index_name": "products"},
+    "parameters": {"retrieval_reuse": True, "select": "content", "k": 3},
+}
+RESULTS: List[Dict[str, Any]] = [
+    {"content": "The RainGuard jacket is waterproof and in red.", "@search.rerankerScore": 2.5, "id": 1},
+    {"content": "The TrailBlaze jacket is breathable.", "@search.rerankerScore": 1.5, "id": "2"},
+]
+
+
+def create_reuse(
+    query: str, conversation_data: Dict[str, Any], config: Dict[str, Any] = CONFIG
+) -> RetrievalReuse:
+    conversation_data["arguments"] = {"query": query}
+    return RetrievalReuse(conversation_data, {"session_id": "tests", "conversation_id": "reuse"}, config)
+
+
+def searched(query: str = "Which jacket is waterproof?") -> Dict[str, Any]:
+    conversation_data: Dict[str, Any] = {}
+    reuse: RetrievalReuse = create_reuse(query, conversation_data)
+    assert reuse.decide() == RetrievalReuse.SEARCH
+    reuse.remember(RESULTS)
+    return conversation_data
+
+
+def test_only_the_content_and_score_are_remembered():
+    stored: Dict[str, Any] = searched()[RetrievalReuse.KEY]
+
+    assert stored["query"] == "Which jacket is waterproof?"
+    assert stored["results"][0] == {"content": RESULTS[0]["content"], "@search.rerankerScore": 2.5}
+
+
+def test_follow_up_covered_by_the_previous_retrieval_is_reused():
+    conversation_data: Dict[str, Any] = searched()
+
+    assert create_reuse("Is the waterproof jacket red?", conversation_data).decide() == "reuse"
+    assert create_reuse("Is the RainGuard jacket warm?", conversation_data).decide() == "supplement"
+    assert create_reuse("Which tent sleeps eight?", conversation_data).decide() == "search"
+
+
+def test_previous_retrieval_of_another_index_or_too_old_is_not_reused():
+    conversation_data: Dict[str, Any] = searched()
+    other_index: Dict[str, Any] = dict(CONFIG, index_details=dict(CONFIG["index_details"], index_name="faq"))
+    assert create_reuse("Is the waterproof jacket red?", conversation_data, other_index).decide() == "search"
+
+    conversation_data[RetrievalReuse.KEY]["retrieved_at"] -= 601
+    assert create_reuse("Is the waterproof jacket red?", conversation_data).decide() == "search"
+
+
+def test_supplement_merges_without_duplicates_best_first():
+    conversation_data: Dict[str, Any] = searched()
+    reuse: RetrievalReuse = create_reuse("Is the RainGuard jacket warm?", conversation_data)
+
+    merged: List[Dict[str, Any]] = reuse.supplement(
+        [
+            {"content": "The TrailBlaze jacket is breathable.", "@search.rerankerScore": 3.0},
+            {"content": "The RainGuard jacket has a fleece lining.", "@search.rerankerScore": 2.0},
+            {"content": "Gloves.", "@search.rerankerScore": 0.1},
+        ]
+    )
+
+    assert [item["@search.rerankerScore"] for item in merged] == [3.0, 2.5, 2.0]
+    assert reuse.get_supplement_config()["parameters"]["k"] == 2
+
+
+def test_disabled_reuse_always_searches():
+    conversation_data: Dict[str, Any] = searched()
+    disabled: Dict[str, Any] = {**CONFIG, "parameters": {**CONFIG["parameters"], "retrieval_reuse": False}}
+
+    assert create_reuse("Is the waterproof jacket red?", conversation_data, disabled).decide() == "search"
@@ -0,0 +1,63 @@
+"""
+Tests of the JSON serialization layer (`helper_classes/serialization.py`) and its backends.
+"""
+
+import datetime
+from typing import Any, Iterator, List
+
+import pytest
+
+from helper_classes import serialization
+from helper_classes.serialization import OrjsonBackend, StdlibJsonBackend
+
+BACKENDS: List[Any] = [StdlibJsonBackend]
+try:
+    import orjson  # noqa: F401  # pylint: disable=unused-import
+
+    BACKENDS.append(OrjsonBackend)
+except ImportError:
+    pass
+
+VALUE: Any = {
+    "query": "Zelt für Regen ⛺", "k": 3, "score": 2.5, "tags": ["tent", None, True], "nested": {"a": []},
+}
+
+
+@pytest.fixture
+def backend_name() -> Iterator[str]:
+    name: str = serialization.get_backend()
+    yield name
+    serialization.set_backend(name)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_write_the_same_compact_utf8(backend: Any):
+    text: str = backend.dumps(VALUE)
+
+    assert text == StdlibJsonBackend.dumps(VALUE)
+    assert "für" in text and ", " not in text
+    assert backend.dumps_bytes(VALUE) == text.encode("utf-8")
+    assert backend.loads(text) == VALUE
+    assert backend.loads(text.encode("utf-8")) == VALUE
+    assert backend.loads(memoryview(text.encode("utf-8"))) == VALUE
+    # Request hashes do not depend on the key order of the payload
+    assert backend.dumps({"b": 1, "a": 2}, sort_keys=True) == '{"a":2,"b":1}'
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_accept_the_same_values(backend: Any):
+    # Non-string keys and integers over 64 bits, which orjson cannot encode
+    assert backend.loads(backend.dumps({1: 2**70})) == {"1": 2**70}
+    assert backend.loads("NaN") != backend.loads("NaN")
+    assert backend.dumps({"date": datetime.date(2024, 1, 2)}, default=str) == '{"date":"2024-01-02"}'
+    with pytest.raises(serialization.JSONDecodeError):
+        backend.loads("{not json")
+
+
+def test_backend_is_selected_by_name(backend_name: str):
+    assert serialization.set_backend("json") == "json"
+    assert serialization.get_backend() == "json"
+    assert serialization.loads(serialization.dumps_bytes(VALUE)) == VALUE
+
+    with pytest.raises(ValueError):
+        serialization.set_backend("pickle")
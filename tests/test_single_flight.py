@@ -0,0 +1,89 @@
+"""
+Tests of the single-flight deduplication of concurrent identical requests (`SingleFlight`).
+"""
+
+import threading
+import time
+from typing import Any, List, Tuple
+
+import pytest
+
+from helper_classes.single_flight import SingleFlight
+
+
+def run_concurrently(group: SingleFlight, key: str, function: Any, count: int = 4) -> List[Any]:
+    barrier: threading.Barrier = threading.Barrier(count)
+    outcomes: List[Any] = []
+
+    def run() -> None:
+        barrier.wait()
+        try:
+            outcomes.append(group.do(key, function))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads: List[threading.Thread] = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def slow_request(calls: List[int], result: Any = "answer") -> Any:
+    def request() -> Any:
+        calls.append(1)
+        time.sleep(0.2)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return request
+
+
+def test_concurrent_identical_requests_are_performed_once():
+    group: SingleFlight = SingleFlight("tests")
+    calls: List[int] = []
+
+    outcomes: List[Tuple[str, bool]] = run_concurrently(group, "key", slow_request(calls))
+
+    assert len(calls) == 1
+    assert sorted(outcomes) == [("answer", False)] + [("answer", True)] * 3
+    assert group._metrics["collapsed"] == 3 and group._calls == {}
+
+
+def test_the_error_is_raised_in_every_caller():
+    calls: List[int] = []
+    request: Any = slow_request(calls, TimeoutError("slow"))
+
+    outcomes: List[Any] = run_concurrently(SingleFlight("tests"), "key", request)
+
+    assert len(calls) == 1
+    assert all(isinstance(outcome, TimeoutError) for outcome in outcomes)
+
+
+def test_completed_requests_are_not_cached():
+    group: SingleFlight = SingleFlight("tests")
+    calls: List[int] = []
+
+    group.do("key", slow_request(calls))
+    assert group.do("key", slow_request(calls)) == ("answer", False)
+    assert len(calls) == 2
+
+
+def test_disabled_every_caller_performs_its_request(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("SINGLE_FLIGHT", "0")
+    calls: List[int] = []
+
+    run_concurrently(SingleFlight("tests"), "key", slow_request(calls))
+
+    assert len(calls) == 4
+
+
+def test_request_key_ignores_the_key_order():
+    assert SingleFlight.request_key("search", {"q": "tent", "k": 3}) == SingleFlight.request_key(
+        "search", {"k": 3, "q": "tent"}
+    )
+    assert SingleFlight.request_key("search", {"q": "tent"}) != SingleFlight.request_key(
+        "search", {"q": "tarp"}
+    )
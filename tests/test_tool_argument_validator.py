@@ -0,0 +1,95 @@
+"""
+Tests of the validation, repair and re-ask of the tool call arguments (`ToolArgumentValidator`).
+"""
+
+import os
+import uuid
+from typing import Any, Dict
+
+import yaml
+
+from helper_classes.tool_argument_validator import ARGUMENT_KEYS, ToolArgumentValidator
+from helper_classes.topic_helper.topic_registry import TopicRegistry
+from conftest import REPO_ROOT
+
+
+def load_tool(*path: str) -> Dict[str, Any]:
+    with open(os.path.join(REPO_ROOT, *path), "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+
+def test_qna_query_only_is_repaired_with_the_default_previous_answer():
+    tool: Dict[str, Any] = load_tool("standard_tool_functions", "qna.yaml")
+    validator = ToolArgumentValidator.compile_tools([tool])["qna"]
+    arguments: Dict[str, Any] = {"query": "Which tent is best for rain?"}
+
+    assert validator.validate(arguments)
+    repaired: Dict[str, Any] = validator.repair(arguments, {})
+    assert validator.validate(repaired) == []
+    assert repaired == {"query": "Which tent is best for rain?", "previous_answer_provided": ""}
+
+
+def test_known_arguments_take_precedence_over_the_default():
+    tool: Dict[str, Any] = load_tool("standard_tool_functions", "qna.yaml")
+    validator = ToolArgumentValidator.compile_tools([tool])["qna"]
+
+    repaired: Dict[str, Any] = validator.repair(
+        {"query": "And in blue?"}, {"previous_answer_provided": "The jacket comes in red."}
+    )
+    assert repaired["previous_answer_provided"] == "The jacket comes in red."
+
+
+def test_required_field_without_default_is_not_repaired():
+    topic: Dict[str, Any] = load_tool("persona-public", "topic_area_customerService", "customerQuery.yaml")
+    validator = ToolArgumentValidator.compile_tools(topic["tools"])["customerQuery"]
+
+    repaired: Dict[str, Any] = validator.repair({"query": "Where is my order?"}, {})
+    assert validator.missing_required(repaired) == ["email"]
+
+
+def test_describe_uses_the_prompt_or_the_field_name():
+    validator = ToolArgumentValidator(
+        "lookup",
+        {
+            "type": "object",
+            "properties": {
+                "email": {"type": "string", "description": "Ask the model to do things."},
+                "order_number": {"type": "string", "description": "Instructions for the model."},
+            },
+        },
+        prompts={"email": "your email"},
+    )
+
+    assert validator.describe("email") == "your email"
+    assert validator.describe("order_number") == "order number"
+
+
+def test_prompts_and_defaults_are_not_sent_to_the_model(flow_dir: str):
+    for topic_name, function_name in (("customerQuery", "customerQuery"), ("default", "qna")):
+        topic = TopicRegistry.get_topic("public", "customerService", topic_name)
+        for tool in topic.tools_list:
+            assert not set(tool) & set(ARGUMENT_KEYS)
+            for schema in tool["function"].get("parameters", {}).get("properties", {}).values():
+                assert "prompt" not in schema and "default" not in schema
+        # Still read by the validators
+        assert topic.get_tool_validators()[function_name].prompts or topic.get_tool_validators()[function_name].defaults
+
+
+def test_reask_does_not_echo_the_tool_description(run_turn):
+    conversation_id: str = str(uuid.uuid4())
+    # Switches to the customerQuery topic, whose tool call then comes without the email
+    run_turn(conversation_id, "Where is my order?")
+    answer: str = run_turn(conversation_id, "Where is my order?")
+
+    assert "I need a few more details" in answer
+    assert "the email address you registered with" in answer
+    assert "The email address they registered with" not in answer
+
+
+def test_first_turn_qna_call_with_only_a_query_searches(run_turn, stand_ins):
+    searches: int = stand_ins.request_counts["search"]
+
+    answer: str = run_turn(str(uuid.uuid4()), "Which tent is best for rain?")
+
+    assert "I need a few more details" not in answer
+    assert stand_ins.request_counts["search"] > searches
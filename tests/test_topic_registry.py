@@ -0,0 +1,55 @@
+"""
+Tests of the topic registry shared by the threads of the worker.
+"""
+
+import threading
+import time
+from typing import Any, List, Tuple
+
+import pytest
+
+from helper_classes.topic_helper import topic_registry
+from helper_classes.topic_helper.topic_registry import TopicRegistry
+
+AREA: Tuple[str, str] = ("public", "customerService")
+
+
+def run_threads(target: Any, count: int = 8) -> None:
+    barrier: threading.Barrier = threading.Barrier(count)
+
+    def run() -> None:
+        barrier.wait()
+        target()
+
+    threads: List[threading.Thread] = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_hits_are_all_counted(flow_dir: str):
+    TopicRegistry.get_area(AREA)
+    hits: float = TopicRegistry.get_metrics()["hits"]
+
+    run_threads(lambda: [TopicRegistry.get_area(AREA) for _ in range(500)])
+
+    assert TopicRegistry.get_metrics()["hits"] == hits + 8 * 500
+
+
+def test_validators_are_compiled_once_per_topic(flow_dir: str, monkeypatch: pytest.MonkeyPatch):
+    compile_tools = topic_registry.ToolArgumentValidator.compile_tools
+    compiled: List[int] = []
+
+    def slow_compile_tools(tools_list: Any) -> Any:
+        compiled.append(1)
+        time.sleep(0.05)
+        return compile_tools(tools_list)
+
+    monkeypatch.setattr(topic_registry.ToolArgumentValidator, "compile_tools", slow_compile_tools)
+    topic = TopicRegistry.load_area(*AREA).topics["customerQuery"]
+    validators: List[Any] = []
+    run_threads(lambda: validators.append(topic.get_tool_validators()))
+
+    assert len(compiled) == 1
+    assert all(item is validators[0] for item in validators)